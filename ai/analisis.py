@@ -1,14 +1,29 @@
-import google.generativeai as genai
 from django.conf import settings
 from django.db.models import Avg, Max, Min
+import hashlib
 import json
+import threading
+
+from registro import cache_versionada
 
 
 class GeminiAnalisisIndicadores:
     def __init__(self):
+        # El SDK tarda en importarse; solo se carga al crear el analizador
+        import google.generativeai as genai
+
         genai.configure(api_key=settings.GEMINI_API_KEY)
         self.model = genai.GenerativeModel('gemini-2.5-flash')
 
+    def _generar(self, prompt):
+        """
+        Texto generado para el prompt. Las respuestas se guardan en el espacio de caché
+        'analisis_ia' por el hash del prompt, que ya incluye los datos analizados
+        """
+        clave = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        return cache_versionada.espacio('analisis_ia').get_or_set(
+            clave, lambda: self.model.generate_content(prompt).text)
+
     def analizar_indicador_individual(self, indicador):
         """
         Analiza un indicador individual de adaptación
@@ -24,12 +39,12 @@ class GeminiAnalisisIndicadores:
         prompt = self._construir_prompt_individual(datos)
 
         try:
-            response = self.model.generate_content(prompt)
+            texto = self._generar(prompt)
             return {
                 'exito': True,
                 'indicador_id': indicador.id,
                 'indicador_nombre': indicador.nombre,
-                'analisis': response.text,
+                'analisis': texto,
                 'datos_analizados': datos
             }
         except Exception as e:
@@ -66,13 +81,13 @@ class GeminiAnalisisIndicadores:
         prompt = self._construir_prompt_accion(accion, resumen_indicadores)
 
         try:
-            response = self.model.generate_content(prompt)
+            texto = self._generar(prompt)
             return {
                 'exito': True,
                 'accion_id': accion.id,
                 'accion_nombre': accion.nombre,
                 'total_indicadores': len(resumen_indicadores),
-                'analisis_consolidado': response.text,
+                'analisis_consolidado': texto,
                 'indicadores_analizados': [ind.nombre for ind in indicadores]
             }
         except Exception as e:
@@ -130,12 +145,12 @@ class GeminiAnalisisIndicadores:
         """
 
         try:
-            response = self.model.generate_content(prompt)
+            texto = self._generar(prompt)
             return {
                 'exito': True,
                 'indicador_id': indicador.id,
                 'progreso': progreso,
-                'analisis_meta': response.text
+                'analisis_meta': texto
             }
         except Exception as e:
             return {
@@ -194,14 +209,14 @@ class GeminiAnalisisIndicadores:
         """
 
         try:
-            response = self.model.generate_content(prompt)
+            texto = self._generar(prompt)
             return {
                 'exito': True,
                 'sector_id': sector.id,
                 'sector_nombre': sector.nombre,
                 'total_acciones': acciones.count(),
                 'total_indicadores': len(todos_indicadores),
-                'analisis_comparativo': response.text
+                'analisis_comparativo': texto
             }
         except Exception as e:
             return {
@@ -265,12 +280,12 @@ class GeminiAnalisisIndicadores:
         """
 
         try:
-            response = self.model.generate_content(prompt)
+            texto = self._generar(prompt)
             return {
                 'exito': True,
                 'indicador_id': indicador.id,
                 'total_mediciones': resultados.count(),
-                'analisis_tendencias': response.text,
+                'analisis_tendencias': texto,
                 'serie_temporal': serie_temporal
             }
         except Exception as e:
@@ -444,4 +459,17 @@ class GeminiAnalisisIndicadores:
           Variación: {ind['variacion_porcentual']}%
         """
 
-        return texto
\ No newline at end of file
+        return texto
+
+
+_analizador = None
+_bloqueo_analizador = threading.Lock()
+
+
+def obtener_analizador():
+    """Instancia única de GeminiAnalisisIndicadores, creada (y configurada) en el primer uso"""
+    global _analizador
+    with _bloqueo_analizador:
+        if _analizador is None:
+            _analizador = GeminiAnalisisIndicadores()
+    return _analizador
@@ -6,7 +6,7 @@ from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_http_methods
 
-from ai.analisis import GeminiAnalisisIndicadores
+from ai.analisis import obtener_analizador
 from nomencladores.models import Sector
 from registro.models import Indicador, Accion
 
@@ -22,7 +22,7 @@ def analizar_indicador(request, indicador_id):
     indicador = get_object_or_404(Indicador, id=indicador_id)
 
     # Analizar con Gemini
-    gemini = GeminiAnalisisIndicadores()
+    gemini = obtener_analizador()
     resultado = gemini.analizar_indicador_individual(indicador)
 
     if resultado['exito']:
@@ -48,7 +48,7 @@ def analizar_accion(request, accion_id):
             'error': 'No tiene permisos para analizar esta acción'
         }, status=403)
 
-    gemini = GeminiAnalisisIndicadores()
+    gemini = obtener_analizador()
     resultado = gemini.analizar_indicadores_accion(accion)
 
     if resultado['exito']:
@@ -67,7 +67,7 @@ def analizar_progreso_meta(request, indicador_id):
     """
     indicador = get_object_or_404(Indicador, id=indicador_id)
 
-    gemini = GeminiAnalisisIndicadores()
+    gemini = obtener_analizador()
     resultado = gemini.generar_reporte_progreso_meta(indicador)
 
     if resultado['exito']:
@@ -86,7 +86,7 @@ def analizar_tendencias(request, indicador_id):
     """
     indicador = get_object_or_404(Indicador, id=indicador_id)
 
-    gemini = GeminiAnalisisIndicadores()
+    gemini = obtener_analizador()
     resultado = gemini.analizar_tendencias_temporales(indicador)
 
     if resultado['exito']:
@@ -105,7 +105,7 @@ def comparar_sector(request, sector_id):
     """
     sector = get_object_or_404(Sector, id=sector_id)
 
-    gemini = GeminiAnalisisIndicadores()
+    gemini = obtener_analizador()
     resultado = gemini.comparar_indicadores_sector(sector)
 
     if resultado['exito']:
@@ -201,7 +201,7 @@ def obtener_analisis_ajax(request):
                 'error': 'No se proporcionaron IDs de indicadores'
             }, status=400)
 
-        gemini = GeminiAnalisisIndicadores()
+        gemini = obtener_analizador()
         resultados = []
 
         for ind_id in indicador_ids:
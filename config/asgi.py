@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# Índice de geometrías del mapa al arrancar, no en la primera petición (registro.geometria)
+if settings.GEOMETRIAS_PRECARGAR:
+    from registro import geometria
+
+    geometria.precargar_indices()
@@ -59,10 +59,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'registro.estaticos.EstaticosMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'seguridad.auditoria.AuditoriaAgrupadaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django_browser_reload.middleware.BrowserReloadMiddleware',
@@ -92,11 +94,98 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=sqlite (por defecto) o postgresql (requiere psycopg). Las conexiones se reutilizan
+# durante DB_CONN_MAX_AGE segundos.
+DB_ENGINE = config('DB_ENGINE', default='sqlite')
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=60, cast=int)
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME'),
+            'USER': config('DB_USER', default=''),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default='localhost'),
+            'PORT': config('DB_PORT', default='5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {
+                # Toma el bloqueo de escritura al iniciar la transacción, de modo que busy_timeout
+                # espera en lugar de fallar con "database is locked" al promover una lectura
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+
+# Pragmas que se aplican a cada conexión SQLite nueva (registro.signals)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int),
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+# Cachés con nombre (registro.cache_versionada). CACHE_BACKEND=locmem (por defecto, propia de cada
+# proceso), file (compartida entre procesos en CACHE_DIR), db (tablas creadas con
+# python manage.py createcachetable), redis o memcached (servidor en CACHE_URL)
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+CACHE_DIR = config('CACHE_DIR', default=os.path.join(BASE_DIR, 'cache'))
+CACHE_URL = config('CACHE_URL', default='')
+# Procesos que atienden peticiones. Los contadores de versión de los espacios viven en la caché:
+# con locmem y más de un proceso, una invalidación no llegaría a los demás y servirían datos
+# obsoletos, así que en ese caso no se cachea (dummy) hasta configurar un backend compartido
+CACHE_PROCESOS = config('CACHE_PROCESOS', default=1, cast=int)
+if CACHE_BACKEND == 'locmem' and CACHE_PROCESOS > 1:
+    CACHE_BACKEND = 'dummy'
+
+BACKENDS_CACHE = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'db': 'django.core.cache.backends.db.DatabaseCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+    'dummy': 'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def _cache(nombre, timeout, max_entradas):
+    ubicacion = {
+        'locmem': nombre,
+        'file': os.path.join(CACHE_DIR, nombre),
+        'db': f'cache_{nombre}',
+        'redis': CACHE_URL,
+        'memcached': CACHE_URL,
+        'dummy': '',
+    }[CACHE_BACKEND]
+    return {
+        'BACKEND': BACKENDS_CACHE[CACHE_BACKEND],
+        'LOCATION': ubicacion,
+        'TIMEOUT': timeout,
+        # Redis y memcached comparten servidor: cada caché con nombre va con su prefijo
+        'KEY_PREFIX': nombre if CACHE_BACKEND in ('redis', 'memcached') else '',
+        'OPTIONS': {'MAX_ENTRIES': max_entradas} if CACHE_BACKEND in ('locmem', 'file', 'db') else {},
+    }
+
+
+CACHES = {
+    'default': _cache('default', 300, 1000),
+    'nomencladores': _cache('nomencladores', 60 * 60 * 24, 500),
+    'vistas': _cache('vistas', 60 * 60, 5000),
+    'analisis_ia': _cache('analisis_ia', 60 * 60 * 24 * 7, 1000),
+    'mapa': _cache('mapa', 60 * 60 * 24, 2000),
+    'pronosticos': _cache('pronosticos', None, 20000),
 }
 
 
@@ -139,10 +228,57 @@ STATICFILES_DIRS = (
 )
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles_build', 'static')
 
+# Ficheros estáticos (registro.estaticos, python manage.py construir_estaticos): collectstatic
+# copia de static/ solo lo referenciado por las plantillas y lo que case con ESTATICOS_INCLUIR
+# (ficheros que algún JS carga por su ruta), con hash en el nombre y variantes .gz/.br. Con
+# ESTATICOS_SERVIR el propio Django sirve STATIC_ROOT con caché de un año
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'registro.estaticos.AlmacenEstaticos'},
+}
+STATICFILES_FINDERS = [
+    'registro.estaticos.BuscadorReferenciados',
+    'django.contrib.staticfiles.finders.AppDirectoriesFinder',
+]
+ESTATICOS_INCLUIR = []
+ESTATICOS_SERVIR = config('ESTATICOS_SERVIR', default=not DEBUG, cast=bool)
+
 MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Archivo histórico de auditoría (python manage.py archivar_auditoria). Va fuera de MEDIA_ROOT
+# porque en DEBUG los ficheros de MEDIA_ROOT se sirven sin autenticación
+AUDITORIA_ARCHIVO_DIR = config('AUDITORIA_ARCHIVO_DIR', default=os.path.join(BASE_DIR, 'archivo_auditoria'))
+AUDITORIA_RETENCION_DIAS = config('AUDITORIA_RETENCION_DIAS', default=180, cast=int)
+
+# Detección de resultados atípicos (registro.anomalias): umbral del z robusto, revisión del
+# indicador al guardar cada resultado y exclusión de las anomalías en las estadísticas
+ANOMALIAS_UMBRAL = config('ANOMALIAS_UMBRAL', default=3.5, cast=float)
+ANOMALIAS_DETECCION_AUTOMATICA = config('ANOMALIAS_DETECCION_AUTOMATICA', default=True, cast=bool)
+ANOMALIAS_EXCLUIR_DE_ESTADISTICAS = config('ANOMALIAS_EXCLUIR_DE_ESTADISTICAS', default=False, cast=bool)
+
+# Documentos adjuntos (registro.documentos): extracción del texto en segundo plano al subirlos y
+# número de hilos del proceso web dedicados a ella. Con la extracción automática desactivada se
+# usa el comando extraer_texto_documentos. Cada extracción lee el fichero entero en memoria: los
+# mayores de DOCUMENTOS_EXTRACCION_TAMANO_MAXIMO quedan como no soportados
+DOCUMENTOS_EXTRACCION_AUTOMATICA = config('DOCUMENTOS_EXTRACCION_AUTOMATICA', default=True, cast=bool)
+DOCUMENTOS_HILOS_EXTRACCION = config('DOCUMENTOS_HILOS_EXTRACCION', default=2, cast=int)
+DOCUMENTOS_EXTRACCION_TAMANO_MAXIMO = config('DOCUMENTOS_EXTRACCION_TAMANO_MAXIMO', default=64 * 1024 * 1024,
+                                             cast=int)
+
+# Subidas por fragmentos de documentos grandes (registro.subidas). Los ficheros parciales van
+# fuera de MEDIA_ROOT y conviene que estén en el mismo disco para moverlos sin copiarlos
+SUBIDAS_DIR = config('SUBIDAS_DIR', default=os.path.join(BASE_DIR, 'subidas_parciales'))
+SUBIDAS_TAMANO_FRAGMENTO = config('SUBIDAS_TAMANO_FRAGMENTO', default=8 * 1024 * 1024, cast=int)
+SUBIDAS_TAMANO_MAXIMO = config('SUBIDAS_TAMANO_MAXIMO', default=2 * 1024 ** 3, cast=int)
+SUBIDAS_CADUCIDAD_HORAS = config('SUBIDAS_CADUCIDAD_HORAS', default=48, cast=int)
+
+# Geometrías simplificadas del mapa (python manage.py construir_geometrias)
+GEOMETRIAS_DIR = os.path.join(BASE_DIR, 'staticfiles_build', 'geometrias')
+# Construir el índice de geometrías por zoom al arrancar el servidor (config/wsgi.py, asgi.py)
+GEOMETRIAS_PRECARGAR = config('GEOMETRIAS_PRECARGAR', default=True, cast=bool)
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 from django.contrib.messages import constants as messages
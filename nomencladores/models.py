@@ -74,14 +74,11 @@ class Sector(NomencladorAbstract):
         return self.nombre
 
     def get_presupuesto_total(self):
+        # Lee los totales precalculados en registro.ResumenPresupuestoSector
+        totales = dict(self.resumenes_presupuesto.values_list('tipo_moneda_id', 'monto_planificado'))
         presupuesto_total_por_monedas = []
         for tm in TipoMoneda.objects.all():
-            monto_total = 0
-            for a in self.accion_set.all():
-                for pp in a.presupuestos_planificados.filter(tipo_moneda=tm):
-                    monto_total += pp.monto
-
-            presupuesto_total_por_monedas.append({'moneda': tm, 'total': monto_total})
+            presupuesto_total_por_monedas.append({'moneda': tm, 'total': totales.get(tm.id, 0)})
 
         return presupuesto_total_por_monedas
 
@@ -324,10 +324,12 @@ def clear_and_populate():
     # 6. RESULTADOS DE INDICADORES
     print("Creando resultados de indicadores...")
     ResultadoIndicador.objects.all().delete()
+    indicadores_list = list(Indicador.objects.all())
 
     for i in range(5):
         fecha_resultado = date.today() - timedelta(days=30 * i)
         resultado = ResultadoIndicador.objects.create(
+            indicador=indicadores_list[i] if i < len(indicadores_list) else None,
             fuente_dato=f"Sistema de monitoreo {i + 1}",
             valor=100.5 + (i * 25.3),
             observacion=f"Resultado del período {i + 1}",
@@ -494,16 +496,9 @@ def clear_and_populate():
 
     print("Acciones creadas exitosamente.")
 
-    # Agregar resultados a indicadores
-    print("Vinculando resultados a indicadores...")
-    indicadores_list = list(Indicador.objects.all())
-    resultados_list = list(ResultadoIndicador.objects.all())
-
-    for i, indicador in enumerate(indicadores_list):
-        if i < len(resultados_list):
-            indicador.resultados.add(resultados_list[i])
-
-        # Actualizar última medición
+    # Última medición de cada indicador según sus resultados
+    print("Actualizando última medición de los indicadores...")
+    for indicador in Indicador.objects.all():
         ultimo_resultado = indicador.resultados.order_by('-fecha').first()
         if ultimo_resultado:
             indicador.ultima_medicion = ultimo_resultado.fecha
@@ -1,12 +1,20 @@
+import functools
+import hashlib
+import json
 import statistics
+from datetime import datetime, timedelta
 
-import numpy as np
-from django.db.models import Avg, Min, Max, StdDev
+from django.db import transaction
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Avg, Min, Max, StdDev, Sum, Count, F, Q, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.utils import timezone
-from sympy import sympify, Symbol
 
-from registro.models import ResultadoVariable
+from nomencladores.models import EstadoAccion, TipoMoneda
+from registro import cache_versionada, geometria
+from registro.models import ResultadoVariable, Accion, PresupuestoPlanificado, ResumenPresupuestoAccion, \
+    ResumenPresupuestoSector, ResumenPresupuestoTerritorio
 from registro.utils import data_chart_line
 
 
@@ -212,6 +220,8 @@ class StatisticsCalculatorService:
     @staticmethod
     def _calculate_percentiles(valores):
         """Calcula percentiles útiles para análisis"""
+        import numpy as np
+
         if len(valores) < 4:
             return {}
 
@@ -225,6 +235,8 @@ class StatisticsCalculatorService:
     @staticmethod
     def calculate_trend_strength(object_list):
         """Calcula la fuerza de la tendencia usando correlación"""
+        import numpy as np
+
         if object_list.count() < 3:
             return {'fuerza': 0, 'descripcion': 'Insuficientes datos'}
 
@@ -372,22 +384,47 @@ class ResultadoIndicadorService:
 
     def save_resultado_with_calculation(self, form_resultado_indicador, formset_variables,
                                         indicador, resultado_obj):
-        """Guarda el resultado y calcula el valor usando la fórmula"""
-        variables_resultados = []
-
-        # Limpiar variables anteriores si es edición
-        if resultado_obj.pk:
-            resultado_obj.resultadovariable_set.all().delete()
-
-        # Guardar valores de las variables
-        for form in formset_variables:
-            v = ResultadoVariable()
-            v.resultado = resultado_obj
-            v.variable_indicador_id = form.cleaned_data['variable_indicador_id']
-            v.valor = form.cleaned_data['valor']
-            v.fecha = form_resultado_indicador.cleaned_data['fecha']
-            v.save()
+        """
+        Guarda los valores de las variables, calcula el valor con la fórmula y lo guarda en el
+        resultado. Las variables se comparan con las ya guardadas: solo se insertan las nuevas, se
+        actualizan las que cambiaron y se eliminan las que ya no llegan, con una consulta por
+        operación, de modo que el costo no depende de la historia del indicador.
+        """
+        from auditlog.models import LogEntry
+        from nomencladores.models import VariableIndicador
+        from seguridad.auditoria import registrar_cambios
+
+        enviados = {
+            form.cleaned_data['variable_indicador_id']: form.cleaned_data['valor']
+            for form in formset_variables
+        }
+        existentes = {v.variable_indicador_id: v for v in resultado_obj.resultadovariable_set.all()}
+        variables = VariableIndicador.objects.in_bulk(list(enviados))
+
+        nuevas, cambiadas, cambios, variables_resultados = [], [], [], []
+        for variable_id, valor in enviados.items():
+            v = existentes.get(variable_id)
+            if v is None:
+                v = ResultadoVariable(resultado=resultado_obj, variable_indicador_id=variable_id, valor=valor)
+                nuevas.append(v)
+            elif v.valor != valor:
+                cambios.append((v, {'valor': [str(v.valor), str(valor)]}))
+                v.valor = valor
+                v.fecha = timezone.now()  # auto_now no se aplica en bulk_update
+                cambiadas.append(v)
+            v.variable_indicador = variables.get(variable_id)
             variables_resultados.append(v)
+        eliminadas = [v.id for variable_id, v in existentes.items() if variable_id not in enviados]
+
+        ResultadoVariable.objects.bulk_create(nuevas)
+        ResultadoVariable.objects.bulk_update(cambiadas, ['valor', 'fecha'])
+        if eliminadas:
+            ResultadoVariable.objects.filter(id__in=eliminadas).delete()
+        # bulk_create y bulk_update no emiten señales: se registran aquí las entradas de auditoría
+        registrar_cambios([
+            *((v, LogEntry.Action.CREATE, {'valor': ['None', str(v.valor)]}) for v in nuevas),
+            *((v, LogEntry.Action.UPDATE, cambio) for v, cambio in cambios),
+        ])
 
         # Calcular resultado usando el servicio de cálculo
         result = self.formula_calculator.calculate_formula_result(
@@ -395,16 +432,13 @@ class ResultadoIndicadorService:
         )
 
         # Actualizar resultado
-        resultado_obj.valor = round(result, 2)
+        resultado_obj.valor = round(float(result), 2)
+        resultado_obj.indicador = indicador
         resultado_obj.save()
 
         # Actualizar última medición del indicador
         indicador.ultima_medicion = form_resultado_indicador.cleaned_data['fecha']
-        indicador.save()
-
-        # Añadir al indicador si es nuevo
-        if resultado_obj not in indicador.resultados.all():
-            indicador.resultados.add(resultado_obj)
+        indicador.save(update_fields=['ultima_medicion'])
 
 
 class FormulaCalculatorService:
@@ -413,6 +447,8 @@ class FormulaCalculatorService:
     @staticmethod
     def calculate_formula_result(formula_string, variables_resultados):
         """Calcula el resultado de una fórmula con variables"""
+        from sympy import sympify, Symbol
+
         formula = sympify(formula_string)
         symbols = [Symbol(var.variable_indicador.variable) for var in variables_resultados]
         substitutions = {
@@ -421,6 +457,21 @@ class FormulaCalculatorService:
         }
 
         return formula.subs(substitutions)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def compilar(formula_string):
+        """
+        (símbolos, función) de la fórmula para evaluarla sobre arreglos de numpy; la función recibe
+        un arreglo por símbolo en el orden devuelto. Se compila una vez por fórmula.
+        """
+        from sympy import lambdify, sympify
+
+        expresion = sympify(formula_string)
+        simbolos = sorted(expresion.free_symbols, key=str)
+        return [str(simbolo) for simbolo in simbolos], lambdify(simbolos, expresion, modules='numpy')
+
+
 class InsightGeneratorService:
     """Servicio para generar insights automáticos"""
 
@@ -593,6 +644,25 @@ class InsightGeneratorService:
                 'accion_recomendada': 'Mejorar protocolo de medición'
             })
 
+        # Resultados marcados por el detector de anomalías
+        from django.conf import settings
+        from registro.models import AnomaliaResultado
+
+        anomalias = AnomaliaResultado.objects.filter(
+            indicador_id__in=object_list.values('indicador_id'), descartada=False).count()
+        if anomalias:
+            excluidas = settings.ANOMALIAS_EXCLUIR_DE_ESTADISTICAS
+            insights.append({
+                'tipo': 'datos_atipicos',
+                'titulo': 'Resultados Atípicos Detectados',
+                'descripcion': f"{anomalias} resultado(s) se apartan de la tendencia y la estacionalidad de la serie "
+                               f"(posibles errores de unidad o de fórmula). "
+                               f"{'Se excluyen de las estadísticas.' if excluidas else 'Se incluyen en las estadísticas.'}",
+                'nivel': 'regular',
+                'icono': 'ki-information',
+                'accion_recomendada': 'Revisar los valores marcados'
+            })
+
         # Análisis de frecuencia de mediciones
         if len(object_list) >= 2:
             fechas = [r.fecha for r in object_list.order_by('fecha')]
@@ -810,25 +880,211 @@ class InsightGeneratorService:
 
 
 class ChartDataService:
-    """Servicio para preparar datos de gráficos"""
+    """
+    Servicio para preparar datos de gráficos. Las series con más de PUNTOS resultados se reducen
+    con LTTB (registro.muestreo) antes de enviarlas al navegador
+    """
+
+    PUNTOS = 1000
+    PUNTOS_MAXIMO = 10000
+
+    @staticmethod
+    def _fechas_valores(object_list):
+        """(fechas, valores) de los resultados, sin los que no tienen valor"""
+        if hasattr(object_list, 'values_list'):
+            filas = object_list.values_list('fecha', 'valor')
+        else:
+            filas = ((r.fecha, r.valor) for r in object_list)
+        filas = [(fecha, valor) for fecha, valor in filas if valor is not None]
+        return [f for f, _ in filas], [v for _, v in filas]
 
     @staticmethod
-    def prepare_chart_data(object_list, indicador):
-        """Prepara los datos para el gráfico de línea"""
+    def _milisegundos(fechas):
+        import numpy as np
+
+        return np.array(fechas, dtype='datetime64[D]').astype('datetime64[ms]').astype(np.int64)
+
+    @staticmethod
+    def prepare_chart_data(object_list, indicador, puntos=PUNTOS):
+        """Prepara los datos para el gráfico de línea (resultados ordenados por fecha)"""
+        from registro import muestreo
+
+        fechas, valores = ChartDataService._fechas_valores(object_list)
+        if len(fechas) > puntos:
+            elegidos = muestreo.lttb(ChartDataService._milisegundos(fechas), valores, puntos).tolist()
+            fechas = [fechas[i] for i in elegidos]
+            valores = [valores[i] for i in elegidos]
+
         data_line = {
             'valores': {
                 'name': 'Valor',
-                'data': []
+                'data': [round(valor, 2) for valor in valores]
             },
-            'labels': []
+            'labels': [fecha.strftime("%d-%m-%Y") for fecha in fechas]
         }
+        return data_chart_line(data_line, indicador)
 
-        for result in object_list:
-            data_line['valores']['data'].append(round(result.valor, 2))
-            data_line['labels'].append(result.fecha.strftime("%d-%m-%Y"))
+    @staticmethod
+    def serie(indicador, puntos=PUNTOS, desde=None, hasta=None):
+        """
+        Serie columnar del indicador para el gráfico (registro.muestreo.reducir): x en milisegundos
+        desde 1970, y reducida con LTTB y, si se redujo, la envolvente min/max de cada cubeta.
+        desde/hasta (fechas) acotan el tramo en la base de datos, con el resultado anterior y el
+        siguiente para que la línea llegue a los bordes.
+        """
+        from registro import muestreo
+
+        puntos = min(max(puntos, muestreo.MINIMO_PUNTOS), ChartDataService.PUNTOS_MAXIMO)
+        resultados = indicador.resultados.exclude(valor__isnull=True).order_by('fecha')
+        tramo = resultados
+        if desde is not None:
+            tramo = tramo.filter(fecha__gte=desde)
+        if hasta is not None:
+            tramo = tramo.filter(fecha__lte=hasta)
+        filas = list(tramo.values_list('fecha', 'valor'))
+        if desde is not None:
+            filas = list(resultados.filter(fecha__lt=desde).order_by('-fecha').values_list('fecha', 'valor')[:1]) + filas
+        if hasta is not None:
+            filas += list(resultados.filter(fecha__gt=hasta).values_list('fecha', 'valor')[:1])
+
+        serie = muestreo.reducir(ChartDataService._milisegundos([f for f, _ in filas]),
+                                 [v for _, v in filas], puntos)
+        serie['nombre'] = indicador.nombre
+        serie['unidad'] = indicador.unidad_medida.nombre
+        return serie
 
-        # Asumiendo que data_chart_line es una función externa
-        return data_chart_line(data_line, indicador)
+    @staticmethod
+    def distribucion(indicador, cubetas=20):
+        """Histograma de los valores del indicador: {'x': centros, 'y': frecuencias, 'ancho'}"""
+        import numpy as np
+
+        valores = np.array(indicador.resultados.exclude(valor__isnull=True).values_list('valor', flat=True),
+                           dtype=np.float64)
+        valores = valores[np.isfinite(valores)]
+        if not len(valores):
+            return {'x': [], 'y': [], 'ancho': 0}
+        frecuencias, bordes = np.histogram(valores, bins=min(cubetas, max(len(np.unique(valores)), 1)))
+        return {
+            'x': np.round((bordes[:-1] + bordes[1:]) / 2, 2).tolist(),
+            'y': frecuencias.tolist(),
+            'ancho': round(float(bordes[1] - bordes[0]), 4),
+        }
+
+    @staticmethod
+    def donas_presupuesto(accion):
+        """[restante, ejecutado] de la acción por moneda activa, a partir de ResumenPresupuestoAccion"""
+        resumenes = {r.tipo_moneda_id: r for r in accion.resumenes_presupuesto.all()}
+        donas = []
+        for moneda in TipoMoneda.objects.filter(estado=True):
+            resumen = resumenes.get(moneda.id)
+            total = resumen.monto_planificado if resumen else None
+            ejecutado = resumen.monto_ejecutado if resumen else 0
+            donas.append({
+                'moneda': moneda.nombre,
+                'series': [round(total - ejecutado, 2), round(ejecutado, 2)] if total else [0, 0],
+            })
+        return donas
+
+    @staticmethod
+    def acciones_panel(user):
+        """Acciones publicadas que ve el usuario en el panel (todas si es superusuario)"""
+        if user.is_superuser:
+            return Accion.objects.filter(publicado=True)
+        return Accion.objects.filter(user=user, publicado=True)
+
+    @staticmethod
+    def presupuestos_panel(acciones):
+        """Planificado, ejecutado y porcentaje de ejecución por moneda activa"""
+        # Una sola consulta agrupada sobre los totales precalculados por acción
+        totales_por_moneda = {
+            fila['tipo_moneda_id']: fila
+            for fila in ResumenPresupuestoAccion.objects.filter(accion__in=acciones)
+            .values('tipo_moneda_id')
+            .annotate(planificado=Sum('monto_planificado'), ejecutado=Sum('monto_ejecutado'))
+        }
+        presupuestos_por_moneda = []
+        for moneda in TipoMoneda.objects.filter(estado=True):
+            fila = totales_por_moneda.get(moneda.id, {})
+            total_planificado = fila.get('planificado') or 0
+            total_ejecutado = fila.get('ejecutado') or 0
+
+            # Cálculos
+            restante = total_planificado - total_ejecutado
+            porcentaje_ejecutado = (
+                (total_ejecutado / total_planificado * 100)
+                if total_planificado > 0 else 0
+            )
+
+            # Estado del semáforo
+            if porcentaje_ejecutado < 50:
+                estado = 'danger'
+            elif porcentaje_ejecutado < 80:
+                estado = 'warning'
+            else:
+                estado = 'success'
+
+            presupuestos_por_moneda.append({
+                'moneda': moneda.nombre,
+                'total_planificado': round(total_planificado, 2),
+                'total_ejecutado': round(total_ejecutado, 2),
+                'restante': round(restante, 2),
+                'porcentaje_ejecutado': round(porcentaje_ejecutado, 2),
+                'estado': estado
+            })
+        return presupuestos_por_moneda
+
+    @staticmethod
+    def estados_panel(acciones):
+        """Número y porcentaje de acciones por estado, con una consulta agrupada"""
+        conteos = dict(acciones.values('estado_accion_id').annotate(n=Count('id')).values_list('estado_accion_id', 'n'))
+        total = sum(conteos.values())
+        return [
+            {
+                'estado': estado.nombre,
+                'count': conteos.get(estado.id, 0),
+                'porcentaje': round(conteos.get(estado.id, 0) / total * 100, 2) if total else 0,
+            }
+            for estado in EstadoAccion.objects.all().order_by('orden')
+        ]
+
+    # Huellas para el ETag de las vistas de datos de gráficos. Salen de agregados sobre las filas
+    # que lee cada vista, así que valen igual en cualquier proceso y solo cambian con los datos
+
+    @staticmethod
+    def _firma(*partes):
+        return hashlib.sha256(repr(partes).encode()).hexdigest()[:20]
+
+    @staticmethod
+    def huella_resultados(indicador_id):
+        """Nombre y unidad del indicador y cantidad, último id, rango de fechas y suma de sus resultados"""
+        from registro.models import Indicador, ResultadoIndicador
+
+        return ChartDataService._firma(
+            Indicador.objects.filter(id=indicador_id).values_list('nombre', 'unidad_medida__nombre').first(),
+            ResultadoIndicador.objects.filter(indicador_id=indicador_id).aggregate(
+                n=Count('id'), ultimo_id=Max('id'), primera_fecha=Min('fecha'), ultima_fecha=Max('fecha'),
+                suma=Sum('valor')),
+        )
+
+    @staticmethod
+    def huella_resumenes(acciones):
+        """
+        Monedas activas y cantidad, último id y suma de los totales precalculados de las acciones.
+        ResumenPresupuestoService reescribe las filas de una acción al recalcularla, así que el
+        último id cambia aunque los montos no
+        """
+        return ChartDataService._firma(
+            list(TipoMoneda.objects.filter(estado=True).values_list('id', 'nombre')),
+            ResumenPresupuestoAccion.objects.filter(accion__in=acciones).aggregate(
+                n=Count('id'), ultimo_id=Max('id'), planificado=Sum('monto_planificado'),
+                ejecutado=Sum('monto_ejecutado')),
+        )
+
+    @staticmethod
+    def huella_panel(acciones):
+        """Huella de los totales y del conteo por estado de las acciones del panel"""
+        return ChartDataService._firma(ChartDataService.huella_resumenes(acciones),
+                                       ChartDataService.estados_panel(acciones))
 
 
 class RankingCalculatorService:
@@ -986,6 +1242,7 @@ class MetaProgressService:
             'distancia_meta': round(distancia_meta, 2),
             'porcentaje_faltante': round(porcentaje_faltante, 2),
             'tiempo_estimado': tiempo_estimado,
+            'probabilidad_meta': PronosticoService.probabilidad_meta(indicador),
             'nivel_riesgo': riesgo,
             'unidad_medida': indicador.unidad_medida.nombre if indicador.unidad_medida else '',
             'direccion': indicador.get_direccion_optima_display()
@@ -993,55 +1250,24 @@ class MetaProgressService:
 
     @staticmethod
     def _estimate_time_to_goal(indicador, valor_actual, meta_valor):
-        """Estima tiempo para alcanzar la meta basado en tendencia actual"""
-        resultados = indicador.resultados.order_by('fecha')
-
-        if resultados.count() < 3:
-            return None
-
-        # Calcular velocidad promedio mensual de los últimos 3 resultados
-        ultimos_3 = list(resultados.order_by('-fecha')[:3])
-
-        diferencias_temporales = []
-        cambios = []
-
-        for i in range(len(ultimos_3) - 1):
-            fecha_actual = ultimos_3[i].fecha
-            fecha_anterior = ultimos_3[i + 1].fecha
-            dias_diff = (fecha_actual - fecha_anterior).days
-
-            if dias_diff > 0:
-                cambio = ultimos_3[i].valor - ultimos_3[i + 1].valor
-                cambio_mensual = (cambio / dias_diff) * 30
-                cambios.append(cambio_mensual)
-
-        if not cambios:
-            return None
-
-        velocidad_promedio_mensual = sum(cambios) / len(cambios)
+        """Estima tiempo para alcanzar la meta con el pronóstico del indicador (PronosticoService)"""
+        from registro import pronostico
 
-        if velocidad_promedio_mensual == 0:
-            return None
-
-        # Calcular meses necesarios
-        if indicador.direccion_optima == 'incremento':
-            diferencia_necesaria = meta_valor - valor_actual
-            if velocidad_promedio_mensual <= 0:
-                return None  # Tendencia contraria
-        else:
-            diferencia_necesaria = valor_actual - meta_valor
-            if velocidad_promedio_mensual >= 0:
-                return None  # Tendencia contraria
-            velocidad_promedio_mensual = abs(velocidad_promedio_mensual)
-
-        if diferencia_necesaria <= 0:
+        incremento = indicador.direccion_optima != 'decremento'
+        if (valor_actual >= meta_valor) if incremento else (valor_actual <= meta_valor):
             return {'meses': 0, 'descripcion': 'Meta ya alcanzada'}
 
-        meses_estimados = diferencia_necesaria / velocidad_promedio_mensual
+        ajuste = PronosticoService.ajuste(indicador)
+        if ajuste is None:
+            return None
+        pasos = pronostico.paso_de_cruce(ajuste, meta_valor, incremento)
+        if pasos is None:
+            return None  # El pronóstico no alcanza la meta
 
+        meses_estimados = pasos * ajuste['paso_dias'] / 30
         return {
             'meses': round(meses_estimados, 1),
-            'descripcion': f'Aproximadamente {round(meses_estimados)} meses al ritmo actual'
+            'descripcion': f'Aproximadamente {round(meses_estimados)} meses según el pronóstico ({ajuste["modelo"]})'
         }
 
     @staticmethod
@@ -1109,4 +1335,1350 @@ class ClimateInsightAnalyzer:
         # Lógica específica para indicadores de adaptación
         # ...
 
-        return insights
\ No newline at end of file
+        return insights
+
+
+class ResumenPresupuestoService:
+    """
+    Mantiene los totales precalculados de presupuesto (planificado, ejecutado y restante)
+    por acción, sector y territorio para cada moneda.
+
+    Cada método recalcula solo las filas afectadas con consultas agrupadas, de modo que el costo
+    no depende del número total de acciones.
+    """
+
+    @staticmethod
+    def actualizar_presupuestos_planificados(presupuesto_ids):
+        """Recalcula el monto ejecutado de los presupuestos planificados y propaga a sus acciones"""
+        presupuesto_ids = set(presupuesto_ids)
+        if not presupuesto_ids:
+            return
+
+        ResumenPresupuestoService._recalcular_montos_ejecutados(presupuesto_ids)
+
+        accion_ids = Accion.presupuestos_planificados.through.objects.filter(
+            presupuestoplanificado_id__in=presupuesto_ids
+        ).values_list('accion_id', flat=True)
+        ResumenPresupuestoService.actualizar_acciones(accion_ids)
+
+    @staticmethod
+    def _recalcular_montos_ejecutados(presupuesto_ids):
+        """Actualiza PresupuestoPlanificado.monto_ejecutado con una sola sentencia UPDATE"""
+        through = PresupuestoPlanificado.presupuestos_ejecutados.through
+        ejecutado = (
+            through.objects
+            .filter(presupuestoplanificado_id=OuterRef('pk'))
+            .values('presupuestoplanificado_id')
+            .annotate(total=Sum('presupuestoejecutado__monto'))
+            .values('total')
+        )
+        PresupuestoPlanificado.objects.filter(id__in=presupuesto_ids).update(
+            monto_ejecutado=Coalesce(Subquery(ejecutado), Value(0.0))
+        )
+
+    @staticmethod
+    def actualizar_acciones(accion_ids, sector_ids=(), municipio_ids=(), provincia_ids=()):
+        """
+        Recalcula los totales de las acciones indicadas y, a partir de ellos, los de sus sectores
+        y territorios. Los ids adicionales permiten recalcular sectores o territorios que la acción
+        acaba de abandonar.
+        """
+        accion_ids = set(accion_ids)
+        sector_ids = set(sector_ids)
+        municipio_ids = set(municipio_ids)
+        provincia_ids = set(provincia_ids)
+
+        if accion_ids:
+            through = Accion.presupuestos_planificados.through
+            filas = (
+                through.objects
+                .filter(accion_id__in=accion_ids)
+                .values('accion_id', 'presupuestoplanificado__tipo_moneda_id')
+                .annotate(
+                    planificado=Sum('presupuestoplanificado__monto'),
+                    ejecutado=Sum('presupuestoplanificado__monto_ejecutado'),
+                )
+            )
+            resumenes = [
+                ResumenPresupuestoAccion(
+                    accion_id=f['accion_id'],
+                    tipo_moneda_id=f['presupuestoplanificado__tipo_moneda_id'],
+                    monto_planificado=f['planificado'] or 0,
+                    monto_ejecutado=f['ejecutado'] or 0,
+                    monto_restante=(f['planificado'] or 0) - (f['ejecutado'] or 0),
+                )
+                for f in filas
+            ]
+
+            with transaction.atomic():
+                ResumenPresupuestoAccion.objects.filter(accion_id__in=accion_ids).delete()
+                ResumenPresupuestoAccion.objects.bulk_create(resumenes)
+            SerieEjecucionPresupuestoService.invalidar_acciones(accion_ids)
+            MapaAccionesService.invalidar()
+
+            sector_ids.update(
+                Accion.objects.filter(id__in=accion_ids).values_list('sector_id', flat=True)
+            )
+            municipio_ids.update(
+                Accion.municipios.through.objects.filter(accion_id__in=accion_ids)
+                .values_list('municipio_id', flat=True)
+            )
+            provincia_ids.update(
+                Accion.provincias.through.objects.filter(accion_id__in=accion_ids)
+                .values_list('provincia_id', flat=True)
+            )
+
+        ResumenPresupuestoService.actualizar_sectores(sector_ids)
+        ResumenPresupuestoService.actualizar_territorios(municipio_ids, provincia_ids)
+
+    @staticmethod
+    def actualizar_sectores(sector_ids):
+        """Recalcula los totales por sector a partir de los totales por acción"""
+        sector_ids = set(sector_ids)
+        if not sector_ids:
+            return
+
+        filas = (
+            ResumenPresupuestoAccion.objects
+            .filter(accion__sector_id__in=sector_ids)
+            .values('accion__sector_id', 'tipo_moneda_id')
+            .annotate(
+                planificado=Sum('monto_planificado'),
+                ejecutado=Sum('monto_ejecutado'),
+                restante=Sum('monto_restante'),
+            )
+        )
+        resumenes = [
+            ResumenPresupuestoSector(
+                sector_id=f['accion__sector_id'],
+                tipo_moneda_id=f['tipo_moneda_id'],
+                monto_planificado=f['planificado'],
+                monto_ejecutado=f['ejecutado'],
+                monto_restante=f['restante'],
+            )
+            for f in filas
+        ]
+
+        with transaction.atomic():
+            ResumenPresupuestoSector.objects.filter(sector_id__in=sector_ids).delete()
+            ResumenPresupuestoSector.objects.bulk_create(resumenes)
+
+    @staticmethod
+    def actualizar_territorios(municipio_ids=(), provincia_ids=()):
+        """
+        Recalcula los totales por municipio y por provincia. A nivel de provincia solo cuentan
+        las acciones sin municipios, igual que en el mapa de acciones.
+        """
+        municipio_ids = set(municipio_ids)
+        provincia_ids = set(provincia_ids)
+        resumenes = []
+
+        if municipio_ids:
+            filas = (
+                ResumenPresupuestoAccion.objects
+                .filter(accion__municipios__in=municipio_ids)
+                .values('accion__municipios', 'accion__municipios__provincia_id', 'tipo_moneda_id')
+                .annotate(
+                    planificado=Sum('monto_planificado'),
+                    ejecutado=Sum('monto_ejecutado'),
+                    restante=Sum('monto_restante'),
+                )
+            )
+            resumenes.extend(
+                ResumenPresupuestoTerritorio(
+                    municipio_id=f['accion__municipios'],
+                    provincia_id=f['accion__municipios__provincia_id'],
+                    tipo_moneda_id=f['tipo_moneda_id'],
+                    monto_planificado=f['planificado'],
+                    monto_ejecutado=f['ejecutado'],
+                    monto_restante=f['restante'],
+                )
+                for f in filas
+            )
+
+        if provincia_ids:
+            filas = (
+                ResumenPresupuestoAccion.objects
+                .filter(accion__provincias__in=provincia_ids, accion__municipios__isnull=True)
+                .values('accion__provincias', 'tipo_moneda_id')
+                .annotate(
+                    planificado=Sum('monto_planificado'),
+                    ejecutado=Sum('monto_ejecutado'),
+                    restante=Sum('monto_restante'),
+                )
+            )
+            resumenes.extend(
+                ResumenPresupuestoTerritorio(
+                    provincia_id=f['accion__provincias'],
+                    tipo_moneda_id=f['tipo_moneda_id'],
+                    monto_planificado=f['planificado'],
+                    monto_ejecutado=f['ejecutado'],
+                    monto_restante=f['restante'],
+                )
+                for f in filas
+            )
+
+        if not municipio_ids and not provincia_ids:
+            return
+
+        with transaction.atomic():
+            ResumenPresupuestoTerritorio.objects.filter(municipio_id__in=municipio_ids).delete()
+            ResumenPresupuestoTerritorio.objects.filter(
+                provincia_id__in=provincia_ids, municipio__isnull=True
+            ).delete()
+            ResumenPresupuestoTerritorio.objects.bulk_create(resumenes)
+        MapaAccionesService.invalidar()
+
+    @staticmethod
+    def reconstruir():
+        """Reconstruye todos los totales desde cero (recuperación ante inconsistencias)"""
+        from nomencladores.models import Sector, Municipio, Provincia
+
+        with transaction.atomic():
+            ResumenPresupuestoAccion.objects.all().delete()
+            ResumenPresupuestoSector.objects.all().delete()
+            ResumenPresupuestoTerritorio.objects.all().delete()
+            ResumenPresupuestoService._recalcular_montos_ejecutados(
+                PresupuestoPlanificado.objects.values_list('id', flat=True)
+            )
+            ResumenPresupuestoService.actualizar_acciones(
+                Accion.objects.values_list('id', flat=True),
+                sector_ids=Sector.objects.values_list('id', flat=True),
+                municipio_ids=Municipio.objects.values_list('id', flat=True),
+                provincia_ids=Provincia.objects.values_list('id', flat=True),
+            )
+
+
+# ============================================================================
+# Series temporales de ejecución presupuestaria y proyección de agotamiento
+# ============================================================================
+
+class SerieEjecucionPresupuestoService:
+    """
+    Reparte el monto de cada presupuesto ejecutado de forma uniforme entre su fecha de inicio y
+    de fin y lo acumula en periodos (mes o trimestre). A partir de ese reparto diario calcula el
+    ritmo de gasto de cada presupuesto planificado y la fecha estimada en que se agotará.
+    """
+
+    PERIODOS = {'mes': 1, 'trimestre': 3}
+    VENTANA_RITMO_DIAS = 90
+    CACHE_TIMEOUT = 60 * 60 * 24
+
+    @staticmethod
+    def _cache_key(accion_id, periodo):
+        return f'serie_ejecucion_presupuesto:accion:{accion_id}:{periodo}'
+
+    @staticmethod
+    def invalidar_acciones(accion_ids):
+        """Elimina de la caché las series de las acciones indicadas"""
+        cache_versionada.espacio('vistas').delete_many([
+            SerieEjecucionPresupuestoService._cache_key(accion_id, periodo)
+            for accion_id in accion_ids
+            for periodo in SerieEjecucionPresupuestoService.PERIODOS
+        ])
+
+    @staticmethod
+    def _ejecuciones(por_accion=True, **filtros):
+        """
+        Devuelve los presupuestos ejecutados como arreglos de NumPy: monto, día de inicio, día de
+        fin (exclusivo) y el presupuesto planificado, la moneda y la acción a la que pertenecen.
+        Si solo hay una de las fechas el monto se asigna a ese día; sin fechas se descarta.
+        Con por_accion=False no se une con las acciones y cada ejecución aparece una sola vez.
+        """
+        import numpy as np
+
+        through = PresupuestoPlanificado.presupuestos_ejecutados.through
+        campos = [
+            'presupuestoejecutado__monto',
+            'presupuestoejecutado__fecha_inicio',
+            'presupuestoejecutado__fecha_fin',
+            'presupuestoplanificado_id',
+            'presupuestoplanificado__tipo_moneda_id',
+        ]
+        if por_accion:
+            campos.append('presupuestoplanificado__presupuestos_planificados')
+        filas = [f + (0,) * (6 - len(f)) for f in through.objects.filter(**filtros).values_list(*campos)]
+        filas = [f for f in filas if f[1] or f[2]]
+
+        monto = np.array([f[0] or 0 for f in filas], dtype=float)
+        inicio = np.array([f[1] or f[2] for f in filas], dtype='datetime64[D]')
+        fin = np.array([f[2] or f[1] for f in filas], dtype='datetime64[D]')
+        # Fechas invertidas: se toma el intervalo en el orden correcto
+        inicio, fin = np.minimum(inicio, fin), np.maximum(inicio, fin) + 1
+
+        return {
+            'monto': monto,
+            'inicio': inicio.astype(np.int64),
+            'fin': fin.astype(np.int64),
+            'presupuesto': np.array([f[3] for f in filas], dtype=np.int64),
+            'moneda': np.array([f[4] for f in filas], dtype=np.int64),
+            'accion': np.array([f[5] or 0 for f in filas], dtype=np.int64),
+        }
+
+    @staticmethod
+    def _dias_solapados(inicio, fin, desde, hasta):
+        """Matriz (ejecuciones x intervalos) con los días que cada ejecución cae en cada intervalo"""
+        import numpy as np
+
+        solape = (np.minimum(fin[:, None], hasta[None, :]) -
+                  np.maximum(inicio[:, None], desde[None, :]))
+        return np.clip(solape, 0, None)
+
+    @staticmethod
+    def _periodos(inicio, fin, periodo):
+        """Límites (en días) y etiquetas de los periodos que cubren el rango [inicio, fin)"""
+        import numpy as np
+
+        paso = SerieEjecucionPresupuestoService.PERIODOS[periodo]
+        primer_mes = np.datetime64(int(inicio), 'D').astype('datetime64[M]').astype(np.int64)
+        ultimo_mes = np.datetime64(int(fin) - 1, 'D').astype('datetime64[M]').astype(np.int64)
+        primer_mes -= primer_mes % paso
+
+        meses = np.arange(primer_mes, ultimo_mes + 1, paso)
+        desde = meses.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+        hasta = (meses + paso).astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+
+        etiquetas = []
+        for mes in meses.astype('datetime64[M]').astype(object):
+            if periodo == 'trimestre':
+                etiquetas.append(f'T{(mes.month - 1) // 3 + 1}-{mes.year}')
+            else:
+                etiquetas.append(mes.strftime('%m-%Y'))
+        return desde, hasta, etiquetas
+
+    @staticmethod
+    def calcular_serie(datos, clave, periodo='mes'):
+        """
+        Agrupa los montos repartidos por periodo según la clave indicada ('accion', 'moneda'...).
+        Devuelve {'periodos': [...], 'series': {(clave, moneda): [montos por periodo]}}.
+        """
+        import numpy as np
+
+        if not datos['monto'].size:
+            return {'periodos': [], 'series': {}}
+
+        desde, hasta, etiquetas = SerieEjecucionPresupuestoService._periodos(
+            datos['inicio'].min(), datos['fin'].max(), periodo)
+        diario = datos['monto'] / (datos['fin'] - datos['inicio'])
+        montos = diario[:, None] * SerieEjecucionPresupuestoService._dias_solapados(
+            datos['inicio'], datos['fin'], desde, hasta)
+
+        claves = np.column_stack((datos[clave], datos['moneda']))
+        grupos, inverso = np.unique(claves, axis=0, return_inverse=True)
+        totales = np.zeros((len(grupos), len(etiquetas)))
+        np.add.at(totales, inverso.ravel(), montos)
+
+        return {
+            'periodos': etiquetas,
+            'series': {
+                (int(g[0]), int(g[1])): np.round(fila, 2).tolist()
+                for g, fila in zip(grupos, totales)
+            },
+        }
+
+    @staticmethod
+    def serie_accion(accion_id, periodo='mes'):
+        """
+        Serie de ejecución de una acción por moneda: {'periodos': [...], 'monedas': {moneda_id:
+        {'montos': [...], 'acumulado': [...]}}}. El resultado se guarda en caché hasta que cambia
+        algún presupuesto de la acción.
+        """
+        import numpy as np
+
+        key = SerieEjecucionPresupuestoService._cache_key(accion_id, periodo)
+        serie = cache_versionada.espacio('vistas').get(key)
+        if serie is None:
+            datos = SerieEjecucionPresupuestoService._ejecuciones(
+                presupuestoplanificado__presupuestos_planificados=accion_id)
+            calculada = SerieEjecucionPresupuestoService.calcular_serie(datos, 'accion', periodo)
+            serie = {
+                'periodos': calculada['periodos'],
+                'monedas': {
+                    moneda_id: {
+                        'montos': montos,
+                        'acumulado': np.round(np.cumsum(montos), 2).tolist(),
+                    }
+                    for (_, moneda_id), montos in calculada['series'].items()
+                },
+            }
+            cache_versionada.espacio('vistas').set(key, serie, SerieEjecucionPresupuestoService.CACHE_TIMEOUT)
+        return serie
+
+    @staticmethod
+    def serie_sector(sector_id, periodo='mes'):
+        """Serie de ejecución de las acciones de un sector por moneda"""
+        import numpy as np
+
+        datos = SerieEjecucionPresupuestoService._ejecuciones(
+            presupuestoplanificado__presupuestos_planificados__sector_id=sector_id)
+        datos['sector'] = np.full(datos['monto'].shape, sector_id, dtype=np.int64)
+        calculada = SerieEjecucionPresupuestoService.calcular_serie(datos, 'sector', periodo)
+        return {
+            'periodos': calculada['periodos'],
+            'monedas': {moneda_id: montos for (_, moneda_id), montos in calculada['series'].items()},
+        }
+
+    @staticmethod
+    def proyecciones(presupuestos, hoy=None, ventana_dias=None):
+        """
+        Calcula el ritmo de gasto diario y la fecha estimada de agotamiento de cada presupuesto
+        planificado. El ritmo es el gasto medio de los últimos `ventana_dias`; si no hubo gasto en
+        ese intervalo se usa el gasto medio desde la primera ejecución.
+        Devuelve {presupuesto_id: {'ritmo_diario', 'monto_restante', 'dias_restantes',
+        'fecha_agotamiento'}}; dias_restantes y fecha_agotamiento son None si no hay gasto.
+        """
+        import numpy as np
+
+        hoy = hoy or timezone.now().date()
+        ventana_dias = ventana_dias or SerieEjecucionPresupuestoService.VENTANA_RITMO_DIAS
+        presupuestos = list(presupuestos)
+        if not presupuestos:
+            return {}
+
+        datos = SerieEjecucionPresupuestoService._ejecuciones(
+            por_accion=False, presupuestoplanificado_id__in=[p.id for p in presupuestos])
+
+        dia_hoy = np.datetime64(hoy, 'D').astype(np.int64) + 1
+        limites = np.array([dia_hoy - ventana_dias, dia_hoy])
+        diario = datos['monto'] / np.maximum(datos['fin'] - datos['inicio'], 1)
+        dias = SerieEjecucionPresupuestoService._dias_solapados(
+            datos['inicio'], datos['fin'], limites[:1], limites[1:])[:, 0]
+        dias_hasta_hoy = np.clip(np.minimum(datos['fin'], dia_hoy) - datos['inicio'], 0, None)
+
+        indices = {p.id: i for i, p in enumerate(presupuestos)}
+        posicion = np.array([indices[p] for p in datos['presupuesto']], dtype=np.int64)
+        gasto_ventana = np.bincount(posicion, weights=diario * dias, minlength=len(presupuestos))
+        gasto_total = np.bincount(posicion, weights=diario * dias_hasta_hoy, minlength=len(presupuestos))
+        primer_dia = np.full(len(presupuestos), dia_hoy)
+        np.minimum.at(primer_dia, posicion, datos['inicio'])
+
+        ritmo = gasto_ventana / ventana_dias
+        sin_gasto_reciente = ritmo <= 0
+        transcurrido = np.maximum(dia_hoy - primer_dia, 1)
+        ritmo[sin_gasto_reciente] = gasto_total[sin_gasto_reciente] / transcurrido[sin_gasto_reciente]
+
+        resultado = {}
+        for i, presupuesto in enumerate(presupuestos):
+            restante = max(presupuesto.monto - presupuesto.monto_ejecutado, 0)
+            if ritmo[i] > 0:
+                dias_restantes = int(np.ceil(restante / ritmo[i]))
+                fecha_agotamiento = hoy + timedelta(days=dias_restantes)
+            else:
+                dias_restantes = fecha_agotamiento = None
+            resultado[presupuesto.id] = {
+                'ritmo_diario': round(float(ritmo[i]), 2),
+                'monto_restante': restante,
+                'dias_restantes': dias_restantes,
+                'fecha_agotamiento': fecha_agotamiento,
+            }
+        return resultado
+
+
+# ============================================================================
+# Mapa de acciones: agregados por territorio unidos a sus geometrías
+# ============================================================================
+
+class MapaAccionesService:
+    """
+    Conteo de acciones y presupuesto planificado por municipio (o por provincia para las acciones
+    sin municipios) con los filtros del mapa, y su unión con las geometrías del índice en memoria
+    en un único FeatureCollection.
+
+    Los FeatureCollection se guardan en el espacio de caché 'mapa' por filtros y nivel de zoom; el
+    espacio se invalida con cada cambio de acciones, territorios o presupuestos, de modo que no
+    hace falta localizar las entradas afectadas. El ETag sale de una huella de los datos (_firma).
+    """
+
+    CAMPOS_FILTRO = {
+        'tipo': 'tipo_accion_id',
+        'estado': 'estado_accion_id',
+        'sector': 'sector_id',
+        'escenario': 'escenario_id',
+        'fecha': None,
+    }
+    CACHE_TIMEOUT = 60 * 60 * 24
+
+    @staticmethod
+    def invalidar():
+        """Da por obsoletas todas las respuestas del mapa guardadas en caché"""
+        cache_versionada.espacio('mapa').invalidar()
+
+    @staticmethod
+    def filtros(params):
+        """
+        Tupla ordenada ((nombre, valor), ...) con los filtros no vacíos de la petición. El periodo
+        llega como 'dd/mm/aaaa to dd/mm/aaaa' y se normaliza a fechas ISO.
+        """
+        filtros = []
+        for nombre in MapaAccionesService.CAMPOS_FILTRO:
+            valor = (params.get(nombre) or '').strip()
+            if not valor:
+                continue
+            if nombre == 'fecha':
+                try:
+                    inicio, fin = valor.split(' to ')
+                    valor = (datetime.strptime(inicio, '%d/%m/%Y').date().isoformat(),
+                             datetime.strptime(fin, '%d/%m/%Y').date().isoformat())
+                except ValueError:
+                    raise ValueError('Formato de fecha inválido. Use DD/MM/YYYY to DD/MM/YYYY')
+            filtros.append((nombre, valor))
+        return tuple(filtros)
+
+    @staticmethod
+    def _consulta(filtros):
+        q = Q()
+        for nombre, valor in filtros:
+            if nombre == 'fecha':
+                q &= Q(fecha_inicio__gte=valor[0]) & Q(fecha_fin__lte=valor[1])
+            else:
+                q &= Q(**{MapaAccionesService.CAMPOS_FILTRO[nombre]: valor})
+        return q
+
+    @staticmethod
+    def _presupuesto_por_territorio(filas, clave):
+        """Agrupa filas {clave, tipo_moneda__nombre, monto_total} en listas {moneda, monto_total} por territorio"""
+        presupuestos = {}
+        for fila in filas:
+            if fila['monto_total'] > 0:
+                presupuestos.setdefault(fila[clave], []).append(
+                    {'moneda': fila['tipo_moneda__nombre'], 'monto_total': fila['monto_total']})
+        return presupuestos
+
+    @staticmethod
+    def agregados(filtros=()):
+        """
+        {'tipo': 'municipio'|'provincia'|'vacio', 'municipios'|'provincias': [...], 'resumen': {...}}
+        con el número de acciones y el presupuesto planificado por moneda de cada territorio
+        """
+        acciones = Accion.objects.filter(MapaAccionesService._consulta(filtros))
+        # Sin filtros se leen directamente los totales precalculados por territorio
+        sin_filtros = not filtros
+
+        # Acciones con municipios: conteo y presupuesto por municipio
+        if sin_filtros:
+            filas_municipio = (
+                ResumenPresupuestoTerritorio.objects.filter(municipio__isnull=False)
+                .values('municipio_id', 'tipo_moneda__nombre')
+                .annotate(monto_total=Sum('monto_planificado'))
+            )
+        else:
+            filas_municipio = (
+                ResumenPresupuestoAccion.objects.filter(accion__in=acciones, accion__municipios__isnull=False)
+                .values('tipo_moneda__nombre', municipio_id=F('accion__municipios'))
+                .annotate(monto_total=Sum('monto_planificado'))
+            )
+        presupuestos_municipio = MapaAccionesService._presupuesto_por_territorio(filas_municipio, 'municipio_id')
+
+        municipios = {}
+        for m in (Accion.municipios.through.objects.filter(accion__in=acciones)
+                  .values('municipio_id', 'municipio__nombre', 'municipio__provincia_id',
+                          'municipio__provincia__nombre', 'municipio__provincia__hc_keys')
+                  .annotate(acciones_count=Count('accion_id'))):
+            municipios[m['municipio_id']] = {
+                'municipio_id': m['municipio_id'],
+                'municipio_nombre': m['municipio__nombre'],
+                'provincia_id': m['municipio__provincia_id'],
+                'provincia_nombre': m['municipio__provincia__nombre'],
+                'provincia_hc_keys': m['municipio__provincia__hc_keys'].lower(),
+                'acciones_count': m['acciones_count'],
+                'presupuesto_total': presupuestos_municipio.get(m['municipio_id'], []),
+            }
+
+        # Acciones que solo tienen provincias: conteo y presupuesto por provincia
+        acciones_provincia = acciones.filter(municipios__isnull=True)
+        if sin_filtros:
+            filas_provincia = (
+                ResumenPresupuestoTerritorio.objects.filter(municipio__isnull=True)
+                .values('provincia_id', 'tipo_moneda__nombre')
+                .annotate(monto_total=Sum('monto_planificado'))
+            )
+        else:
+            filas_provincia = (
+                ResumenPresupuestoAccion.objects.filter(accion__in=acciones_provincia,
+                                                        accion__provincias__isnull=False)
+                .values('tipo_moneda__nombre', provincia_id=F('accion__provincias'))
+                .annotate(monto_total=Sum('monto_planificado'))
+            )
+        presupuestos_provincia = MapaAccionesService._presupuesto_por_territorio(filas_provincia, 'provincia_id')
+
+        provincias = {}
+        for p in (Accion.provincias.through.objects.filter(accion__in=acciones_provincia)
+                  .values('provincia_id', 'provincia__nombre', 'provincia__hc_keys')
+                  .annotate(acciones_count=Count('accion_id'))):
+            provincias[p['provincia_id']] = {
+                'provincia_id': p['provincia_id'],
+                'provincia_nombre': p['provincia__nombre'],
+                'provincia_hc_keys': p['provincia__hc_keys'].lower(),
+                'acciones_count': p['acciones_count'],
+                'presupuesto_total': presupuestos_provincia.get(p['provincia_id'], []),
+            }
+
+        if not municipios and not provincias:
+            return {'tipo': 'vacio', 'data': [],
+                    'resumen': {'total_acciones': 0, 'total_activas': 0, 'presupuesto_total': []}}
+
+        total_acciones = acciones.count()
+        resumen = {
+            'total_acciones': total_acciones,
+            'total_activas': total_acciones,
+            'presupuesto_total': [
+                {'moneda': r['tipo_moneda__nombre'], 'monto_total': r['monto_total']}
+                for r in ResumenPresupuestoAccion.objects.filter(accion__in=acciones, tipo_moneda__estado=True)
+                .values('tipo_moneda__nombre')
+                .annotate(monto_total=Sum('monto_planificado'))
+                if r['monto_total'] > 0
+            ],
+        }
+        if municipios:
+            return {'tipo': 'municipio', 'municipios': list(municipios.values()), 'resumen': resumen}
+        return {'tipo': 'provincia', 'provincias': list(provincias.values()), 'resumen': resumen}
+
+    @staticmethod
+    def feature_collection(filtros=(), zoom=0):
+        """
+        FeatureCollection con una feature por territorio de agregados(); las propiedades de la
+        feature incluyen el conteo y el presupuesto. Los territorios sin geometría conocida se
+        devuelven con geometry null. 'tipo' y 'resumen' van como miembros del FeatureCollection.
+        """
+        datos = MapaAccionesService.agregados(filtros)
+        indice = geometria.indice_geometrias(zoom)
+
+        features = []
+        for territorio in datos.get('municipios', []):
+            clave = (territorio['provincia_hc_keys'], geometria.normalizar_nombre(territorio['municipio_nombre']))
+            features.append((indice['municipios'].get(clave), territorio))
+        for territorio in datos.get('provincias', []):
+            features.append((indice['provincias'].get(territorio['provincia_hc_keys']), territorio))
+
+        return {
+            'type': 'FeatureCollection',
+            'tipo': datos['tipo'],
+            'resumen': datos['resumen'],
+            'features': [
+                {
+                    'type': 'Feature',
+                    'properties': {**(feature['properties'] if feature else {}), **territorio},
+                    'geometry': feature['geometry'] if feature else None,
+                }
+                for feature, territorio in features
+            ],
+        }
+
+    @staticmethod
+    def _firma(filtros, zoom):
+        """
+        Huella de los datos de la respuesta: filtros, nivel y versión de las geometrías y agregados
+        de las acciones filtradas, sus territorios y sus totales de presupuesto. No depende de la
+        versión del espacio de caché (local al proceso con locmem), así que vale en cualquier proceso
+        """
+        acciones = Accion.objects.filter(MapaAccionesService._consulta(filtros))
+        por_municipio = Accion.municipios.through.objects.filter(accion__in=acciones)
+        por_provincia = Accion.provincias.through.objects.filter(accion__in=acciones)
+        firma = repr((
+            filtros, geometria.nivel(zoom)[0], (geometria.manifiesto() or {}).get('version'),
+            acciones.aggregate(n=Count('id'), ultimo_id=Max('id'), suma_ids=Sum('id')),
+            por_municipio.aggregate(n=Count('id'), ultimo_id=Max('id'), suma=Sum('municipio_id')),
+            por_provincia.aggregate(n=Count('id'), ultimo_id=Max('id'), suma=Sum('provincia_id')),
+            ResumenPresupuestoAccion.objects.filter(accion__in=acciones).aggregate(
+                n=Count('id'), ultimo_id=Max('id'), planificado=Sum('monto_planificado')),
+            list(TipoMoneda.objects.filter(estado=True).values_list('id', 'nombre')),
+        ))
+        return hashlib.sha256(firma.encode()).hexdigest()[:20]
+
+    @staticmethod
+    def etag(filtros=(), zoom=0):
+        """ETag de la respuesta para los filtros y el zoom, a partir de los datos"""
+        return f'"{MapaAccionesService._firma(filtros, zoom)}"'
+
+    @staticmethod
+    def geojson(filtros=(), zoom=0):
+        """FeatureCollection serializado, desde la caché si los datos no han cambiado"""
+        return cache_versionada.espacio('mapa').get_or_set(
+            f'geojson:{MapaAccionesService._firma(filtros, zoom)}',
+            lambda: json.dumps(MapaAccionesService.feature_collection(filtros, zoom), cls=DjangoJSONEncoder,
+                               separators=(',', ':'), ensure_ascii=False).encode('utf-8'),
+            MapaAccionesService.CACHE_TIMEOUT,
+        )
+
+
+# ============================================================================
+# Geocodificación de puntos a municipio y provincia
+# ============================================================================
+
+class GeocodificacionService:
+    """
+    Asigna municipio y provincia a puntos lat/lon con el índice espacial de los límites de
+    static/data. Las features se relacionan con la base de datos por Provincia.hc_keys y por el
+    nombre del municipio dentro de su provincia.
+    """
+
+    @staticmethod
+    def _territorios(indice_municipios, indice_provincias):
+        """Ids de Municipio/Provincia de cada feature de los índices (None si no existe en la BD)"""
+        from nomencladores.models import Municipio, Provincia
+
+        provincias = {hc_keys.lower(): id_ for id_, hc_keys in Provincia.objects.values_list('id', 'hc_keys')}
+        municipios = {
+            (hc_keys.lower(), geometria.normalizar_nombre(nombre)): (id_, provincia_id)
+            for id_, nombre, provincia_id, hc_keys in
+            Municipio.objects.values_list('id', 'nombre', 'provincia_id', 'provincia__hc_keys')
+        }
+        por_municipio = [
+            municipios.get((p['hc_key'], geometria.normalizar_nombre(p['municipality'])),
+                           (None, provincias.get(p['hc_key'])))
+            for p in indice_municipios.propiedades
+        ]
+        por_provincia = [provincias.get(p['hc_key']) for p in indice_provincias.propiedades]
+        return por_municipio, por_provincia
+
+    @staticmethod
+    def geocodificar(latitudes, longitudes):
+        """
+        Lista con {'municipio_id', 'provincia_id'} para cada punto; los puntos fuera de todo
+        municipio se buscan en las provincias y, si tampoco caen en ninguna, quedan con None.
+        """
+        import numpy as np
+        from registro import indice_espacial
+
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+        indice_municipios = indice_espacial.indice('municipios')
+        indice_provincias = indice_espacial.indice('provincias')
+        por_municipio, por_provincia = GeocodificacionService._territorios(indice_municipios, indice_provincias)
+
+        municipio = indice_municipios.localizar(longitudes, latitudes)
+        provincia = np.full(len(municipio), -1)
+        sin_municipio = np.flatnonzero(municipio < 0)
+        if len(sin_municipio):
+            provincia[sin_municipio] = indice_provincias.localizar(longitudes[sin_municipio],
+                                                                   latitudes[sin_municipio])
+
+        resultado = []
+        for m, p in zip(municipio.tolist(), provincia.tolist()):
+            if m >= 0:
+                municipio_id, provincia_id = por_municipio[m]
+            else:
+                municipio_id, provincia_id = None, por_provincia[p] if p >= 0 else None
+            resultado.append({'municipio_id': municipio_id, 'provincia_id': provincia_id})
+        return resultado
+
+
+# ============================================================================
+# Pronóstico de indicadores
+# ============================================================================
+
+class PronosticoService:
+    """
+    Pronósticos de los resultados de indicadores (registro.pronostico). El ajuste de cada
+    indicador se guarda en el espacio de caché 'pronosticos' junto con una huella de sus
+    resultados (cantidad, último id, última fecha y suma de valores); solo se vuelve a ajustar
+    cuando la huella cambia.
+    """
+
+    HORIZONTE = 6
+
+    @staticmethod
+    def _periodo(frecuencia):
+        from registro import pronostico
+
+        if frecuencia is None:
+            return None
+        return pronostico.periodo_estacional(frecuencia.calcular_timedelta().days)
+
+    @staticmethod
+    def _huellas(indicador_ids):
+        from registro.models import ResultadoIndicador
+
+        return {
+            fila['indicador_id']: (fila['n'], fila['ultimo_id'], fila['ultima_fecha'], fila['suma'])
+            for fila in ResultadoIndicador.objects.filter(indicador_id__in=indicador_ids, valor__isnull=False)
+            .values('indicador_id')
+            .annotate(n=Count('id'), ultimo_id=Max('id'), ultima_fecha=Max('fecha'), suma=Sum('valor'))
+            .order_by()
+        }
+
+    @staticmethod
+    def ajuste(indicador):
+        """Ajuste vigente del indicador (ver pronostico.ajustar), o None con menos de 3 resultados"""
+        from registro import pronostico
+
+        cache = cache_versionada.espacio('pronosticos')
+        huella = PronosticoService._huellas([indicador.id]).get(indicador.id)
+        if huella is None:
+            return None
+        guardado = cache.get(indicador.id)
+        if guardado is not None and guardado['huella'] == huella:
+            return guardado['ajuste']
+
+        serie = list(indicador.resultados.filter(valor__isnull=False).order_by('fecha').values_list('fecha', 'valor'))
+        ajuste = pronostico.ajustar([f for f, _ in serie], [v for _, v in serie],
+                                    PronosticoService._periodo(indicador.frecuencia_medicion))
+        cache.set(indicador.id, {'huella': huella, 'ajuste': ajuste}, None)
+        return ajuste
+
+    @staticmethod
+    def ajustar_todos(forzar=False):
+        """
+        Ajusta todos los indicadores con resultados cuya huella cambió (o todos con forzar) con
+        una consulta para las huellas y otra para las series. Devuelve los totales por estado.
+        """
+        import numpy as np
+        from registro import pronostico
+        from registro.models import Indicador, ResultadoIndicador
+
+        cache = cache_versionada.espacio('pronosticos')
+        huellas = PronosticoService._huellas(Indicador.objects.values('id'))
+        pendientes = []
+        for indicador_id, huella in huellas.items():
+            guardado = None if forzar else cache.get(indicador_id)
+            if guardado is None or guardado['huella'] != huella:
+                pendientes.append(indicador_id)
+
+        filas = (ResultadoIndicador.objects.filter(indicador_id__in=pendientes, valor__isnull=False)
+                 .order_by('indicador_id', 'fecha').values_list('indicador_id', 'fecha', 'valor'))
+        ids = np.fromiter((f[0] for f in filas), dtype=np.int64, count=len(filas))
+        fechas = np.array([f[1] for f in filas], dtype='datetime64[D]')
+        valores = np.array([f[2] for f in filas], dtype=float)
+        periodos = {
+            indicador.id: PronosticoService._periodo(indicador.frecuencia_medicion)
+            for indicador in Indicador.objects.filter(id__in=pendientes).select_related('frecuencia_medicion')
+        }
+
+        totales = {'ajustados': 0, 'vigentes': len(huellas) - len(pendientes), 'insuficientes': 0}
+        cortes = np.flatnonzero(np.diff(ids)) + 1
+        for inicio, fin in zip(np.r_[0, cortes], np.r_[cortes, len(ids)]):
+            if inicio == fin:
+                continue
+            indicador_id = int(ids[inicio])
+            ajuste = pronostico.ajustar(fechas[inicio:fin], valores[inicio:fin], periodos.get(indicador_id))
+            cache.set(indicador_id, {'huella': huellas[indicador_id], 'ajuste': ajuste}, None)
+            totales['ajustados' if ajuste else 'insuficientes'] += 1
+        return totales
+
+    @staticmethod
+    def proyeccion(indicador, horizonte=None):
+        """
+        Próximos valores con intervalos, tendencia y probabilidad de cumplir la meta en su fecha
+        límite, o None si el indicador no tiene resultados suficientes.
+        """
+        from registro import pronostico
+
+        ajuste = PronosticoService.ajuste(indicador)
+        if ajuste is None:
+            return None
+        proyeccion = pronostico.proyectar(ajuste, horizonte or PronosticoService.HORIZONTE)
+        proximo = float(proyeccion['valor'][0])
+        cambio = proximo - ajuste['ultimo_valor']
+        if abs(cambio) <= 0.01 * max(abs(ajuste['ultimo_valor']), 1e-9):
+            tendencia = 'Estable'
+        else:
+            tendencia = 'Creciente' if cambio > 0 else 'Decreciente'
+
+        return {
+            'modelo': ajuste['modelo'],
+            'errores_holdout': ajuste['errores_holdout'],
+            'proximo_valor': round(proximo, 4),
+            'proxima_fecha': proyeccion['fechas'][0],
+            'tendencia': tendencia,
+            'puntos': [
+                {
+                    'fecha': fecha,
+                    'valor': round(float(valor), 4),
+                    'intervalo_80': [round(float(i80), 4), round(float(s80), 4)],
+                    'intervalo_95': [round(float(i95), 4), round(float(s95), 4)],
+                }
+                for fecha, valor, i80, s80, i95, s95 in zip(
+                    proyeccion['fechas'], proyeccion['valor'], proyeccion['inferior_80'],
+                    proyeccion['superior_80'], proyeccion['inferior_95'], proyeccion['superior_95'])
+            ],
+            'probabilidad_meta': PronosticoService.probabilidad_meta(indicador, ajuste),
+        }
+
+    @staticmethod
+    def probabilidad_meta(indicador, ajuste=None):
+        """Probabilidad (0-1) de alcanzar meta_valor en meta_fecha_limite, o None sin meta"""
+        from registro import pronostico
+
+        if indicador.meta_valor is None or not indicador.meta_fecha_limite:
+            return None
+        ajuste = ajuste or PronosticoService.ajuste(indicador)
+        if ajuste is None:
+            return None
+        return round(pronostico.probabilidad_meta(ajuste, indicador.meta_valor, indicador.meta_fecha_limite,
+                                                  indicador.direccion_optima != 'decremento'), 4)
+
+
+# ============================================================================
+# Detección de resultados atípicos
+# ============================================================================
+
+class AnomaliaService:
+    """
+    Mantiene AnomaliaResultado con el detector de registro.anomalias. Un indicador se revisa
+    completo cada vez que cambia uno de sus resultados (registro.signals); revisar_todos() recorre
+    la base de datos entera. Las anomalías descartadas por un usuario se conservan y no se vuelven
+    a marcar.
+    """
+
+    @staticmethod
+    def _guardar(deteccion, resultado_ids, indicador_ids, indicadores=None):
+        """Reemplaza las anomalías no descartadas de `indicadores` (todos si es None)"""
+        import numpy as np
+        from registro.models import AnomaliaResultado
+
+        pendientes = AnomaliaResultado.objects.filter(descartada=False)
+        descartadas = AnomaliaResultado.objects.filter(descartada=True)
+        if indicadores is not None:
+            pendientes = pendientes.filter(indicador_id__in=indicadores)
+            descartadas = descartadas.filter(indicador_id__in=indicadores)
+        descartadas = set(descartadas.values_list('resultado_id', flat=True))
+
+        nuevas = []
+        for i in np.flatnonzero(deteccion['marcada']).tolist():
+            if int(resultado_ids[i]) in descartadas:
+                continue
+            esperado = float(deteccion['esperado'][i])
+            nuevas.append(AnomaliaResultado(
+                resultado_id=int(resultado_ids[i]),
+                indicador_id=int(indicador_ids[i]),
+                metodo=str(deteccion['metodo'][i]),
+                puntuacion=float(deteccion['puntuacion'][i]),
+                valor_esperado=esperado if np.isfinite(esperado) else None,
+            ))
+        with transaction.atomic():
+            pendientes.delete()
+            AnomaliaResultado.objects.bulk_create(nuevas, batch_size=1000)
+        return len(nuevas)
+
+    @staticmethod
+    def _serie(resultados):
+        """Arrays (indicador, resultado, valor) ordenados por indicador y fecha"""
+        import numpy as np
+
+        filas = list(resultados.filter(valor__isnull=False).order_by('indicador_id', 'fecha')
+                     .values_list('indicador_id', 'id', 'valor'))
+        datos = np.array(filas, dtype=float).reshape(-1, 3)
+        return datos[:, 0].astype(np.int64), datos[:, 1].astype(np.int64), datos[:, 2]
+
+    @staticmethod
+    def _periodos(indicador_ids=None):
+        from registro.models import Indicador
+
+        indicadores = Indicador.objects.select_related('frecuencia_medicion')
+        if indicador_ids is not None:
+            indicadores = indicadores.filter(id__in=indicador_ids)
+        return {i.id: PronosticoService._periodo(i.frecuencia_medicion) for i in indicadores}
+
+    @staticmethod
+    def revisar_indicador(indicador_id):
+        """Vuelve a evaluar todos los resultados del indicador; devuelve las anomalías marcadas"""
+        return AnomaliaService.revisar_indicadores([indicador_id])
+
+    @staticmethod
+    def revisar_indicadores(indicador_ids):
+        """revisar_indicador() para varios indicadores a la vez"""
+        from django.conf import settings
+        from registro import anomalias
+        from registro.models import ResultadoIndicador
+
+        indicador_ids = list(indicador_ids)
+        indicadores, resultados, valores = AnomaliaService._serie(
+            ResultadoIndicador.objects.filter(indicador_id__in=indicador_ids))
+        deteccion = anomalias.detectar(indicadores, valores, AnomaliaService._periodos(indicador_ids),
+                                       settings.ANOMALIAS_UMBRAL)
+        return AnomaliaService._guardar(deteccion, resultados, indicadores, indicador_ids)
+
+    @staticmethod
+    def revisar_todos():
+        """Evalúa los resultados de todos los indicadores; devuelve resultados y anomalías"""
+        from django.conf import settings
+        from registro import anomalias
+        from registro.models import ResultadoIndicador
+
+        indicadores, resultados, valores = AnomaliaService._serie(
+            ResultadoIndicador.objects.filter(indicador__isnull=False))
+        deteccion = anomalias.detectar(indicadores, valores, AnomaliaService._periodos(),
+                                       settings.ANOMALIAS_UMBRAL)
+        return {'resultados': len(valores), 'anomalias': AnomaliaService._guardar(deteccion, resultados, indicadores)}
+
+    @staticmethod
+    def para_estadisticas(resultados):
+        """
+        Los resultados sin las anomalías no descartadas si settings.ANOMALIAS_EXCLUIR_DE_ESTADISTICAS
+        (sin filtrar si quedarían vacíos)
+        """
+        from django.conf import settings
+        from registro.models import AnomaliaResultado
+
+        if not settings.ANOMALIAS_EXCLUIR_DE_ESTADISTICAS:
+            return resultados
+        filtrados = resultados.exclude(
+            id__in=AnomaliaResultado.objects.filter(descartada=False).values('resultado_id'))
+        return filtrados if filtrados.exists() else resultados
+
+
+# ============================================================================
+# Variables e indicadores en bloque
+# ============================================================================
+
+class PlantillaIndicadorService:
+    """
+    Alta de variables e indicadores con un número fijo de consultas, sin importar cuántas
+    variables o acciones intervengan, y plantillas de indicadores (PlantillaIndicador).
+
+    Los indicadores creados desde una plantilla quedan vinculados a ella: actualizar_plantilla()
+    les propaga los campos compartidos y las variables con una actualización por tabla y recalcula
+    sus resultados si cambia la fórmula. Editar los campos compartidos de un indicador vinculado lo
+    desvincula (copia al escribir). VariableIndicadorService (registro.views) usa este servicio al
+    guardar un indicador.
+
+    Los bulk_create/bulk_update/update no emiten señales: las entradas de auditoría se escriben con
+    registrar_cambios() y las cachés se invalidan aquí.
+    """
+
+    # Campos que definen el indicador y se toman de la plantilla; meta y valor base son de cada acción
+    CAMPOS_COMPARTIDOS = ('nombre', 'tipo_indicador', 'descripcion', 'fuente_indicador', 'formula',
+                          'unidad_medida', 'enfoqueIPCC', 'frecuencia_medicion', 'direccion_optima',
+                          'objetivos_relacionados')
+
+    @staticmethod
+    def _campos_compartidos():
+        """attname de los campos compartidos que son columnas (sin los ManyToMany)"""
+        from registro.models import Indicador
+
+        campos = (Indicador._meta.get_field(nombre) for nombre in PlantillaIndicadorService.CAMPOS_COMPARTIDOS)
+        return [campo.attname for campo in campos if not campo.many_to_many]
+
+    @staticmethod
+    def resolver_variables(items, modelo=None, indicador_ids=(), plantilla_ids=()):
+        """
+        {nombre: VariableIndicador} para los items del formulario ({'nombre': ..., 'variable': ...})
+        de los indicadores indicador_ids y las plantillas plantilla_ids (los propietarios). Busca
+        todas por nombre en una consulta y crea las que faltan con bulk_create. De las que tienen
+        el mismo nombre se usa la que ya tiene algún propietario, si no una con el mismo símbolo y si
+        no la de menor id (get_or_create fallaba con varias).
+
+        Las variables se comparten entre indicadores y plantillas: si cambia el símbolo de una que
+        también usa otro indicador o plantilla, se crea una copia con el símbolo nuevo y se le pasan
+        los valores de los resultados de los propietarios (copia al escribir), en vez de renombrar
+        la compartida y dejar sin resolver las fórmulas de los demás. Las que solo usan los
+        propietarios se actualizan con bulk_update.
+        """
+        from auditlog.models import LogEntry
+        from nomencladores.models import VariableIndicador
+        from registro.models import Indicador, PlantillaIndicador
+        from seguridad.auditoria import registrar_cambios
+
+        modelo = modelo or VariableIndicador
+        indicador_ids, plantilla_ids = list(indicador_ids), list(plantilla_ids)
+        por_indicador = Indicador.variable_indicador.through
+        por_plantilla = PlantillaIndicador.variable_indicador.through
+        simbolos = {item['nombre']: item['variable'] for item in items if item.get('nombre')}
+
+        candidatas = list(modelo.objects.filter(nombre__in=list(simbolos)).order_by('id'))
+        candidata_ids = [v.id for v in candidatas]
+        propias = set(por_indicador.objects.filter(indicador_id__in=indicador_ids, variableindicador_id__in=candidata_ids)
+                      .values_list('variableindicador_id', flat=True))
+        propias.update(por_plantilla.objects.filter(plantillaindicador_id__in=plantilla_ids,
+                                                    variableindicador_id__in=candidata_ids)
+                       .values_list('variableindicador_id', flat=True))
+        variables = {}
+        for variable in candidatas:
+            elegida = variables.get(variable.nombre)
+            prioridad = (variable.id in propias, variable.variable == simbolos[variable.nombre])
+            if elegida is None or prioridad > (elegida.id in propias, elegida.variable == simbolos[elegida.nombre]):
+                variables[variable.nombre] = variable
+
+        nuevas = [modelo(nombre=nombre, variable=simbolo) for nombre, simbolo in simbolos.items()
+                  if nombre not in variables]
+        distintas = [v for v in variables.values() if v.variable != simbolos[v.nombre]]
+        distinta_ids = [v.id for v in distintas]
+        compartidas = set(por_indicador.objects.filter(variableindicador_id__in=distinta_ids)
+                          .exclude(indicador_id__in=indicador_ids).values_list('variableindicador_id', flat=True))
+        compartidas.update(por_plantilla.objects.filter(variableindicador_id__in=distinta_ids)
+                           .exclude(plantillaindicador_id__in=plantilla_ids)
+                           .values_list('variableindicador_id', flat=True))
+        compartidas.update(ResultadoVariable.objects.filter(variable_indicador_id__in=distinta_ids)
+                           .exclude(resultado__indicador_id__in=indicador_ids)
+                           .values_list('variable_indicador_id', flat=True))
+
+        cambiadas, copias, cambios = [], {}, []
+        for variable in distintas:
+            if variable.id in compartidas:
+                copias[variable.id] = modelo(nombre=variable.nombre, variable=simbolos[variable.nombre])
+            else:
+                cambios.append((variable, LogEntry.Action.UPDATE,
+                                {'variable': [str(variable.variable), str(simbolos[variable.nombre])]}))
+                variable.variable = simbolos[variable.nombre]
+                cambiadas.append(variable)
+
+        modelo.objects.bulk_create(nuevas + list(copias.values()))
+        modelo.objects.bulk_update(cambiadas, ['variable'])
+        for original_id, copia in copias.items():
+            (ResultadoVariable.objects.filter(variable_indicador_id=original_id, resultado__indicador_id__in=indicador_ids)
+             .update(variable_indicador_id=copia.id))
+        registrar_cambios([
+            *((v, LogEntry.Action.CREATE, {'nombre': ['None', v.nombre], 'variable': ['None', str(v.variable)]})
+              for v in nuevas + list(copias.values())),
+            *cambios,
+        ])
+        if nuevas or cambiadas or copias:
+            cache_versionada.invalidar_modelos(modelo)
+        variables.update((v.nombre, v) for v in nuevas + list(copias.values()))
+        return variables
+
+    @staticmethod
+    def _sincronizar(intermedia, origen, destino, origen_ids, destino_ids):
+        """
+        Deja exactamente destino_ids asociados a cada uno de origen_ids en la tabla intermedia con una
+        diferencia de conjuntos: una consulta para leer, otra para borrar las filas que sobran y otra
+        para insertar las que faltan. Devuelve (añadidas, eliminadas).
+        """
+        origen_ids, destino_ids = list(origen_ids), set(destino_ids)
+        actuales = set(intermedia.objects.filter(**{f'{origen}__in': origen_ids}).values_list(origen, destino))
+        faltantes = {(o, d) for o in origen_ids for d in destino_ids} - actuales
+        sobrantes = sum(1 for _, d in actuales if d not in destino_ids)
+
+        if sobrantes:
+            (intermedia.objects.filter(**{f'{origen}__in': origen_ids})
+             .exclude(**{f'{destino}__in': destino_ids}).delete())
+        # La restricción única de la tabla intermedia cubre las altas concurrentes
+        intermedia.objects.bulk_create(
+            [intermedia(**{origen: o, destino: d}) for o, d in faltantes], batch_size=1000, ignore_conflicts=True,
+        )
+        return len(faltantes), sobrantes
+
+    @staticmethod
+    def sincronizar_variables(indicador_ids, variable_ids):
+        """Deja asociadas exactamente variable_ids a cada indicador; devuelve (añadidas, eliminadas)"""
+        from registro.models import Indicador
+
+        cambios = PlantillaIndicadorService._sincronizar(
+            Indicador.variable_indicador.through, 'indicador_id', 'variableindicador_id', indicador_ids, variable_ids)
+        if any(cambios):
+            cache_versionada.invalidar_modelos(Indicador)
+        return cambios
+
+    @staticmethod
+    def aplicar_a_acciones(origen, accion_ids):
+        """
+        Copia el indicador o la plantilla `origen` (campos, variables y ODS relacionados, sin
+        resultados) a cada acción de accion_ids que no tenga ya un indicador con su nombre. Las copias
+        de una plantilla quedan vinculadas a ella. Devuelve los indicadores creados.
+        """
+        from auditlog.models import LogEntry
+        from registro import busqueda
+        from registro.models import Indicador, PlantillaIndicador
+        from seguridad.auditoria import registrar_cambios
+
+        acciones = list(Accion.objects.filter(id__in=accion_ids)
+                        .exclude(indicadores__nombre=origen.nombre)
+                        .order_by('id').values_list('id', flat=True))
+        if not acciones:
+            return []
+
+        es_plantilla = isinstance(origen, PlantillaIndicador)
+        if es_plantilla:
+            campos = PlantillaIndicadorService._campos_compartidos()
+        else:
+            campos = [f.attname for f in Indicador._meta.concrete_fields
+                      if not f.primary_key and f.name != 'ultima_medicion']
+        copias = []
+        for _ in acciones:
+            copia = Indicador(**{campo: getattr(origen, campo) for campo in campos})
+            if es_plantilla:
+                copia.plantilla, copia.version_plantilla = origen, origen.version
+            # str() del indicador usa el tipo; así no se consulta una vez por copia
+            copia.tipo_indicador = origen.tipo_indicador
+            copias.append(copia)
+        variable_ids = list(origen.variable_indicador.values_list('id', flat=True))
+        ods_ids = list(origen.objetivos_relacionados.values_list('id', flat=True))
+
+        por_accion = Accion.indicadores.through
+        ods = Indicador.objetivos_relacionados.through
+        with transaction.atomic():
+            Indicador.objects.bulk_create(copias, batch_size=500)
+            por_accion.objects.bulk_create(
+                [por_accion(accion_id=a, indicador_id=c.id) for a, c in zip(acciones, copias)], batch_size=1000)
+            ods.objects.bulk_create(
+                [ods(indicador_id=c.id, objetivosdesarrollosostenible_id=o) for c in copias for o in ods_ids],
+                batch_size=1000)
+            PlantillaIndicadorService.sincronizar_variables([c.id for c in copias], variable_ids)
+            registrar_cambios([
+                (c, LogEntry.Action.CREATE,
+                 {'accion': ['None', str(a)], 'origen': ['None', f'{origen._meta.model_name} {origen.id}']})
+                for a, c in zip(acciones, copias)
+            ])
+        cache_versionada.invalidar_modelos(Indicador, Accion)
+        # bulk_create no emite post_save: se indexan aquí para la búsqueda
+        copia_ids = [c.id for c in copias]
+        transaction.on_commit(lambda: busqueda.indexar('indicador', copia_ids))
+        return copias
+
+    @staticmethod
+    def crear_desde_indicador(indicador, vincular_iguales=False):
+        """
+        Crea una plantilla con la definición del indicador y lo vincula a ella. Con vincular_iguales
+        también vincula los indicadores sin plantilla con los mismos campos compartidos, variables
+        y ODS. Devuelve (plantilla, indicadores vinculados).
+        """
+        from auditlog.models import LogEntry
+        from registro.models import Indicador, PlantillaIndicador
+        from seguridad.auditoria import registrar_cambios
+
+        campos = PlantillaIndicadorService._campos_compartidos()
+        definicion = {campo: getattr(indicador, campo) for campo in campos}
+        variable_ids = set(indicador.variable_indicador.values_list('id', flat=True))
+        ods_ids = set(indicador.objetivos_relacionados.values_list('id', flat=True))
+
+        with transaction.atomic():
+            plantilla = PlantillaIndicador.objects.create(**definicion)
+            plantilla.variable_indicador.set(variable_ids)
+            plantilla.objetivos_relacionados.set(ods_ids)
+
+            vinculados = [indicador.id]
+            if vincular_iguales:
+                candidatos = list(Indicador.objects.filter(plantilla__isnull=True, **definicion)
+                                  .exclude(id=indicador.id).values_list('id', flat=True))
+                variables, objetivos = {}, {}
+                for i, v in (Indicador.variable_indicador.through.objects.filter(indicador_id__in=candidatos)
+                             .values_list('indicador_id', 'variableindicador_id')):
+                    variables.setdefault(i, set()).add(v)
+                for i, o in (Indicador.objetivos_relacionados.through.objects.filter(indicador_id__in=candidatos)
+                             .values_list('indicador_id', 'objetivosdesarrollosostenible_id')):
+                    objetivos.setdefault(i, set()).add(o)
+                vinculados += [i for i in candidatos
+                               if variables.get(i, set()) == variable_ids and objetivos.get(i, set()) == ods_ids]
+
+            Indicador.objects.filter(id__in=vinculados).update(plantilla=plantilla, version_plantilla=plantilla.version)
+            registrar_cambios([
+                (Indicador(id=i, nombre=indicador.nombre, tipo_indicador=indicador.tipo_indicador),
+                 LogEntry.Action.UPDATE, {'plantilla': ['None', str(plantilla.id)]})
+                for i in vinculados
+            ])
+        cache_versionada.invalidar_modelos(Indicador)
+        return plantilla, vinculados
+
+    @staticmethod
+    def actualizar_plantilla(plantilla, variables=None, objetivos=None):
+        """
+        Guarda la plantilla con los cambios ya asignados a sus campos y los propaga a los
+        indicadores vinculados. variables son items del formulario ({'nombre', 'variable'}) y
+        objetivos ids de ODS; con None no cambian. Si cambia la fórmula o alguna variable se
+        recalculan los resultados de los indicadores vinculados.
+        Devuelve {'indicadores': vinculados, 'resultados': resultados modificados, 'omitidos':
+        resultados que no se recalcularon por faltarles alguna variable}.
+        """
+        from auditlog.models import LogEntry
+        from registro import busqueda
+        from registro.models import Indicador, PlantillaIndicador
+        from seguridad.auditoria import registrar_cambios
+
+        campos = PlantillaIndicadorService._campos_compartidos()
+        anterior = PlantillaIndicador.objects.values(*campos).get(id=plantilla.id)
+        definicion = {campo: getattr(plantilla, campo) for campo in campos}
+        cambios = {campo: [str(anterior[campo]), str(valor)] for campo, valor in definicion.items()
+                   if anterior[campo] != valor}
+
+        with transaction.atomic():
+            plantilla.version += 1
+            plantilla.save()
+            vinculados = Indicador.objects.filter(plantilla=plantilla)
+            ids = list(vinculados.values_list('id', flat=True))
+            vinculados.update(version_plantilla=plantilla.version, **definicion)
+
+            variables_cambiadas = False
+            if variables is not None:
+                previas = set(plantilla.variable_indicador.values_list('id', 'variable'))
+                resueltas = PlantillaIndicadorService.resolver_variables(
+                    variables, indicador_ids=ids, plantilla_ids=[plantilla.id]).values()
+                plantilla.variable_indicador.set([v.id for v in resueltas])
+                PlantillaIndicadorService.sincronizar_variables(ids, [v.id for v in resueltas])
+                variables_cambiadas = previas != {(v.id, v.variable) for v in resueltas}
+                if variables_cambiadas:
+                    cambios['variables'] = [sorted(v for _, v in previas), sorted(v.variable for v in resueltas)]
+            if objetivos is not None:
+                plantilla.objetivos_relacionados.set(objetivos)
+                PlantillaIndicadorService._sincronizar(Indicador.objetivos_relacionados.through, 'indicador_id',
+                                                       'objetivosdesarrollosostenible_id', ids, objetivos)
+
+            if cambios:
+                registrar_cambios([
+                    (Indicador(id=i, nombre=plantilla.nombre, tipo_indicador=plantilla.tipo_indicador),
+                     LogEntry.Action.UPDATE, cambios)
+                    for i in ids
+                ])
+            recalculados = {'resultados': 0, 'omitidos': 0}
+            if 'formula' in cambios or variables_cambiadas:
+                recalculados = PlantillaIndicadorService.recalcular_resultados(ids)
+        cache_versionada.invalidar_modelos(Indicador)
+        if {'nombre', 'descripcion'} & set(cambios):
+            transaction.on_commit(lambda: busqueda.indexar('indicador', ids))
+        return {'indicadores': len(ids), **recalculados}
+
+    @staticmethod
+    def desvincular(indicador):
+        """Copia al escribir: el indicador conserva su definición y deja de seguir a la plantilla"""
+        indicador.plantilla = None
+        indicador.version_plantilla = None
+        indicador.save(update_fields=['plantilla', 'version_plantilla'])
+
+    @staticmethod
+    def recalcular_resultados(indicador_ids):
+        """
+        Vuelve a calcular el valor de todos los resultados de los indicadores con su fórmula actual.
+        Cada fórmula distinta se compila una vez y se evalúa sobre columnas con los valores de sus
+        variables. Los resultados a los que les falta alguna variable de la fórmula, o cuyo valor no
+        es finito, se dejan como estaban: cambiar la fórmula no borra el histórico. Registra una
+        única entrada de auditoría y devuelve {'resultados': modificados, 'omitidos': sin recalcular}.
+        """
+        import math
+
+        import numpy as np
+        from django.conf import settings
+        from registro.models import Indicador, ResultadoIndicador
+        from seguridad.auditoria import resumen_auditoria
+
+        por_formula = {}
+        for indicador_id, formula in Indicador.objects.filter(id__in=indicador_ids).values_list('id', 'formula'):
+            por_formula.setdefault(formula, []).append(indicador_id)
+
+        modificados, indicadores, omitidos = [], set(), 0
+        for formula, ids in por_formula.items():
+            simbolos, funcion = FormulaCalculatorService.compilar(formula)
+            resultados = list(ResultadoIndicador.objects.filter(indicador_id__in=ids).order_by('id')
+                              .values_list('id', 'indicador_id', 'valor'))
+            if not resultados:
+                continue
+            resultado_ids = np.array([r[0] for r in resultados])
+            posicion = {simbolo: i for i, simbolo in enumerate(simbolos)}
+            columnas = np.full((len(simbolos), len(resultados)), np.nan)
+            for resultado_id, simbolo, valor in (
+                    ResultadoVariable.objects.filter(resultado__indicador_id__in=ids, valor__isnull=False,
+                                                     variable_indicador__variable__in=simbolos)
+                    .values_list('resultado_id', 'variable_indicador__variable', 'valor')):
+                columnas[posicion[simbolo], np.searchsorted(resultado_ids, resultado_id)] = valor
+
+            with np.errstate(all='ignore'):
+                valores = np.broadcast_to(np.asarray(funcion(*columnas), dtype=float), (len(resultados),))
+            completos = ~np.isnan(columnas).any(axis=0)
+            for (resultado_id, indicador_id, anterior), valor, completo in zip(
+                    resultados, np.round(valores, 2).tolist(), completos.tolist()):
+                if not completo or not math.isfinite(valor):
+                    omitidos += 1
+                elif valor != anterior:
+                    modificados.append(ResultadoIndicador(id=resultado_id, valor=valor))
+                    indicadores.add(indicador_id)
+
+        if not modificados:
+            return {'resultados': 0, 'omitidos': omitidos}
+        descripcion = 'Recálculo de resultados por cambio de fórmula'
+        if omitidos:
+            descripcion += f' ({omitidos} sin recalcular por falta de variables)'
+        with resumen_auditoria(descripcion) as conteo:
+            ResultadoIndicador.objects.bulk_update(modificados, ['valor'], batch_size=1000)
+            conteo[(ResultadoIndicador, 'update')] += len(modificados)
+        cache_versionada.invalidar_modelos(ResultadoIndicador)
+        if settings.ANOMALIAS_DETECCION_AUTOMATICA:
+            transaction.on_commit(lambda: AnomaliaService.revisar_indicadores(indicadores))
+        return {'resultados': len(modificados), 'omitidos': omitidos}
@@ -0,0 +1,134 @@
+"""
+Detección de resultados atípicos en las series de indicadores.
+
+A cada serie (resultados de un indicador por fecha) se le resta una tendencia lineal robusta, la
+mediana de su misma estación (si se conoce el periodo y hay al menos dos ciclos) y la mediana
+de los puntos vecinos en lo que queda. El residuo se puntúa con un z robusto, (residuo - mediana) / (1.4826 * MAD), y se marca si supera el umbral
+(3.5 por defecto, el de Iglewicz y Hoaglin). Los valores infinitos o NaN (p. ej. una fórmula con
+división por cero) se marcan siempre.
+
+detectar() recibe todas las series concatenadas y las procesa juntas: las agrupa por longitud
+(redondeada a potencia de 2) y periodo, y cada grupo se evalúa como una matriz rellena con NaN.
+"""
+import warnings
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+UMBRAL = 3.5
+MINIMO_PUNTOS = 5
+VENTANA = 7
+# Celdas de los arreglos temporales (ventanas y ciclos) de cada bloque de series; acota la memoria
+CELDAS_POR_BLOQUE = 4_000_000
+
+
+def _mediana_vecinos(matriz, ventana):
+    """Mediana móvil centrada que excluye el propio punto (si no, un tercio de los residuos es 0)"""
+    medio = ventana // 2
+    relleno = np.pad(matriz, ((0, 0), (medio, medio)), constant_values=np.nan)
+    vecinos = sliding_window_view(relleno, ventana, axis=1).copy()
+    vecinos[:, :, medio] = np.nan
+    return np.nanmedian(vecinos, axis=2)
+
+
+def _mediana_estacional(matriz, periodo):
+    """Mediana de la misma estación en los demás ciclos, excluido el propio ciclo"""
+    filas, columnas = matriz.shape
+    ciclos = -(-columnas // periodo)
+    por_fase = np.pad(matriz, ((0, 0), (0, ciclos * periodo - columnas)),
+                      constant_values=np.nan).reshape(filas, ciclos, periodo)
+    otros = np.repeat(por_fase[:, None, :, :], ciclos, axis=1)
+    propio = np.arange(ciclos)
+    otros[:, propio, propio, :] = np.nan
+    return np.nan_to_num(np.nanmedian(otros, axis=2)).reshape(filas, -1)[:, :columnas]
+
+
+def _puntuar(matriz, periodo):
+    """
+    z robusto y valor esperado de cada celda de una matriz de series (NaN = sin dato). El valor
+    esperado es la tendencia lineal robusta (pendiente = mediana de las diferencias entre ciclos), más la
+    estación y la mediana de los vecinos de lo que queda.
+    """
+    t = np.arange(matriz.shape[1])
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        # Con periodo, las diferencias entre ciclos no dependen de la estación
+        salto = periodo or 1
+        pendiente = np.nanmedian(matriz[:, salto:] - matriz[:, :-salto], axis=1, keepdims=True) / salto
+        nivel = np.nanmedian(matriz - pendiente * t, axis=1, keepdims=True)
+        esperado = nivel + pendiente * t
+        residuo = matriz - esperado
+        if periodo:
+            estacion = _mediana_estacional(residuo, periodo)
+            residuo -= estacion
+            esperado += estacion
+        local = np.nan_to_num(_mediana_vecinos(residuo, VENTANA))
+        residuo -= local
+        esperado += local
+
+        centro = np.nanmedian(residuo, axis=1, keepdims=True)
+        desviacion = np.abs(residuo - centro)
+        escala = 1.4826 * np.nanmedian(desviacion, axis=1, keepdims=True)
+        # Con más de la mitad de residuos iguales la MAD es 0; se usa la desviación media
+        escala = np.where(escala > 0, escala, 1.2533 * np.nanmean(desviacion, axis=1, keepdims=True))
+        z = np.divide(residuo - centro, escala, out=np.zeros_like(residuo), where=escala > 0)
+    return z, esperado + centro
+
+
+def detectar(grupos, valores, periodos=None, umbral=UMBRAL):
+    """
+    grupos: id del indicador de cada resultado, con los de un mismo indicador contiguos y en
+    orden de fecha. periodos: {id: resultados por ciclo}. Devuelve arrays alineados con valores:
+    'marcada', 'metodo' ('mad', 'estacional', 'no_finito' o ''), 'puntuacion' y 'esperado'.
+    """
+    grupos = np.asarray(grupos)
+    valores = np.asarray(valores, dtype=float)
+    periodos = periodos or {}
+    n = len(valores)
+    puntuacion = np.full(n, np.nan)
+    esperado = np.full(n, np.nan)
+    metodo = np.full(n, '', dtype='<U10')
+
+    finitos = np.isfinite(valores)
+    limpios = np.where(finitos, valores, np.nan)
+
+    cortes = np.flatnonzero(grupos[1:] != grupos[:-1]) + 1
+    inicios = np.r_[0, cortes] if n else np.array([], dtype=np.int64)
+    longitudes = np.diff(np.r_[inicios, n])
+    # El ajuste estacional necesita al menos dos ciclos
+    periodo_serie = np.zeros(len(inicios), dtype=np.int64)
+    if periodos:
+        for j, (inicio, largo) in enumerate(zip(inicios.tolist(), longitudes.tolist())):
+            periodo = periodos.get(int(grupos[inicio])) or 0
+            if largo >= 2 * periodo:
+                periodo_serie[j] = periodo
+    ancho = np.maximum(8, 2 ** np.ceil(np.log2(np.maximum(longitudes, 1)))).astype(np.int64)
+
+    evaluables = longitudes >= MINIMO_PUNTOS
+    for clave in set(zip(ancho[evaluables].tolist(), periodo_serie[evaluables].tolist())):
+        columnas, periodo = clave
+        series = np.flatnonzero(evaluables & (ancho == columnas) & (periodo_serie == periodo))
+        filas_por_bloque = max(1, CELDAS_POR_BLOQUE // (columnas * max(VENTANA, -(-columnas // (periodo or 1)))))
+        for bloque in range(0, len(series), filas_por_bloque):
+            seleccion = series[bloque:bloque + filas_por_bloque]
+            largos = longitudes[seleccion]
+            fila = np.repeat(np.arange(len(seleccion)), largos)
+            desplazamiento = np.arange(largos.sum()) - np.repeat(np.cumsum(largos) - largos, largos)
+            origen = np.repeat(inicios[seleccion], largos) + desplazamiento
+
+            matriz = np.full((len(seleccion), columnas), np.nan)
+            matriz[fila, desplazamiento] = limpios[origen]
+            z, e = _puntuar(matriz, periodo)
+            puntuacion[origen] = z[fila, desplazamiento]
+            esperado[origen] = e[fila, desplazamiento]
+            atipicos = origen[np.abs(z[fila, desplazamiento]) > umbral]
+            metodo[atipicos] = 'estacional' if periodo else 'mad'
+
+    metodo[~finitos] = 'no_finito'
+    puntuacion[~finitos] = np.inf
+    return {
+        'marcada': metodo != '',
+        'metodo': metodo,
+        'puntuacion': puntuacion,
+        'esperado': esperado,
+    }
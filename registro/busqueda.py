@@ -0,0 +1,274 @@
+"""
+Búsqueda de texto completo sobre acciones, indicadores, resultados de acciones y documentos.
+
+Cada objeto tiene una fila en DocumentoBusqueda con su título, su texto y el texto normalizado
+(minúsculas y sin tildes). Sobre esa tabla se mantiene un índice según la base de datos:
+
+- SQLite: tabla virtual FTS5 de contenido externo (tokenizador unicode61 sin diacríticos),
+  sincronizada con triggers y ordenada por bm25 con el título diez veces más pesado que el texto.
+- PostgreSQL: índice GIN sobre to_tsvector('spanish', normalizado), ordenado por ts_rank.
+
+El índice se crea la primera vez que se usa (asegurar_indice). Las señales de registro.signals
+llaman a indexar()/eliminar() al confirmarse cada cambio; reconstruir() rehace todo desde cero
+(comando reconstruir_busqueda). El texto de los documentos es el extraído de sus ficheros
+(registro.documentos). Cada término de la consulta se busca como prefijo, de modo que
+"emision" encuentra "emisiones" en ambos motores.
+"""
+import contextlib
+import re
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.urls import reverse
+
+from registro.models import Accion, Documento, DocumentoBusqueda, FragmentoDocumento, Indicador, ResultadoAccion
+
+FTS = 'registro_busqueda_fts'
+INDICE_GIN = 'registro_busqueda_gin'
+
+# tipo: (modelo, campo del título o None para usar el texto, campos del texto, tabla intermedia
+# de Accion y su columna con el id del objeto)
+FUENTES = {
+    'accion': (Accion, 'nombre', ('objetivo', 'descripcion', 'meta', 'lugar_intervencion'), None, None),
+    'indicador': (Indicador, 'nombre', ('descripcion',), Accion.indicadores.through, 'indicador_id'),
+    'resultado_accion': (ResultadoAccion, None, ('descripcion',), Accion.resultados_accion.through,
+                         'resultadoaccion_id'),
+    'documento': (Documento, 'nombre', (), Accion.documentos.through, 'documento_id'),
+}
+
+STOPWORDS = frozenset(
+    'a al ante con contra de del desde e el en entre la las lo los o para por que se sin sobre su sus u un '
+    'una unas unos y'.split()
+)
+MAXIMO_TERMINOS = 8
+LARGO_FRAGMENTO = 160
+
+_SIN_ACENTOS = dict(zip('áàäâãéèëêíìïîóòöôõúùüûñç', 'aaaaaeeeeiiiiooooouuuunc'))
+_ACENTOS = re.compile(f"[{''.join(_SIN_ACENTOS)}]")
+_preparadas = set()
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes; conserva la longitud para ubicar fragmentos en el texto original"""
+    # Con textos largos (documentos extraídos) re.sub es unas tres veces más rápido que str.translate
+    return _ACENTOS.sub(lambda m: _SIN_ACENTOS[m.group()], (texto or '').lower())
+
+
+def terminos(consulta):
+    """Palabras de la consulta normalizadas, sin artículos ni preposiciones salvo que sea solo eso"""
+    palabras = re.findall(r'\w+', normalizar(consulta))
+    return ([p for p in palabras if p not in STOPWORDS] or palabras)[:MAXIMO_TERMINOS]
+
+
+def _triggers_sqlite(cursor):
+    tabla = DocumentoBusqueda._meta.db_table
+    nuevo = f"INSERT INTO {FTS}(rowid, titulo, texto) VALUES (new.id, new.titulo, new.texto);"
+    viejo = f"INSERT INTO {FTS}({FTS}, rowid, titulo, texto) VALUES ('delete', old.id, old.titulo, old.texto);"
+    for nombre, evento, cuerpo in (('ai', 'INSERT', nuevo), ('ad', 'DELETE', viejo), ('au', 'UPDATE', viejo + nuevo)):
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {FTS}_{nombre} AFTER {evento} ON {tabla} BEGIN {cuerpo} END")
+
+
+def asegurar_indice():
+    """Crea el índice de texto completo si no existe (una vez por conexión y proceso, ya confirmado)"""
+    if connection.alias in _preparadas:
+        return
+    tabla = DocumentoBusqueda._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [FTS])
+            existia = cursor.fetchone() is not None
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS} USING fts5(titulo, texto, content='{tabla}', "
+                f"content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+            )
+            _triggers_sqlite(cursor)
+            if not existia:
+                cursor.execute(f"INSERT INTO {FTS}({FTS}) VALUES ('rebuild')")
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {INDICE_GIN} ON {tabla} "
+                           f"USING gin (to_tsvector('spanish', normalizado))")
+        else:
+            raise NotImplementedError(f'Búsqueda de texto completo no disponible en {connection.vendor}')
+    # Dentro de una transacción el DDL se deshace si se revierte: solo cuenta al confirmarse
+    alias = connection.alias
+    transaction.on_commit(lambda: _preparadas.add(alias), using=alias)
+
+
+@contextlib.contextmanager
+def carga_masiva():
+    """
+    Para cargar o borrar muchas filas de DocumentoBusqueda dentro de una transacción. En SQLite
+    quita los triggers y reconstruye el índice FTS5 una sola vez al final, unas tres veces más
+    rápido que sincronizarlo fila a fila.
+    """
+    asegurar_indice()
+    with transaction.atomic():
+        if connection.vendor != 'sqlite':
+            yield
+            return
+        with connection.cursor() as cursor:
+            for nombre in ('ai', 'ad', 'au'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {FTS}_{nombre}")
+        yield
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS}({FTS}) VALUES ('rebuild')")
+            _triggers_sqlite(cursor)
+
+
+def _acciones(tipo, ids):
+    """{id del objeto: id de la acción} (la de menor id si está en varias)"""
+    _, _, _, intermedia, columna = FUENTES[tipo]
+    if intermedia is None:
+        return {i: i for i in ids}
+    acciones = {}
+    for objeto_id, accion_id in (intermedia.objects.filter(**{f'{columna}__in': ids})
+                                 .order_by('-accion_id').values_list(columna, 'accion_id')):
+        acciones[objeto_id] = accion_id
+    return acciones
+
+
+def _texto_documentos(ids):
+    """{id del documento: texto extraído de su fichero}"""
+    archivos = dict(Documento.objects.filter(id__in=ids, archivo__isnull=False).values_list('id', 'archivo_id'))
+    fragmentos = defaultdict(list)
+    for archivo_id, texto in (FragmentoDocumento.objects.filter(archivo_id__in=set(archivos.values()))
+                              .order_by('archivo_id', 'orden').values_list('archivo_id', 'texto')):
+        fragmentos[archivo_id].append(texto)
+    return {documento_id: '\n'.join(fragmentos[archivo_id]) for documento_id, archivo_id in archivos.items()
+            if archivo_id in fragmentos}
+
+
+# Texto que no está en los campos del modelo: tipo -> función que recibe ids y devuelve {id: texto}
+TEXTO_ADICIONAL = {
+    'documento': _texto_documentos,
+}
+
+
+def _documentos(tipo, objetos):
+    modelo, campo_titulo, campos, _, _ = FUENTES[tipo]
+    acciones = _acciones(tipo, [o['id'] for o in objetos])
+    adicional = TEXTO_ADICIONAL[tipo]([o['id'] for o in objetos]) if tipo in TEXTO_ADICIONAL else {}
+    documentos = []
+    for objeto in objetos:
+        partes = [objeto[campo] for campo in campos if objeto[campo]]
+        if adicional.get(objeto['id']):
+            partes.append(adicional[objeto['id']])
+        titulo = objeto[campo_titulo] if campo_titulo else (partes[0] if partes else '')
+        texto = '\n'.join(partes)
+        documentos.append(DocumentoBusqueda(
+            tipo=tipo, objeto_id=objeto['id'], id_accion=acciones.get(objeto['id']),
+            titulo=(titulo or '')[:500], texto=texto,
+            normalizado=normalizar(f'{titulo or ""}\n{texto}'),
+        ))
+    return documentos
+
+
+def indexar(tipo, ids):
+    """Vuelve a indexar los objetos de `tipo`; los que ya no existen salen del índice"""
+    asegurar_indice()
+    ids = list(ids)
+    modelo, campo_titulo, campos, _, _ = FUENTES[tipo]
+    objetos = list(modelo.objects.filter(id__in=ids).values('id', *filter(None, [campo_titulo]), *campos))
+    with transaction.atomic():
+        DocumentoBusqueda.objects.filter(tipo=tipo, objeto_id__in=ids).delete()
+        DocumentoBusqueda.objects.bulk_create(_documentos(tipo, objetos), batch_size=1000)
+
+
+def eliminar(tipo, ids):
+    asegurar_indice()
+    DocumentoBusqueda.objects.filter(tipo=tipo, objeto_id__in=list(ids)).delete()
+
+
+def reconstruir(lote=2000):
+    """Vacía el índice y lo vuelve a llenar con todos los objetos; devuelve {tipo: documentos}"""
+    totales = {}
+    with carga_masiva():
+        DocumentoBusqueda.objects.all().delete()
+        for tipo, (modelo, campo_titulo, campos, _, _) in FUENTES.items():
+            totales[tipo] = 0
+            consulta = modelo.objects.order_by('id').values('id', *filter(None, [campo_titulo]), *campos)
+            ultimo = 0
+            while True:
+                objetos = list(consulta.filter(id__gt=ultimo)[:lote])
+                if not objetos:
+                    break
+                DocumentoBusqueda.objects.bulk_create(_documentos(tipo, objetos), batch_size=1000)
+                totales[tipo] += len(objetos)
+                ultimo = objetos[-1]['id']
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS}({FTS}) VALUES ('optimize')")
+    return totales
+
+
+def _fragmento(texto, palabras):
+    """Trozo del texto alrededor de la primera palabra encontrada"""
+    if not texto:
+        return ''
+    normalizado = normalizar(texto)
+    posiciones = [p for p in (normalizado.find(palabra) for palabra in palabras) if p >= 0]
+    inicio = max(0, min(posiciones, default=0) - LARGO_FRAGMENTO // 4)
+    if inicio:
+        # Empieza en una palabra completa
+        inicio = texto.find(' ', inicio, min(posiciones)) + 1 or inicio
+    fragmento = texto[inicio:inicio + LARGO_FRAGMENTO].replace('\n', ' ')
+    return ('…' if inicio else '') + fragmento + ('…' if inicio + LARGO_FRAGMENTO < len(texto) else '')
+
+
+def _url(tipo, objeto_id, id_accion):
+    if tipo == 'accion':
+        return reverse('registro:detalle_accion', args=[objeto_id])
+    if id_accion is None:
+        return None
+    if tipo == 'indicador':
+        return reverse('registro:lista_resultado_indicador', args=[id_accion, objeto_id])
+    return reverse('registro:detalle_accion', args=[id_accion])
+
+
+def buscar(consulta, tipos=None, pagina=1, por_pagina=20):
+    """
+    Documentos que contienen todos los términos de la consulta, del más al menos relevante.
+    Devuelve {'total', 'resultados': [{tipo, id, titulo, fragmento, url, puntuacion}]}; la
+    puntuación es mayor cuanto más relevante en ambos motores.
+    """
+    palabras = terminos(consulta)
+    if not palabras:
+        return {'total': 0, 'resultados': []}
+    asegurar_indice()
+
+    tabla = DocumentoBusqueda._meta.db_table
+    filtro_tipos, parametros_tipos = '', []
+    if tipos:
+        filtro_tipos = f" AND d.tipo IN ({', '.join(['%s'] * len(tipos))})"
+        parametros_tipos = list(tipos)
+    if connection.vendor == 'sqlite':
+        desde = f"{FTS} JOIN {tabla} d ON d.id = {FTS}.rowid WHERE {FTS} MATCH %s"
+        expresion = ' '.join(f'"{p}"*' for p in palabras)
+        puntuacion = f"-bm25({FTS}, 10.0, 1.0)"
+    else:
+        desde = (f"{tabla} d, to_tsquery('spanish', %s) q "
+                 f"WHERE to_tsvector('spanish', d.normalizado) @@ q")
+        expresion = ' & '.join(f'{p}:*' for p in palabras)
+        puntuacion = "ts_rank(to_tsvector('spanish', d.normalizado), q)"
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {desde}{filtro_tipos}", [expresion, *parametros_tipos])
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            f"SELECT d.tipo, d.objeto_id, d.id_accion, d.titulo, d.texto, {puntuacion} AS puntuacion "
+            f"FROM {desde}{filtro_tipos} ORDER BY puntuacion DESC, d.id LIMIT %s OFFSET %s",
+            [expresion, *parametros_tipos, por_pagina, (pagina - 1) * por_pagina],
+        )
+        filas = cursor.fetchall()
+
+    return {
+        'total': total,
+        'resultados': [{
+            'tipo': tipo,
+            'id': objeto_id,
+            'titulo': titulo,
+            'fragmento': _fragmento(texto, palabras),
+            'url': _url(tipo, objeto_id, id_accion),
+            'puntuacion': round(float(puntuacion), 4),
+        } for tipo, objeto_id, id_accion, titulo, texto, puntuacion in filas],
+    }
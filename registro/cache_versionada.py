@@ -0,0 +1,165 @@
+"""
+Espacios de caché versionados sobre las cachés con nombre de settings.CACHES.
+
+Cada espacio (nomencladores, vistas, analisis_ia, mapa, pronosticos) guarda sus entradas en la caché del mismo
+nombre con el prefijo '<espacio>:<versión>:'. Invalidar un espacio incrementa su versión, de modo
+que todas sus entradas quedan obsoletas sin recorrerlas y el backend las descarta al expirar o al
+llenarse. registro.signals conecta los cambios de los modelos de ESPACIOS con la invalidación.
+Las versiones viven en la propia caché, así que con varios procesos el backend tiene que ser
+compartido; con locmem y CACHE_PROCESOS > 1 settings cambia a dummy y no se cachea. Con dummy
+la versión es constante (0) e invalidar no hace nada: no hay entradas que dejar obsoletas.
+
+La versión solo sirve para nombrar claves: es local al proceso con locmem y constante con dummy,
+así que no se debe derivar de ella ningún validador HTTP (ETag, Last-Modified). Los validadores
+salen de los datos (ChartDataService.huella_*).
+
+Las métricas (aciertos, fallos, escrituras, desalojos e invalidaciones) son de este proceso. Se
+cuenta como desalojo el fallo de una clave escrita en la versión vigente que aún no había expirado.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.dummy import DummyCache
+
+# Espacio -> modelos ('app.Modelo' o 'app.*') cuyos cambios lo invalidan
+ESPACIOS = {
+    'nomencladores': ['nomencladores.*'],
+    'vistas': ['registro.Accion', 'registro.Indicador', 'registro.ResultadoIndicador',
+               'registro.PresupuestoPlanificado', 'registro.PresupuestoEjecutado'],
+    'analisis_ia': ['registro.Accion', 'registro.Indicador', 'registro.ResultadoIndicador'],
+    'mapa': ['registro.Accion', 'registro.PresupuestoPlanificado', 'registro.PresupuestoEjecutado'],
+    # Cada entrada lleva la huella de los resultados con que se calculó (PronosticoService)
+    'pronosticos': [],
+}
+
+# Claves escritas cuyo estado se sigue para detectar desalojos
+SEGUIMIENTO_MAXIMO = 10000
+
+_AUSENTE = object()
+
+
+class EspacioCache:
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self._bloqueo = threading.Lock()
+        self._escritas = OrderedDict()
+        self.metricas = dict.fromkeys(('aciertos', 'fallos', 'escrituras', 'desalojos', 'invalidaciones'), 0)
+
+    @property
+    def cache(self):
+        return caches[self.nombre if self.nombre in settings.CACHES else 'default']
+
+    def version(self):
+        if isinstance(self.cache, DummyCache):
+            # get_or_set daría una versión nueva en cada llamada
+            return 0
+        # Si la clave se pierde se reinicia con la hora para no repetir versiones anteriores
+        return self.cache.get_or_set(f'{self.nombre}:version', time.time_ns, None)
+
+    def _clave(self, clave):
+        return f'{self.nombre}:{self.version()}:{clave}'
+
+    def get(self, clave, default=None):
+        clave = self._clave(clave)
+        valor = self.cache.get(clave, _AUSENTE)
+        with self._bloqueo:
+            if valor is not _AUSENTE:
+                self.metricas['aciertos'] += 1
+                return valor
+            self.metricas['fallos'] += 1
+            expira = self._escritas.pop(clave, None)
+            if expira is not None and expira > time.monotonic():
+                self.metricas['desalojos'] += 1
+        return default
+
+    def set(self, clave, valor, timeout=DEFAULT_TIMEOUT):
+        clave = self._clave(clave)
+        self.cache.set(clave, valor, timeout)
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.cache.default_timeout
+        with self._bloqueo:
+            self.metricas['escrituras'] += 1
+            self._escritas[clave] = float('inf') if timeout is None else time.monotonic() + timeout
+            self._escritas.move_to_end(clave)
+            while len(self._escritas) > SEGUIMIENTO_MAXIMO:
+                self._escritas.popitem(last=False)
+
+    def get_or_set(self, clave, funcion, timeout=DEFAULT_TIMEOUT):
+        valor = self.get(clave, _AUSENTE)
+        if valor is _AUSENTE:
+            valor = funcion()
+            self.set(clave, valor, timeout)
+        return valor
+
+    def delete_many(self, claves):
+        claves = [self._clave(clave) for clave in claves]
+        self.cache.delete_many(claves)
+        with self._bloqueo:
+            for clave in claves:
+                self._escritas.pop(clave, None)
+
+    def invalidar(self):
+        """Deja obsoletas todas las entradas del espacio"""
+        if not isinstance(self.cache, DummyCache):
+            try:
+                self.cache.incr(f'{self.nombre}:version')
+            except ValueError:
+                self.cache.set(f'{self.nombre}:version', time.time_ns(), None)
+        with self._bloqueo:
+            self.metricas['invalidaciones'] += 1
+            self._escritas.clear()
+
+    def estadisticas(self):
+        with self._bloqueo:
+            metricas = dict(self.metricas)
+            seguidas = len(self._escritas)
+        lecturas = metricas['aciertos'] + metricas['fallos']
+        return {
+            **metricas,
+            'tasa_aciertos': round(metricas['aciertos'] / lecturas, 4) if lecturas else None,
+            'claves_seguidas': seguidas,
+            'backend': type(self.cache).__name__,
+            'version': self.version(),
+        }
+
+
+_espacios = {nombre: EspacioCache(nombre) for nombre in ESPACIOS}
+
+
+def espacio(nombre):
+    return _espacios[nombre]
+
+
+def modelos_observados():
+    """{modelo: [espacios]} a partir de ESPACIOS"""
+    observados = {}
+    for nombre, referencias in ESPACIOS.items():
+        for referencia in referencias:
+            app_label, modelo = referencia.split('.')
+            if modelo == '*':
+                modelos = apps.get_app_config(app_label).get_models()
+            else:
+                modelos = [apps.get_model(app_label, modelo)]
+            for m in modelos:
+                observados.setdefault(m, []).append(nombre)
+    return observados
+
+
+_observados = {}
+
+
+def invalidar_modelos(*modelos):
+    """Invalida los espacios que dependen de alguno de los modelos"""
+    if not _observados:
+        _observados.update(modelos_observados())
+    for nombre in {n for modelo in modelos for n in _observados.get(modelo, [])}:
+        _espacios[nombre].invalidar()
+
+
+def metricas():
+    return {nombre: e.estadisticas() for nombre, e in _espacios.items()}
@@ -0,0 +1,396 @@
+"""
+Documentos adjuntos: almacenamiento por contenido y extracción de texto.
+
+guardar_subida() calcula el SHA-256 del fichero subido; si ese contenido ya estaba guardado, el
+nuevo Documento apunta al mismo ArchivoDocumento en lugar de escribir otra copia. El texto de cada
+contenido se extrae una sola vez (PDF con pypdf si está instalado, DOCX leyendo el XML del paquete
+y texto plano), se guarda en FragmentoDocumento en trozos de LARGO_FRAGMENTO caracteres y entra en
+el índice de búsqueda de todos los documentos que lo comparten.
+
+La extracción corre en hilos: al confirmarse una subida el contenido nuevo se encola en un grupo
+de hilos del proceso (settings.DOCUMENTOS_EXTRACCION_AUTOMATICA) y el comando
+extraer_texto_documentos procesa los pendientes, deduplica los documentos anteriores a este
+módulo e informa del rendimiento y del ahorro de almacenamiento. En procesar() los hilos solo
+leen y analizan ficheros; las escrituras en la base de datos se hacen desde el hilo que llama.
+"""
+import hashlib
+import io
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+from auditlog.models import LogEntry
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, Sum
+from django.utils.timezone import now
+
+from registro import busqueda
+from registro.models import ArchivoDocumento, Documento, FragmentoDocumento
+from seguridad.auditoria import registrar_cambios
+
+logger = logging.getLogger(__name__)
+
+LARGO_FRAGMENTO = 4000
+MAXIMO_CARACTERES = 2_000_000
+MAXIMO_XML = 50 * 1024 * 1024
+EXTENSIONES_TEXTO = frozenset({'.txt', '.csv', '.tsv', '.md', '.json'})
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+_bloqueo = threading.Lock()
+_grupo = None
+
+
+class FormatoNoSoportado(Exception):
+    pass
+
+
+# ============================================================================
+# Subida con deduplicación por contenido
+# ============================================================================
+
+def resumen(fichero):
+    """(SHA-256 en hexadecimal, tamaño en bytes) de un fichero de Django, leído por trozos"""
+    sha = hashlib.sha256()
+    tamano = 0
+    fichero.seek(0)
+    for trozo in fichero.chunks():
+        sha.update(trozo)
+        tamano += len(trozo)
+    fichero.seek(0)
+    return sha.hexdigest(), tamano
+
+
+def _contenido(sha, tamano, guardar):
+    """
+    (ArchivoDocumento con ese SHA-256, si es nuevo). Si no existía se crea y guardar(archivo)
+    escribe su fichero; si ya existía no se escribe nada.
+    """
+    archivo = ArchivoDocumento.objects.filter(sha256=sha).first()
+    if archivo is not None:
+        return archivo, False
+    archivo = ArchivoDocumento(sha256=sha, tamano=tamano)
+    guardar(archivo)
+    try:
+        with transaction.atomic():
+            archivo.save()
+    except IntegrityError:
+        # Otra petición guardó el mismo contenido a la vez: se usa el suyo
+        archivo.archivo.delete(save=False)
+        return ArchivoDocumento.objects.get(sha256=sha), False
+    if settings.DOCUMENTOS_EXTRACCION_AUTOMATICA:
+        archivo_id = archivo.id
+        transaction.on_commit(lambda: encolar([archivo_id]))
+    return archivo, True
+
+
+def guardar_subida(fichero, nombre=None):
+    """Documento para un fichero subido; si su contenido ya estaba guardado no se escribe otra copia"""
+    sha, tamano = resumen(fichero)
+    archivo, _ = _contenido(sha, tamano, lambda a: a.archivo.save(fichero.name, fichero, save=False))
+    return Documento.objects.create(nombre=nombre or fichero.name, documento=archivo.archivo.name,
+                                    archivo=archivo)
+
+
+def guardar_contenido(ruta, nombre, sha, tamano):
+    """
+    ArchivoDocumento para un fichero ya escrito en disco (subidas por fragmentos) con su SHA-256
+    calculado. El fichero se mueve al almacenamiento sin copiarlo si está en el mismo sistema de
+    ficheros, o se borra si su contenido ya estaba guardado. No abre ninguna transacción larga:
+    el llamador crea el Documento.
+    """
+    def mover(archivo):
+        campo = archivo.archivo
+        nombre_final = campo.storage.get_available_name(campo.field.generate_filename(archivo, nombre),
+                                                        max_length=campo.field.max_length)
+        try:
+            destino = campo.storage.path(nombre_final)
+        except NotImplementedError:
+            with open(ruta, 'rb') as f:
+                campo.save(nombre, File(f), save=False)
+            os.remove(ruta)
+            return
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        shutil.move(ruta, destino)
+        campo.name = nombre_final
+
+    archivo, _ = _contenido(sha, tamano, mover)
+    if os.path.exists(ruta):
+        # El contenido ya estaba guardado
+        os.remove(ruta)
+    return archivo
+
+
+def deduplicar_existentes(lote=200):
+    """
+    Enlaza los documentos sin ArchivoDocumento (subidos antes de la deduplicación) con el de su
+    contenido. El primero de cada contenido conserva su fichero; los demás pasan a apuntar a él y
+    su copia se borra. Devuelve {'documentos', 'nuevos', 'duplicados', 'bytes_liberados', 'sin_fichero'}.
+    """
+    totales = dict.fromkeys(('documentos', 'nuevos', 'duplicados', 'bytes_liberados', 'sin_fichero'), 0)
+    ultimo = 0
+    while True:
+        documentos = list(Documento.objects.filter(id__gt=ultimo, archivo__isnull=True)
+                          .exclude(documento='').exclude(documento__isnull=True).order_by('id')[:lote])
+        if not documentos:
+            return totales
+        ultimo = documentos[-1].id
+        cambiados, auditoria = [], []
+        for documento in documentos:
+            try:
+                with documento.documento.open('rb') as fichero:
+                    sha, tamano = resumen(fichero)
+            except OSError:
+                totales['sin_fichero'] += 1
+                continue
+            archivo = ArchivoDocumento.objects.filter(sha256=sha).first()
+            if archivo is None:
+                # El fichero existente pasa a ser el del contenido, sin copiarlo
+                archivo = ArchivoDocumento.objects.create(sha256=sha, tamano=tamano,
+                                                          archivo=documento.documento.name)
+                totales['nuevos'] += 1
+            elif archivo.archivo.name != documento.documento.name:
+                redundante = documento.documento.name
+                documento.documento = archivo.archivo.name
+                auditoria.append((documento, LogEntry.Action.UPDATE,
+                                  {'documento': [redundante, archivo.archivo.name]}))
+                if not Documento.objects.filter(documento=redundante).exclude(id=documento.id).exists():
+                    documento.documento.storage.delete(redundante)
+                    totales['bytes_liberados'] += tamano
+                totales['duplicados'] += 1
+            documento.archivo = archivo
+            cambiados.append(documento)
+        Documento.objects.bulk_update(cambiados, ['documento', 'archivo'])
+        registrar_cambios(auditoria)
+        # Los que comparten un contenido ya extraído entran al índice con su texto
+        busqueda.indexar('documento', [d.id for d in cambiados if d.archivo.estado_extraccion == 'extraido'])
+        totales['documentos'] += len(cambiados)
+
+
+def limpiar_huerfanos():
+    """Borra los contenidos que ya no usa ningún documento, con sus ficheros; devuelve cuántos"""
+    huerfanos = list(ArchivoDocumento.objects.filter(documentos__isnull=True))
+    for archivo in huerfanos:
+        if not Documento.objects.filter(documento=archivo.archivo.name).exists():
+            archivo.archivo.delete(save=False)
+    ArchivoDocumento.objects.filter(id__in=[a.id for a in huerfanos]).delete()
+    return len(huerfanos)
+
+
+def estadisticas():
+    """Documentos, contenidos distintos y bytes que ocuparían sin deduplicar frente a los guardados"""
+    referenciados = Documento.objects.filter(archivo__isnull=False).aggregate(
+        documentos=Count('id'), bytes=Sum('archivo__tamano'))
+    guardados = ArchivoDocumento.objects.aggregate(archivos=Count('id'), bytes=Sum('tamano'))
+    bytes_documentos = referenciados['bytes'] or 0
+    bytes_guardados = guardados['bytes'] or 0
+    return {
+        'documentos': referenciados['documentos'],
+        'archivos': guardados['archivos'],
+        'bytes_documentos': bytes_documentos,
+        'bytes_guardados': bytes_guardados,
+        'ahorro': 1 - bytes_guardados / bytes_documentos if bytes_documentos else 0.0,
+        'estados': dict(ArchivoDocumento.objects.order_by().values_list('estado_extraccion')
+                        .annotate(total=Count('id'))),
+    }
+
+
+# ============================================================================
+# Extracción de texto
+# ============================================================================
+
+def _texto_plano(datos):
+    for codificacion in ('utf-8-sig', 'cp1252'):
+        try:
+            return datos.decode(codificacion)
+        except UnicodeDecodeError:
+            continue
+    return datos.decode('latin-1')
+
+
+def _texto_docx(paquete):
+    """Párrafos de word/document.xml; las tablas salen como párrafos con celdas separadas"""
+    info = paquete.getinfo('word/document.xml')
+    if info.file_size > MAXIMO_XML:
+        raise ValueError(f'document.xml demasiado grande ({info.file_size} bytes)')
+    parrafos, partes = [], []
+    with paquete.open(info) as xml:
+        for evento, elemento in ElementTree.iterparse(xml, events=('start', 'end')):
+            if evento == 'start':
+                continue
+            if elemento.tag == f'{_W}t':
+                partes.append(elemento.text or '')
+            elif elemento.tag == f'{_W}tab':
+                partes.append('\t')
+            elif elemento.tag in (f'{_W}br', f'{_W}cr'):
+                partes.append('\n')
+            elif elemento.tag == f'{_W}p':
+                parrafos.append(''.join(partes))
+                partes = []
+                elemento.clear()
+    return '\n'.join(parrafos)
+
+
+def _texto_pdf(datos):
+    # Se importa al extraer, no al cargar las vistas; sin pypdf los PDF quedan como no soportados
+    try:
+        import pypdf
+    except ImportError:
+        raise FormatoNoSoportado('PDF sin pypdf instalado')
+    lector = pypdf.PdfReader(io.BytesIO(datos))
+    if lector.is_encrypted:
+        lector.decrypt('')
+    paginas, total = [], 0
+    for pagina in lector.pages:
+        texto = pagina.extract_text() or ''
+        paginas.append(texto)
+        total += len(texto)
+        if total >= MAXIMO_CARACTERES:
+            break
+    return '\n'.join(paginas)
+
+
+def extraer_texto(datos, nombre=''):
+    """Texto de un PDF, DOCX o fichero de texto; el formato se reconoce por el contenido o la extensión"""
+    extension = ('.' + nombre.rsplit('.', 1)[-1].lower()) if '.' in nombre else ''
+    if datos[:5] == b'%PDF-':
+        return _texto_pdf(datos)
+    if datos[:4] == b'PK\x03\x04':
+        with zipfile.ZipFile(io.BytesIO(datos)) as paquete:
+            if 'word/document.xml' in paquete.namelist():
+                return _texto_docx(paquete)
+        raise FormatoNoSoportado(f'Paquete zip no reconocido ({extension or "sin extensión"})')
+    if extension in EXTENSIONES_TEXTO:
+        return _texto_plano(datos)
+    raise FormatoNoSoportado(f'Formato no soportado ({extension or "sin extensión"})')
+
+
+def fragmentar(texto, largo=LARGO_FRAGMENTO):
+    """Trozos de hasta `largo` caracteres cortados en un espacio; los espacios repetidos se reducen a uno"""
+    texto = re.sub(r'[ \t\r\f\v]+', ' ', texto)
+    texto = re.sub(r'\n\s*\n+', '\n\n', texto).strip()[:MAXIMO_CARACTERES]
+    inicio = 0
+    while inicio < len(texto):
+        fin = inicio + largo
+        if fin < len(texto):
+            corte = texto.rfind(' ', inicio + largo // 2, fin)
+            fin = corte if corte > 0 else fin
+        trozo = texto[inicio:fin].strip()
+        if trozo:
+            yield trozo
+        inicio = fin
+
+
+def _extraer(archivo_id, fichero, nombre):
+    """(archivo_id, estado, texto, error); se ejecuta en los hilos y no toca la base de datos"""
+    try:
+        # Los analizadores trabajan con el fichero entero en memoria: los mayores no se extraen
+        if fichero.size > settings.DOCUMENTOS_EXTRACCION_TAMANO_MAXIMO:
+            raise FormatoNoSoportado(f'Fichero de {fichero.size / 2 ** 20:,.1f} MB; se extrae el texto hasta '
+                                     f'{settings.DOCUMENTOS_EXTRACCION_TAMANO_MAXIMO / 2 ** 20:,.1f} MB')
+        with fichero.open('rb') as f:
+            datos = f.read()
+        texto = extraer_texto(datos, nombre)
+    except FormatoNoSoportado as e:
+        return archivo_id, 'no_soportado', '', str(e)
+    except Exception as e:
+        return archivo_id, 'error', '', f'{type(e).__name__}: {e}'[:500]
+    return archivo_id, ('extraido' if texto.strip() else 'sin_texto'), texto, ''
+
+
+def _guardar(resultados):
+    """Guarda los fragmentos de los resultados de _extraer y reindexa sus documentos"""
+    fragmentos, caracteres = [], {}
+    for archivo_id, estado, texto, _ in resultados:
+        trozos = list(fragmentar(texto)) if estado == 'extraido' else []
+        caracteres[archivo_id] = sum(map(len, trozos))
+        fragmentos.extend(FragmentoDocumento(archivo_id=archivo_id, orden=i, texto=trozo)
+                          for i, trozo in enumerate(trozos))
+    ids = list(caracteres)
+    archivos = ArchivoDocumento.objects.in_bulk(ids)
+    momento = now()
+    for archivo_id, estado, _, error in resultados:
+        archivo = archivos[archivo_id]
+        archivo.estado_extraccion, archivo.error_extraccion = estado, error
+        archivo.caracteres, archivo.fecha_extraccion = caracteres[archivo_id], momento
+    with transaction.atomic():
+        FragmentoDocumento.objects.filter(archivo_id__in=ids).delete()
+        FragmentoDocumento.objects.bulk_create(fragmentos, batch_size=500)
+        ArchivoDocumento.objects.bulk_update(
+            archivos.values(), ['estado_extraccion', 'error_extraccion', 'caracteres', 'fecha_extraccion'])
+    documento_ids = list(Documento.objects.filter(archivo_id__in=ids).values_list('id', flat=True))
+    if documento_ids:
+        busqueda.indexar('documento', documento_ids)
+    return sum(caracteres.values())
+
+
+def procesar(archivo_ids=None, hilos=4, lote=50, estados=('pendiente',)):
+    """
+    Extrae el texto de los contenidos indicados, o de todos los que están en `estados`, con
+    `hilos` hilos de lectura y análisis. Mientras se guarda un lote los hilos ya extraen el
+    siguiente. Devuelve {'archivos', 'bytes', 'caracteres', 'errores', 'no_soportados', 'segundos'}.
+    """
+    consulta = ArchivoDocumento.objects.order_by('id')
+    consulta = consulta.filter(id__in=archivo_ids) if archivo_ids is not None else \
+        consulta.filter(estado_extraccion__in=estados)
+    totales = dict.fromkeys(('archivos', 'bytes', 'caracteres', 'errores', 'no_soportados'), 0)
+    inicio = time.perf_counter()
+    grupo = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='extraccion') if hilos > 1 else None
+
+    def enviar(archivos):
+        # La ruta del contenido conserva la extensión del fichero subido
+        tareas = [(a.id, a.archivo, a.archivo.name) for a in archivos]
+        if grupo is None:
+            return [_extraer(*tarea) for tarea in tareas]
+        return [grupo.submit(_extraer, *tarea) for tarea in tareas]
+
+    def guardar(archivos, pendientes):
+        resultados = pendientes if grupo is None else [f.result() for f in pendientes]
+        totales['caracteres'] += _guardar(resultados)
+        totales['archivos'] += len(archivos)
+        totales['bytes'] += sum(a.tamano for a in archivos)
+        totales['errores'] += sum(r[1] == 'error' for r in resultados)
+        totales['no_soportados'] += sum(r[1] == 'no_soportado' for r in resultados)
+
+    try:
+        ultimo, anterior = 0, None
+        while True:
+            archivos = list(consulta.filter(id__gt=ultimo)[:lote])
+            actual = (archivos, enviar(archivos)) if archivos else None
+            if anterior is not None:
+                guardar(*anterior)
+            if actual is None:
+                break
+            ultimo, anterior = archivos[-1].id, actual
+    finally:
+        if grupo is not None:
+            grupo.shutdown(cancel_futures=True)
+    totales['segundos'] = time.perf_counter() - inicio
+    return totales
+
+
+def _procesar_en_segundo_plano(archivo_ids):
+    try:
+        procesar(archivo_ids, hilos=1)
+    except Exception:
+        logger.exception('Error extrayendo el texto de los documentos %s', archivo_ids)
+    finally:
+        # Cada hilo del grupo tiene su propia conexión
+        connection.close()
+
+
+def encolar(archivo_ids):
+    """Extrae en segundo plano el texto de los contenidos indicados (settings.DOCUMENTOS_HILOS_EXTRACCION hilos)"""
+    global _grupo
+    with _bloqueo:
+        if _grupo is None:
+            _grupo = ThreadPoolExecutor(max_workers=settings.DOCUMENTOS_HILOS_EXTRACCION,
+                                        thread_name_prefix='extraccion_documentos')
+    return _grupo.submit(_procesar_en_segundo_plano, list(archivo_ids))
@@ -0,0 +1,303 @@
+"""
+Construcción y servicio de los ficheros estáticos.
+
+static/ trae los plugins completos de Metronic, datos y ficheros de trabajo que ninguna página
+usa. BuscadorReferenciados hace que collectstatic copie de static/ solo lo que se usa: las rutas
+de {% static '...' %} de las plantillas, lo que a su vez referencian esos CSS y JS (url(),
+@import, sourceMappingURL, con las mismas expresiones con las que los reescribe el almacén) y lo
+que se añada en settings.ESTATICOS_INCLUIR. AlmacenEstaticos nombra cada fichero por el hash de
+su contenido, escribe el manifiesto staticfiles.json y guarda al lado variantes .gz y .br
+(brotli es opcional) de los ficheros de texto. EstaticosMiddleware sirve STATIC_ROOT en
+producción: la variante comprimida que acepte el navegador y, para los nombres con hash, caché
+de un año sin revalidar.
+
+El comando construir_estaticos ejecuta collectstatic e informa de los ficheros sin usar y de
+los bytes ahorrados.
+"""
+import fnmatch
+import gzip
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urldefrag, urlsplit
+
+from django.conf import settings
+from django.contrib.staticfiles.finders import FileSystemFinder
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.http import FileResponse, HttpResponseNotModified
+from django.template.utils import get_app_template_dirs
+from django.utils._os import safe_join
+from django.utils.http import parse_etags
+
+try:
+    import brotli
+except ImportError:  # Sin brotli solo se genera la variante .gz
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRIMIBLES = ('.css', '.js', '.mjs', '.json', '.geojson', '.map', '.svg', '.txt', '.xml', '.html',
+                '.ico', '.ttf', '.eot', '.otf')
+COMPRESION_MINIMA = 1024
+EXTENSIONES = {'br': '.br', 'gzip': '.gz'}
+CACHE_INMUTABLE = 'public, max-age=31536000, immutable'
+CACHE_SIN_HASH = 'public, max-age=3600'
+
+_STATIC_PLANTILLA = re.compile(r"""\{%\s*static\s+(['"])(?P<ruta>[^'"]+)\1""")
+
+
+# ============================================================================
+# Ficheros referenciados
+# ============================================================================
+
+def directorios_plantillas():
+    directorios = [d for motor in settings.TEMPLATES for d in motor.get('DIRS', [])]
+    return directorios + list(get_app_template_dirs('templates'))
+
+
+def referencias_plantillas():
+    """Rutas literales de {% static %} en todas las plantillas del proyecto y de las apps"""
+    rutas = set()
+    for directorio in directorios_plantillas():
+        for raiz, _, nombres in os.walk(directorio):
+            for nombre in nombres:
+                if not nombre.endswith(('.html', '.txt', '.xml', '.js')):
+                    continue
+                with open(os.path.join(raiz, nombre), encoding='utf-8', errors='ignore') as f:
+                    rutas.update(m.group('ruta') for m in _STATIC_PLANTILLA.finditer(f.read()))
+    return rutas
+
+
+def _destino(origen, url):
+    """Ruta estática a la que apunta `url` desde el fichero `origen`, o None si es externa"""
+    if re.match(r'^[a-z]+:', url) or url.startswith('//'):
+        return None
+    if url.startswith('/') and not url.startswith(settings.STATIC_URL):
+        return None
+    ruta = urlsplit(urldefrag(url)[0]).path
+    if not ruta:
+        return None
+    if ruta.startswith('/'):
+        ruta = ruta.removeprefix(settings.STATIC_URL)
+    else:
+        ruta = posixpath.join(posixpath.dirname(origen), ruta)
+    return posixpath.normpath(unquote(ruta))
+
+
+def referenciados(archivos, patrones, iniciales):
+    """
+    Cierre de `iniciales` sobre las referencias de los CSS/JS. `archivos` es {ruta: storage} de
+    los ficheros disponibles y `patrones` el _patterns del almacén ({'*.css': [(regex, plantilla)]})
+    """
+    usados = set()
+    pendientes = [r for r in iniciales if r in archivos]
+    while pendientes:
+        ruta = pendientes.pop()
+        if ruta in usados:
+            continue
+        usados.add(ruta)
+        expresiones = [e for extension, lista in patrones.items() if fnmatch.fnmatchcase(ruta, extension)
+                       for e, _ in lista]
+        if not expresiones:
+            continue
+        with archivos[ruta].open(ruta) as f:
+            contenido = f.read().decode('utf-8', errors='ignore')
+        for expresion in expresiones:
+            for coincidencia in expresion.finditer(contenido):
+                destino = _destino(ruta, coincidencia.group('url'))
+                if destino in archivos and destino not in usados:
+                    pendientes.append(destino)
+    return usados
+
+
+class BuscadorReferenciados(FileSystemFinder):
+    """
+    FileSystemFinder que en collectstatic lista solo los ficheros de STATICFILES_DIRS que usa
+    alguna plantilla (directa o indirectamente) o que casan con settings.ESTATICOS_INCLUIR.
+    find() no cambia, así que runserver sigue sirviendo todo static/.
+    """
+
+    def todos(self, ignore_patterns):
+        return {ruta: storage for ruta, storage in super().list(ignore_patterns)}
+
+    def usados(self, archivos):
+        from django.contrib.staticfiles.storage import staticfiles_storage
+
+        iniciales = referencias_plantillas()
+        iniciales.update(r for r in archivos
+                         if any(fnmatch.fnmatchcase(r, p) for p in settings.ESTATICOS_INCLUIR))
+        return referenciados(archivos, getattr(staticfiles_storage, '_patterns', {}), iniciales)
+
+    def list(self, ignore_patterns):
+        archivos = self.todos(ignore_patterns)
+        usados = self.usados(archivos)
+        for ruta, storage in archivos.items():
+            if ruta in usados:
+                yield ruta, storage
+
+
+# ============================================================================
+# Almacén con hash y precompresión
+# ============================================================================
+
+def comprimir(ruta):
+    """
+    Escribe junto a `ruta` las variantes .gz y .br que ahorren al menos un 5 %, borra las que
+    no, y devuelve {'': bytes, 'gzip': bytes, 'br': bytes} de las que quedan
+    """
+    with open(ruta, 'rb') as f:
+        datos = f.read()
+    tamanos = {'': len(datos)}
+    variantes = {'gzip': lambda: gzip.compress(datos, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variantes['br'] = lambda: brotli.compress(datos, quality=11)
+    for codificacion, generar in variantes.items():
+        destino = ruta + EXTENSIONES[codificacion]
+        comprimido = generar() if len(datos) >= COMPRESION_MINIMA else None
+        if comprimido is not None and len(comprimido) < len(datos) * 0.95:
+            with open(destino, 'wb') as f:
+                f.write(comprimido)
+            tamanos[codificacion] = len(comprimido)
+        elif os.path.exists(destino):
+            os.remove(destino)
+    return tamanos
+
+
+class AlmacenEstaticos(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage que, tras escribir el manifiesto, comprime los ficheros con hash
+    en paralelo (zlib y brotli liberan el GIL). Una referencia a un fichero que no existe (un
+    url() roto de un plugin, una plantilla que apunta a algo borrado) se deja sin hash en vez de
+    abortar collectstatic o dar un error 500.
+    """
+    manifest_strict = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._ausentes = set()
+
+    def hashed_name(self, name, content=None, filename=None):
+        if content is None and not self.exists(self.clean_name(urlsplit(unquote(name)).path.strip())):
+            if name not in self._ausentes:
+                self._ausentes.add(name)
+                logger.warning('Fichero estático referenciado que no existe: %s', name)
+            return name
+        return super().hashed_name(name, content, filename)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        nombres = sorted({n for n in self.hashed_files.values() if n.lower().endswith(COMPRIMIBLES)})
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 2) as grupo:
+            self.compresion = dict(zip(nombres, grupo.map(comprimir, map(self.path, nombres))))
+
+
+# ============================================================================
+# Servicio en producción
+# ============================================================================
+
+_manifiesto = {'mtime': None, 'inmutables': frozenset()}
+_bloqueo = threading.Lock()
+
+
+def inmutables():
+    """Nombres con hash del manifiesto de STATIC_ROOT; se vuelve a leer solo si cambió"""
+    ruta = os.path.join(settings.STATIC_ROOT, AlmacenEstaticos.manifest_name)
+    try:
+        mtime = os.path.getmtime(ruta)
+    except OSError:
+        return frozenset()
+    if _manifiesto['mtime'] != mtime:
+        with _bloqueo, open(ruta, encoding='utf-8') as f:
+            _manifiesto['inmutables'] = frozenset(json.load(f).get('paths', {}).values())
+            _manifiesto['mtime'] = mtime
+    return _manifiesto['inmutables']
+
+
+def codificaciones_aceptadas(cabecera):
+    """
+    Codificaciones de Accept-Encoding con q > 0, de mayor a menor preferencia. '*' acepta las
+    que no se mencionan; 'identity' y las de q=0 se descartan.
+    """
+    calidades = {}
+    for parte in cabecera.split(','):
+        codificacion, _, parametros = parte.partition(';')
+        codificacion = codificacion.strip().lower()
+        if not codificacion:
+            continue
+        calidad = 1.0
+        for parametro in parametros.split(';'):
+            clave, _, valor = parametro.partition('=')
+            if clave.strip().lower() == 'q':
+                try:
+                    calidad = float(valor)
+                except ValueError:
+                    calidad = 0.0
+        calidades[codificacion] = calidad
+    comodin = calidades.pop('*', 0.0)
+    candidatas = {c: calidades.get(c, comodin) for c in EXTENSIONES}
+    return [c for c, q in sorted(candidatas.items(), key=lambda c: -c[1]) if q > 0]
+
+
+def coincide_etag(cabecera, etag):
+    """Si la cabecera If-None-Match es '*' o lista `etag` (comparación débil, sin el prefijo W/)"""
+    etiquetas = parse_etags(cabecera)
+    return '*' in etiquetas or etag.removeprefix('W/') in {e.removeprefix('W/') for e in etiquetas}
+
+
+def servir(request, nombre):
+    """Respuesta para el fichero `nombre` de STATIC_ROOT, o None si no existe"""
+    try:
+        ruta = safe_join(settings.STATIC_ROOT, nombre)
+    except SuspiciousFileOperation:
+        return None
+    try:
+        estado = os.stat(ruta)
+    except OSError:
+        return None
+    if not os.path.isfile(ruta):
+        return None
+
+    aceptadas = codificaciones_aceptadas(request.headers.get('Accept-Encoding', ''))
+    codificacion = next((c for c in aceptadas if os.path.isfile(ruta + EXTENSIONES[c])), '')
+    etag = f'"{int(estado.st_mtime):x}-{estado.st_size:x}{"-" + codificacion if codificacion else ""}"'
+
+    if coincide_etag(request.headers.get('If-None-Match', ''), etag):
+        respuesta = HttpResponseNotModified()
+    else:
+        tipo, _ = mimetypes.guess_type(nombre)
+        respuesta = FileResponse(open(ruta + EXTENSIONES.get(codificacion, ''), 'rb'),
+                                 content_type=tipo or 'application/octet-stream')
+        if codificacion:
+            respuesta['Content-Encoding'] = codificacion
+    respuesta['ETag'] = etag
+    respuesta['Vary'] = 'Accept-Encoding'
+    respuesta['Cache-Control'] = CACHE_INMUTABLE if nombre in inmutables() else CACHE_SIN_HASH
+    return respuesta
+
+
+class EstaticosMiddleware:
+    """
+    Sirve STATIC_URL desde STATIC_ROOT antes de sesiones y autenticación cuando
+    settings.ESTATICOS_SERVIR está activo (por defecto, con DEBUG desactivado)
+    """
+
+    def __init__(self, get_response):
+        if not settings.ESTATICOS_SERVIR:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefijo = settings.STATIC_URL
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD') and request.path_info.startswith(self.prefijo):
+            respuesta = servir(request, request.path_info[len(self.prefijo):])
+            if respuesta is not None:
+                return respuesta
+        return self.get_response(request)
@@ -149,6 +149,16 @@ class ResultadoIndicadorForm(forms.ModelForm):
             'fecha': forms.DateInput(attrs={'class': 'form-control rounded rounded-end-0'}),
         }
 
+    def clean_fecha(self):
+        # El indicador no forma parte del formulario, por lo que la restricción única
+        # (indicador, fecha) se valida aquí a partir de la instancia
+        fecha = self.cleaned_data['fecha']
+        indicador_id = self.instance.indicador_id
+        if indicador_id and ResultadoIndicador.objects.filter(
+                indicador_id=indicador_id, fecha=fecha).exclude(pk=self.instance.pk).exists():
+            raise forms.ValidationError('Ya existe un resultado de este indicador en esa fecha.')
+        return fecha
+
 
 class ResultadoVariableForm(forms.Form):
     variable_indicador = forms.CharField(widget=forms.HiddenInput(), required=False)
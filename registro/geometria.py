@@ -0,0 +1,461 @@
+"""
+Geometrías del mapa de acciones.
+
+Construye, a partir de los GeoJSON de static/data, topologías TopoJSON simplificadas para varios
+niveles de zoom (Douglas–Peucker sobre arcos compartidos, de modo que las fronteras entre
+territorios vecinos se simplifican igual) y lee el manifiesto que genera el comando
+construir_geometrias.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:  # La variante .br es opcional
+    brotli = None
+
+# (zoom mínimo, tolerancia de simplificación en grados, cuantización)
+NIVELES = (
+    (0, 0.01, 10000),
+    (8, 0.0025, 20000),
+    (10, 0.0006, 100000),
+)
+
+PROPIEDADES = {
+    'provincias': ('province', 'DPA_province_code'),
+    'municipios': ('municipality', 'province', 'DPA_municipality_code', 'DPA_province_code'),
+}
+
+
+def directorio_fuente():
+    return getattr(settings, 'GEOMETRIAS_FUENTE', os.path.join(settings.BASE_DIR, 'static', 'data'))
+
+
+def directorio_salida():
+    return getattr(settings, 'GEOMETRIAS_DIR', os.path.join(settings.BASE_DIR, 'staticfiles_build', 'geometrias'))
+
+
+# ============================================================================
+# Lectura de las geometrías originales
+# ============================================================================
+
+def leer_capa(tipo, hc_keys=None):
+    """
+    Lee las features de static/data/<tipo>/*.geojson conservando solo las propiedades útiles para
+    el mapa y añadiendo hc_key (el nombre del archivo, igual a Provincia.hc_keys en minúsculas).
+    Los archivos originales traen cada islote como una feature aparte; aquí se unen en un
+    MultiPolygon por código DPA. cuba.geojson repite todas las provincias y se omite.
+    """
+    carpeta = os.path.join(directorio_fuente(), tipo)
+    codigo = PROPIEDADES[tipo][-1] if tipo == 'provincias' else 'DPA_municipality_code'
+    features = {}
+    for nombre in sorted(os.listdir(carpeta)):
+        hc_key, extension = os.path.splitext(nombre)
+        if extension != '.geojson' or hc_key == 'cuba' or (hc_keys and hc_key not in hc_keys):
+            continue
+        with open(os.path.join(carpeta, nombre), encoding='utf-8') as archivo:
+            datos = json.load(archivo)
+        for feature in datos['features']:
+            clave = (hc_key, feature['properties'].get(codigo))
+            if clave not in features:
+                propiedades = {k: feature['properties'].get(k) for k in PROPIEDADES[tipo]}
+                propiedades['hc_key'] = hc_key
+                features[clave] = {'type': 'Feature', 'properties': propiedades,
+                                   'geometry': {'type': 'MultiPolygon', 'coordinates': []}}
+            features[clave]['geometry']['coordinates'].extend(poligonos(feature['geometry']))
+    return list(features.values())
+
+
+def poligonos(geometria):
+    """Lista de polígonos (listas de anillos) de una geometría Polygon o MultiPolygon"""
+    if geometria['type'] == 'Polygon':
+        return [geometria['coordinates']]
+    if geometria['type'] == 'MultiPolygon':
+        return geometria['coordinates']
+    return []
+
+
+# ============================================================================
+# Simplificación
+# ============================================================================
+
+def douglas_peucker(puntos, tolerancia):
+    """Simplifica una polilínea conservando sus extremos (versión iterativa)"""
+    if len(puntos) < 3:
+        return list(puntos)
+
+    tolerancia2 = tolerancia * tolerancia
+    conservar = [False] * len(puntos)
+    conservar[0] = conservar[-1] = True
+    pendientes = [(0, len(puntos) - 1)]
+
+    while pendientes:
+        inicio, fin = pendientes.pop()
+        ax, ay = puntos[inicio]
+        bx, by = puntos[fin]
+        dx, dy = bx - ax, by - ay
+        largo2 = dx * dx + dy * dy
+
+        maxima, indice = -1.0, None
+        for i in range(inicio + 1, fin):
+            px, py = puntos[i]
+            if largo2 == 0:
+                distancia2 = (px - ax) ** 2 + (py - ay) ** 2
+            else:
+                t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / largo2))
+                distancia2 = (px - ax - t * dx) ** 2 + (py - ay - t * dy) ** 2
+            if distancia2 > maxima:
+                maxima, indice = distancia2, i
+
+        if indice is not None and maxima > tolerancia2:
+            conservar[indice] = True
+            pendientes.append((inicio, indice))
+            pendientes.append((indice, fin))
+
+    return [p for p, c in zip(puntos, conservar) if c]
+
+
+def simplificar_arco(arco, tolerancia):
+    """
+    Simplifica un arco. Un arco cerrado (anillo sin uniones) se parte en su punto más lejano al
+    inicio para que el resultado siga siendo un anillo de al menos tres vértices.
+    """
+    if len(arco) > 3 and arco[0] == arco[-1]:
+        x0, y0 = arco[0]
+        lejano = max(range(1, len(arco) - 1), key=lambda i: (arco[i][0] - x0) ** 2 + (arco[i][1] - y0) ** 2)
+        primero = douglas_peucker(arco[:lejano + 1], tolerancia)
+        segundo = douglas_peucker(arco[lejano:], tolerancia)
+        resultado = primero + segundo[1:]
+        if len(resultado) < 4:
+            # Se conserva al menos un triángulo
+            medio = lejano // 2 if lejano > 1 else (lejano + len(arco) - 1) // 2
+            resultado = [arco[0]] + [arco[i] for i in sorted((medio, lejano))] + [arco[0]]
+        return resultado
+    return douglas_peucker(arco, tolerancia)
+
+
+# ============================================================================
+# Topología
+# ============================================================================
+
+def _anillos(features):
+    for f, feature in enumerate(features):
+        for p, poligono in enumerate(poligonos(feature['geometry'])):
+            for anillo in poligono:
+                puntos = [tuple(punto[:2]) for punto in anillo]
+                if puntos[0] == puntos[-1]:
+                    puntos = puntos[:-1]
+                # Se eliminan vértices repetidos consecutivos
+                puntos = [q for i, q in enumerate(puntos) if q != puntos[i - 1]] or puntos[:1]
+                yield f, p, puntos
+
+
+def _uniones(anillos):
+    """Vértices en los que un anillo deja de compartir frontera con otro (uniones de la topología)"""
+    vecinos = {}
+    uniones = set()
+    for _, _, puntos in anillos:
+        n = len(puntos)
+        for i, punto in enumerate(puntos):
+            par = (puntos[i - 1], puntos[(i + 1) % n])
+            anterior = vecinos.setdefault(punto, par)
+            if anterior != par and anterior != par[::-1]:
+                uniones.add(punto)
+    return uniones
+
+
+def _clave_cerrada(arco):
+    """Clave canónica de un anillo sin uniones, independiente del punto de inicio y del sentido"""
+    abierto = arco[:-1]
+    i = abierto.index(min(abierto))
+    return tuple(abierto[i:] + abierto[:i])
+
+
+def construir_topologia(features):
+    """
+    Divide los anillos de las features en arcos entre uniones y elimina los arcos repetidos, de
+    modo que cada frontera compartida se guarda (y se simplifica) una sola vez.
+    Devuelve (arcos, geometrias) donde cada geometría es una lista de polígonos expresados como
+    listas de anillos de índices de arco (~i indica el arco i recorrido al revés).
+    """
+    anillos = list(_anillos(features))
+    uniones = _uniones(anillos)
+
+    arcos = []
+    indices = {}
+    geometrias = [[] for _ in features]
+
+    def registrar(arco):
+        if arco[0] == arco[-1] and not any(p in uniones for p in arco[:-1]):
+            clave = _clave_cerrada(arco)
+            if clave in indices:
+                return indices[clave]
+            inverso = _clave_cerrada(arco[::-1])
+            if inverso in indices:
+                return ~indices[inverso]
+            indices[clave] = len(arcos)
+            arcos.append(list(clave) + [clave[0]])
+            return indices[clave]
+
+        clave = tuple(arco)
+        if clave in indices:
+            return indices[clave]
+        if clave[::-1] in indices:
+            return ~indices[clave[::-1]]
+        indices[clave] = len(arcos)
+        arcos.append(arco)
+        return indices[clave]
+
+    ultimo = None
+    for f, p, puntos in anillos:
+        if len(puntos) < 3:
+            continue
+        if (f, p) != ultimo:
+            geometrias[f].append([])
+            ultimo = (f, p)
+
+        cortes = [i for i, punto in enumerate(puntos) if punto in uniones]
+        if not cortes:
+            referencias = [registrar(puntos + puntos[:1])]
+        else:
+            rotado = puntos[cortes[0]:] + puntos[:cortes[0]]
+            rotado.append(rotado[0])
+            referencias = []
+            inicio = 0
+            for i in range(1, len(rotado)):
+                if rotado[i] in uniones or i == len(rotado) - 1:
+                    referencias.append(registrar(rotado[inicio:i + 1]))
+                    inicio = i
+        geometrias[f][-1].append(referencias)
+
+    return arcos, geometrias
+
+
+def _cuantizar(arcos, cuantizacion):
+    """Cuantiza y codifica por diferencias los arcos; devuelve (arcos, transform, bbox)"""
+    xs = [x for arco in arcos for x, _ in arco]
+    ys = [y for arco in arcos for _, y in arco]
+    x0, y0, x1, y1 = min(xs), min(ys), max(xs), max(ys)
+    kx = (x1 - x0) / (cuantizacion - 1) or 1
+    ky = (y1 - y0) / (cuantizacion - 1) or 1
+
+    codificados = []
+    for arco in arcos:
+        enteros = []
+        for x, y in arco:
+            punto = (round((x - x0) / kx), round((y - y0) / ky))
+            if not enteros or punto != enteros[-1]:
+                enteros.append(punto)
+        if len(enteros) == 1:
+            enteros.append(enteros[0])
+        anterior = (0, 0)
+        delta = []
+        for punto in enteros:
+            delta.append([punto[0] - anterior[0], punto[1] - anterior[1]])
+            anterior = punto
+        codificados.append(delta)
+
+    return codificados, {'scale': [kx, ky], 'translate': [x0, y0]}, [x0, y0, x1, y1]
+
+
+def _descartar_pequenos(arcos, geometrias, extension_minima):
+    """
+    Quita los polígonos y huecos cuya extensión es menor que `extension_minima` (cayos e islotes
+    invisibles a ese nivel de zoom). Se conserva siempre el polígono mayor de cada feature.
+    """
+    cajas = []
+    for arco in arcos:
+        xs = [x for x, _ in arco]
+        ys = [y for _, y in arco]
+        cajas.append((min(xs), min(ys), max(xs), max(ys)))
+
+    def extension(anillo):
+        caja = [cajas[i if i >= 0 else ~i] for i in anillo]
+        return max(max(c[2] for c in caja) - min(c[0] for c in caja),
+                   max(c[3] for c in caja) - min(c[1] for c in caja))
+
+    resultado = []
+    for poligonos_arcos in geometrias:
+        if not poligonos_arcos:
+            resultado.append(poligonos_arcos)
+            continue
+        extensiones = [extension(poligono[0]) for poligono in poligonos_arcos]
+        mayor = extensiones.index(max(extensiones))
+        resultado.append([
+            [poligono[0]] + [hueco for hueco in poligono[1:] if extension(hueco) >= extension_minima]
+            for i, poligono in enumerate(poligonos_arcos)
+            if i == mayor or extensiones[i] >= extension_minima
+        ])
+    return resultado
+
+
+def topojson(features, nombre_objeto, tolerancia, cuantizacion, arcos=None, geometrias=None):
+    """Serializa las features como TopoJSON simplificado con la tolerancia y cuantización dadas"""
+    if arcos is None:
+        arcos, geometrias = construir_topologia(features)
+
+    geometrias = _descartar_pequenos(arcos, geometrias, tolerancia * 2)
+    usados = sorted({i if i >= 0 else ~i for g in geometrias for poligono in g for anillo in poligono for i in anillo})
+    nuevo_indice = {viejo: nuevo for nuevo, viejo in enumerate(usados)}
+    geometrias = [
+        [[[nuevo_indice[i] if i >= 0 else ~nuevo_indice[~i] for i in anillo] for anillo in poligono]
+         for poligono in g]
+        for g in geometrias
+    ]
+
+    simplificados = [simplificar_arco(arcos[i], tolerancia) for i in usados]
+    codificados, transform, bbox = _cuantizar(simplificados, cuantizacion)
+
+    objetos = []
+    for feature, poligonos_arcos in zip(features, geometrias):
+        if len(poligonos_arcos) == 1:
+            geometria = {'type': 'Polygon', 'arcs': poligonos_arcos[0]}
+        else:
+            geometria = {'type': 'MultiPolygon', 'arcs': poligonos_arcos}
+        geometria['properties'] = feature['properties']
+        objetos.append(geometria)
+
+    return {
+        'type': 'Topology',
+        'bbox': bbox,
+        'transform': transform,
+        'objects': {nombre_objeto: {'type': 'GeometryCollection', 'geometries': objetos}},
+        'arcs': codificados,
+    }
+
+
+def geojson_simplificado(features, tolerancia, decimales=5):
+    """
+    Geometrías GeoJSON (MultiPolygon) de las features simplificadas sobre la topología compartida,
+    con las mismas fronteras que el TopoJSON del nivel con esa tolerancia
+    """
+    arcos, geometrias = construir_topologia(features)
+    geometrias = _descartar_pequenos(arcos, geometrias, tolerancia * 2)
+    simplificados = {}
+
+    def arco(i):
+        j = i if i >= 0 else ~i
+        if j not in simplificados:
+            simplificados[j] = [[round(x, decimales), round(y, decimales)]
+                                for x, y in simplificar_arco(arcos[j], tolerancia)]
+        return simplificados[j] if i >= 0 else simplificados[j][::-1]
+
+    resultado = []
+    for poligonos_arcos in geometrias:
+        coordenadas = []
+        for poligono in poligonos_arcos:
+            anillos = []
+            for anillo in poligono:
+                puntos = []
+                for i in anillo:
+                    puntos.extend(arco(i) if not puntos else arco(i)[1:])
+                anillos.append(puntos)
+            coordenadas.append(anillos)
+        resultado.append({'type': 'MultiPolygon', 'coordinates': coordenadas})
+    return resultado
+
+
+def comprimir(datos):
+    """Devuelve {'': datos, 'gzip': ..., 'br': ...}; 'br' solo si está instalado brotli"""
+    variantes = {'': datos, 'gzip': gzip.compress(datos, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variantes['br'] = brotli.compress(datos, quality=11)
+    return variantes
+
+
+def hash_contenido(datos):
+    return hashlib.sha256(datos).hexdigest()[:12]
+
+
+# ============================================================================
+# Manifiesto
+# ============================================================================
+
+_manifiesto = {'mtime': None, 'datos': None}
+
+
+def manifiesto():
+    """Manifiesto de la última construcción; se vuelve a leer solo si el archivo cambió"""
+    ruta = os.path.join(directorio_salida(), 'manifest.json')
+    try:
+        mtime = os.path.getmtime(ruta)
+    except OSError:
+        return None
+    if _manifiesto['mtime'] != mtime:
+        with open(ruta, encoding='utf-8') as archivo:
+            _manifiesto['datos'] = json.load(archivo)
+        _manifiesto['mtime'] = mtime
+    return _manifiesto['datos']
+
+
+def nivel_para_zoom(capa, zoom):
+    """Entrada del manifiesto con el nivel de detalle adecuado para el zoom (o None)"""
+    datos = manifiesto()
+    if not datos or capa not in datos['capas']:
+        return None
+    niveles = datos['capas'][capa]
+    elegido = min(niveles, key=int)
+    for minimo in sorted(niveles, key=int):
+        if zoom >= int(minimo):
+            elegido = minimo
+    return niveles[elegido]
+
+
+# ============================================================================
+# Índice en memoria de features por provincia y municipio
+# ============================================================================
+
+_indices = {}
+_bloqueo_indices = threading.Lock()
+
+
+def normalizar_nombre(nombre):
+    """Nombre en minúsculas, sin tildes ni espacios repetidos, para comparar con la base de datos"""
+    sin_tildes = unicodedata.normalize('NFKD', nombre or '').encode('ascii', 'ignore').decode()
+    return ' '.join(sin_tildes.lower().split())
+
+
+def nivel(zoom):
+    """Nivel de NIVELES que corresponde al zoom"""
+    return max((n for n in NIVELES if zoom >= n[0]), key=lambda n: n[0], default=NIVELES[0])
+
+
+def indice_geometrias(zoom=0):
+    """
+    Índice {'provincias': {hc_key: feature}, 'municipios': {(hc_key, nombre): feature}} con las
+    geometrías simplificadas para el nivel del zoom. Se construye una sola vez por proceso y nivel
+    a partir de los GeoJSON originales, por lo que no depende de construir_geometrias.
+    """
+    minimo, tolerancia, _ = nivel(zoom)
+    with _bloqueo_indices:
+        if minimo not in _indices:
+            claves = {
+                'provincias': lambda p: p['hc_key'],
+                'municipios': lambda p: (p['hc_key'], normalizar_nombre(p['municipality'])),
+            }
+            indice = {}
+            for tipo, clave in claves.items():
+                features = leer_capa(tipo)
+                indice[tipo] = {
+                    clave(feature['properties']): {'type': 'Feature', 'properties': feature['properties'],
+                                                   'geometry': geometria}
+                    for feature, geometria in zip(features, geojson_simplificado(features, tolerancia))
+                }
+            _indices[minimo] = indice
+    return _indices[minimo]
+
+
+def precargar_indices():
+    """
+    Construye el índice de todos los niveles. Lo llaman config/wsgi.py y config/asgi.py al
+    arrancar el servidor (si GEOMETRIAS_PRECARGAR está activo), para que la primera petición
+    del mapa no pague la simplificación; los comandos de gestión no lo construyen.
+    """
+    for minimo, _, _ in NIVELES:
+        indice_geometrias(minimo)
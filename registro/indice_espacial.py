@@ -0,0 +1,137 @@
+"""
+Índice espacial en memoria sobre los límites de provincias y municipios de static/data.
+
+Una rejilla regular sobre las cajas envolventes de las features reduce cada punto a unas pocas
+candidatas; la prueba de punto en polígono (regla par-impar por cruce de rayos) se hace en NumPy
+para todos los puntos de una misma candidata a la vez. No requiere ningún servicio SIG externo.
+"""
+import threading
+
+import numpy as np
+
+from registro import geometria
+
+# Tamaño de celda de la rejilla en grados (~10 km)
+CELDA = 0.1
+# Máximo de pares arista-punto evaluados de una vez
+BLOQUE = 2_000_000
+
+
+class IndiceEspacial:
+    """Índice de un conjunto de features (Polygon/MultiPolygon) para localizar puntos lon/lat"""
+
+    def __init__(self, features, celda=CELDA):
+        self.propiedades = [feature['properties'] for feature in features]
+        self.celda = celda
+
+        aristas = []
+        limites = [0]
+        cajas = []
+        for feature in features:
+            anillos = [np.asarray(anillo, dtype=float)[:, :2]
+                       for poligono in geometria.poligonos(feature['geometry']) for anillo in poligono]
+            anillos = [np.vstack([a, a[:1]]) if (a[0] != a[-1]).any() else a for a in anillos if len(a) >= 3]
+            if anillos:
+                puntos = np.vstack(anillos)
+                aristas.extend(np.hstack([a[:-1], a[1:]]) for a in anillos)
+                cajas.append((*puntos.min(axis=0), *puntos.max(axis=0)))
+            else:
+                cajas.append((np.inf, np.inf, -np.inf, -np.inf))
+            limites.append(limites[-1] + sum(len(a) - 1 for a in anillos))
+
+        # Aristas (x1, y1, x2, y2) de todas las features, contiguas por feature
+        self.aristas = np.vstack(aristas) if aristas else np.empty((0, 4))
+        self.limites = np.asarray(limites)
+        self.cajas = np.asarray(cajas, dtype=float)
+
+        validas = np.isfinite(self.cajas).all(axis=1)
+        self.origen = self.cajas[validas, :2].min(axis=0) if validas.any() else np.zeros(2)
+        extremo = self.cajas[validas, 2:].max(axis=0) if validas.any() else np.zeros(2)
+        self.dimensiones = np.floor((extremo - self.origen) / celda).astype(int) + 1
+
+        # Rejilla: celda -> features cuya caja la toca
+        celdas = {}
+        for i in np.flatnonzero(validas):
+            (x0, y0), (x1, y1) = self._celda(self.cajas[i, :2]), self._celda(self.cajas[i, 2:])
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    celdas.setdefault(cx * self.dimensiones[1] + cy, []).append(i)
+        self.celdas = {clave: np.asarray(ids) for clave, ids in celdas.items()}
+
+    def _celda(self, punto):
+        return tuple(np.floor((np.asarray(punto) - self.origen) / self.celda).astype(int))
+
+    def _contiene(self, feature, x, y):
+        """Máscara de los puntos (x, y) que caen dentro de la feature"""
+        aristas = self.aristas[self.limites[feature]:self.limites[feature + 1]]
+        x1, y1, x2, y2 = (aristas[:, i:i + 1] for i in range(4))
+        dentro = np.zeros(len(x), dtype=bool)
+        paso = max(1, BLOQUE // max(len(aristas), 1))
+        for inicio in range(0, len(x), paso):
+            px, py = x[inicio:inicio + paso], y[inicio:inicio + paso]
+            cruza = (y1 > py) != (y2 > py)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                corte = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+            dentro[inicio:inicio + paso] = np.count_nonzero(cruza & (px < corte), axis=0) % 2 == 1
+        return dentro
+
+    def localizar(self, lon, lat):
+        """
+        Índice de la feature que contiene cada punto, o -1 si no cae en ninguna. Acepta escalares
+        o arrays de longitudes y latitudes.
+        """
+        x = np.atleast_1d(np.asarray(lon, dtype=float))
+        y = np.atleast_1d(np.asarray(lat, dtype=float))
+        resultado = np.full(len(x), -1, dtype=np.int64)
+
+        celdas = np.floor((np.column_stack([x, y]) - self.origen) / self.celda).astype(np.int64)
+        en_rejilla = ((celdas >= 0) & (celdas < self.dimensiones)).all(axis=1) & np.isfinite(x) & np.isfinite(y)
+        puntos = np.flatnonzero(en_rejilla)
+        if not len(puntos):
+            return resultado
+        claves = celdas[puntos, 0] * self.dimensiones[1] + celdas[puntos, 1]
+
+        # Pares (punto, feature candidata) agrupados por feature
+        pares_puntos, pares_features = [], []
+        unicas, inversa = np.unique(claves, return_inverse=True)
+        orden = np.argsort(inversa, kind='stable')
+        cortes = np.searchsorted(inversa[orden], np.arange(len(unicas) + 1))
+        for k, clave in enumerate(unicas):
+            candidatas = self.celdas.get(int(clave))
+            if candidatas is None:
+                continue
+            en_celda = puntos[orden[cortes[k]:cortes[k + 1]]]
+            pares_puntos.append(np.repeat(en_celda, len(candidatas)))
+            pares_features.append(np.tile(candidatas, len(en_celda)))
+        if not pares_puntos:
+            return resultado
+        pares_puntos = np.concatenate(pares_puntos)
+        pares_features = np.concatenate(pares_features)
+
+        caja = self.cajas[pares_features]
+        px, py = x[pares_puntos], y[pares_puntos]
+        en_caja = (px >= caja[:, 0]) & (px <= caja[:, 2]) & (py >= caja[:, 1]) & (py <= caja[:, 3])
+        pares_puntos, pares_features = pares_puntos[en_caja], pares_features[en_caja]
+
+        orden = np.argsort(pares_features, kind='stable')
+        pares_puntos, pares_features = pares_puntos[orden], pares_features[orden]
+        features, inicios = np.unique(pares_features, return_index=True)
+        for feature, inicio, fin in zip(features, inicios, np.append(inicios[1:], len(pares_features))):
+            candidatos = pares_puntos[inicio:fin]
+            candidatos = candidatos[resultado[candidatos] < 0]
+            if len(candidatos):
+                dentro = self._contiene(feature, x[candidatos], y[candidatos])
+                resultado[candidatos[dentro]] = feature
+        return resultado
+
+
+_indices = {}
+_bloqueo = threading.Lock()
+
+
+def indice(tipo):
+    """Índice de 'provincias' o 'municipios' a resolución completa; se construye una vez por proceso"""
+    with _bloqueo:
+        if tipo not in _indices:
+            _indices[tipo] = IndiceEspacial(geometria.leer_capa(tipo))
+    return _indices[tipo]
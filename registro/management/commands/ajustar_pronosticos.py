@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from registro.Services import PronosticoService
+
+
+class Command(BaseCommand):
+    help = ('Ajusta el modelo de pronóstico de los indicadores cuyos resultados cambiaron desde el '
+            'último ajuste y lo guarda en la caché de pronósticos')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forzar', action='store_true', help='Reajusta todos los indicadores')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        totales = PronosticoService.ajustar_todos(forzar=options['forzar'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{totales["ajustados"]} indicadores ajustados, {totales["vigentes"]} vigentes y '
+            f'{totales["insuficientes"]} con menos de 3 resultados en {time.perf_counter() - inicio:.2f} s'
+        ))
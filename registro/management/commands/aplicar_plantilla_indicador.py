@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from registro.models import Accion, Indicador
+from registro.Services import PlantillaIndicadorService
+
+
+class Command(BaseCommand):
+    help = ('Copia un indicador (campos, variables y ODS relacionados) a varias acciones. Las acciones '
+            'que ya tienen un indicador con el mismo nombre se omiten')
+
+    def add_arguments(self, parser):
+        parser.add_argument('indicador', type=int, help='Id del indicador que sirve de plantilla')
+        destino = parser.add_mutually_exclusive_group(required=True)
+        destino.add_argument('--acciones', type=int, nargs='+', help='Ids de las acciones')
+        destino.add_argument('--todas', action='store_true', help='Todas las acciones')
+
+    def handle(self, *args, **options):
+        plantilla = Indicador.objects.select_related('tipo_indicador').filter(id=options['indicador']).first()
+        if plantilla is None:
+            raise CommandError(f'No existe el indicador {options["indicador"]}')
+        accion_ids = options['acciones'] or list(Accion.objects.values_list('id', flat=True))
+
+        copias = PlantillaIndicadorService.aplicar_a_acciones(plantilla, accion_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(copias)} indicadores creados; {len(accion_ids) - len(copias)} acciones omitidas'
+        ))
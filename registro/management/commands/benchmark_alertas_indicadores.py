@@ -0,0 +1,78 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from nomencladores.models import TipoAccion, Sector, TipoIndicador, UnidadMedidaIndicador
+from registro.models import Accion, Indicador, ResultadoIndicador
+from registro.notificacions import IndicadorAlertService, NotificationService
+
+
+class Command(BaseCommand):
+    help = ('Mide el tiempo y el número de consultas de las alertas de indicadores sobre datos '
+            'sintéticos. Los datos se crean dentro de una transacción que se revierte al terminar')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--indicadores', type=int, default=50000)
+        parser.add_argument('--resultados', type=int, default=3, help='Resultados por indicador')
+        parser.add_argument('--indicadores-por-accion', type=int, default=10)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._crear_datos(options['indicadores'], options['resultados'], options['indicadores_por_accion'])
+
+            servicio = IndicadorAlertService(NotificationService())
+            for nombre in ('check_indicadores_sin_medicion', 'check_metas_en_riesgo',
+                           'check_tendencias_negativas'):
+                with CaptureQueriesContext(connection) as consultas:
+                    inicio = time.perf_counter()
+                    alertas = getattr(servicio, nombre)()
+                    duracion = time.perf_counter() - inicio
+                self.stdout.write(f'{nombre}: {duracion:.2f} s, {len(consultas)} consultas, '
+                                  f'{len(alertas)} alertas')
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS('Datos sintéticos revertidos'))
+
+    def _crear_datos(self, n_indicadores, n_resultados, por_accion):
+        random.seed(0)
+        hoy = timezone.now().date()
+        user = User.objects.create(username='benchmark_alertas')
+        tipo_accion = TipoAccion.objects.create(nombre='Benchmark')
+        sector = Sector.objects.create(nombre='Benchmark')
+        tipo_indicador = TipoIndicador.objects.create(nombre='Benchmark')
+        unidad = UnidadMedidaIndicador.objects.create(nombre='Benchmark', sigla='b')
+
+        acciones = Accion.objects.bulk_create([
+            Accion(user=user, tipo_accion=tipo_accion, sector=sector, nombre=f'Acción {i}', publicado=True,
+                   fecha_inicio=hoy - timedelta(days=random.randint(30, 720)))
+            for i in range(max(n_indicadores // por_accion, 1))
+        ])
+        indicadores = Indicador.objects.bulk_create([
+            Indicador(nombre=f'Indicador {i}', tipo_indicador=tipo_indicador, unidad_medida=unidad, formula='x',
+                      direccion_optima=random.choice(['incremento', 'decremento']),
+                      valor_baseline=100, meta_valor=random.choice([50, 150]),
+                      meta_fecha_limite=hoy + timedelta(days=random.randint(-60, 60)))
+            for i in range(n_indicadores)
+        ])
+
+        resultados = ResultadoIndicador.objects.bulk_create([
+            ResultadoIndicador(indicador=indicador, valor=random.uniform(0, 200),
+                               fecha=hoy - timedelta(days=90 * j + random.randint(0, 60)))
+            for indicador in indicadores
+            for j in range(n_resultados)
+        ], batch_size=5000)
+        Accion.indicadores.through.objects.bulk_create([
+            Accion.indicadores.through(accion_id=acciones[i // por_accion % len(acciones)].id,
+                                       indicador_id=indicador.id)
+            for i, indicador in enumerate(indicadores)
+        ], batch_size=5000)
+
+        self.stdout.write(f'Creados {len(indicadores)} indicadores, {len(resultados)} resultados, '
+                          f'{len(acciones)} acciones')
@@ -0,0 +1,96 @@
+import time
+from datetime import date, timedelta
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from nomencladores.models import TipoIndicador, UnidadMedidaIndicador
+from registro import anomalias
+from registro.models import Indicador, ResultadoIndicador, AnomaliaResultado
+from registro.Services import AnomaliaService
+
+
+class Command(BaseCommand):
+    help = ('Mide el detector de anomalías sobre series sintéticas (tendencia, estacionalidad y ruido) '
+            'con errores inyectados: valores x1000, ceros e infinitos. Informa del rendimiento, la '
+            'sensibilidad y los falsos positivos. Con --bd repite la revisión completa sobre la base '
+            'de datos dentro de una transacción que se revierte')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--resultados', type=int, default=2_000_000)
+        parser.add_argument('--por-indicador', type=int, default=48)
+        parser.add_argument('--errores', type=float, default=0.001, help='Fracción de resultados alterados')
+        parser.add_argument('--bd', type=int, default=0, help='Resultados a insertar para medir la revisión en la BD')
+
+    def handle(self, *args, **options):
+        grupos, valores, periodos, alterados = self._series(options['resultados'], options['por_indicador'],
+                                                            options['errores'])
+        inicio = time.perf_counter()
+        deteccion = anomalias.detectar(grupos, valores, periodos)
+        duracion = time.perf_counter() - inicio
+        marcadas = deteccion['marcada']
+        self.stdout.write(
+            f'{len(valores):,} resultados en {duracion:.2f} s ({len(valores) / duracion:,.0f}/s); '
+            f'sensibilidad {np.count_nonzero(marcadas & alterados) / max(np.count_nonzero(alterados), 1):.1%}, '
+            f'falsos positivos {np.count_nonzero(marcadas & ~alterados) / np.count_nonzero(~alterados):.2%}'
+        )
+
+        if options['bd']:
+            self._medir_bd(options['bd'], options['por_indicador'], options['errores'])
+
+    @staticmethod
+    def _series(n, por_indicador, errores, semilla=0):
+        rng = np.random.default_rng(semilla)
+        n_indicadores = max(1, n // por_indicador)
+        grupos = np.repeat(np.arange(n_indicadores), por_indicador)
+        t = np.tile(np.arange(por_indicador), n_indicadores)
+        nivel = rng.uniform(10, 1000, n_indicadores)[grupos]
+        pendiente = rng.normal(0, 0.01, n_indicadores)[grupos] * nivel
+        # La mitad de los indicadores son mensuales con estacionalidad anual
+        estacional = grupos % 2 == 0
+        valores = (nivel + pendiente * t
+                   + estacional * 0.1 * nivel * np.sin(2 * np.pi * t / 12)
+                   + rng.normal(0, 0.02, len(t)) * nivel)
+
+        alterados = np.zeros(len(valores), dtype=bool)
+        indices = rng.choice(len(valores), int(len(valores) * errores), replace=False)
+        alterados[indices] = True
+        tercio = len(indices) // 3
+        valores[indices[:tercio]] *= 1000
+        valores[indices[tercio:2 * tercio]] = 0
+        valores[indices[2 * tercio:]] = np.inf
+        periodos = {i: 12 for i in range(0, n_indicadores, 2)}
+        return grupos, valores, periodos, alterados
+
+    def _medir_bd(self, n, por_indicador, errores):
+        grupos, valores, _, _ = self._series(n, por_indicador, errores, semilla=1)
+        with transaction.atomic():
+            tipo_indicador = TipoIndicador.objects.create(nombre='Benchmark anomalías')
+            unidad = UnidadMedidaIndicador.objects.create(nombre='Benchmark anomalías', sigla='b')
+            indicadores = Indicador.objects.bulk_create([
+                Indicador(nombre=f'Indicador {i}', tipo_indicador=tipo_indicador, unidad_medida=unidad, formula='x')
+                for i in range(grupos[-1] + 1)
+            ])
+            hoy = date.today()
+            ResultadoIndicador.objects.bulk_create([
+                ResultadoIndicador(indicador=indicadores[g], valor=float(v),
+                                   fecha=hoy - timedelta(days=30 * (por_indicador - k % por_indicador)))
+                for k, (g, v) in enumerate(zip(grupos.tolist(), valores.tolist()))
+            ], batch_size=5000)
+
+            inicio = time.perf_counter()
+            totales = AnomaliaService.revisar_todos()
+            duracion = time.perf_counter() - inicio
+            self.stdout.write(
+                f'Revisión en la BD: {totales["resultados"]:,} resultados y '
+                f'{AnomaliaResultado.objects.count():,} anomalías guardadas en {duracion:.2f} s'
+            )
+
+            indicador = indicadores[0]
+            inicio = time.perf_counter()
+            for _ in range(20):
+                AnomaliaService.revisar_indicador(indicador.id)
+            self.stdout.write(f'Revisión de un indicador: {(time.perf_counter() - inicio) / 20 * 1000:.1f} ms')
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Datos sintéticos revertidos'))
@@ -0,0 +1,115 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Se ejecuta en un proceso nuevo para medir el arranque sin los módulos ya cargados por manage.py
+PRIMERA_RESPUESTA = '''
+import json, time
+inicio = time.perf_counter()
+import django
+django.setup()
+configurado = time.perf_counter()
+from django.urls import get_resolver
+get_resolver().url_patterns
+rutas = time.perf_counter()
+from django.test import Client
+respuesta = Client().get({url!r})
+fin = time.perf_counter()
+print(json.dumps({{
+    'setup_ms': (configurado - inicio) * 1000,
+    'urls_ms': (rutas - configurado) * 1000,
+    'primera_respuesta_ms': (fin - rutas) * 1000,
+    'status': respuesta.status_code,
+}}))
+'''
+
+IMPORTTIME = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)')
+
+
+class Command(BaseCommand):
+    help = ('Mide el arranque del proyecto en un proceso nuevo: tiempo de importación por módulo '
+            '(python -X importtime) y tiempo hasta la primera respuesta. Con --json escribe el '
+            'resultado en formato JSON para seguirlo en CI')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='/accounts/login/', help='URL de la primera petición')
+        parser.add_argument('--repeticiones', type=int, default=3)
+        parser.add_argument('--top', type=int, default=15, help='Módulos más lentos a mostrar')
+        parser.add_argument('--json', action='store_true')
+        parser.add_argument('--max-ms', type=float, help='Falla si la mediana hasta la primera respuesta lo supera')
+
+    def handle(self, *args, **options):
+        modulos = self._importtime()
+        corridas = [self._primera_respuesta(options['url']) for _ in range(options['repeticiones'])]
+        mediana = sorted(corridas, key=lambda c: c['total_ms'])[len(corridas) // 2]
+
+        resultado = {
+            'importacion_total_ms': round(sum(m['propio_ms'] for m in modulos), 1),
+            'modulos_lentos': sorted(
+                (m for m in modulos if m['nivel'] == 0), key=lambda m: m['acumulado_ms'], reverse=True
+            )[:options['top']],
+            'modulos_pesados': {
+                nombre: next((m['acumulado_ms'] for m in modulos if m['modulo'] == nombre), None)
+                for nombre in ('numpy', 'sympy', 'google.generativeai', 'PIL', 'pypdf')
+            },
+            'mediana': mediana,
+            'corridas': corridas,
+        }
+
+        if options['json']:
+            self.stdout.write(json.dumps(resultado, indent=2))
+        else:
+            self.stdout.write(f'Importación: {resultado["importacion_total_ms"]:.0f} ms en total')
+            for m in resultado['modulos_lentos']:
+                self.stdout.write(f'  {m["acumulado_ms"]:8.1f} ms  {m["modulo"]}')
+            for nombre, ms in resultado['modulos_pesados'].items():
+                self.stdout.write(f'  {nombre}: {"no se importa al arrancar" if ms is None else f"{ms:.1f} ms"}')
+            self.stdout.write(
+                f'Primera respuesta (mediana de {len(corridas)}): {mediana["total_ms"]:.0f} ms de proceso, '
+                f'{mediana["setup_ms"]:.0f} ms django.setup, {mediana["urls_ms"]:.0f} ms urls, '
+                f'{mediana["primera_respuesta_ms"]:.0f} ms petición (HTTP {mediana["status"]})'
+            )
+
+        if options['max_ms'] and mediana['total_ms'] > options['max_ms']:
+            raise CommandError(f'El arranque ({mediana["total_ms"]:.0f} ms) supera {options["max_ms"]:.0f} ms')
+
+    @staticmethod
+    def _importtime():
+        """Módulos importados al cargar settings y urls con su tiempo propio y acumulado"""
+        proceso = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import django; django.setup(); import config.urls'],
+            capture_output=True, text=True, env=os.environ.copy(),
+        )
+        if proceso.returncode:
+            raise CommandError(proceso.stderr[-2000:])
+        modulos = []
+        for linea in proceso.stderr.splitlines():
+            coincidencia = IMPORTTIME.match(linea)
+            if coincidencia:
+                propio, acumulado, sangria, modulo = coincidencia.groups()
+                modulos.append({
+                    'modulo': modulo,
+                    'propio_ms': int(propio) / 1000,
+                    'acumulado_ms': int(acumulado) / 1000,
+                    'nivel': (len(sangria) - 1) // 2,
+                })
+        return modulos
+
+    @staticmethod
+    def _primera_respuesta(url):
+        inicio = time.perf_counter()
+        proceso = subprocess.run(
+            [sys.executable, '-c', PRIMERA_RESPUESTA.format(url=url)],
+            capture_output=True, text=True, env=os.environ.copy(),
+        )
+        total = (time.perf_counter() - inicio) * 1000
+        if proceso.returncode:
+            raise CommandError(proceso.stderr[-2000:])
+        medida = json.loads(proceso.stdout.strip().splitlines()[-1])
+        medida['total_ms'] = total
+        return {k: round(v, 1) if isinstance(v, float) else v for k, v in medida.items()}
@@ -0,0 +1,78 @@
+import statistics
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from registro import busqueda
+from registro.models import DocumentoBusqueda
+
+PALABRAS = ('reducción emisiones gases efecto invernadero energía renovable solar eólica biomasa '
+            'reforestación manglares costa erosión sequía agua riego agricultura ganadería metano '
+            'eficiencia alumbrado transporte eléctrico residuos compostaje vertedero adaptación '
+            'resiliencia comunidad vivienda huracán inundación salinización suelo bosque carbono '
+            'captura monitoreo capacitación municipio provincia cooperativa turismo playa arrecife').split()
+CONSULTAS = ('energía solar', 'emisiones metano', 'manglares costa', 'riego', 'reducción de emisiones',
+             'eolica', 'residuos compostaje municipio', 'inundacion', 'arrecife turismo', 'carbono')
+
+
+class Command(BaseCommand):
+    help = ('Mide la latencia de la búsqueda de texto completo sobre documentos sintéticos. Los datos '
+            'se crean dentro de una transacción que se revierte al terminar')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documentos', type=int, default=100_000)
+        parser.add_argument('--repeticiones', type=int, default=20)
+
+    def handle(self, *args, **options):
+        n = options['documentos']
+        titulos, textos = self._textos(n)
+        tipos = list(busqueda.FUENTES)
+        with transaction.atomic():
+            inicio = time.perf_counter()
+            with busqueda.carga_masiva():
+                DocumentoBusqueda.objects.bulk_create([
+                    DocumentoBusqueda(tipo=tipos[i % len(tipos)], objeto_id=i, id_accion=i, titulo=titulo,
+                                      texto=texto, normalizado=busqueda.normalizar(f'{titulo}\n{texto}'))
+                    for i, (titulo, texto) in enumerate(zip(titulos, textos))
+                ], batch_size=1000)
+            self.stdout.write(f'{n:,} documentos indexados en {time.perf_counter() - inicio:.1f} s')
+
+            for consulta in CONSULTAS:
+                tiempos = []
+                for repeticion in range(options['repeticiones']):
+                    inicio = time.perf_counter()
+                    resultado = busqueda.buscar(consulta, pagina=1 + repeticion % 3)
+                    tiempos.append((time.perf_counter() - inicio) * 1000)
+                tiempos.sort()
+                self.stdout.write(
+                    f'{consulta!r}: {resultado["total"]:,} resultados, mediana {statistics.median(tiempos):.1f} ms, '
+                    f'p95 {tiempos[int(len(tiempos) * 0.95) - 1]:.1f} ms'
+                )
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS('Datos sintéticos revertidos'))
+
+    @staticmethod
+    def _textos(n, semilla=0):
+        """
+        Títulos de 5 palabras y textos de 20 a 80 con frecuencias de Zipf sobre un vocabulario de
+        ~30 000 palabras inventadas, con las del dominio repartidas entre los rangos 10 y 500
+        """
+        rng = np.random.default_rng(semilla)
+        silabas = np.array(['ba', 'ca', 'de', 'fi', 'go', 'la', 'me', 'no', 'pa', 'ro', 'sa', 'ti', 'vu', 'cho'])
+        vocabulario = sorted({''.join(s) for s in rng.choice(silabas, size=(40_000, 4))})
+        vocabulario = list(rng.permutation(vocabulario))
+        for i, palabra in enumerate(PALABRAS):
+            vocabulario.insert(10 + i * 10, palabra)
+        vocabulario = np.array(vocabulario)
+        probabilidades = 1 / np.arange(1, len(vocabulario) + 1)
+        probabilidades /= probabilidades.sum()
+
+        largos = rng.integers(20, 81, n)
+        palabras = vocabulario[rng.choice(len(vocabulario), size=5 * n + largos.sum(), p=probabilidades)].tolist()
+        titulos = [' '.join(palabras[5 * i:5 * i + 5]).capitalize() for i in range(n)]
+        cortes = 5 * n + np.concatenate([[0], np.cumsum(largos)])
+        textos = [' '.join(palabras[a:b]) for a, b in zip(cortes[:-1].tolist(), cortes[1:].tolist())]
+        return titulos, textos
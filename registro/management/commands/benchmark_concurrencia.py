@@ -0,0 +1,139 @@
+import itertools
+import random
+import threading
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, transaction, OperationalError
+from django.db.models import Avg, Count
+from django.test.utils import override_settings
+
+from nomencladores.models import TipoIndicador, UnidadMedidaIndicador
+from registro.models import Indicador, ResultadoIndicador
+
+# Perfiles de SQLite comparados: los valores por defecto de SQLite/Django y el de settings
+PERFILES_SQLITE = {
+    'predeterminado': {
+        'pragmas': {'journal_mode': 'DELETE', 'synchronous': 'FULL'},
+        'transaction_mode': None,
+    },
+    'configurado': {
+        'pragmas': settings.SQLITE_PRAGMAS,
+        'transaction_mode': 'IMMEDIATE',
+    },
+}
+
+
+class Command(BaseCommand):
+    help = ('Mide lecturas y escrituras por segundo con N hilos lectores (consultas de panel sobre '
+            'resultados de indicadores) y M hilos escritores (registro de resultados) en cada perfil '
+            'de base de datos. Como los hilos usan conexiones distintas no se puede revertir una '
+            'transacción: los datos sintéticos se eliminan al terminar')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lectores', type=int, default=8)
+        parser.add_argument('--escritores', type=int, default=2)
+        parser.add_argument('--segundos', type=float, default=5)
+        parser.add_argument('--indicadores', type=int, default=200)
+
+    def handle(self, *args, **options):
+        indicador_ids = self._crear_datos(options['indicadores'])
+        # Fechas futuras, distintas en todos los perfiles, para no chocar con la restricción
+        # única (indicador, fecha)
+        self._dias = itertools.count(1)
+        try:
+            if connection.vendor == 'sqlite':
+                perfiles = PERFILES_SQLITE.items()
+            else:
+                perfiles = [(connection.vendor, None)]
+            for nombre, perfil in perfiles:
+                resultado = self._ejecutar(perfil, indicador_ids, options)
+                self.stdout.write(
+                    f'{nombre}: {resultado["lecturas"] / options["segundos"]:,.0f} lecturas/s, '
+                    f'{resultado["escrituras"] / options["segundos"]:,.0f} escrituras/s, '
+                    f'{resultado["bloqueos"]} errores "database is locked", '
+                    f'escritura más lenta {resultado["espera_maxima"] * 1000:.0f} ms'
+                )
+        finally:
+            connections.close_all()
+            Indicador.objects.filter(id__in=indicador_ids).delete()
+            TipoIndicador.objects.filter(nombre='Benchmark concurrencia').delete()
+            UnidadMedidaIndicador.objects.filter(nombre='Benchmark concurrencia').delete()
+        self.stdout.write(self.style.SUCCESS('Datos sintéticos eliminados'))
+
+    def _crear_datos(self, n_indicadores):
+        random.seed(0)
+        hoy = date.today()
+        tipo_indicador = TipoIndicador.objects.create(nombre='Benchmark concurrencia')
+        unidad = UnidadMedidaIndicador.objects.create(nombre='Benchmark concurrencia', sigla='b')
+        indicadores = Indicador.objects.bulk_create([
+            Indicador(nombre=f'Indicador {i}', tipo_indicador=tipo_indicador, unidad_medida=unidad, formula='x')
+            for i in range(n_indicadores)
+        ])
+        ResultadoIndicador.objects.bulk_create([
+            ResultadoIndicador(indicador=indicador, valor=random.uniform(0, 200), fecha=hoy - timedelta(days=7 * j))
+            for indicador in indicadores
+            for j in range(50)
+        ], batch_size=5000)
+        return [i.id for i in indicadores]
+
+    def _ejecutar(self, perfil, indicador_ids, options):
+        connections.close_all()
+        opciones = connections.settings['default'].setdefault('OPTIONS', {})
+        transaction_mode_anterior = opciones.get('transaction_mode')
+        if perfil is not None:
+            opciones['transaction_mode'] = perfil['transaction_mode']
+
+        contadores = {'lecturas': 0, 'escrituras': 0, 'bloqueos': 0, 'espera_maxima': 0.0}
+        cerrojo = threading.Lock()
+        fin = time.monotonic() + options['segundos']
+
+        def lector():
+            try:
+                while time.monotonic() < fin:
+                    ids = random.sample(indicador_ids, min(10, len(indicador_ids)))
+                    list(ResultadoIndicador.objects.filter(indicador_id__in=ids)
+                         .values('indicador_id').annotate(media=Avg('valor'), total=Count('id')))
+                    list(ResultadoIndicador.objects.filter(indicador_id=ids[0])
+                         .order_by('-fecha').values_list('fecha', 'valor')[:10])
+                    with cerrojo:
+                        contadores['lecturas'] += 1
+            finally:
+                connection.close()
+
+        def escritor():
+            try:
+                while time.monotonic() < fin:
+                    with cerrojo:
+                        dia = next(self._dias)
+                    inicio = time.perf_counter()
+                    try:
+                        with transaction.atomic():
+                            ResultadoIndicador.objects.create(
+                                indicador_id=random.choice(indicador_ids), valor=random.uniform(0, 200),
+                                fecha=date.today() + timedelta(days=dia))
+                    except OperationalError:
+                        with cerrojo:
+                            contadores['bloqueos'] += 1
+                        continue
+                    espera = time.perf_counter() - inicio
+                    with cerrojo:
+                        contadores['escrituras'] += 1
+                        contadores['espera_maxima'] = max(contadores['espera_maxima'], espera)
+            finally:
+                connection.close()
+
+        pragmas = perfil['pragmas'] if perfil is not None else settings.SQLITE_PRAGMAS
+        with override_settings(SQLITE_PRAGMAS=pragmas):
+            hilos = ([threading.Thread(target=lector) for _ in range(options['lectores'])] +
+                     [threading.Thread(target=escritor) for _ in range(options['escritores'])])
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+
+        opciones['transaction_mode'] = transaction_mode_anterior
+        connections.close_all()
+        return contadores
@@ -0,0 +1,124 @@
+import io
+import os
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+
+from registro import documentos
+from registro.models import ArchivoDocumento
+
+PALABRAS = ('reducción emisiones gases efecto invernadero energía renovable solar eólica biomasa '
+            'reforestación manglares costa erosión sequía agua riego agricultura ganadería metano '
+            'eficiencia alumbrado transporte eléctrico residuos compostaje vertedero adaptación '
+            'resiliencia comunidad vivienda huracán inundación salinización suelo bosque carbono').split()
+
+DOCX_TIPOS = ('<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+              'content-types"><Override PartName="/word/document.xml" ContentType="application/vnd.'
+              'openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>')
+
+
+class Command(BaseCommand):
+    help = ('Mide la subida con deduplicación y la extracción de texto de documentos sintéticos (texto '
+            'plano, DOCX y PDF) con distinto número de hilos. Los ficheros se escriben en un directorio '
+            'temporal y los datos se crean dentro de una transacción que se revierte')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documentos', type=int, default=1000)
+        parser.add_argument('--duplicados', type=float, default=0.4,
+                            help='Fracción de subidas que repiten el contenido de otra')
+        parser.add_argument('--palabras', type=int, default=3000, help='Palabras por documento')
+        parser.add_argument('--hilos', default='1,2,4,8')
+
+    def handle(self, *args, **options):
+        n = options['documentos']
+        rng = np.random.default_rng(0)
+        distintos = max(1, round(n * (1 - options['duplicados'])))
+        contenidos = [self._fichero(i, rng, options['palabras']) for i in range(distintos)]
+        elegidos = np.concatenate([np.arange(distintos), rng.integers(0, distintos, n - distintos)])
+
+        with tempfile.TemporaryDirectory() as directorio, override_settings(MEDIA_ROOT=directorio), \
+                transaction.atomic():
+            inicio = time.perf_counter()
+            for i in elegidos.tolist():
+                nombre, datos = contenidos[i]
+                documentos.guardar_subida(SimpleUploadedFile(nombre, datos))
+            duracion = time.perf_counter() - inicio
+            en_disco = sum(os.path.getsize(os.path.join(raiz, f))
+                           for raiz, _, ficheros in os.walk(directorio) for f in ficheros)
+            resumen = documentos.estadisticas()
+            self.stdout.write(
+                f'{n:,} subidas en {duracion:.2f} s ({n / duracion:,.0f}/s): {resumen["archivos"]:,} contenidos, '
+                f'{en_disco / 1e6:.1f} MB en disco de {resumen["bytes_documentos"] / 1e6:.1f} MB subidos '
+                f'({resumen["ahorro"]:.1%} de ahorro)'
+            )
+
+            for hilos in map(int, options['hilos'].split(',')):
+                ArchivoDocumento.objects.update(estado_extraccion='pendiente')
+                totales = documentos.procesar(hilos=hilos)
+                por_minuto = 60 / totales['segundos']
+                self.stdout.write(
+                    f'{hilos} hilo(s): {totales["archivos"]:,} contenidos en {totales["segundos"]:.2f} s, '
+                    f'{totales["archivos"] * por_minuto:,.0f} contenidos/min '
+                    f'({n * por_minuto:,.0f} documentos/min indexados), '
+                    f'{totales["bytes"] / 1e6 / totales["segundos"]:.1f} MB/s, '
+                    f'{totales["no_soportados"]} no soportados'
+                )
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Datos sintéticos revertidos'))
+
+    @staticmethod
+    def _texto(rng, palabras):
+        texto = ' '.join(PALABRAS[i] for i in rng.integers(0, len(PALABRAS), palabras))
+        return '\n'.join(texto[i:i + 600] for i in range(0, len(texto), 600))
+
+    def _fichero(self, i, rng, palabras):
+        texto = f'Documento {i}\n' + self._texto(rng, palabras)
+        formato = i % 3
+        if formato == 0:
+            return f'informe_{i}.txt', texto.encode('utf-8')
+        if formato == 1:
+            return f'informe_{i}.docx', self._docx(texto)
+        return f'informe_{i}.pdf', self._pdf(texto)
+
+    @staticmethod
+    def _docx(texto):
+        parrafos = ''.join(f'<w:p><w:r><w:t xml:space="preserve">{linea}</w:t></w:r></w:p>'
+                           for linea in texto.split('\n'))
+        documento = ('<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="http://schemas.openxmlformats.'
+                     f'org/wordprocessingml/2006/main"><w:body>{parrafos}</w:body></w:document>')
+        salida = io.BytesIO()
+        with zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED) as paquete:
+            paquete.writestr('[Content_Types].xml', DOCX_TIPOS)
+            paquete.writestr('word/document.xml', documento)
+        return salida.getvalue()
+
+    @staticmethod
+    def _pdf(texto):
+        """PDF mínimo de una página con el texto en líneas de la fuente Helvetica"""
+        lineas = texto.encode('cp1252', 'replace').replace(b'\\', b'\\\\').replace(b'(', b'\\(') \
+            .replace(b')', b'\\)').split(b'\n')
+        contenido = b'BT /F1 9 Tf 11 TL 40 800 Td ' + b' '.join(b'(%s) Tj T*' % linea for linea in lineas) + b' ET'
+        objetos = [
+            b'<< /Type /Catalog /Pages 2 0 R >>',
+            b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R '
+            b'/Resources << /Font << /F1 5 0 R >> >> >>',
+            b'<< /Length %d >>\nstream\n%s\nendstream' % (len(contenido), contenido),
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+        ]
+        salida = bytearray(b'%PDF-1.4\n')
+        posiciones = []
+        for numero, objeto in enumerate(objetos, 1):
+            posiciones.append(len(salida))
+            salida += b'%d 0 obj\n%s\nendobj\n' % (numero, objeto)
+        xref = len(salida)
+        salida += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objetos) + 1)
+        salida += b''.join(b'%010d 00000 n \n' % p for p in posiciones)
+        salida += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objetos) + 1, xref)
+        return bytes(salida)
@@ -0,0 +1,88 @@
+import json
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from nomencladores.models import TipoIndicador, UnidadMedidaIndicador
+from registro import muestreo
+from registro.Services import ChartDataService
+from registro.models import Indicador, ResultadoIndicador
+from registro.utils import data_chart_line
+
+
+class Command(BaseCommand):
+    help = ('Compara el gráfico de un indicador con una serie larga enviando todos los resultados '
+            '(como antes) y reducida con LTTB, en el gráfico de la página y en el endpoint columnar '
+            'con y sin zoom. Los datos se crean dentro de una transacción que se revierte al terminar')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--resultados', type=int, default=50000, help='Resultados diarios del indicador')
+        parser.add_argument('--puntos', type=int, default=ChartDataService.PUNTOS)
+        parser.add_argument('--repeticiones', type=int, default=5)
+
+    def handle(self, *args, **options):
+        n, puntos = options['resultados'], options['puntos']
+        with transaction.atomic():
+            indicador = self._crear_datos(n)
+            resultados = indicador.resultados.order_by('fecha')
+            hasta = timezone.now().date()
+            desde = hasta - timedelta(days=n // 10)
+
+            casos = [
+                ('Todos los resultados (antes)', lambda: repr(self._completo(resultados, indicador))),
+                (f'Gráfico de la página, LTTB a {puntos}',
+                 lambda: repr(ChartDataService.prepare_chart_data(resultados, indicador, puntos))),
+                (f'Endpoint columnar, LTTB a {puntos} + envolvente',
+                 lambda: json.dumps(ChartDataService.serie(indicador, puntos))),
+                ('Endpoint columnar, zoom al último 10 %',
+                 lambda: json.dumps(ChartDataService.serie(indicador, puntos, desde, hasta))),
+            ]
+            for nombre, generar in casos:
+                inicio = time.perf_counter()
+                for _ in range(options['repeticiones']):
+                    carga = generar()
+                duracion = (time.perf_counter() - inicio) / options['repeticiones'] * 1000
+                self.stdout.write(f'{nombre}: {duracion:,.1f} ms, {len(carga.encode()) / 1024:,.1f} KB')
+
+            x = np.arange(n, dtype=np.float64) * 86_400_000
+            y = np.cumsum(np.random.default_rng(0).normal(size=n))
+            inicio = time.perf_counter()
+            muestreo.reducir(x, y, puntos)
+            self.stdout.write(f'Solo la reducción (LTTB + envolvente) de {n} puntos: '
+                              f'{(time.perf_counter() - inicio) * 1000:.1f} ms')
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS('Datos sintéticos revertidos'))
+
+    @staticmethod
+    def _completo(resultados, indicador):
+        """El gráfico como se construía antes: un punto por resultado"""
+        data_line = {'valores': {'name': 'Valor', 'data': []}, 'labels': []}
+        for re in resultados:
+            data_line['valores']['data'].append(round(re.valor, 2))
+            data_line['labels'].append(re.fecha.strftime("%d-%m-%Y"))
+        return data_chart_line(data_line, indicador)
+
+    def _crear_datos(self, n):
+        hoy = timezone.now().date()
+        tipo_indicador = TipoIndicador.objects.create(nombre='Benchmark')
+        unidad = UnidadMedidaIndicador.objects.create(nombre='Benchmark', sigla='b')
+        indicador = Indicador.objects.create(nombre='Indicador benchmark', tipo_indicador=tipo_indicador,
+                                             unidad_medida=unidad, formula='x')
+        # Paseo aleatorio con estacionalidad y picos, para que la reducción tenga forma que conservar
+        rng = np.random.default_rng(0)
+        dias = np.arange(n)
+        valores = 100 + np.cumsum(rng.normal(0, 1, n)) + 20 * np.sin(dias * 2 * np.pi / 365)
+        picos = rng.choice(n, size=max(n // 1000, 1), replace=False)
+        valores[picos] += rng.normal(0, 60, len(picos))
+        ResultadoIndicador.objects.bulk_create([
+            ResultadoIndicador(indicador=indicador, valor=float(v), fecha=hoy - timedelta(days=n - 1 - i))
+            for i, v in enumerate(valores)
+        ], batch_size=5000)
+        self.stdout.write(f'Creado un indicador con {n} resultados diarios')
+        return indicador
@@ -0,0 +1,85 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from nomencladores.models import TipoAccion, Sector, TipoIndicador, UnidadMedidaIndicador, VariableIndicador
+from registro.models import Accion, Indicador
+from registro.Services import PlantillaIndicadorService
+
+
+class Command(BaseCommand):
+    help = ('Mide las consultas y el tiempo de guardar las variables de un indicador (por elemento, como '
+            'antes, y en bloque) y de aplicar un indicador a muchas acciones. Los datos sintéticos se '
+            'crean dentro de una transacción que se revierte al terminar')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--variables', type=int, default=50)
+        parser.add_argument('--acciones', type=int, default=300)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            indicador, acciones = self._crear_datos(options['acciones'])
+            items = [{'nombre': f'Variable benchmark {i}', 'variable': f'v{i}'}
+                     for i in range(options['variables'])]
+
+            self._medir('Por elemento, alta', lambda: self._por_elemento(items, indicador))
+            items = [{**item, 'variable': f'{item["variable"]}_b'} if i % 5 == 0 else item
+                     for i, item in enumerate(items)]
+            self._medir('Por elemento, edición', lambda: self._por_elemento(items, indicador, limpiar=True))
+
+            indicador.variable_indicador.clear()
+            VariableIndicador.objects.filter(nombre__startswith='Variable benchmark').delete()
+            self._medir('En bloque, alta', lambda: self._en_bloque(items, indicador))
+            items = [{**item, 'variable': f'{item["variable"]}_c'} if i % 5 == 0 else item
+                     for i, item in enumerate(items)]
+            self._medir('En bloque, edición', lambda: self._en_bloque(items, indicador))
+
+            self._medir(f'Aplicar a {len(acciones)} acciones',
+                        lambda: PlantillaIndicadorService.aplicar_a_acciones(indicador, acciones))
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS('Datos sintéticos revertidos'))
+
+    def _medir(self, nombre, funcion):
+        with CaptureQueriesContext(connection) as consultas:
+            inicio = time.perf_counter()
+            funcion()
+            duracion = time.perf_counter() - inicio
+        self.stdout.write(f'{nombre}: {len(consultas)} consultas, {duracion * 1000:.0f} ms')
+
+    @staticmethod
+    def _por_elemento(items, indicador, limpiar=False):
+        """El guardado anterior: get_or_create, save y add por variable"""
+        if limpiar:
+            indicador.variable_indicador.clear()
+        for item in items:
+            variable, creada = VariableIndicador.objects.get_or_create(
+                nombre=item['nombre'], defaults={'variable': item['variable']})
+            if not creada and variable.variable != item['variable']:
+                variable.variable = item['variable']
+                variable.save()
+            indicador.variable_indicador.add(variable)
+
+    @staticmethod
+    def _en_bloque(items, indicador):
+        variables = PlantillaIndicadorService.resolver_variables(items)
+        PlantillaIndicadorService.sincronizar_variables([indicador.id], [v.id for v in variables.values()])
+
+    @staticmethod
+    def _crear_datos(n_acciones):
+        user = User.objects.create(username='benchmark_plantillas')
+        tipo_accion = TipoAccion.objects.create(nombre='Benchmark')
+        sector = Sector.objects.create(nombre='Benchmark')
+        indicador = Indicador.objects.create(
+            nombre='Indicador plantilla benchmark', formula='v0',
+            tipo_indicador=TipoIndicador.objects.create(nombre='Benchmark'),
+            unidad_medida=UnidadMedidaIndicador.objects.create(nombre='Benchmark', sigla='b'),
+        )
+        acciones = Accion.objects.bulk_create([
+            Accion(user=user, tipo_accion=tipo_accion, sector=sector, nombre=f'Acción {i}')
+            for i in range(n_acciones)
+        ])
+        return indicador, [a.id for a in acciones]
@@ -0,0 +1,109 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from nomencladores.models import TipoIndicador, UnidadMedidaIndicador
+from registro.models import Indicador, ResultadoIndicador
+
+TABLA_LEGADA = 'benchmark_indicador_resultados'
+
+
+class Command(BaseCommand):
+    help = ('Compara la lectura de series de resultados por la antigua tabla intermedia '
+            'Indicador.resultados con la lectura por ResultadoIndicador.indicador. Los datos se '
+            'crean dentro de una transacción que se revierte al terminar')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--indicadores', type=int, default=2000)
+        parser.add_argument('--resultados', type=int, default=100, help='Resultados por indicador')
+        parser.add_argument('--consultas', type=int, default=500, help='Consultas por caso')
+        parser.add_argument('--ultimos', type=int, default=10, help='N de la consulta de últimos N')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            indicador_ids, desde, hasta = self._crear_datos(options['indicadores'], options['resultados'])
+            muestra = [random.choice(indicador_ids) for _ in range(options['consultas'])]
+            n = options['ultimos']
+
+            resultados = ResultadoIndicador._meta.db_table
+            legado_ultimos = (
+                f'SELECT r.fecha, r.valor FROM {resultados} r '
+                f'JOIN {TABLA_LEGADA} t ON t.resultadoindicador_id = r.id '
+                f'WHERE t.indicador_id = %s ORDER BY r.fecha DESC LIMIT {n}'
+            )
+            legado_rango = (
+                f'SELECT r.fecha, r.valor FROM {resultados} r '
+                f'JOIN {TABLA_LEGADA} t ON t.resultadoindicador_id = r.id '
+                f'WHERE t.indicador_id = %s AND r.fecha BETWEEN %s AND %s ORDER BY r.fecha'
+            )
+
+            nuevo_ultimos = (
+                f'SELECT fecha, valor FROM {resultados} '
+                f'WHERE indicador_id = %s ORDER BY fecha DESC LIMIT {n}'
+            )
+            nuevo_rango = (
+                f'SELECT fecha, valor FROM {resultados} '
+                f'WHERE indicador_id = %s AND fecha BETWEEN %s AND %s ORDER BY fecha'
+            )
+
+            casos = [
+                (f'Últimos {n} (tabla intermedia)', lambda i: self._sql(legado_ultimos, [i])),
+                (f'Últimos {n} (FK indicador)', lambda i: self._sql(nuevo_ultimos, [i])),
+                ('Rango de fechas (tabla intermedia)', lambda i: self._sql(legado_rango, [i, desde, hasta])),
+                ('Rango de fechas (FK indicador)', lambda i: self._sql(nuevo_rango, [i, desde, hasta])),
+            ]
+            for nombre, consulta in casos:
+                inicio = time.perf_counter()
+                for indicador_id in muestra:
+                    consulta(indicador_id)
+                duracion = (time.perf_counter() - inicio) / len(muestra) * 1000
+                self.stdout.write(f'{nombre}: {duracion:.3f} ms por consulta')
+
+            explain = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+            for nombre, sql in (('tabla intermedia', legado_ultimos), ('FK indicador', nuevo_ultimos)):
+                self.stdout.write(f'\nPlan de ejecución de últimos {n} ({nombre}):')
+                self.stdout.write(self._sql(explain + sql, [muestra[0]]))
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS('Datos sintéticos revertidos'))
+
+    @staticmethod
+    def _sql(sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return '\n'.join(str(fila) for fila in cursor.fetchall())
+
+    def _crear_datos(self, n_indicadores, n_resultados):
+        random.seed(0)
+        hoy = timezone.now().date()
+        tipo_indicador = TipoIndicador.objects.create(nombre='Benchmark')
+        unidad = UnidadMedidaIndicador.objects.create(nombre='Benchmark', sigla='b')
+
+        indicadores = Indicador.objects.bulk_create([
+            Indicador(nombre=f'Indicador {i}', tipo_indicador=tipo_indicador, unidad_medida=unidad, formula='x')
+            for i in range(n_indicadores)
+        ])
+        ResultadoIndicador.objects.bulk_create([
+            ResultadoIndicador(indicador=indicador, valor=random.uniform(0, 200), fecha=hoy - timedelta(days=7 * j))
+            for indicador in indicadores
+            for j in range(n_resultados)
+        ], batch_size=5000)
+
+        # Reproduce la antigua tabla intermedia con el mismo índice que genera Django para un M2M
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE TABLE {TABLA_LEGADA} (id integer PRIMARY KEY, indicador_id integer NOT NULL, '
+                           f'resultadoindicador_id integer NOT NULL)')
+            cursor.execute(f'CREATE UNIQUE INDEX {TABLA_LEGADA}_uniq ON {TABLA_LEGADA} '
+                           f'(indicador_id, resultadoindicador_id)')
+            cursor.execute(f'CREATE INDEX {TABLA_LEGADA}_res ON {TABLA_LEGADA} (resultadoindicador_id)')
+            cursor.execute(f'INSERT INTO {TABLA_LEGADA} (id, indicador_id, resultadoindicador_id) '
+                           f'SELECT id, indicador_id, id FROM {ResultadoIndicador._meta.db_table} '
+                           f'WHERE indicador_id IS NOT NULL')
+
+        self.stdout.write(f'Creados {n_indicadores} indicadores con {n_resultados} resultados cada uno')
+        return [i.id for i in indicadores], hoy - timedelta(days=7 * n_resultados // 2), hoy
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import override_settings
+
+from nomencladores.models import Sector, TipoAccion
+from registro import subidas
+from registro.models import Accion, ArchivoDocumento, Documento
+
+
+class _Flujo:
+    """Cuerpo de petición sintético: devuelve `longitud` bytes de `patron` sin tenerlos en memoria"""
+
+    def __init__(self, patron, inicio, longitud):
+        self.patron, self.posicion, self.restantes = patron, inicio, longitud
+
+    def read(self, n):
+        n = min(n, self.restantes)
+        desplazamiento = self.posicion % len(self.patron)
+        repeticiones = -(-(desplazamiento + n) // len(self.patron))
+        bloque = (self.patron * repeticiones)[desplazamiento:desplazamiento + n]
+        self.posicion += n
+        self.restantes -= n
+        return bloque
+
+
+class Command(BaseCommand):
+    help = ('Mide subidas por fragmentos simultáneas: N hilos suben cada uno un fichero sintético de '
+            'M MB enviando sus fragmentos en orden aleatorio, con una interrupción a mitad que se '
+            'reanuda. Informa del caudal y de la memoria máxima reservada por subida. Los ficheros se '
+            'escriben en un directorio temporal y los datos sintéticos se eliminan al terminar')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subidas', type=int, default=8)
+        parser.add_argument('--mb', type=int, default=64)
+        parser.add_argument('--fragmento-mb', type=int, default=8)
+
+    def handle(self, *args, **options):
+        n, tamano = options['subidas'], options['mb'] * 2 ** 20
+        usuario = User.objects.create(username='benchmark_subidas')
+        tipo_accion = TipoAccion.objects.create(nombre='Benchmark subidas')
+        sector = Sector.objects.create(nombre='Benchmark subidas')
+        accion = Accion.objects.create(user=usuario, tipo_accion=tipo_accion, sector=sector,
+                                       nombre='Benchmark subidas')
+        # Un patrón aleatorio por subida para que la deduplicación no las junte
+        patrones = [os.urandom(subidas.BLOQUE) for _ in range(n)]
+        esperados = [self._sha256(patron, tamano) for patron in patrones]
+        errores = []
+
+        def subir(i):
+            try:
+                subida = subidas.crear(accion, usuario, f'informe_{i}.bin', tamano, esperados[i])
+                orden = list(range(-(-tamano // subida.tamano_fragmento)))
+                random.Random(i).shuffle(orden)
+                for k, indice in enumerate(orden):
+                    inicio = indice * subida.tamano_fragmento
+                    longitud = min(subida.tamano_fragmento, tamano - inicio)
+                    if k == len(orden) // 2:
+                        # Conexión cortada a mitad de fragmento: no se anota y se vuelve a enviar
+                        try:
+                            subidas.escribir_fragmento(subida, indice, _Flujo(patrones[i], inicio, longitud // 2),
+                                                       longitud)
+                        except subidas.ErrorSubida:
+                            pass
+                    subida = subidas.escribir_fragmento(subida, indice, _Flujo(patrones[i], inicio, longitud),
+                                                        longitud)
+                subidas.completar(subida)
+            except Exception as e:
+                errores.append(e)
+            finally:
+                connection.close()
+
+        directorio = tempfile.TemporaryDirectory()
+        try:
+            with override_settings(MEDIA_ROOT=os.path.join(directorio.name, 'media'),
+                                   SUBIDAS_DIR=os.path.join(directorio.name, 'parciales'),
+                                   SUBIDAS_TAMANO_FRAGMENTO=options['fragmento_mb'] * 2 ** 20,
+                                   DOCUMENTOS_EXTRACCION_AUTOMATICA=False):
+                tracemalloc.start()
+                inicio = time.perf_counter()
+                hilos = [threading.Thread(target=subir, args=(i,)) for i in range(n)]
+                for hilo in hilos:
+                    hilo.start()
+                for hilo in hilos:
+                    hilo.join()
+                duracion = time.perf_counter() - inicio
+                _, pico = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+            adjuntos = accion.documentos.count()
+            self.stdout.write(
+                f'{n} subidas de {options["mb"]} MB en {duracion:.2f} s '
+                f'({n * tamano / 2 ** 20 / duracion:,.0f} MB/s), {adjuntos} documentos adjuntos, '
+                f'{len(errores)} errores; memoria máxima {pico / 2 ** 20:.1f} MB '
+                f'({pico / n / 2 ** 10:,.0f} KB por subida, bloque de {subidas.BLOQUE // 2 ** 10} KB)'
+            )
+            for error in errores[:5]:
+                self.stderr.write(repr(error))
+        finally:
+            connections.close_all()
+            documentos = list(accion.documentos.all())
+            ArchivoDocumento.objects.filter(documentos__in=documentos).delete()
+            Documento.objects.filter(pk__in=[d.pk for d in documentos]).delete()
+            accion.delete()
+            sector.delete()
+            tipo_accion.delete()
+            usuario.delete()
+            directorio.cleanup()
+        self.stdout.write(self.style.SUCCESS('Datos sintéticos eliminados'))
+
+    @staticmethod
+    def _sha256(patron, tamano):
+        resumen = hashlib.sha256()
+        flujo = _Flujo(patron, 0, tamano)
+        while bloque := flujo.read(2 ** 20):
+            resumen.update(bloque)
+        return resumen.hexdigest()
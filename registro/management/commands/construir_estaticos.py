@@ -0,0 +1,49 @@
+from django.contrib.staticfiles.finders import get_finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from registro.estaticos import BuscadorReferenciados
+
+
+class Command(BaseCommand):
+    help = ('Construye STATIC_ROOT: collectstatic con solo los ficheros referenciados, nombres con hash, '
+            'manifiesto y variantes gzip y brotli. Informa de los ficheros de static/ que no usa ninguna '
+            'plantilla y de los bytes ahorrados. Con --solo-informe no copia nada')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--solo-informe', action='store_true')
+        parser.add_argument('--mostrar', type=int, default=15, help='Ficheros sin usar más grandes a listar')
+
+    def handle(self, *args, **options):
+        buscador = next((f for f in get_finders() if isinstance(f, BuscadorReferenciados)), None)
+        if buscador is None:
+            self.stderr.write('STATICFILES_FINDERS no incluye registro.estaticos.BuscadorReferenciados')
+            return
+
+        archivos = buscador.todos(['CVS', '.*', '*~'])
+        usados = buscador.usados(archivos)
+        tamanos = {ruta: storage.size(ruta) for ruta, storage in archivos.items()}
+        sin_usar = sorted(set(archivos) - usados, key=tamanos.get, reverse=True)
+        total = sum(tamanos.values())
+        usado = sum(tamanos[r] for r in usados)
+        self.stdout.write(f'static/: {len(archivos)} ficheros, {total / 2 ** 20:,.1f} MB; '
+                          f'referenciados {len(usados)} ({usado / 2 ** 20:,.1f} MB); '
+                          f'sin usar {len(sin_usar)} ({(total - usado) / 2 ** 20:,.1f} MB)')
+        for ruta in sin_usar[:options['mostrar']]:
+            self.stdout.write(f'  {tamanos[ruta] / 2 ** 10:>10,.0f} KB  {ruta}')
+
+        if options['solo_informe']:
+            return
+
+        call_command('collectstatic', interactive=False, clear=True, verbosity=0)
+        compresion = getattr(staticfiles_storage, 'compresion', {})
+        original = sum(t[''] for t in compresion.values())
+        gzip_ = sum(t.get('gzip', t['']) for t in compresion.values())
+        br = sum(t.get('br', t.get('gzip', t[''])) for t in compresion.values())
+        self.stdout.write(f'Comprimidos {len(compresion)} ficheros: {original / 2 ** 20:,.2f} MB -> '
+                          f'gzip {gzip_ / 2 ** 20:,.2f} MB, brotli {br / 2 ** 20:,.2f} MB '
+                          f'({(original - br) / 2 ** 20:,.2f} MB menos por transferencia completa)')
+        self.stdout.write(self.style.SUCCESS(
+            f'Estáticos en {staticfiles_storage.location}: {total - usado:,} bytes de static/ sin copiar'
+        ))
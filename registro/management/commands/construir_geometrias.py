@@ -0,0 +1,71 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand
+
+from registro import geometria
+
+
+class Command(BaseCommand):
+    help = ('Genera las geometrías del mapa: TopoJSON simplificado por nivel de zoom para todas las '
+            'provincias y municipios y para cada provincia por separado, con variantes gzip y brotli '
+            'nombradas por el hash de su contenido')
+
+    def handle(self, *args, **options):
+        salida = geometria.directorio_salida()
+        os.makedirs(salida, exist_ok=True)
+
+        provincias = geometria.leer_capa('provincias')
+        municipios = geometria.leer_capa('municipios')
+        capas = {'provincias': provincias, 'municipios': municipios}
+        for tipo, features in (('provincias', provincias), ('municipios', municipios)):
+            for hc_key in sorted({f['properties']['hc_key'] for f in features}):
+                capas[f'{tipo}-{hc_key}'] = [f for f in features if f['properties']['hc_key'] == hc_key]
+
+        manifest = {'capas': {}}
+        archivos = {'manifest.json'}
+        original_total = reducido_total = 0
+
+        for capa, features in capas.items():
+            tipo = capa.split('-')[0]
+            original = len(json.dumps({'type': 'FeatureCollection', 'features': features}).encode())
+            arcos, geometrias = geometria.construir_topologia(features)
+            manifest['capas'][capa] = {}
+
+            for zoom, tolerancia, cuantizacion in geometria.NIVELES:
+                topologia = geometria.topojson(features, tipo, tolerancia, cuantizacion, arcos, geometrias)
+                datos = json.dumps(topologia, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+                hash_ = geometria.hash_contenido(datos)
+                nombre = f'{capa}.z{zoom}.{hash_}.topo.json'
+
+                entrada = {'hash': hash_, 'archivo': nombre}
+                for codificacion, contenido in geometria.comprimir(datos).items():
+                    archivo = nombre + {'': '', 'gzip': '.gz', 'br': '.br'}[codificacion]
+                    with open(os.path.join(salida, archivo), 'wb') as f:
+                        f.write(contenido)
+                    archivos.add(archivo)
+                    entrada[codificacion or 'bytes'] = len(contenido)
+                manifest['capas'][capa][str(zoom)] = entrada
+
+            mejor = min(manifest['capas'][capa].values(), key=lambda e: e['bytes'])
+            comprimido = mejor.get('br', mejor['gzip'])
+            original_total += original
+            reducido_total += comprimido
+            self.stdout.write(f'{capa}: {original / 1024:.0f} KB GeoJSON -> '
+                              f'{mejor["bytes"] / 1024:.1f} KB TopoJSON, {comprimido / 1024:.1f} KB comprimido '
+                              f'(zoom bajo)')
+
+        manifest['version'] = geometria.hash_contenido(
+            json.dumps(manifest['capas'], sort_keys=True).encode())
+        with open(os.path.join(salida, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1)
+
+        # Archivos de construcciones anteriores
+        for archivo in os.listdir(salida):
+            if archivo not in archivos and '.topo.json' in archivo:
+                os.remove(os.path.join(salida, archivo))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Geometrías generadas en {salida}: {original_total / 1024:.0f} KB de GeoJSON original, '
+            f'{reducido_total / 1024:.0f} KB comprimidos al zoom más bajo'
+        ))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from registro.Services import AnomaliaService
+
+
+class Command(BaseCommand):
+    help = ('Revisa los resultados de todos los indicadores con el detector de anomalías y '
+            'reemplaza las anomalías no descartadas de AnomaliaResultado')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--indicador', type=int, help='Revisa solo este indicador')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        if options['indicador']:
+            marcadas = AnomaliaService.revisar_indicador(options['indicador'])
+            self.stdout.write(self.style.SUCCESS(f'{marcadas} anomalías en el indicador {options["indicador"]}'))
+            return
+        totales = AnomaliaService.revisar_todos()
+        self.stdout.write(self.style.SUCCESS(
+            f'{totales["anomalias"]} anomalías en {totales["resultados"]} resultados '
+            f'({time.perf_counter() - inicio:.2f} s)'
+        ))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from registro import documentos
+from registro.models import ArchivoDocumento
+
+
+class Command(BaseCommand):
+    help = ('Extrae el texto de los documentos adjuntos pendientes y lo añade al índice de búsqueda. '
+            'Con --deduplicar enlaza antes los documentos subidos sin deduplicar con el contenido de su '
+            'fichero y borra las copias repetidas. Informa de los documentos por minuto y del ahorro '
+            'de almacenamiento')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, default=4)
+        parser.add_argument('--lote', type=int, default=50)
+        parser.add_argument('--deduplicar', action='store_true')
+        parser.add_argument('--reintentar', action='store_true',
+                            help='Vuelve a procesar también los que dieron error o no estaban soportados')
+        parser.add_argument('--todos', action='store_true', help='Vuelve a extraer todos los contenidos')
+        parser.add_argument('--limpiar', action='store_true', help='Borra los contenidos sin documentos')
+
+    def handle(self, *args, **options):
+        if options['deduplicar']:
+            totales = documentos.deduplicar_existentes()
+            self.stdout.write(
+                f'Deduplicación: {totales["documentos"]} documentos enlazados, {totales["nuevos"]} contenidos '
+                f'nuevos, {totales["duplicados"]} duplicados, {totales["bytes_liberados"] / 1e6:.1f} MB '
+                f'liberados, {totales["sin_fichero"]} sin fichero'
+            )
+        if options['limpiar']:
+            self.stdout.write(f'{documentos.limpiar_huerfanos()} contenidos sin documentos borrados')
+
+        estados = ['pendiente']
+        if options['reintentar']:
+            estados += ['error', 'no_soportado']
+        if options['todos']:
+            estados = [estado for estado, _ in ArchivoDocumento.ESTADOS]
+        totales = documentos.procesar(hilos=options['hilos'], lote=options['lote'], estados=estados)
+        segundos = max(totales['segundos'], 1e-9)
+        self.stdout.write(
+            f'{totales["archivos"]} contenidos ({totales["bytes"] / 1e6:.1f} MB) en {totales["segundos"]:.2f} s: '
+            f'{totales["archivos"] / segundos * 60:,.0f} documentos/min, {totales["caracteres"]:,} caracteres, '
+            f'{totales["errores"]} errores, {totales["no_soportados"]} no soportados'
+        )
+
+        resumen = documentos.estadisticas()
+        self.stdout.write(self.style.SUCCESS(
+            f'{resumen["documentos"]} documentos sobre {resumen["archivos"]} contenidos: '
+            f'{resumen["bytes_guardados"] / 1e6:.1f} MB guardados de {resumen["bytes_documentos"] / 1e6:.1f} MB '
+            f'({resumen["ahorro"]:.1%} de ahorro). Estados: {resumen["estados"]}'
+        ))
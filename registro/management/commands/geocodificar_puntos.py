@@ -0,0 +1,93 @@
+import csv
+import sys
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from nomencladores.models import Municipio, Provincia
+from registro import indice_espacial
+from registro.Services import GeocodificacionService
+
+
+class Command(BaseCommand):
+    help = ('Asigna municipio y provincia a los puntos lat/lon de un CSV usando los límites de '
+            'static/data. Escribe el CSV con las columnas municipio_id, municipio, provincia_id y '
+            'provincia añadidas. Con --aleatorios mide el rendimiento sobre puntos sintéticos')
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', nargs='?', help='CSV de entrada')
+        parser.add_argument('--salida', help='CSV de salida (por defecto la salida estándar)')
+        parser.add_argument('--lat', default='lat', help='Columna de latitud')
+        parser.add_argument('--lon', default='lon', help='Columna de longitud')
+        parser.add_argument('--aleatorios', type=int, help='Geocodifica N puntos aleatorios dentro de Cuba')
+
+    def handle(self, *args, **options):
+        if options['aleatorios']:
+            return self._medir(options['aleatorios'])
+        if not options['archivo']:
+            raise CommandError('Indique el archivo CSV o --aleatorios N')
+
+        with open(options['archivo'], newline='', encoding='utf-8-sig') as archivo:
+            filas = list(csv.DictReader(archivo))
+        if filas and (options['lat'] not in filas[0] or options['lon'] not in filas[0]):
+            raise CommandError(f'El CSV debe tener las columnas {options["lat"]} y {options["lon"]}')
+
+        latitudes = [self._numero(f[options['lat']]) for f in filas]
+        longitudes = [self._numero(f[options['lon']]) for f in filas]
+        inicio = time.perf_counter()
+        territorios = GeocodificacionService.geocodificar(latitudes, longitudes)
+        duracion = time.perf_counter() - inicio
+
+        municipios = dict(Municipio.objects.values_list('id', 'nombre'))
+        provincias = dict(Provincia.objects.values_list('id', 'nombre'))
+        salida = open(options['salida'], 'w', newline='', encoding='utf-8') if options['salida'] else sys.stdout
+        try:
+            campos = list(filas[0]) if filas else [options['lat'], options['lon']]
+            escritor = csv.DictWriter(salida, fieldnames=campos + ['municipio_id', 'municipio',
+                                                                   'provincia_id', 'provincia'])
+            escritor.writeheader()
+            for fila, territorio in zip(filas, territorios):
+                escritor.writerow({
+                    **fila,
+                    'municipio_id': territorio['municipio_id'] or '',
+                    'municipio': municipios.get(territorio['municipio_id'], ''),
+                    'provincia_id': territorio['provincia_id'] or '',
+                    'provincia': provincias.get(territorio['provincia_id'], ''),
+                })
+        finally:
+            if salida is not sys.stdout:
+                salida.close()
+
+        sin_territorio = sum(1 for t in territorios if t['provincia_id'] is None)
+        self.stderr.write(f'{len(filas)} puntos en {duracion:.2f} s; {sin_territorio} sin territorio')
+
+    @staticmethod
+    def _numero(valor):
+        try:
+            return float(valor)
+        except (TypeError, ValueError):
+            return float('nan')
+
+    def _medir(self, n):
+        inicio = time.perf_counter()
+        municipios = indice_espacial.indice('municipios')
+        indice_espacial.indice('provincias')
+        self.stdout.write(f'Construcción de los índices: {time.perf_counter() - inicio:.2f} s')
+
+        rng = np.random.default_rng(0)
+        x0, y0 = municipios.origen
+        x1, y1 = municipios.origen + municipios.dimensiones * municipios.celda
+        longitudes = rng.uniform(x0, x1, n)
+        latitudes = rng.uniform(y0, y1, n)
+
+        inicio = time.perf_counter()
+        localizados = municipios.localizar(longitudes, latitudes)
+        duracion = time.perf_counter() - inicio
+        self.stdout.write(f'Índice de municipios: {n} puntos en {duracion:.2f} s '
+                          f'({n / duracion:,.0f} puntos/s), {np.count_nonzero(localizados >= 0)} dentro')
+
+        inicio = time.perf_counter()
+        GeocodificacionService.geocodificar(latitudes, longitudes)
+        duracion = time.perf_counter() - inicio
+        self.stdout.write(f'Geocodificación completa: {n / duracion:,.0f} puntos/s')
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from registro import subidas
+
+
+class Command(BaseCommand):
+    help = ('Borra las subidas por fragmentos sin completar que llevan más de SUBIDAS_CADUCIDAD_HORAS '
+            'horas sin actividad, con sus ficheros parciales')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horas', type=int, default=settings.SUBIDAS_CADUCIDAD_HORAS)
+
+    def handle(self, *args, **options):
+        total = subidas.limpiar_caducadas(options['horas'])
+        self.stdout.write(self.style.SUCCESS(f'{total} subidas caducadas borradas'))
@@ -0,0 +1,77 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from registro.models import ResultadoIndicador, ResultadoVariable
+
+
+class Command(BaseCommand):
+    help = ('Asigna ResultadoIndicador.indicador a partir de la antigua tabla intermedia de '
+            'Indicador.resultados. Un resultado compartido por varios indicadores se copia, junto con '
+            'sus variables, para cada indicador adicional. Puede ejecutarse más de una vez')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tabla', default='registro_indicador_resultados',
+                            help='Tabla intermedia con las columnas indicador_id y resultadoindicador_id')
+
+    def handle(self, *args, **options):
+        tabla = options['tabla']
+        if tabla not in connection.introspection.table_names():
+            self.stdout.write(self.style.WARNING(f'No existe la tabla {tabla}; no hay nada que migrar'))
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT indicador_id, resultadoindicador_id FROM {connection.ops.quote_name(tabla)} '
+                f'ORDER BY resultadoindicador_id, indicador_id'
+            )
+            indicadores_por_resultado = defaultdict(list)
+            for indicador_id, resultado_id in cursor.fetchall():
+                indicadores_por_resultado[resultado_id].append(indicador_id)
+
+        with transaction.atomic():
+            resultados = ResultadoIndicador.objects.in_bulk(list(indicadores_por_resultado))
+            existentes = set(ResultadoIndicador.objects.filter(indicador__isnull=False)
+                             .values_list('indicador_id', 'fecha'))
+
+            asignar = []
+            copias = []
+            for resultado_id, indicador_ids in indicadores_por_resultado.items():
+                resultado = resultados.get(resultado_id)
+                if resultado is None:
+                    continue
+                if resultado.indicador_id is None:
+                    resultado.indicador_id = indicador_ids[0]
+                    asignar.append(resultado)
+                    existentes.add((resultado.indicador_id, resultado.fecha))
+
+                for indicador_id in indicador_ids:
+                    if (indicador_id, resultado.fecha) in existentes:
+                        continue
+                    existentes.add((indicador_id, resultado.fecha))
+                    copias.append((resultado, ResultadoIndicador(
+                        indicador_id=indicador_id,
+                        fuente_dato=resultado.fuente_dato,
+                        valor=resultado.valor,
+                        observacion=resultado.observacion,
+                        fecha=resultado.fecha,
+                    )))
+
+            ResultadoIndicador.objects.bulk_update(asignar, ['indicador'], batch_size=1000)
+            ResultadoIndicador.objects.bulk_create([copia for _, copia in copias], batch_size=1000)
+
+            # Las copias conservan los valores de las variables con que se calculó el original
+            variables = defaultdict(list)
+            for v in ResultadoVariable.objects.filter(resultado_id__in={r.id for r, _ in copias}):
+                variables[v.resultado_id].append(v)
+            ResultadoVariable.objects.bulk_create([
+                ResultadoVariable(resultado=copia, variable_indicador_id=v.variable_indicador_id, valor=v.valor)
+                for original, copia in copias
+                for v in variables[original.id]
+            ], batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(asignar)} resultados asignados a su indicador, '
+            f'{len(copias)} copiados para indicadores adicionales'
+        ))
@@ -0,0 +1,77 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from registro.models import Accion, Indicador, PlantillaIndicador
+from registro.Services import FormulaCalculatorService, PlantillaIndicadorService
+
+
+class Command(BaseCommand):
+    help = ('Plantillas de indicadores. crear: crea una plantilla a partir de un indicador (con '
+            '--vincular-iguales vincula también los indicadores idénticos). aplicar: crea indicadores '
+            'vinculados a la plantilla en varias acciones. formula: cambia la fórmula de la plantilla, la '
+            'propaga a sus indicadores y recalcula sus resultados')
+
+    def add_arguments(self, parser):
+        acciones = parser.add_subparsers(dest='accion', required=True)
+
+        crear = acciones.add_parser('crear')
+        crear.add_argument('indicador', type=int)
+        crear.add_argument('--vincular-iguales', action='store_true')
+
+        aplicar = acciones.add_parser('aplicar')
+        aplicar.add_argument('plantilla', type=int)
+        destino = aplicar.add_mutually_exclusive_group(required=True)
+        destino.add_argument('--acciones', type=int, nargs='+', help='Ids de las acciones')
+        destino.add_argument('--todas', action='store_true', help='Todas las acciones')
+
+        formula = acciones.add_parser('formula')
+        formula.add_argument('plantilla', type=int)
+        formula.add_argument('formula')
+
+    def handle(self, *args, **options):
+        getattr(self, f'_{options["accion"]}')(options)
+
+    @staticmethod
+    def _obtener(modelo, id):
+        objeto = modelo.objects.select_related('tipo_indicador').filter(id=id).first()
+        if objeto is None:
+            raise CommandError(f'No existe {modelo._meta.verbose_name} {id}')
+        return objeto
+
+    def _crear(self, options):
+        indicador = self._obtener(Indicador, options['indicador'])
+        if indicador.plantilla_id:
+            raise CommandError(f'El indicador ya está vinculado a la plantilla {indicador.plantilla_id}')
+        plantilla, vinculados = PlantillaIndicadorService.crear_desde_indicador(
+            indicador, options['vincular_iguales'])
+        self.stdout.write(self.style.SUCCESS(f'Plantilla {plantilla.id} creada con {len(vinculados)} indicadores vinculados'))
+
+    def _aplicar(self, options):
+        plantilla = self._obtener(PlantillaIndicador, options['plantilla'])
+        accion_ids = options['acciones'] or list(Accion.objects.values_list('id', flat=True))
+        inicio = time.perf_counter()
+        copias = PlantillaIndicadorService.aplicar_a_acciones(plantilla, accion_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(copias)} indicadores creados; {len(accion_ids) - len(copias)} acciones omitidas '
+            f'({time.perf_counter() - inicio:.2f} s)'
+        ))
+
+    def _formula(self, options):
+        plantilla = self._obtener(PlantillaIndicador, options['plantilla'])
+        try:
+            simbolos, _ = FormulaCalculatorService.compilar(options['formula'])
+        except Exception as e:
+            raise CommandError(f'Fórmula no válida: {e}')
+        faltantes = set(simbolos) - set(plantilla.variable_indicador.values_list('variable', flat=True))
+        if faltantes:
+            raise CommandError(f'Variables que no tiene la plantilla: {", ".join(sorted(faltantes))}')
+
+        plantilla.formula = options['formula']
+        inicio = time.perf_counter()
+        totales = PlantillaIndicadorService.actualizar_plantilla(plantilla)
+        self.stdout.write(self.style.SUCCESS(
+            f'{totales["indicadores"]} indicadores actualizados, {totales["resultados"]} resultados '
+            f'recalculados y {totales["omitidos"]} sin recalcular por falta de variables '
+            f'({time.perf_counter() - inicio:.2f} s)'
+        ))
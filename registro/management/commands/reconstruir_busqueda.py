@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from registro import busqueda
+
+
+class Command(BaseCommand):
+    help = ('Vacía y vuelve a llenar el índice de búsqueda de texto completo con todas las acciones, '
+            'indicadores, resultados de acciones y documentos')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        totales = busqueda.reconstruir(options['lote'])
+        for tipo, total in totales.items():
+            self.stdout.write(f'  {tipo}: {total}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{sum(totales.values())} documentos indexados ({time.perf_counter() - inicio:.2f} s)'
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from registro.Services import ResumenPresupuestoService
+from registro.models import ResumenPresupuestoAccion, ResumenPresupuestoSector, ResumenPresupuestoTerritorio
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye desde cero los totales precalculados de presupuesto por acción, sector y territorio'
+
+    def handle(self, *args, **options):
+        ResumenPresupuestoService.reconstruir()
+        self.stdout.write(self.style.SUCCESS(
+            f'Resumen de presupuesto reconstruido: '
+            f'{ResumenPresupuestoAccion.objects.count()} filas por acción, '
+            f'{ResumenPresupuestoSector.objects.count()} por sector, '
+            f'{ResumenPresupuestoTerritorio.objects.count()} por territorio'
+        ))
@@ -1,5 +1,6 @@
 import datetime
 import pathlib
+import uuid
 
 from dateutil.relativedelta import relativedelta
 from django.contrib.auth.models import User
@@ -7,7 +8,6 @@ from django.contrib.humanize.templatetags.humanize import intcomma
 from django.db.models import F, Avg
 from django.utils.timezone import now
 
-from .utils import data_chart_line
 from nomencladores.models import *
 
 
@@ -19,9 +19,60 @@ def get_upload_path(instance, filename):
     return upload_path
 
 
+def get_contenido_path(instance, filename):
+    # Ruta por contenido: el mismo fichero adjunto a varias acciones se guarda una sola vez
+    extension = pathlib.Path(filename).suffix.lower()
+    return f'documentos_subidos/contenido/{instance.sha256[:2]}/{instance.sha256}{extension}'
+
+
+class ArchivoDocumento(models.Model):
+    """
+    Contenido de un fichero subido, identificado por su SHA-256. Lo comparten todos los Documento
+    con el mismo contenido; su texto se extrae una vez en FragmentoDocumento (registro.documentos)
+    """
+    ESTADOS = [
+        ('pendiente', 'Pendiente de extraer'),
+        ('extraido', 'Texto extraído'),
+        ('sin_texto', 'Sin texto'),
+        ('no_soportado', 'Formato no soportado'),
+        ('error', 'Error al extraer'),
+    ]
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    archivo = models.FileField(upload_to=get_contenido_path, max_length=200)
+    tamano = models.PositiveBigIntegerField(verbose_name='Tamaño en bytes')
+    estado_extraccion = models.CharField(max_length=20, choices=ESTADOS, default='pendiente', db_index=True)
+    error_extraccion = models.CharField(max_length=500, blank=True)
+    caracteres = models.PositiveIntegerField(default=0, help_text='Caracteres de texto extraídos')
+    fecha = models.DateTimeField(auto_now_add=True)
+    fecha_extraccion = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'Archivos de documentos'
+
+    def __str__(self):
+        return self.sha256
+
+
+class FragmentoDocumento(models.Model):
+    """Trozo del texto extraído de un ArchivoDocumento, en orden"""
+    archivo = models.ForeignKey(ArchivoDocumento, on_delete=models.CASCADE, related_name='fragmentos')
+    orden = models.PositiveIntegerField()
+    texto = models.TextField()
+
+    class Meta:
+        ordering = ['archivo', 'orden']
+        constraints = [
+            models.UniqueConstraint(fields=['archivo', 'orden'], name='fragmento_documento_orden_unico'),
+        ]
+
+
 class Documento(models.Model):
     nombre = models.CharField(max_length=500, verbose_name="Nombre", null=True, blank=True)
-    documento = models.FileField(verbose_name="Documento", upload_to=get_upload_path, null=True, blank=True)
+    documento = models.FileField(verbose_name="Documento", upload_to=get_upload_path, max_length=200, null=True,
+                                 blank=True)
+    archivo = models.ForeignKey(ArchivoDocumento, verbose_name='Contenido', on_delete=models.SET_NULL,
+                                related_name='documentos', null=True, blank=True)
     fecha = models.DateTimeField('Fecha de subida', auto_now=True)
 
     def __str__(self):
@@ -48,7 +99,19 @@ class ResultadoIndicador(models.Model):
                                                 through="ResultadoVariable")
     valor = models.FloatField(null=True, blank=True)
     observacion = models.CharField(max_length=500, verbose_name="Observaciones o comentarios", null=True, blank=True)
-    fecha = models.DateField(unique=True)
+    fecha = models.DateField()
+    indicador = models.ForeignKey('Indicador', verbose_name='Indicador', on_delete=models.CASCADE,
+                                  related_name='resultados', null=True, blank=True)
+
+    class Meta:
+        # Una medición por indicador y día. El índice (indicador, fecha, valor) cubre las lecturas
+        # por rango y las de los últimos N valores sin consultar la tabla
+        constraints = [
+            models.UniqueConstraint(fields=['indicador', 'fecha'], name='resultado_indicador_fecha_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['indicador', 'fecha', 'valor'], name='resultado_indicador_serie_idx'),
+        ]
 
 
 
@@ -85,8 +148,6 @@ class Indicador(models.Model):
                                             on_delete=models.CASCADE, null=True, blank=True)
     variable_indicador = models.ManyToManyField(VariableIndicador, verbose_name="Dato del indicador",
                                                 related_name="variables_indicador")
-    resultados = models.ManyToManyField(ResultadoIndicador, verbose_name="Resultados del indicador",
-                                        related_name="resultados_indicador", blank=True)
     ultima_medicion = models.DateTimeField(null=True, blank=True)
     direccion_optima = models.CharField(
         max_length=20,
@@ -116,6 +177,9 @@ class Indicador(models.Model):
         blank=True,
         help_text='Valor inicial o de referencia antes de implementar acciones'
     )
+    plantilla = models.ForeignKey('PlantillaIndicador', verbose_name='Plantilla', on_delete=models.SET_NULL,
+                                  null=True, blank=True, related_name='indicadores')
+    version_plantilla = models.PositiveIntegerField(null=True, blank=True)
 
 
     def __str__(self):
@@ -162,19 +226,9 @@ class Indicador(models.Model):
 
     @property
     def get_grafico(self):
-        data_line = {
-            'valores': {
-                'name': 'Valor',
-                'data': []
-            },
-            'labels': []
-        }
-        for re in self.resultados.all():
-            data_line['valores']['data'].append(round(re.valor, 2))
-            data_line['labels'].append(re.fecha.strftime("%d-%m-%Y"))
+        from registro.Services import ChartDataService
 
-        chart_data_line = data_chart_line(data_line, self)
-        return chart_data_line
+        return ChartDataService.prepare_chart_data(self.resultados.order_by('fecha'), self)
 
     def calcular_proxima_medicion(self):
         """Calcula la próxima medición basada en la última medición registrada"""
@@ -270,6 +324,40 @@ class Indicador(models.Model):
         return usuarios
 
 
+class PlantillaIndicador(models.Model):
+    """
+    Definición canónica de un indicador que se repite en varias acciones. Los indicadores creados
+    desde la plantilla quedan vinculados (Indicador.plantilla) y reciben sus cambios; al editar
+    los campos compartidos de uno de ellos se desvincula y conserva su copia.
+    """
+    history = AuditlogHistoryField()
+    nombre = models.CharField(verbose_name='Nombre', max_length=500)
+    tipo_indicador = models.ForeignKey(TipoIndicador, verbose_name='Tipo de indicador', on_delete=models.CASCADE)
+    descripcion = models.CharField(verbose_name='Descripcion del indicador', max_length=500, null=True, blank=True)
+    fuente_indicador = models.CharField(verbose_name='Fuente del indicador', max_length=500, null=True, blank=True)
+    formula = models.CharField(verbose_name='Fórmula o Método de calculo', max_length=500)
+    unidad_medida = models.ForeignKey(UnidadMedidaIndicador, on_delete=models.CASCADE)
+    enfoqueIPCC = models.ForeignKey(EnfoqueIPCC, verbose_name='Enfoque IPCC', on_delete=models.CASCADE,
+                                    null=True, blank=True)
+    objetivos_relacionados = models.ManyToManyField(ObjetivosDesarrolloSostenible, blank=True,
+                                                    related_name="plantillas_indicador",
+                                                    verbose_name="Objetivos de Desarrollo Sostenible relacionados")
+    frecuencia_medicion = models.ForeignKey(FrecuenciaMedicion, verbose_name="Frecuencia de la medicion",
+                                            on_delete=models.CASCADE, null=True, blank=True)
+    variable_indicador = models.ManyToManyField(VariableIndicador, verbose_name="Dato del indicador",
+                                                related_name="plantillas_indicador")
+    direccion_optima = models.CharField(max_length=20, choices=Indicador.DIRECCION_CHOICES,
+                                        verbose_name='Dirección óptima del indicador', null=True, blank=True)
+    version = models.PositiveIntegerField(default=1)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Plantillas de indicadores'
+
+    def __str__(self):
+        return self.nombre + ' - ' + self.tipo_indicador.nombre
+
+
 class ResultadoAccion(models.Model):
     history = AuditlogHistoryField()
     descripcion = models.TextField(verbose_name="Descripcion del resultado de la acción")
@@ -323,6 +411,16 @@ class PresupuestoPlanificado(Presupuesto):
                                   on_delete=models.CASCADE, null=True, blank=True)
     presupuestos_ejecutados = models.ManyToManyField(PresupuestoEjecutado, verbose_name="Presupuestos ejecutados",
                                                      related_name="presupuestos_ejecutados", blank=True)
+    # Total ejecutado precalculado, lo mantienen las señales de registro/signals.py
+    monto_ejecutado = models.FloatField(verbose_name='Monto ejecutado', default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        # Las señales actualizan monto_ejecutado con update(): al guardar una instancia leída antes
+        # se escriben los demás campos para no devolverle el valor que tenía al leerla
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name != 'monto_ejecutado']
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.tipo_presupuesto.nombre + ' - ' + self.estado_presupuesto.nombre + ' - ' + str(
@@ -330,18 +428,17 @@ class PresupuestoPlanificado(Presupuesto):
 
     @property
     def get_monto_restante(self):
-        total_ejecutado = sum(p.monto for p in self.presupuestos_ejecutados.all())
-        return self.monto - total_ejecutado
+        return self.monto - self.monto_ejecutado
 
     @property
     def get_porcentaje_monto_ejecutado(self):
-        porciento_total_ejecutado = sum(p.get_porciento_ejecutado for p in self.presupuestos_ejecutados.all())
-        return porciento_total_ejecutado
+        if not self.monto:
+            return 0
+        return (self.monto_ejecutado / self.monto) * 100
 
     @property
     def get_monto_total_ejecutado(self):
-        total_ejecutado = sum(p.monto for p in self.presupuestos_ejecutados.all())
-        return total_ejecutado
+        return self.monto_ejecutado
 
     # @property
     # def format_monto(self):
@@ -401,15 +498,17 @@ class Accion(models.Model):
 
     @property
     def presupuesto_total(self):
+        resumenes = {r.tipo_moneda_id: r for r in self.resumenes_presupuesto.all()}
         presupuesto_total_por_monedas = []
 
         for tm in TipoMoneda.objects.filter(estado=True):
-            monto_total = 0
-            monto_ejecutado = 0
-            monto_restante = 0
-            for pp in self.presupuestos_planificados.filter(tipo_moneda=tm):
-                monto_total += pp.monto
-            presupuesto_total_por_monedas.append({'moneda': tm.nombre, 'monto_total': monto_total})
+            resumen = resumenes.get(tm.id)
+            presupuesto_total_por_monedas.append({
+                'moneda': tm.nombre,
+                'monto_total': resumen.monto_planificado if resumen else 0,
+                'monto_ejecutado': resumen.monto_ejecutado if resumen else 0,
+                'monto_restante': resumen.monto_restante if resumen else 0,
+            })
 
         return presupuesto_total_por_monedas
 
@@ -423,9 +522,149 @@ class Accion(models.Model):
         return self.nombre[0]
 
 
+class ResumenPresupuesto(models.Model):
+    """Totales precalculados de presupuesto por moneda (planificado, ejecutado y restante)"""
+    tipo_moneda = models.ForeignKey(TipoMoneda, verbose_name='Tipo de moneda', on_delete=models.CASCADE)
+    monto_planificado = models.FloatField(verbose_name='Monto planificado', default=0)
+    monto_ejecutado = models.FloatField(verbose_name='Monto ejecutado', default=0)
+    monto_restante = models.FloatField(verbose_name='Monto restante', default=0)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def porcentaje_ejecutado(self):
+        if not self.monto_planificado:
+            return 0
+        return (self.monto_ejecutado / self.monto_planificado) * 100
+
+
+class ResumenPresupuestoAccion(ResumenPresupuesto):
+    accion = models.ForeignKey(Accion, verbose_name='Acción', on_delete=models.CASCADE,
+                               related_name='resumenes_presupuesto')
+
+    class Meta:
+        verbose_name_plural = 'Resúmenes de presupuesto por acción'
+        constraints = [
+            models.UniqueConstraint(fields=['accion', 'tipo_moneda'], name='resumen_presupuesto_accion_unico'),
+        ]
+
+
+class ResumenPresupuestoSector(ResumenPresupuesto):
+    sector = models.ForeignKey(Sector, verbose_name='Sector', on_delete=models.CASCADE,
+                               related_name='resumenes_presupuesto')
+
+    class Meta:
+        verbose_name_plural = 'Resúmenes de presupuesto por sector'
+        constraints = [
+            models.UniqueConstraint(fields=['sector', 'tipo_moneda'], name='resumen_presupuesto_sector_unico'),
+        ]
+
+
+class ResumenPresupuestoTerritorio(ResumenPresupuesto):
+    """
+    Las filas con municipio agrupan las acciones con municipios; las filas sin municipio agrupan,
+    por provincia, las acciones que solo tienen provincias (igual que el mapa de acciones).
+    """
+    provincia = models.ForeignKey(Provincia, verbose_name='Provincia', on_delete=models.CASCADE,
+                                  related_name='resumenes_presupuesto')
+    municipio = models.ForeignKey(Municipio, verbose_name='Municipio', on_delete=models.CASCADE,
+                                  related_name='resumenes_presupuesto', null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'Resúmenes de presupuesto por territorio'
+        constraints = [
+            models.UniqueConstraint(fields=['municipio', 'tipo_moneda'],
+                                    condition=models.Q(municipio__isnull=False),
+                                    name='resumen_presupuesto_municipio_unico'),
+            models.UniqueConstraint(fields=['provincia', 'tipo_moneda'],
+                                    condition=models.Q(municipio__isnull=True),
+                                    name='resumen_presupuesto_provincia_unico'),
+        ]
+
+
+class AnomaliaResultado(models.Model):
+    """Resultado marcado como sospechoso por el detector de anomalías (registro.anomalias)"""
+    METODOS = [
+        ('mad', 'Desviación robusta (MAD)'),
+        ('estacional', 'Residuo estacional'),
+        ('no_finito', 'Valor no finito'),
+    ]
+
+    resultado = models.OneToOneField(ResultadoIndicador, verbose_name='Resultado', on_delete=models.CASCADE,
+                                     related_name='anomalia')
+    indicador = models.ForeignKey(Indicador, verbose_name='Indicador', on_delete=models.CASCADE,
+                                  related_name='anomalias')
+    metodo = models.CharField(max_length=20, choices=METODOS)
+    puntuacion = models.FloatField(verbose_name='Puntuación z robusta')
+    valor_esperado = models.FloatField(null=True, blank=True)
+    detectada = models.DateTimeField(auto_now=True)
+    descartada = models.BooleanField(default=False, help_text='Revisada y aceptada como válida')
+
+    class Meta:
+        verbose_name_plural = 'Anomalías de resultados'
+        indexes = [
+            models.Index(fields=['indicador', 'descartada'], name='anomalia_indicador_idx'),
+        ]
+
+
+class DocumentoBusqueda(models.Model):
+    """
+    Texto de una acción, indicador, resultado de acción o documento para la búsqueda de texto
+    completo (registro.busqueda). Lo mantienen las señales; reconstruir_busqueda lo rehace.
+    """
+    tipo = models.CharField(max_length=20)
+    objeto_id = models.PositiveIntegerField()
+    id_accion = models.PositiveIntegerField(null=True, blank=True, help_text='Acción a la que enlaza el resultado')
+    titulo = models.CharField(max_length=500)
+    texto = models.TextField(blank=True)
+    normalizado = models.TextField(blank=True, help_text='Título y texto en minúsculas y sin tildes')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tipo', 'objeto_id'], name='documento_busqueda_objeto_unico'),
+        ]
+
+
+
+class SubidaDocumento(models.Model):
+    """
+    Subida por fragmentos de un documento grande a una acción (registro.subidas). Cada fragmento
+    se escribe en su posición de un fichero parcial; al completarse se comprueba el SHA-256 y el
+    fichero pasa a ser un Documento de la acción.
+    """
+    ESTADOS = [
+        ('activa', 'En curso'),
+        ('verificando', 'Verificando'),
+        ('completada', 'Completada'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    accion = models.ForeignKey(Accion, on_delete=models.CASCADE, related_name='subidas')
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subidas_documentos')
+    nombre = models.CharField(max_length=500)
+    tamano = models.PositiveBigIntegerField(verbose_name='Tamaño en bytes')
+    tamano_fragmento = models.PositiveIntegerField()
+    sha256 = models.CharField(max_length=64, blank=True, help_text='Suma declarada por el cliente')
+    recibidos = models.BinaryField(default=b'', help_text='Mapa de bits de los fragmentos recibidos')
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='activa')
+    documento = models.ForeignKey(Documento, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    creada = models.DateTimeField(auto_now_add=True)
+    actualizada = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['estado', 'actualizada'], name='subida_documento_estado_idx'),
+        ]
+
+    def __str__(self):
+        return self.nombre
+
 
 auditlog.register(Accion)
 auditlog.register(Indicador)
+auditlog.register(PlantillaIndicador)
 auditlog.register(PresupuestoPlanificado)
 auditlog.register(PresupuestoEjecutado)
 auditlog.register(ResultadoAccion)
@@ -0,0 +1,109 @@
+"""
+Reducción de series largas para los gráficos.
+
+lttb() elige los puntos con el algoritmo largest-triangle-three-buckets (Steinarsson, 2013): el
+primero y el último se conservan y el resto de la serie se reparte en cubetas consecutivas; de
+cada una se toma el punto que forma el triángulo de mayor área con el elegido en la cubeta
+anterior y la media de la siguiente. Así se mantienen los picos y la forma de la curva con unos
+cientos de puntos. La geometría de todos los candidatos se calcula de una vez como matriz
+(cubetas x tamaño de cubeta): el área es lineal en el punto anterior, de modo que el recorrido
+secuencial solo evalúa una fila por cubeta.
+
+envolvente() da el mínimo y el máximo de cada cubeta de lttb(), para dibujar la banda de los
+valores que la reducción no muestra. reducir() junta recorte por rango, LTTB y envolvente y
+devuelve el formato columnar de los endpoints de series ({'x': [...], 'y': [...], ...}).
+"""
+import numpy as np
+
+PUNTOS = 1000
+MINIMO_PUNTOS = 3
+
+
+def cubetas(n, puntos):
+    """Límites de las puntos - 2 cubetas en que se reparten los puntos 1..n-2"""
+    return np.floor(np.linspace(1, n - 1, puntos - 1)).astype(np.int64)
+
+
+def lttb(x, y, puntos=PUNTOS):
+    """Índices (crecientes) de los puntos elegidos de la serie ordenada por x"""
+    n = len(x)
+    if n <= puntos or puntos < MINIMO_PUNTOS:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    limites = cubetas(n, puntos)
+    inicios, finales = limites[:-1], limites[1:]
+    tamanos = finales - inicios
+
+    # Media de cada cubeta; para la última, el punto final de la serie
+    media_x = np.add.reduceat(x[1:n - 1], inicios - 1) / tamanos
+    media_y = np.add.reduceat(y[1:n - 1], inicios - 1) / tamanos
+    cx = np.append(media_x[1:], x[-1])[:, None]
+    cy = np.append(media_y[1:], y[-1])[:, None]
+
+    # Candidatos de cada cubeta en una matriz; los huecos de las cubetas cortas se anulan
+    indices = inicios[:, None] + np.arange(tamanos.max())
+    validos = indices < finales[:, None]
+    indices = np.where(validos, indices, inicios[:, None])
+    bx, by = x[indices], y[indices]
+    # Doble del área con el punto anterior a: |a_x * (b_y - c_y) + a_y * (c_x - b_x) + (b_x c_y - c_x b_y)|
+    coef_x = by - cy
+    coef_y = cx - bx
+    constante = bx * cy - cx * by
+
+    elegidos = np.empty(puntos, dtype=np.int64)
+    elegidos[0], elegidos[-1] = 0, n - 1
+    anterior = 0
+    for i in range(puntos - 2):
+        areas = np.abs(coef_x[i] * x[anterior] + coef_y[i] * y[anterior] + constante[i])
+        anterior = indices[i, np.argmax(np.where(validos[i], areas, -1.0))]
+        elegidos[i + 1] = anterior
+    return elegidos
+
+
+def envolvente(y, puntos=PUNTOS):
+    """(mínimos, máximos) de las cubetas de lttb(), alineados con sus puntos elegidos"""
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= puntos or puntos < MINIMO_PUNTOS:
+        return y, y
+    inicios = cubetas(n, puntos)[:-1] - 1
+    centro = y[1:n - 1]
+    minimos = np.concatenate(([y[0]], np.minimum.reduceat(centro, inicios), [y[-1]]))
+    maximos = np.concatenate(([y[0]], np.maximum.reduceat(centro, inicios), [y[-1]]))
+    return minimos, maximos
+
+
+def recortar(x, desde=None, hasta=None):
+    """Slice de x (ordenado) entre desde y hasta, con un punto más a cada lado si lo hay"""
+    inicio = 0 if desde is None else max(int(np.searchsorted(x, desde, 'left')) - 1, 0)
+    fin = len(x) if hasta is None else min(int(np.searchsorted(x, hasta, 'right')) + 1, len(x))
+    return slice(inicio, fin)
+
+
+def reducir(x, y, puntos=PUNTOS, desde=None, hasta=None, decimales=2):
+    """
+    Serie columnar reducida a `puntos` como máximo. x debe estar ordenado; los y NaN se
+    descartan. Con desde/hasta (en las unidades de x) solo se reduce ese tramo.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    validos = ~np.isnan(y)
+    x, y = x[validos], y[validos]
+    tramo = recortar(x, desde, hasta)
+    x, y = x[tramo], y[tramo]
+
+    elegidos = lttb(x, y, puntos)
+    minimos, maximos = envolvente(y, puntos)
+    reducida = len(elegidos) < len(x)
+    serie = {
+        'x': x[elegidos].astype(np.int64).tolist(),
+        'y': np.round(y[elegidos], decimales).tolist(),
+        'total': int(len(x)),
+        'puntos': int(len(elegidos)),
+        'reducida': reducida,
+    }
+    if reducida:
+        serie['min'] = np.round(minimos, decimales).tolist()
+        serie['max'] = np.round(maximos, decimales).tolist()
+    return serie
@@ -1,11 +1,11 @@
 from django.utils import timezone
 from django.core.mail import send_mail
 from django.conf import settings
-from django.db.models import Sum
-from datetime import timedelta
 from typing import List, Dict
 import logging
 
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
 
@@ -58,175 +58,252 @@ class NotificationService:
 
 
 class IndicadorAlertService:
-    """Servicio para generar alertas de indicadores"""
+    """
+    Servicio para generar alertas de indicadores.
+
+    Las reglas se evalúan sobre arreglos de NumPy construidos con unas pocas consultas: cada
+    indicador se carga una sola vez aunque pertenezca a varias acciones y se emite una alerta por
+    cada acción publicada a la que pertenece.
+    """
 
     def __init__(self, notification_service: NotificationService):
         self.notification_service = notification_service
 
+    def _estado_indicadores(self, n_valores: int = 1) -> Dict:
+        """
+        Carga el estado de los indicadores de acciones publicadas: los pares (acción, indicador),
+        la fecha de inicio de cada acción, los campos de meta y los últimos `n_valores`
+        resultados de cada indicador, numerados con una función de ventana.
+        """
+        from django.db.models import F, Window
+        from django.db.models.functions import RowNumber
+        from registro.models import Accion, Indicador, ResultadoIndicador
+
+        through = Accion.indicadores.through
+        publicados = through.objects.filter(accion__publicado=True)
+
+        pares = np.array(list(publicados.values_list('accion_id', 'indicador_id')),
+                         dtype=np.int64).reshape(-1, 2)
+        ids, indice = np.unique(pares[:, 1], return_inverse=True)
+        indice = indice.ravel()
+
+        inicio_accion = dict(Accion.objects.filter(publicado=True).values_list('id', 'fecha_inicio'))
+
+        n = len(ids)
+        meta_valor = np.full(n, np.nan)
+        meta_fecha = np.full(n, np.datetime64('NaT'), dtype='datetime64[D]')
+        baseline = np.zeros(n)
+        incremento = np.zeros(n, dtype=bool)
+        decremento = np.zeros(n, dtype=bool)
+        for id_, meta, fecha_limite, base, direccion in Indicador.objects.filter(
+                id__in=publicados.values('indicador_id')).values_list(
+                'id', 'meta_valor', 'meta_fecha_limite', 'valor_baseline', 'direccion_optima'):
+            i = np.searchsorted(ids, id_)
+            meta_valor[i] = np.nan if meta is None else meta
+            meta_fecha[i] = fecha_limite or np.datetime64('NaT')
+            baseline[i] = base or 0
+            incremento[i] = direccion == 'incremento'
+            decremento[i] = direccion == 'decremento'
+
+        # Columna 0 = resultado más reciente
+        valores = np.full((n, n_valores), np.nan)
+        fechas = np.full((n, n_valores), np.datetime64('NaT'), dtype='datetime64[D]')
+        cantidad = np.zeros(n, dtype=np.int64)
+        ultimos = (
+            ResultadoIndicador.objects
+            .filter(indicador_id__in=publicados.values('indicador_id'))
+            .annotate(orden=Window(RowNumber(), partition_by=F('indicador_id'), order_by=F('fecha').desc()))
+            .filter(orden__lte=n_valores)
+            .values_list('indicador_id', 'orden', 'fecha', 'valor')
+        )
+        for id_, orden, fecha, valor in ultimos:
+            i = np.searchsorted(ids, id_)
+            valores[i, orden - 1] = np.nan if valor is None else valor
+            fechas[i, orden - 1] = fecha
+            cantidad[i] += 1
+
+        return {
+            'accion': pares[:, 0],
+            'indice': indice,
+            'inicio_accion': np.array([inicio_accion.get(a) or np.datetime64('NaT') for a in pares[:, 0]],
+                                      dtype='datetime64[D]'),
+            'ids': ids,
+            'meta_valor': meta_valor,
+            'meta_fecha': meta_fecha,
+            'baseline': baseline,
+            'incremento': incremento,
+            'decremento': decremento,
+            'valores': valores,
+            'fechas': fechas,
+            'cantidad': cantidad,
+        }
+
+    @staticmethod
+    def _progreso_meta(estado) -> Dict:
+        """Versión vectorizada de Indicador.calcular_progreso_meta (NaN si no es calculable)"""
+        meta = estado['meta_valor']
+        base = estado['baseline']
+        actual = estado['valores'][:, 0]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            progreso = np.where(estado['incremento'],
+                                (actual - base) / (meta - base),
+                                (base - actual) / (base - meta)) * 100
+            alcanzada = np.where(estado['incremento'], actual >= meta, actual <= meta)
+
+        valido = (~np.isnan(meta) & (meta != 0) & (estado['cantidad'] > 0) &
+                  np.where(estado['incremento'], meta > base, meta < base))
+        progreso = np.where(valido, np.clip(progreso, 0, 100), np.nan)
+        return {'progreso': progreso, 'alcanzada': alcanzada & valido}
+
+    @staticmethod
+    def _instancias(estado, filas):
+        """Carga solo las acciones e indicadores de las filas que generan alerta"""
+        from registro.models import Accion, Indicador
+
+        acciones = Accion.objects.select_related('user').in_bulk(
+            set(estado['accion'][filas].tolist()))
+        indicadores = Indicador.objects.in_bulk(
+            set(estado['ids'][estado['indice'][filas]].tolist()))
+        return acciones, indicadores
+
     def check_indicadores_sin_medicion(self, dias_umbral: int = 90) -> List[Dict]:
         """Detecta indicadores sin mediciones recientes"""
-        from registro.models import Accion
+        estado = self._estado_indicadores()
+        hoy = np.datetime64(timezone.now().date(), 'D')
+
+        ultima = estado['fechas'][:, 0][estado['indice']]
+        nunca = np.isnat(ultima)
+        dias_sin_medir = np.where(nunca, 0, (hoy - ultima).astype(np.int64))
+        atrasado = ~nunca & (dias_sin_medir > dias_umbral)
+        prioridades = np.select(
+            [nunca, dias_sin_medir > 180, dias_sin_medir > 120],
+            [NotificationPriority.HIGH, NotificationPriority.CRITICAL, NotificationPriority.HIGH],
+            NotificationPriority.MEDIUM,
+        )
+
+        filas = np.flatnonzero(nunca | atrasado)
+        acciones, indicadores = self._instancias(estado, filas)
 
         alertas = []
-        fecha_limite = timezone.now().date() - timedelta(days=dias_umbral)
-
-        # Obtener acciones publicadas
-        acciones = Accion.objects.filter(publicado=True)
-
-        for accion in acciones:
-            for indicador in accion.indicadores.all():
-                resultados = indicador.resultados.all().order_by('-fecha')
-
-                if not resultados.exists():
-                    # Sin mediciones nunca
-                    alertas.append({
-                        'indicador': indicador,
-                        'accion': accion,
-                        'tipo': 'sin_mediciones',
-                        'prioridad': NotificationPriority.HIGH,
-                        'mensaje': f'El indicador "{indicador.nombre}" no tiene mediciones registradas',
-                        'dias_sin_medir': 'Nunca'
-                    })
-                else:
-                    ultima_medicion = resultados.first()
-                    dias_sin_medir = (timezone.now().date() - ultima_medicion.fecha).days
-
-                    if ultima_medicion.fecha < fecha_limite:
-                        # Determinar prioridad según días sin medir
-                        if dias_sin_medir > 180:
-                            prioridad = NotificationPriority.CRITICAL
-                        elif dias_sin_medir > 120:
-                            prioridad = NotificationPriority.HIGH
-                        else:
-                            prioridad = NotificationPriority.MEDIUM
-
-                        alertas.append({
-                            'indicador': indicador,
-                            'accion': accion,
-                            'tipo': 'medicion_atrasada',
-                            'prioridad': prioridad,
-                            'mensaje': f'Hace {dias_sin_medir} días sin medir "{indicador.nombre}"',
-                            'dias_sin_medir': dias_sin_medir
-                        })
+        for f in filas:
+            indicador = indicadores[int(estado['ids'][estado['indice'][f]])]
+            alerta = {
+                'indicador': indicador,
+                'accion': acciones[int(estado['accion'][f])],
+                'prioridad': str(prioridades[f]),
+            }
+            if nunca[f]:
+                alerta.update({
+                    'tipo': 'sin_mediciones',
+                    'mensaje': f'El indicador "{indicador.nombre}" no tiene mediciones registradas',
+                    'dias_sin_medir': 'Nunca'
+                })
+            else:
+                alerta.update({
+                    'tipo': 'medicion_atrasada',
+                    'mensaje': f'Hace {dias_sin_medir[f]} días sin medir "{indicador.nombre}"',
+                    'dias_sin_medir': int(dias_sin_medir[f])
+                })
+            alertas.append(alerta)
 
         return alertas
 
     def check_metas_en_riesgo(self, umbral_dias: int = 30) -> List[Dict]:
         """Detecta metas en riesgo de no cumplirse"""
-        from registro.models import Accion
+        estado = self._estado_indicadores()
+        hoy = np.datetime64(timezone.now().date(), 'D')
+        meta = self._progreso_meta(estado)
+
+        indice = estado['indice']
+        meta_fecha = estado['meta_fecha'][indice]
+        con_meta = ~np.isnan(estado['meta_valor'][indice]) & ~np.isnat(meta_fecha)
+        dias_restantes = np.where(con_meta, (meta_fecha - hoy).astype(np.int64), 0)
+        progreso = meta['progreso'][indice]
+        con_progreso = con_meta & ~np.isnan(progreso)
+
+        # Progreso esperado según el tiempo transcurrido desde el inicio de la acción
+        inicio = estado['inicio_accion']
+        con_inicio = ~np.isnat(inicio)
+        dias_totales = np.where(con_inicio & con_meta, (meta_fecha - inicio).astype(np.int64), 0)
+        dias_transcurridos = np.where(con_inicio, (hoy - inicio).astype(np.int64), 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            progreso_esperado = np.where(dias_totales > 0, dias_transcurridos / dias_totales * 100, 0)
+
+        vencida = con_progreso & (dias_restantes < 0) & ~meta['alcanzada'][indice]
+        en_riesgo = (con_progreso & (dias_restantes >= 0) & (dias_restantes <= umbral_dias) &
+                     (progreso < progreso_esperado - 20))
+
+        filas = np.flatnonzero(vencida | en_riesgo)
+        acciones, indicadores = self._instancias(estado, filas)
 
         alertas = []
-        hoy = timezone.now().date()
-
-        acciones = Accion.objects.filter(publicado=True)
-
-        for accion in acciones:
-            for indicador in accion.indicadores.filter(
-                    meta_valor__isnull=False,
-                    meta_fecha_limite__isnull=False
-            ):
-                # Verificar si la meta está próxima a vencer
-                dias_restantes = (indicador.meta_fecha_limite - hoy).days
-
-                if dias_restantes < 0:
-                    # Meta vencida
-                    progreso = indicador.calcular_progreso_meta()
-                    if progreso and not progreso['meta_alcanzada']:
-                        alertas.append({
-                            'indicador': indicador,
-                            'accion': accion,
-                            'tipo': 'meta_vencida',
-                            'prioridad': NotificationPriority.CRITICAL,
-                            'mensaje': f'Meta vencida sin cumplir: "{indicador.nombre}"',
-                            'progreso': progreso['progreso_porcentaje'],
-                            'dias_restantes': dias_restantes
-                        })
-                elif 0 <= dias_restantes <= umbral_dias:
-                    # Meta próxima a vencer
-                    progreso = indicador.calcular_progreso_meta()
-
-                    if progreso:
-                        porcentaje = progreso['progreso_porcentaje']
-
-                        # Calcular si el progreso está atrasado
-                        dias_totales = (
-                                indicador.meta_fecha_limite -
-                                accion.fecha_inicio
-                        ).days
-                        dias_transcurridos = (hoy - accion.fecha_inicio).days
-                        progreso_esperado = (
-                            dias_transcurridos / dias_totales * 100
-                            if dias_totales > 0 else 0
-                        )
-
-                        if porcentaje < (progreso_esperado - 20):
-                            # Progreso significativamente atrasado
-                            prioridad = (
-                                NotificationPriority.CRITICAL if dias_restantes <= 7
-                                else NotificationPriority.HIGH
-                            )
-
-                            alertas.append({
-                                'indicador': indicador,
-                                'accion': accion,
-                                'tipo': 'meta_en_riesgo',
-                                'prioridad': prioridad,
-                                'mensaje': f'Meta en riesgo: "{indicador.nombre}" '
-                                           f'(Progreso: {porcentaje:.1f}%, '
-                                           f'Esperado: {progreso_esperado:.1f}%)',
-                                'progreso': porcentaje,
-                                'progreso_esperado': progreso_esperado,
-                                'dias_restantes': dias_restantes
-                            })
+        for f in filas:
+            indicador = indicadores[int(estado['ids'][indice[f]])]
+            accion = acciones[int(estado['accion'][f])]
+            if vencida[f]:
+                alertas.append({
+                    'indicador': indicador,
+                    'accion': accion,
+                    'tipo': 'meta_vencida',
+                    'prioridad': NotificationPriority.CRITICAL,
+                    'mensaje': f'Meta vencida sin cumplir: "{indicador.nombre}"',
+                    'progreso': float(progreso[f]),
+                    'dias_restantes': int(dias_restantes[f])
+                })
+            else:
+                alertas.append({
+                    'indicador': indicador,
+                    'accion': accion,
+                    'tipo': 'meta_en_riesgo',
+                    'prioridad': (NotificationPriority.CRITICAL if dias_restantes[f] <= 7
+                                  else NotificationPriority.HIGH),
+                    'mensaje': f'Meta en riesgo: "{indicador.nombre}" '
+                               f'(Progreso: {progreso[f]:.1f}%, '
+                               f'Esperado: {progreso_esperado[f]:.1f}%)',
+                    'progreso': float(progreso[f]),
+                    'progreso_esperado': float(progreso_esperado[f]),
+                    'dias_restantes': int(dias_restantes[f])
+                })
 
         return alertas
 
     def check_tendencias_negativas(self, min_mediciones: int = 3) -> List[Dict]:
         """Detecta tendencias negativas consecutivas"""
-        from registro.models import Accion
+        estado = self._estado_indicadores(min_mediciones)
+
+        # Valores en orden cronológico; los NaN hacen fallar ambas comparaciones
+        valores = estado['valores'][:, ::-1]
+        diferencias = np.diff(valores, axis=1)
+        completos = estado['cantidad'] >= min_mediciones
+        descendente = completos & estado['incremento'] & np.all(diferencias < 0, axis=1)
+        ascendente = completos & estado['decremento'] & np.all(diferencias > 0, axis=1)
+
+        indice = estado['indice']
+        filas = np.flatnonzero((descendente | ascendente)[indice])
+        acciones, indicadores = self._instancias(estado, filas)
 
         alertas = []
-        acciones = Accion.objects.filter(publicado=True)
-
-        for accion in acciones:
-            for indicador in accion.indicadores.all():
-                resultados = list(
-                    indicador.resultados.all().order_by('-fecha')[:min_mediciones]
-                )
-
-                if len(resultados) < min_mediciones:
-                    continue
-
-                # Verificar si hay tendencia negativa
-                valores = [r.valor for r in reversed(resultados)]
-
-                if indicador.direccion_optima == 'incremento':
-                    # Debería aumentar, pero está disminuyendo
-                    if all(valores[i] > valores[i + 1]
-                           for i in range(len(valores) - 1)):
-                        alertas.append({
-                            'indicador': indicador,
-                            'accion': accion,
-                            'tipo': 'tendencia_negativa',
-                            'prioridad': NotificationPriority.HIGH,
-                            'mensaje': f'Tendencia descendente en "{indicador.nombre}" '
-                                       f'(últimas {min_mediciones} mediciones)',
-                            'valores': valores
-                        })
-                elif indicador.direccion_optima == 'decremento':
-                    # Debería disminuir, pero está aumentando
-                    if all(valores[i] < valores[i + 1]
-                           for i in range(len(valores) - 1)):
-                        alertas.append({
-                            'indicador': indicador,
-                            'accion': accion,
-                            'tipo': 'tendencia_negativa',
-                            'prioridad': NotificationPriority.HIGH,
-                            'mensaje': f'Tendencia ascendente no deseada en '
-                                       f'"{indicador.nombre}" '
-                                       f'(últimas {min_mediciones} mediciones)',
-                            'valores': valores
-                        })
+        for f in filas:
+            i = indice[f]
+            indicador = indicadores[int(estado['ids'][i])]
+            if descendente[i]:
+                # Debería aumentar, pero está disminuyendo
+                mensaje = (f'Tendencia descendente en "{indicador.nombre}" '
+                           f'(últimas {min_mediciones} mediciones)')
+            else:
+                # Debería disminuir, pero está aumentando
+                mensaje = (f'Tendencia ascendente no deseada en '
+                           f'"{indicador.nombre}" '
+                           f'(últimas {min_mediciones} mediciones)')
+            alertas.append({
+                'indicador': indicador,
+                'accion': acciones[int(estado['accion'][f])],
+                'tipo': 'tendencia_negativa',
+                'prioridad': NotificationPriority.HIGH,
+                'mensaje': mensaje,
+                'valores': valores[i].tolist()
+            })
 
         return alertas
 
@@ -240,95 +317,159 @@ class IndicadorAlertService:
 
 
 class PresupuestoAlertService:
-    """Servicio para alertas de presupuesto"""
+    """
+    Servicio para alertas de presupuesto.
+
+    Las reglas se aplican sobre una sola consulta con una fila por presupuesto planificado de cada
+    acción publicada; solo se cargan las instancias de las filas que generan alerta.
+    """
 
     def __init__(self, notification_service: NotificationService):
         self.notification_service = notification_service
 
-    def check_ejecucion_presupuestaria(self, umbral_bajo: float = 30) -> List[Dict]:
-        """Detecta presupuestos con baja ejecución"""
+    def _estado_presupuestos(self) -> Dict:
+        """
+        Devuelve como arreglos de NumPy el monto, el monto ejecutado (mantenido por
+        registro/signals.py), el usuario y las fechas de la acción de cada par
+        (acción publicada, presupuesto planificado).
+        """
         from registro.models import Accion
 
-        alertas = []
+        filas = list(
+            Accion.presupuestos_planificados.through.objects
+            .filter(accion__publicado=True)
+            .values_list('accion_id', 'accion__user_id', 'presupuestoplanificado_id',
+                         'presupuestoplanificado__monto', 'presupuestoplanificado__monto_ejecutado',
+                         'accion__fecha_inicio', 'accion__fecha_fin')
+        )
+        columnas = list(zip(*filas)) or [()] * 7
 
-        for accion in Accion.objects.filter(publicado=True):
-            for presupuesto in accion.presupuestos_planificados.all():
-                ejecutado = presupuesto.presupuestos_ejecutados.aggregate(
-                    total=Sum('monto')
-                )['total'] or 0
-
-                porcentaje_ejecutado = (
-                    ejecutado / presupuesto.monto * 100
-                    if presupuesto.monto > 0 else 0
-                )
-
-                # Calcular tiempo transcurrido de la acción
-                hoy = timezone.now().date()
-                dias_totales = (accion.fecha_fin - accion.fecha_inicio).days
-                dias_transcurridos = (hoy - accion.fecha_inicio).days
-                porcentaje_tiempo = (
-                    dias_transcurridos / dias_totales * 100
-                    if dias_totales > 0 else 0
-                )
-
-                # Alerta si la ejecución está muy por debajo del tiempo
-                if porcentaje_ejecutado < (porcentaje_tiempo - 20) and porcentaje_tiempo > 25:
-                    prioridad = (
-                        NotificationPriority.CRITICAL
-                        if porcentaje_ejecutado < umbral_bajo
-                        else NotificationPriority.HIGH
-                    )
-
-                    alertas.append({
-                        'accion': accion,
-                        'presupuesto': presupuesto,
-                        'tipo': 'ejecucion_baja',
-                        'prioridad': prioridad,
-                        'mensaje': f'Baja ejecución presupuestaria en "{accion.nombre}" '
-                                   f'({porcentaje_ejecutado:.1f}% ejecutado, '
-                                   f'{porcentaje_tiempo:.1f}% del tiempo transcurrido)',
-                        'porcentaje_ejecutado': porcentaje_ejecutado,
-                        'porcentaje_tiempo': porcentaje_tiempo
-                    })
+        monto = np.array(columnas[3], dtype=float)
+        ejecutado = np.array(columnas[4], dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            porcentaje = np.where(monto > 0, ejecutado / monto * 100, 0)
 
-        return alertas
+        return {
+            'accion': np.array(columnas[0], dtype=np.int64),
+            'user': np.array(columnas[1], dtype=np.int64),
+            'presupuesto': np.array(columnas[2], dtype=np.int64),
+            'monto': monto,
+            'ejecutado': ejecutado,
+            'porcentaje': porcentaje,
+            'inicio': np.array(columnas[5], dtype='datetime64[D]'),
+            'fin': np.array(columnas[6], dtype='datetime64[D]'),
+        }
 
-    def check_presupuesto_agotado(self, umbral: float = 95) -> List[Dict]:
-        """Detecta presupuestos próximos a agotarse"""
-        from registro.models import Accion
+    @staticmethod
+    def _instancias(estado, filas):
+        """Carga solo las acciones (con su usuario) y presupuestos de las filas que generan alerta"""
+        from registro.models import Accion, PresupuestoPlanificado
+
+        acciones = Accion.objects.select_related('user').in_bulk(set(estado['accion'][filas].tolist()))
+        presupuestos = PresupuestoPlanificado.objects.in_bulk(set(estado['presupuesto'][filas].tolist()))
+        return acciones, presupuestos
+
+    def check_ejecucion_presupuestaria(self, umbral_bajo: float = 30, margen_tiempo: float = 20,
+                                       tiempo_minimo: float = 25) -> List[Dict]:
+        """
+        Detecta presupuestos con baja ejecución: el porcentaje ejecutado queda `margen_tiempo`
+        puntos por debajo del porcentaje de tiempo transcurrido de la acción, una vez superado
+        `tiempo_minimo`. Es crítica si además la ejecución está por debajo de `umbral_bajo`.
+        """
+        estado = self._estado_presupuestos()
+        hoy = np.datetime64(timezone.now().date(), 'D')
+
+        con_fechas = ~np.isnat(estado['inicio']) & ~np.isnat(estado['fin'])
+        dias_totales = np.where(con_fechas, (estado['fin'] - estado['inicio']).astype(np.int64), 0)
+        dias_transcurridos = np.where(con_fechas, (hoy - estado['inicio']).astype(np.int64), 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            porcentaje_tiempo = np.where(dias_totales > 0, dias_transcurridos / dias_totales * 100, 0)
+
+        porcentaje = estado['porcentaje']
+        filas = np.flatnonzero((porcentaje < porcentaje_tiempo - margen_tiempo) &
+                               (porcentaje_tiempo > tiempo_minimo))
+        acciones, presupuestos = self._instancias(estado, filas)
 
         alertas = []
+        for f in filas:
+            accion = acciones[int(estado['accion'][f])]
+            alertas.append({
+                'accion': accion,
+                'presupuesto': presupuestos[int(estado['presupuesto'][f])],
+                'user_id': int(estado['user'][f]),
+                'tipo': 'ejecucion_baja',
+                'prioridad': (NotificationPriority.CRITICAL if porcentaje[f] < umbral_bajo
+                              else NotificationPriority.HIGH),
+                'mensaje': f'Baja ejecución presupuestaria en "{accion.nombre}" '
+                           f'({porcentaje[f]:.1f}% ejecutado, '
+                           f'{porcentaje_tiempo[f]:.1f}% del tiempo transcurrido)',
+                'porcentaje_ejecutado': float(porcentaje[f]),
+                'porcentaje_tiempo': float(porcentaje_tiempo[f])
+            })
 
-        for accion in Accion.objects.filter(publicado=True):
-            for presupuesto in accion.presupuestos_planificados.all():
-                ejecutado = presupuesto.presupuestos_ejecutados.aggregate(
-                    total=Sum('monto')
-                )['total'] or 0
-
-                porcentaje_ejecutado = (
-                    ejecutado / presupuesto.monto * 100
-                    if presupuesto.monto > 0 else 0
-                )
-
-                if porcentaje_ejecutado >= umbral and porcentaje_ejecutado < 100:
-                    alertas.append({
-                        'accion': accion,
-                        'presupuesto': presupuesto,
-                        'tipo': 'presupuesto_agotandose',
-                        'prioridad': NotificationPriority.HIGH,
-                        'mensaje': f'Presupuesto próximo a agotarse en "{accion.nombre}" '
-                                   f'({porcentaje_ejecutado:.1f}% ejecutado)',
-                        'porcentaje_ejecutado': porcentaje_ejecutado
-                    })
-                elif porcentaje_ejecutado >= 100:
-                    alertas.append({
-                        'accion': accion,
-                        'presupuesto': presupuesto,
-                        'tipo': 'presupuesto_agotado',
-                        'prioridad': NotificationPriority.CRITICAL,
-                        'mensaje': f'Presupuesto agotado en "{accion.nombre}"',
-                        'porcentaje_ejecutado': porcentaje_ejecutado
-                    })
+        return alertas
+
+    def check_presupuesto_agotado(self, umbral: float = 95, dias_anticipacion: int = 30) -> List[Dict]:
+        """
+        Detecta presupuestos agotados o que se agotarán en los próximos `dias_anticipacion` días
+        según su ritmo de gasto reciente. El umbral de porcentaje se mantiene para presupuestos
+        sin gasto reciente con el que proyectar.
+        """
+        from registro.models import PresupuestoPlanificado
+        from registro.Services import SerieEjecucionPresupuestoService
+
+        estado = self._estado_presupuestos()
+        ids, unicos = np.unique(estado['presupuesto'], return_index=True)
+        proyecciones = SerieEjecucionPresupuestoService.proyecciones(
+            PresupuestoPlanificado(id=int(ids[i]), monto=estado['monto'][u], monto_ejecutado=estado['ejecutado'][u])
+            for i, u in enumerate(unicos)
+        )
+        dias_restantes = np.array(
+            [proyecciones[int(p)]['dias_restantes'] for p in estado['presupuesto']], dtype=float)
+
+        porcentaje = estado['porcentaje']
+        agotado = porcentaje >= 100
+        proyectado = ~agotado & (dias_restantes <= dias_anticipacion)
+        sobre_umbral = ~agotado & ~proyectado & (porcentaje >= umbral)
+
+        filas = np.flatnonzero(agotado | proyectado | sobre_umbral)
+        acciones, presupuestos = self._instancias(estado, filas)
+
+        alertas = []
+        for f in filas:
+            accion = acciones[int(estado['accion'][f])]
+            alerta = {
+                'accion': accion,
+                'presupuesto': presupuestos[int(estado['presupuesto'][f])],
+                'user_id': int(estado['user'][f]),
+                'porcentaje_ejecutado': float(porcentaje[f])
+            }
+            if agotado[f]:
+                alerta.update({
+                    'tipo': 'presupuesto_agotado',
+                    'prioridad': NotificationPriority.CRITICAL,
+                    'mensaje': f'Presupuesto agotado en "{accion.nombre}"',
+                })
+            elif proyectado[f]:
+                proyeccion = proyecciones[int(estado['presupuesto'][f])]
+                fecha = proyeccion['fecha_agotamiento'].strftime('%d/%m/%Y')
+                alerta.update({
+                    'tipo': 'presupuesto_agotandose',
+                    'prioridad': NotificationPriority.HIGH,
+                    'mensaje': f'Al ritmo de gasto actual el presupuesto de "{accion.nombre}" '
+                               f'se agotará alrededor del {fecha} '
+                               f'({porcentaje[f]:.1f}% ejecutado)',
+                    'fecha_agotamiento': proyeccion['fecha_agotamiento'],
+                    'dias_restantes': proyeccion['dias_restantes']
+                })
+            else:
+                alerta.update({
+                    'tipo': 'presupuesto_agotandose',
+                    'prioridad': NotificationPriority.HIGH,
+                    'mensaje': f'Presupuesto próximo a agotarse en "{accion.nombre}" '
+                               f'({porcentaje[f]:.1f}% ejecutado)',
+                })
+            alertas.append(alerta)
 
         return alertas
 
@@ -0,0 +1,193 @@
+"""
+Pronóstico de las series de resultados de indicadores.
+
+ajustar() compara tres modelos sobre los últimos puntos de la serie (holdout) y se queda con el de
+menor error absoluto medio, reajustado con la serie completa:
+
+- lineal: recta por mínimos cuadrados sobre la fecha real de cada resultado.
+- holt: suavizado exponencial con tendencia; alfa y beta se eligen en una rejilla que se evalúa
+  para todas las combinaciones a la vez.
+- estacional: repite el valor de la misma estación del ciclo anterior (solo si se conoce el
+  periodo a partir de la frecuencia de medición y hay al menos dos ciclos).
+
+El horizonte se mide en pasos de la mediana de días entre resultados. Los intervalos suponen
+errores normales con la desviación de los residuos de un paso. El ajuste es un diccionario de
+números y listas para poder guardarlo en caché; proyectar() y probabilidad_meta() lo usan sin
+volver a ajustar.
+"""
+import math
+from datetime import timedelta
+
+import numpy as np
+
+# Mínimo de resultados para pronosticar y para comparar modelos con holdout
+MINIMO_PUNTOS = 3
+MINIMO_HOLDOUT = 6
+
+Z_80 = 1.2816
+Z_95 = 1.96
+
+_REJILLA = np.linspace(0.1, 0.9, 9)
+_ALFAS, _BETAS = (m.ravel() for m in np.meshgrid(_REJILLA, _REJILLA))
+
+
+def _holt(y, alfas, betas):
+    """Recorre la serie con cada par (alfa, beta); devuelve nivel, tendencia y errores de un paso"""
+    nivel = np.full(alfas.shape, y[0])
+    tendencia = np.full(alfas.shape, y[1] - y[0])
+    errores = np.empty((len(y) - 1, len(alfas)))
+    for t in range(1, len(y)):
+        prediccion = nivel + tendencia
+        errores[t - 1] = y[t] - prediccion
+        nuevo_nivel = alfas * y[t] + (1 - alfas) * prediccion
+        tendencia = betas * (nuevo_nivel - nivel) + (1 - betas) * tendencia
+        nivel = nuevo_nivel
+    return nivel, tendencia, errores
+
+
+def _ajustar_modelo(modelo, x, y, periodo):
+    n = len(y)
+    if modelo == 'lineal':
+        pendiente, intercepto = np.polyfit(x, y, 1)
+        residuos = y - (intercepto + pendiente * x)
+        return {
+            'pendiente': float(pendiente),
+            'intercepto': float(intercepto),
+            'n': n,
+            'x_medio': float(x.mean()),
+            'sxx': float(((x - x.mean()) ** 2).sum()),
+            'sigma': float(np.sqrt((residuos ** 2).sum() / max(n - 2, 1))),
+        }
+    if modelo == 'holt':
+        nivel, tendencia, errores = _holt(y, _ALFAS, _BETAS)
+        mejor = int(np.argmin((errores ** 2).mean(axis=0)))
+        return {
+            'alfa': float(_ALFAS[mejor]),
+            'beta': float(_BETAS[mejor]),
+            'nivel': float(nivel[mejor]),
+            'tendencia': float(tendencia[mejor]),
+            'sigma': float(np.sqrt((errores[:, mejor] ** 2).mean())),
+        }
+    residuos = y[periodo:] - y[:-periodo]
+    return {
+        'periodo': periodo,
+        'ultimos': y[-periodo:].tolist(),
+        'sigma': float(np.sqrt((residuos ** 2).mean())),
+    }
+
+
+def _predecir(modelo, parametros, x, pasos):
+    """Valor y desviación del error para las posiciones x (lineal) o los pasos 1..h"""
+    if modelo == 'lineal':
+        p = parametros
+        valor = p['intercepto'] + p['pendiente'] * x
+        desviacion = p['sigma'] * np.sqrt(1 + 1 / p['n'] + (x - p['x_medio']) ** 2 / max(p['sxx'], 1e-12))
+        return valor, desviacion
+    if modelo == 'holt':
+        p = parametros
+        return p['nivel'] + pasos * p['tendencia'], p['sigma'] * np.sqrt(pasos)
+    ultimos = np.asarray(parametros['ultimos'])
+    periodo = parametros['periodo']
+    return ultimos[(pasos - 1) % periodo], parametros['sigma'] * np.sqrt((pasos - 1) // periodo + 1)
+
+
+def _candidatos(n, periodo):
+    modelos = ['lineal', 'holt']
+    if periodo and n >= 2 * periodo:
+        modelos.append('estacional')
+    return modelos
+
+
+def ajustar(fechas, valores, periodo=None):
+    """
+    Ajusta la serie (fechas en orden creciente) y devuelve el modelo elegido con sus parámetros,
+    o None si hay menos de MINIMO_PUNTOS resultados. periodo es el número de resultados por ciclo
+    estacional.
+    """
+    fechas = np.asarray(fechas, dtype='datetime64[D]')
+    y = np.asarray(valores, dtype=float)
+    validos = ~np.isnan(y)
+    fechas, y = fechas[validos], y[validos]
+    n = len(y)
+    if n < MINIMO_PUNTOS:
+        return None
+
+    dias = (fechas - fechas[0]).astype(np.int64).astype(float)
+    paso_dias = float(np.median(np.diff(dias))) or 1.0
+    x = dias / paso_dias
+
+    errores = {}
+    if n >= MINIMO_HOLDOUT:
+        k = max(1, min(n // 4, periodo or 3))
+        pasos = np.arange(1, k + 1)
+        for modelo in _candidatos(n - k, periodo):
+            parametros = _ajustar_modelo(modelo, x[:-k], y[:-k], periodo)
+            prediccion, _ = _predecir(modelo, parametros, x[-k:], pasos)
+            errores[modelo] = float(np.abs(y[-k:] - prediccion).mean())
+        elegido = min(errores, key=errores.get)
+    else:
+        elegido = 'lineal'
+
+    return {
+        'modelo': elegido,
+        'parametros': _ajustar_modelo(elegido, x, y, periodo),
+        'errores_holdout': errores,
+        'n': n,
+        'paso_dias': paso_dias,
+        'x_ultimo': float(x[-1]),
+        'ultima_fecha': fechas[-1].item(),
+        'ultimo_valor': float(y[-1]),
+    }
+
+
+def proyectar(ajuste, horizonte):
+    """Pronóstico de los próximos `horizonte` pasos con intervalos del 80 y 95 %"""
+    pasos = np.arange(1, horizonte + 1)
+    valor, desviacion = _predecir(ajuste['modelo'], ajuste['parametros'], ajuste['x_ultimo'] + pasos, pasos)
+    return {
+        'fechas': [ajuste['ultima_fecha'] + timedelta(days=round(h * ajuste['paso_dias'])) for h in pasos],
+        'valor': valor,
+        'inferior_80': valor - Z_80 * desviacion,
+        'superior_80': valor + Z_80 * desviacion,
+        'inferior_95': valor - Z_95 * desviacion,
+        'superior_95': valor + Z_95 * desviacion,
+    }
+
+
+def pasos_hasta(ajuste, fecha):
+    """Pasos (al menos uno) desde el último resultado hasta la fecha"""
+    return max(1, math.ceil((fecha - ajuste['ultima_fecha']).days / ajuste['paso_dias']))
+
+
+def probabilidad_meta(ajuste, meta_valor, fecha_limite, incremento=True):
+    """Probabilidad de que el valor en fecha_limite alcance la meta según el pronóstico"""
+    if fecha_limite <= ajuste['ultima_fecha']:
+        cumplida = ajuste['ultimo_valor'] >= meta_valor if incremento else ajuste['ultimo_valor'] <= meta_valor
+        return 1.0 if cumplida else 0.0
+    pasos = np.array([pasos_hasta(ajuste, fecha_limite)])
+    valor, desviacion = _predecir(ajuste['modelo'], ajuste['parametros'], ajuste['x_ultimo'] + pasos, pasos)
+    valor, desviacion = float(valor[0]), float(desviacion[0])
+    if desviacion <= 0:
+        return float(valor >= meta_valor if incremento else valor <= meta_valor)
+    z = (valor - meta_valor) / desviacion
+    if not incremento:
+        z = -z
+    return 0.5 * (1 + math.erf(z / math.sqrt(2)))
+
+
+def paso_de_cruce(ajuste, meta_valor, incremento=True, maximo_pasos=600):
+    """Primer paso en que el valor pronosticado alcanza la meta, o None si no la alcanza"""
+    pasos = np.arange(1, maximo_pasos + 1)
+    valor, _ = _predecir(ajuste['modelo'], ajuste['parametros'], ajuste['x_ultimo'] + pasos, pasos)
+    alcanzada = valor >= meta_valor if incremento else valor <= meta_valor
+    if not alcanzada.any():
+        return None
+    return int(pasos[np.argmax(alcanzada)])
+
+
+def periodo_estacional(dias_por_medicion):
+    """Resultados por año según la frecuencia de medición, si forman un ciclo útil (2 a 60)"""
+    if not dias_por_medicion:
+        return None
+    periodo = round(365 / dias_por_medicion)
+    return periodo if 2 <= periodo <= 60 else None
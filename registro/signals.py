@@ -0,0 +1,259 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save, m2m_changed
+from django.dispatch import receiver
+
+from registro import busqueda, cache_versionada
+from registro.Services import ResumenPresupuestoService, AnomaliaService
+from registro.models import Accion, PresupuestoPlanificado, PresupuestoEjecutado, ResultadoIndicador, \
+    DocumentoBusqueda
+
+
+# ============================================================================
+# Base de datos: pragmas de SQLite en cada conexión (settings.SQLITE_PRAGMAS)
+# ============================================================================
+
+@receiver(connection_created)
+def configurar_conexion_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, valor in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {valor}')
+
+
+# ============================================================================
+# Resumen de presupuesto: mantiene ResumenPresupuestoAccion/Sector/Territorio
+# ============================================================================
+
+@receiver(post_save, sender=PresupuestoEjecutado)
+def post_save_presupuesto_ejecutado(sender, instance, **kwargs):
+    ResumenPresupuestoService.actualizar_presupuestos_planificados(
+        instance.presupuestos_ejecutados.values_list('id', flat=True)
+    )
+
+
+@receiver(pre_delete, sender=PresupuestoEjecutado)
+def pre_delete_presupuesto_ejecutado(sender, instance, **kwargs):
+    # Las filas de la tabla intermedia desaparecen antes de post_delete
+    instance._presupuestos_afectados = list(instance.presupuestos_ejecutados.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=PresupuestoEjecutado)
+def post_delete_presupuesto_ejecutado(sender, instance, **kwargs):
+    ResumenPresupuestoService.actualizar_presupuestos_planificados(
+        getattr(instance, '_presupuestos_afectados', [])
+    )
+
+
+@receiver(m2m_changed, sender=PresupuestoPlanificado.presupuestos_ejecutados.through)
+def m2m_changed_presupuestos_ejecutados(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._presupuestos_afectados = list(instance.presupuestos_ejecutados.values_list('id', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        presupuesto_ids = [instance.pk]
+    elif action == 'post_clear':
+        presupuesto_ids = getattr(instance, '_presupuestos_afectados', [])
+    else:
+        presupuesto_ids = pk_set or []
+    ResumenPresupuestoService.actualizar_presupuestos_planificados(presupuesto_ids)
+
+
+@receiver(post_save, sender=PresupuestoPlanificado)
+def post_save_presupuesto_planificado(sender, instance, created, **kwargs):
+    if created:
+        # Aún no pertenece a ninguna acción; se contabiliza al añadirse con m2m_changed
+        return
+    ResumenPresupuestoService.actualizar_acciones(
+        instance.presupuestos_planificados.values_list('id', flat=True)
+    )
+
+
+@receiver(pre_delete, sender=PresupuestoPlanificado)
+def pre_delete_presupuesto_planificado(sender, instance, **kwargs):
+    instance._acciones_afectadas = list(instance.presupuestos_planificados.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=PresupuestoPlanificado)
+def post_delete_presupuesto_planificado(sender, instance, **kwargs):
+    ResumenPresupuestoService.actualizar_acciones(getattr(instance, '_acciones_afectadas', []))
+
+
+@receiver(m2m_changed, sender=Accion.presupuestos_planificados.through)
+def m2m_changed_presupuestos_planificados(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._acciones_afectadas = list(instance.presupuestos_planificados.values_list('id', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        accion_ids = [instance.pk]
+    elif action == 'post_clear':
+        accion_ids = getattr(instance, '_acciones_afectadas', [])
+    else:
+        accion_ids = pk_set or []
+    ResumenPresupuestoService.actualizar_acciones(accion_ids)
+
+
+@receiver(m2m_changed, sender=Accion.municipios.through)
+@receiver(m2m_changed, sender=Accion.provincias.through)
+def m2m_changed_territorios_accion(sender, instance, action, reverse, model, pk_set, **kwargs):
+    es_municipio = sender is Accion.municipios.through
+
+    if action == 'pre_clear':
+        if reverse:
+            instance._acciones_afectadas = list(instance.accion_set.values_list('id', flat=True))
+        else:
+            relacion = instance.municipios if es_municipio else instance.provincias
+            instance._territorios_afectados = list(relacion.values_list('id', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if reverse:
+        # instance es el municipio o la provincia
+        if action == 'post_clear':
+            accion_ids = getattr(instance, '_acciones_afectadas', [])
+        else:
+            accion_ids = pk_set or []
+        territorios = [instance.pk]
+    else:
+        accion_ids = [instance.pk]
+        if action == 'post_clear':
+            territorios = getattr(instance, '_territorios_afectados', [])
+        else:
+            territorios = pk_set or []
+
+    # Un cambio de municipios también altera qué acciones cuentan a nivel de provincia
+    provincia_ids = set(Accion.provincias.through.objects.filter(
+        accion_id__in=accion_ids).values_list('provincia_id', flat=True))
+    municipio_ids = set()
+    if es_municipio:
+        municipio_ids.update(territorios)
+    else:
+        provincia_ids.update(territorios)
+
+    ResumenPresupuestoService.actualizar_territorios(municipio_ids, provincia_ids)
+
+
+@receiver(pre_save, sender=Accion)
+def pre_save_accion(sender, instance, **kwargs):
+    if instance.pk:
+        instance._sector_anterior_id = Accion.objects.filter(pk=instance.pk).values_list(
+            'sector_id', flat=True).first()
+
+
+@receiver(post_save, sender=Accion)
+def post_save_accion(sender, instance, created, **kwargs):
+    sector_anterior_id = getattr(instance, '_sector_anterior_id', None)
+    if not created and sector_anterior_id and sector_anterior_id != instance.sector_id:
+        ResumenPresupuestoService.actualizar_sectores([sector_anterior_id, instance.sector_id])
+
+
+@receiver(pre_delete, sender=Accion)
+def pre_delete_accion(sender, instance, **kwargs):
+    instance._territorios_afectados = (
+        list(instance.municipios.values_list('id', flat=True)),
+        list(instance.provincias.values_list('id', flat=True)),
+    )
+
+
+@receiver(post_delete, sender=Accion)
+def post_delete_accion(sender, instance, **kwargs):
+    municipio_ids, provincia_ids = getattr(instance, '_territorios_afectados', ([], []))
+    ResumenPresupuestoService.actualizar_sectores([instance.sector_id])
+    ResumenPresupuestoService.actualizar_territorios(municipio_ids, provincia_ids)
+
+
+# ============================================================================
+# Anomalías: revisa el indicador cuando cambia uno de sus resultados
+# ============================================================================
+
+class RevisionAnomalias:
+    """Indicadores que revisar al confirmarse la transacción; uno solo por transacción"""
+
+    def __init__(self):
+        self.indicadores = set()
+
+    def __call__(self):
+        for indicador_id in sorted(self.indicadores):
+            AnomaliaService.revisar_indicador(indicador_id)
+
+
+@receiver(post_save, sender=ResultadoIndicador)
+@receiver(post_delete, sender=ResultadoIndicador)
+def revisar_anomalias_resultado(sender, instance, **kwargs):
+    # Guardar un resultado suele dar varios post_save (el formulario y luego el servicio) y una
+    # edición por lotes, uno por resultado: se junta todo en una revisión por indicador
+    if not settings.ANOMALIAS_DETECCION_AUTOMATICA or instance.indicador_id is None:
+        return
+    conexion = transaction.get_connection()
+    revision = getattr(conexion, '_revision_anomalias', None)
+    # Tras confirmar o revertir, Django retira la revisión de run_on_commit y hace falta otra
+    if revision is None or not any(pendiente[1] is revision for pendiente in conexion.run_on_commit):
+        revision = conexion._revision_anomalias = RevisionAnomalias()
+        revision.indicadores.add(instance.indicador_id)
+        transaction.on_commit(revision)
+    else:
+        revision.indicadores.add(instance.indicador_id)
+
+
+# ============================================================================
+# Búsqueda de texto completo: reindexa los objetos al confirmarse sus cambios
+# ============================================================================
+
+def reindexar_busqueda(sender, instance, **kwargs):
+    tipo, objeto_id = _TIPOS_BUSQUEDA[sender], instance.pk
+    if 'created' in kwargs:
+        transaction.on_commit(lambda: busqueda.indexar(tipo, [objeto_id]))
+    else:
+        transaction.on_commit(lambda: busqueda.eliminar(tipo, [objeto_id]))
+
+
+def reindexar_busqueda_m2m(sender, instance, action, model, pk_set, **kwargs):
+    # La acción a la que enlaza un indicador, resultado o documento sale de estas relaciones
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not isinstance(instance, Accion):
+        tipo, objeto_ids = _TIPOS_BUSQUEDA[type(instance)], [instance.pk]
+    elif action == 'post_clear':
+        tipo = _TIPOS_BUSQUEDA[model]
+        objeto_ids = list(DocumentoBusqueda.objects.filter(tipo=tipo, id_accion=instance.pk)
+                          .values_list('objeto_id', flat=True))
+    else:
+        tipo, objeto_ids = _TIPOS_BUSQUEDA[model], list(pk_set)
+    if objeto_ids:
+        transaction.on_commit(lambda: busqueda.indexar(tipo, objeto_ids))
+
+
+_TIPOS_BUSQUEDA = {fuente[0]: tipo for tipo, fuente in busqueda.FUENTES.items()}
+for _modelo, _tipo in _TIPOS_BUSQUEDA.items():
+    post_save.connect(reindexar_busqueda, sender=_modelo, dispatch_uid=f'busqueda_save_{_tipo}')
+    post_delete.connect(reindexar_busqueda, sender=_modelo, dispatch_uid=f'busqueda_delete_{_tipo}')
+for _tipo, (_, _, _, _intermedia, _) in busqueda.FUENTES.items():
+    if _intermedia is not None:
+        m2m_changed.connect(reindexar_busqueda_m2m, sender=_intermedia, dispatch_uid=f'busqueda_m2m_{_tipo}')
+
+
+# ============================================================================
+# Bus de invalidación: cambios de modelos -> espacios de caché versionados
+# ============================================================================
+
+def invalidar_cache_modelo(sender, **kwargs):
+    cache_versionada.invalidar_modelos(sender)
+
+
+def invalidar_cache_m2m(sender, instance, action, model, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        cache_versionada.invalidar_modelos(type(instance), model)
+
+
+for _modelo in cache_versionada.modelos_observados():
+    post_save.connect(invalidar_cache_modelo, sender=_modelo, dispatch_uid=f'cache_save_{_modelo._meta.label}')
+    post_delete.connect(invalidar_cache_modelo, sender=_modelo, dispatch_uid=f'cache_delete_{_modelo._meta.label}')
+    for _campo in _modelo._meta.many_to_many:
+        m2m_changed.connect(invalidar_cache_m2m, sender=_campo.remote_field.through,
+                            dispatch_uid=f'cache_m2m_{_campo.remote_field.through._meta.label}')
@@ -0,0 +1,227 @@
+"""
+Subida por fragmentos y reanudable de documentos grandes a una acción.
+
+El cliente abre una subida con el nombre, el tamaño y, si lo tiene, el SHA-256 del fichero
+(crear); el servidor reserva un fichero parcial de ese tamaño en settings.SUBIDAS_DIR y fija el
+tamaño de fragmento. Cada fragmento se envía con PUT a su índice y se copia del cuerpo de la
+petición a su posición del fichero en bloques de BLOQUE bytes, sin cargarlo entero en memoria
+(escribir_fragmento); puede llevar su propio SHA-256 en la cabecera X-Checksum-Sha256. Los
+fragmentos recibidos se anotan en un mapa de bits, de modo que tras una interrupción el cliente
+consulta cuáles faltan (estado) y envía solo esos, en cualquier orden o en paralelo. Al
+completar se calcula el SHA-256 del fichero, se compara con el declarado y el fichero se mueve
+al almacenamiento por contenido de registro.documentos y se adjunta a la acción; la suma y el
+traslado se hacen fuera de transacción, con la subida en estado 'verificando'.
+
+limpiar_caducadas() (comando limpiar_subidas) borra las subidas sin actividad en
+settings.SUBIDAS_CADUCIDAD_HORAS horas y sus ficheros parciales.
+"""
+import hashlib
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
+
+from registro import documentos
+from registro.models import Documento, SubidaDocumento
+
+BLOQUE = 256 * 1024
+_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+class ErrorSubida(Exception):
+    def __init__(self, mensaje, status=400, **datos):
+        super().__init__(mensaje)
+        self.status = status
+        self.datos = datos
+
+
+def ruta_parcial(subida):
+    return os.path.join(settings.SUBIDAS_DIR, f'{subida.id}.part')
+
+
+def _fragmentos(subida):
+    return -(-subida.tamano // subida.tamano_fragmento) or 1
+
+
+def _pendientes(subida):
+    mapa = bytes(subida.recibidos)
+    return [i for i in range(_fragmentos(subida)) if not mapa[i // 8] & (1 << i % 8)]
+
+
+def _comprobar_sha256(valor):
+    valor = (valor or '').strip().lower()
+    if valor and not _SHA256.match(valor):
+        raise ErrorSubida('SHA-256 inválido: se esperan 64 dígitos hexadecimales')
+    return valor
+
+
+def crear(accion, usuario, nombre, tamano, sha256=''):
+    """Abre una subida y reserva su fichero parcial"""
+    nombre = os.path.basename((nombre or '').replace('\\', '/')).strip()
+    if not nombre:
+        raise ErrorSubida('Falta el nombre del fichero')
+    if not isinstance(tamano, int) or tamano <= 0:
+        raise ErrorSubida('El tamaño debe ser un entero positivo')
+    if tamano > settings.SUBIDAS_TAMANO_MAXIMO:
+        raise ErrorSubida(f'El tamaño máximo es {settings.SUBIDAS_TAMANO_MAXIMO // 2 ** 20} MB', status=413)
+    subida = SubidaDocumento(accion=accion, usuario=usuario, nombre=nombre[:500], tamano=tamano,
+                             tamano_fragmento=settings.SUBIDAS_TAMANO_FRAGMENTO, sha256=_comprobar_sha256(sha256))
+    subida.recibidos = bytes(-(-_fragmentos(subida) // 8))
+    os.makedirs(settings.SUBIDAS_DIR, exist_ok=True)
+    with open(ruta_parcial(subida), 'wb') as f:
+        # Fichero disperso del tamaño final: cada fragmento se escribe en su sitio
+        f.truncate(tamano)
+    subida.save()
+    return subida
+
+
+def estado(subida):
+    pendientes = _pendientes(subida) if subida.estado == 'activa' else []
+    fragmentos = _fragmentos(subida)
+    return {
+        'id': str(subida.id),
+        'nombre': subida.nombre,
+        'tamano': subida.tamano,
+        'tamano_fragmento': subida.tamano_fragmento,
+        'fragmentos': fragmentos,
+        'pendientes': pendientes,
+        'recibido': min(subida.tamano, (fragmentos - len(pendientes)) * subida.tamano_fragmento),
+        'estado': subida.estado,
+        'documento': subida.documento_id,
+    }
+
+
+def escribir_fragmento(subida, indice, flujo, longitud, sha256=''):
+    """
+    Copia el fragmento `indice` de `flujo` (el cuerpo de la petición) a su posición del fichero
+    parcial y lo anota como recibido. `longitud` es el Content-Length, que debe coincidir con el
+    tamaño del fragmento. Un fragmento incompleto o con la suma equivocada no se anota.
+    """
+    sha256 = _comprobar_sha256(sha256)
+    if subida.estado != 'activa':
+        raise ErrorSubida(f'La subida ya no admite fragmentos ({subida.get_estado_display().lower()})', status=409)
+    if not 0 <= indice < _fragmentos(subida):
+        raise ErrorSubida(f'Fragmento fuera de rango (0-{_fragmentos(subida) - 1})')
+    inicio = indice * subida.tamano_fragmento
+    esperado = min(subida.tamano_fragmento, subida.tamano - inicio)
+    if longitud != esperado:
+        raise ErrorSubida(f'El fragmento {indice} debe tener {esperado} bytes', esperado=esperado)
+
+    resumen = hashlib.sha256() if sha256 else None
+    escritos = 0
+    try:
+        with open(ruta_parcial(subida), 'r+b') as f:
+            f.seek(inicio)
+            while escritos < esperado:
+                bloque = flujo.read(min(BLOQUE, esperado - escritos))
+                if not bloque:
+                    break
+                f.write(bloque)
+                if resumen is not None:
+                    resumen.update(bloque)
+                escritos += len(bloque)
+    except FileNotFoundError:
+        raise ErrorSubida('La subida ya no existe', status=404)
+    if escritos != esperado:
+        raise ErrorSubida(f'Fragmento incompleto: {escritos} de {esperado} bytes', esperado=esperado)
+    if resumen is not None and resumen.hexdigest() != sha256:
+        raise ErrorSubida(f'El SHA-256 del fragmento {indice} no coincide', status=422)
+
+    with transaction.atomic():
+        # Varios fragmentos de la misma subida pueden llegar a la vez
+        subida = SubidaDocumento.objects.select_for_update().get(pk=subida.pk)
+        if subida.estado != 'activa':
+            raise ErrorSubida(f'La subida ya no admite fragmentos ({subida.get_estado_display().lower()})', status=409)
+        mapa = bytearray(subida.recibidos)
+        mapa[indice // 8] |= 1 << indice % 8
+        subida.recibidos = bytes(mapa)
+        subida.save(update_fields=['recibidos', 'actualizada'])
+    return subida
+
+
+def _sha256_fichero(ruta):
+    calculado = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        while bloque := f.read(1024 * 1024):
+            calculado.update(bloque)
+    return calculado.hexdigest()
+
+
+def completar(subida, sha256=''):
+    """
+    Comprueba que están todos los fragmentos y el SHA-256 del fichero y lo adjunta a la acción
+    como Documento. Si la suma no coincide los fragmentos se descartan para volver a enviarlos.
+
+    La suma de un fichero de varios GB tarda: no se calcula con la fila bloqueada. Un bloqueo
+    corto pasa la subida a 'verificando' (no admite más fragmentos ni otro completar), la suma
+    y el traslado al almacenamiento se hacen sin transacción y otro bloqueo corto crea el
+    Documento y cierra la subida. Si algo falla en medio la subida vuelve a 'activa'.
+    """
+    sha256 = _comprobar_sha256(sha256)
+    with transaction.atomic():
+        subida = SubidaDocumento.objects.select_for_update().get(pk=subida.pk)
+        if subida.estado == 'completada':
+            return subida
+        if subida.estado == 'verificando':
+            raise ErrorSubida('La subida se está verificando', status=409)
+        pendientes = _pendientes(subida)
+        if pendientes:
+            raise ErrorSubida(f'Faltan {len(pendientes)} fragmentos', status=409, pendientes=pendientes)
+        subida.estado = 'verificando'
+        subida.save(update_fields=['estado', 'actualizada'])
+
+    try:
+        calculado = _sha256_fichero(ruta_parcial(subida))
+        declarado = sha256 or subida.sha256
+        if declarado and declarado != calculado:
+            subida.recibidos = bytes(len(subida.recibidos))
+            subida.estado = 'activa'
+            subida.save(update_fields=['estado', 'recibidos', 'actualizada'])
+            raise ErrorSubida('El SHA-256 del fichero no coincide; vuelva a enviar los fragmentos', status=422,
+                              sha256=calculado)
+        archivo = documentos.guardar_contenido(ruta_parcial(subida), subida.nombre, calculado, subida.tamano)
+    except ErrorSubida:
+        raise
+    except Exception:
+        SubidaDocumento.objects.filter(pk=subida.pk, estado='verificando').update(estado='activa')
+        raise
+
+    with transaction.atomic():
+        documento = Documento.objects.create(nombre=subida.nombre, documento=archivo.archivo.name, archivo=archivo)
+        subida.accion.documentos.add(documento)
+        subida.estado, subida.documento, subida.sha256 = 'completada', documento, calculado
+        subida.recibidos = b''
+        subida.save(update_fields=['estado', 'documento', 'sha256', 'recibidos', 'actualizada'])
+    return subida
+
+
+def cancelar(subida):
+    if subida.estado == 'verificando':
+        raise ErrorSubida('La subida se está verificando', status=409)
+    if subida.estado == 'activa':
+        _borrar_parcial(subida)
+    subida.delete()
+
+
+def _borrar_parcial(subida):
+    try:
+        os.remove(ruta_parcial(subida))
+    except FileNotFoundError:
+        pass
+
+
+def limpiar_caducadas(horas=None):
+    """
+    Borra las subidas sin completar y sin actividad en `horas` horas; devuelve cuántas. Una que
+    sigue 'verificando' tanto tiempo es de un proceso que se cayó al completarla
+    """
+    horas = settings.SUBIDAS_CADUCIDAD_HORAS if horas is None else horas
+    caducadas = list(SubidaDocumento.objects.filter(estado__in=['activa', 'verificando'],
+                                                    actualizada__lt=now() - timedelta(hours=horas)))
+    for subida in caducadas:
+        _borrar_parcial(subida)
+    SubidaDocumento.objects.filter(pk__in=[s.pk for s in caducadas]).delete()
+    return len(caducadas)
@@ -1,3 +1,960 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from auditlog.models import LogEntry
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from nomencladores.models import EstadoPresupuesto, Municipio, ObjetivosDesarrolloSostenible, Provincia, Sector, TipoAccion, \
+    TipoIndicador, TipoMoneda, TipoPresupuesto, UnidadMedidaIndicador, VariableIndicador
+from registro import anomalias, busqueda, cache_versionada, estaticos, geometria, muestreo, subidas
+from registro.models import Accion, AnomaliaResultado, ArchivoDocumento, Documento, FragmentoDocumento, Indicador, \
+    PresupuestoEjecutado, PresupuestoPlanificado, ResultadoIndicador, ResultadoVariable, ResumenPresupuestoAccion, \
+    ResumenPresupuestoSector, ResumenPresupuestoTerritorio, SubidaDocumento
+from registro.Services import AnomaliaService, MapaAccionesService, PlantillaIndicadorService, PronosticoService, \
+    ResultadoIndicadorService, ResumenPresupuestoService
+from registro.views import VariableIndicadorService
+
+
+def crear_accion(usuario, nombre='Acción', **campos):
+    return Accion.objects.create(user=usuario, nombre=nombre,
+                                 tipo_accion=TipoAccion.objects.get_or_create(nombre='Tipo')[0],
+                                 sector=campos.pop('sector', None) or Sector.objects.get_or_create(nombre='Sector')[0],
+                                 **campos)
+
+
+def crear_indicador(nombre='Indicador', **campos):
+    return Indicador.objects.create(
+        nombre=nombre, formula=campos.pop('formula', 'x'),
+        tipo_indicador=TipoIndicador.objects.get_or_create(nombre='Tipo')[0],
+        unidad_medida=UnidadMedidaIndicador.objects.get_or_create(nombre='kg', sigla='kg')[0],
+        **campos)
+
+
+def crear_resultados(indicador, valores, inicio=datetime.date(2020, 1, 1)):
+    return ResultadoIndicador.objects.bulk_create([
+        ResultadoIndicador(indicador=indicador, valor=valor, fecha=inicio + datetime.timedelta(days=i))
+        for i, valor in enumerate(valores)
+    ])
+
+
+class MuestreoTests(SimpleTestCase):
+    def test_serie_corta_sin_reducir(self):
+        self.assertEqual(muestreo.lttb(range(10), range(10), 20).tolist(), list(range(10)))
+        serie = muestreo.reducir(range(10), range(10), 20)
+        self.assertFalse(serie['reducida'])
+        self.assertNotIn('min', serie)
+
+    def test_lttb_conserva_extremos_y_picos(self):
+        x = np.arange(10000)
+        y = np.sin(x / 500)
+        y[3333] = 50
+        y[7777] = -50
+        elegidos = muestreo.lttb(x, y, 100)
+        self.assertEqual(len(elegidos), 100)
+        self.assertEqual((elegidos[0], elegidos[-1]), (0, 9999))
+        self.assertTrue(np.all(np.diff(elegidos) > 0))
+        self.assertIn(3333, elegidos)
+        self.assertIn(7777, elegidos)
+
+    def test_un_punto_por_cubeta(self):
+        elegidos = muestreo.lttb(np.arange(1000), np.random.default_rng(1).random(1000), 50)
+        limites = muestreo.cubetas(1000, 50)
+        for i, (inicio, fin) in enumerate(zip(limites[:-1], limites[1:])):
+            self.assertTrue(inicio <= elegidos[i + 1] < fin)
+
+    def test_envolvente_contiene_los_elegidos(self):
+        y = np.random.default_rng(2).normal(size=5000)
+        serie = muestreo.reducir(np.arange(5000), y, 200, decimales=6)
+        self.assertTrue(serie['reducida'])
+        self.assertEqual(serie['total'], 5000)
+        self.assertEqual({len(serie[c]) for c in ('x', 'y', 'min', 'max')}, {200})
+        self.assertTrue(all(mn <= v <= mx for mn, v, mx in zip(serie['min'], serie['y'], serie['max'])))
+        self.assertAlmostEqual(min(serie['min']), y.min(), places=6)
+        self.assertAlmostEqual(max(serie['max']), y.max(), places=6)
+
+    def test_reducir_descarta_nan_y_recorta(self):
+        y = np.arange(100, dtype=float)
+        y[10] = np.nan
+        serie = muestreo.reducir(np.arange(100), y, 1000)
+        self.assertEqual(serie['total'], 99)
+        self.assertNotIn(10, serie['x'])
+        tramo = muestreo.reducir(np.arange(100), np.arange(100), 1000, desde=20, hasta=30)
+        self.assertEqual(tramo['x'], list(range(19, 32)))
+
+
+class AnomaliasTests(SimpleTestCase):
+    def serie(self, n=60, semilla=3):
+        return 10 + np.random.default_rng(semilla).normal(scale=0.5, size=n) + np.arange(n) * 0.1
+
+    def test_marca_el_pico_y_no_la_tendencia(self):
+        valores = self.serie()
+        valores[30] += 20
+        deteccion = anomalias.detectar(np.zeros(60), valores)
+        self.assertEqual(np.flatnonzero(deteccion['marcada']).tolist(), [30])
+        self.assertEqual(deteccion['metodo'][30], 'mad')
+        self.assertAlmostEqual(deteccion['esperado'][30], valores[29], delta=2)
+
+    def test_no_finitos_siempre_marcados(self):
+        valores = self.serie()
+        valores[5] = np.inf
+        valores[6] = np.nan
+        deteccion = anomalias.detectar(np.zeros(60), valores)
+        self.assertEqual(deteccion['metodo'][5], 'no_finito')
+        self.assertEqual(deteccion['metodo'][6], 'no_finito')
+        self.assertEqual(deteccion['puntuacion'][5], np.inf)
+
+    def test_series_cortas_sin_evaluar(self):
+        deteccion = anomalias.detectar([1, 1, 1, 1], [1, 1, 1, 100])
+        self.assertFalse(deteccion['marcada'].any())
+
+    def test_estacionalidad_no_es_anomalia(self):
+        t = np.arange(48)
+        valores = 100 + 30 * (t % 12 == 6) + np.random.default_rng(4).normal(scale=0.3, size=48)
+        self.assertFalse(anomalias.detectar(np.zeros(48), valores, {0: 12})['marcada'].any())
+        valores[30] -= 30
+        deteccion = anomalias.detectar(np.zeros(48), valores, {0: 12})
+        self.assertEqual(np.flatnonzero(deteccion['marcada']).tolist(), [30])
+        self.assertEqual(deteccion['metodo'][30], 'estacional')
+
+    def test_series_concatenadas_independientes(self):
+        valores = np.concatenate([self.serie(semilla=5), self.serie(n=20, semilla=6) * 100])
+        valores[70] += 500
+        grupos = np.repeat([7, 8], [60, 20])
+        self.assertEqual(np.flatnonzero(anomalias.detectar(grupos, valores)['marcada']).tolist(), [70])
+
+
+class AnomaliaServiceTests(TestCase):
+    def setUp(self):
+        self.indicador = crear_indicador()
+        valores = [10.0 + i % 3 * 0.1 for i in range(30)]
+        valores[15] = 80
+        self.resultados = crear_resultados(self.indicador, valores)
+
+    def test_revisar_indicador(self):
+        self.assertEqual(AnomaliaService.revisar_indicador(self.indicador.id), 1)
+        anomalia = AnomaliaResultado.objects.get()
+        self.assertEqual(anomalia.resultado_id, self.resultados[15].id)
+        self.assertEqual(anomalia.indicador_id, self.indicador.id)
+
+    def test_descartada_no_se_vuelve_a_marcar(self):
+        AnomaliaService.revisar_indicador(self.indicador.id)
+        AnomaliaResultado.objects.update(descartada=True)
+        self.assertEqual(AnomaliaService.revisar_indicador(self.indicador.id), 0)
+        self.assertEqual(AnomaliaResultado.objects.get().descartada, True)
+
+    def test_sin_resultados_borra_las_pendientes(self):
+        AnomaliaService.revisar_indicador(self.indicador.id)
+        ResultadoIndicador.objects.filter(indicador=self.indicador).exclude(id=self.resultados[15].id).delete()
+        self.assertEqual(AnomaliaService.revisar_indicador(self.indicador.id), 0)
+        self.assertFalse(AnomaliaResultado.objects.exists())
+
+    def test_una_revision_por_indicador_y_transaccion(self):
+        otro = crear_indicador('Otro')
+        with mock.patch.object(AnomaliaService, 'revisar_indicador') as revisar:
+            with self.captureOnCommitCallbacks(execute=True):
+                for resultado in self.resultados[:10]:
+                    resultado.valor += 1
+                    resultado.save()
+                ResultadoIndicador.objects.create(indicador=otro, valor=1, fecha=datetime.date(2020, 1, 1))
+                self.resultados[20].delete()
+        self.assertEqual([c.args for c in revisar.call_args_list], [(self.indicador.id,), (otro.id,)])
+
+    def test_al_confirmar_se_guardan_las_anomalias(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.resultados[5].valor = -70
+            self.resultados[5].save()
+        self.assertEqual(set(AnomaliaResultado.objects.values_list('resultado_id', flat=True)),
+                         {self.resultados[5].id, self.resultados[15].id})
+
+
+class SubidaDocumentoTests(TestCase):
+    FRAGMENTO = 1024
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio)
+        ajustes = override_settings(
+            SUBIDAS_DIR=os.path.join(self.directorio, 'parciales'), MEDIA_ROOT=self.directorio,
+            SUBIDAS_TAMANO_FRAGMENTO=self.FRAGMENTO, SUBIDAS_TAMANO_MAXIMO=10 * self.FRAGMENTO,
+            DOCUMENTOS_EXTRACCION_AUTOMATICA=False)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        self.client.force_login(self.usuario)
+        self.accion = crear_accion(self.usuario)
+        self.contenido = os.urandom(3 * self.FRAGMENTO + 100)
+
+    def crear(self, **datos):
+        datos = {'nombre': 'informe.txt', 'tamano': len(self.contenido), **datos}
+        return self.client.post(reverse('registro:crear_subida_documento', args=[self.accion.id]),
+                                json.dumps(datos), content_type='application/json')
+
+    def enviar(self, id_subida, indice, datos=None, sha256=''):
+        if datos is None:
+            datos = self.contenido[indice * self.FRAGMENTO:(indice + 1) * self.FRAGMENTO]
+        return self.client.put(reverse('registro:fragmento_subida_documento', args=[id_subida, indice]),
+                               datos, content_type='application/octet-stream',
+                               headers={'X-Checksum-Sha256': sha256} if sha256 else None)
+
+    def completar(self, id_subida, **datos):
+        return self.client.post(reverse('registro:completar_subida_documento', args=[id_subida]),
+                                json.dumps(datos), content_type='application/json')
+
+    def test_formulario_publica_las_urls(self):
+        # subida_fragmentada.js sustituye este id (y el fragmento 0) por los de cada subida
+        plantilla = '00000000-0000-0000-0000-000000000000'
+        respuesta = self.client.get(reverse('registro:editar_accion', args=[self.accion.id]))
+        for atributo, url in (('subida-url', reverse('registro:crear_subida_documento', args=[self.accion.id])),
+                              ('subida-estado-url', f'/api/subidas/{plantilla}/'),
+                              ('subida-fragmento-url', f'/api/subidas/{plantilla}/0/'),
+                              ('subida-completar-url', f'/api/subidas/{plantilla}/completar/')):
+            self.assertContains(respuesta, f'data-{atributo}="{url}"')
+
+    def test_reanudar_y_completar(self):
+        respuesta = self.crear(sha256=hashlib.sha256(self.contenido).hexdigest())
+        self.assertEqual(respuesta.status_code, 201)
+        subida = respuesta.json()
+        self.assertEqual((subida['fragmentos'], subida['pendientes']), (4, [0, 1, 2, 3]))
+
+        self.assertEqual(self.enviar(subida['id'], 2).status_code, 200)
+        self.assertEqual(self.enviar(subida['id'], 0).status_code, 200)
+        # Interrumpida: el estado dice qué falta
+        estado = self.client.get(reverse('registro:subida_documento', args=[subida['id']])).json()
+        self.assertEqual(estado['pendientes'], [1, 3])
+        self.assertEqual(self.completar(subida['id']).status_code, 409)
+
+        for indice in estado['pendientes']:
+            self.assertEqual(self.enviar(subida['id'], indice).status_code, 200)
+        respuesta = self.completar(subida['id'])
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['estado'], 'completada')
+
+        documento = self.accion.documentos.get()
+        with documento.archivo.archivo.open('rb') as f:
+            self.assertEqual(f.read(), self.contenido)
+        self.assertFalse(os.path.exists(subidas.ruta_parcial(SubidaDocumento.objects.get())))
+        # Completar otra vez no crea otro documento
+        self.assertEqual(self.completar(subida['id']).status_code, 200)
+        self.assertEqual(self.accion.documentos.count(), 1)
+
+    def test_tamano_maximo(self):
+        self.assertEqual(self.crear(tamano=10 * self.FRAGMENTO + 1).status_code, 413)
+        self.assertEqual(self.crear(tamano=0).status_code, 400)
+        self.assertFalse(SubidaDocumento.objects.exists())
+
+    def test_fragmento_de_tamano_equivocado(self):
+        subida = self.crear().json()
+        respuesta = self.enviar(subida['id'], 0, self.contenido[:10])
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(respuesta.json()['esperado'], self.FRAGMENTO)
+        self.assertEqual(self.enviar(subida['id'], 3, self.contenido[:self.FRAGMENTO]).status_code, 400)
+        self.assertEqual(self.enviar(subida['id'], 4).status_code, 400)
+        self.assertEqual(SubidaDocumento.objects.get().recibidos, bytes(1))
+
+    def test_sha256_del_fragmento(self):
+        subida = self.crear().json()
+        respuesta = self.enviar(subida['id'], 1, sha256=hashlib.sha256(b'otro').hexdigest())
+        self.assertEqual(respuesta.status_code, 422)
+        fragmento = self.contenido[self.FRAGMENTO:2 * self.FRAGMENTO]
+        respuesta = self.enviar(subida['id'], 1, sha256=hashlib.sha256(fragmento).hexdigest())
+        self.assertEqual(respuesta.json()['pendientes'], [0, 2, 3])
+
+    def test_sha256_del_fichero_no_coincide(self):
+        subida = self.crear(sha256=hashlib.sha256(b'otro contenido').hexdigest()).json()
+        for indice in range(4):
+            self.enviar(subida['id'], indice)
+        respuesta = self.completar(subida['id'])
+        self.assertEqual(respuesta.status_code, 422)
+        self.assertEqual(respuesta.json()['sha256'], hashlib.sha256(self.contenido).hexdigest())
+        # Los fragmentos se descartan y la subida admite que se vuelvan a enviar
+        estado = self.client.get(reverse('registro:subida_documento', args=[subida['id']])).json()
+        self.assertEqual((estado['estado'], estado['pendientes']), ('activa', [0, 1, 2, 3]))
+        self.assertFalse(self.accion.documentos.exists())
+
+    def test_fallo_al_guardar_vuelve_a_activa(self):
+        subida = self.crear().json()
+        for indice in range(4):
+            self.enviar(subida['id'], indice)
+        with mock.patch('registro.documentos.guardar_contenido', side_effect=OSError):
+            with self.assertRaises(OSError):
+                subidas.completar(SubidaDocumento.objects.get())
+        self.assertEqual(SubidaDocumento.objects.get().estado, 'activa')
+        self.assertEqual(self.completar(subida['id']).status_code, 200)
+
+
+class PlantillaIndicadorTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('usuario')
+        self.cabezas = VariableIndicador.objects.create(nombre='Cabezas', variable='c')
+        self.factor = VariableIndicador.objects.create(nombre='Factor', variable='f')
+        self.indicador = crear_indicador('Emisiones', formula='c*f')
+        self.indicador.variable_indicador.set([self.cabezas, self.factor])
+
+    def medir(self, indicador, variables, fecha=datetime.date(2024, 1, 1), valor=None):
+        resultado = ResultadoIndicador.objects.create(indicador=indicador, fecha=fecha, valor=valor)
+        ResultadoVariable.objects.bulk_create([
+            ResultadoVariable(resultado=resultado, variable_indicador=variable, valor=v)
+            for variable, v in variables.items()
+        ])
+        return resultado
+
+    def items(self, **simbolos):
+        return [{'nombre': nombre, 'variable': simbolo} for nombre, simbolo in simbolos.items()]
+
+    def test_resolver_crea_las_que_faltan(self):
+        variables = PlantillaIndicadorService.resolver_variables(
+            self.items(Cabezas='c', Superficie='s'), indicador_ids=[self.indicador.id])
+        self.assertEqual(variables['Cabezas'], self.cabezas)
+        self.assertEqual(variables['Superficie'].variable, 's')
+        self.assertEqual(VariableIndicador.objects.count(), 3)
+
+    def test_resolver_prefiere_la_propia_entre_homonimas(self):
+        VariableIndicador.objects.create(nombre='Cabezas', variable='k')
+        otro = crear_indicador('Otro')
+        otro.variable_indicador.set([VariableIndicador.objects.create(nombre='Cabezas', variable='k')])
+        variables = PlantillaIndicadorService.resolver_variables(self.items(Cabezas='k'), indicador_ids=[otro.id])
+        self.assertEqual(variables['Cabezas'], otro.variable_indicador.get())
+
+    def test_simbolo_de_variable_propia_se_actualiza(self):
+        resultado = self.medir(self.indicador, {self.cabezas: 2, self.factor: 3})
+        variables = PlantillaIndicadorService.resolver_variables(self.items(Cabezas='n'),
+                                                                 indicador_ids=[self.indicador.id])
+        self.assertEqual(variables['Cabezas'], self.cabezas)
+        self.cabezas.refresh_from_db()
+        self.assertEqual(self.cabezas.variable, 'n')
+        self.assertEqual(ResultadoVariable.objects.get(resultado=resultado, valor=2).variable_indicador, self.cabezas)
+
+    def test_simbolo_de_variable_compartida_se_copia(self):
+        otro = crear_indicador('Otro', formula='c*2')
+        otro.variable_indicador.set([self.cabezas])
+        propio = self.medir(self.indicador, {self.cabezas: 2, self.factor: 3})
+        ajeno = self.medir(otro, {self.cabezas: 5})
+
+        variables = PlantillaIndicadorService.resolver_variables(self.items(Cabezas='n'),
+                                                                 indicador_ids=[self.indicador.id])
+        copia = variables['Cabezas']
+        self.assertNotEqual(copia, self.cabezas)
+        self.assertEqual((copia.nombre, copia.variable), ('Cabezas', 'n'))
+        self.cabezas.refresh_from_db()
+        self.assertEqual(self.cabezas.variable, 'c')
+        # Los valores del propietario pasan a la copia; los del otro indicador siguen en la original
+        self.assertEqual(ResultadoVariable.objects.get(resultado=propio, valor=2).variable_indicador, copia)
+        self.assertEqual(ResultadoVariable.objects.get(resultado=ajeno).variable_indicador, self.cabezas)
+
+    def test_sincronizar_variables(self):
+        superficie = VariableIndicador.objects.create(nombre='Superficie', variable='s')
+        otro = crear_indicador('Otro')
+        cambios = PlantillaIndicadorService.sincronizar_variables([self.indicador.id, otro.id],
+                                                                  [self.cabezas.id, superficie.id])
+        # Se añaden s al indicador y c y s al otro; se quita f del indicador
+        self.assertEqual(cambios, (3, 1))
+        for indicador in (self.indicador, otro):
+            self.assertEqual(set(indicador.variable_indicador.all()), {self.cabezas, superficie})
+        self.assertTrue(VariableIndicador.objects.filter(id=self.factor.id).exists())
+        self.assertEqual(PlantillaIndicadorService.sincronizar_variables([self.indicador.id, otro.id],
+                                                                         [superficie.id, self.cabezas.id]), (0, 0))
+        self.assertEqual(PlantillaIndicadorService.sincronizar_variables([otro.id], []), (0, 2))
+        self.assertFalse(otro.variable_indicador.exists())
+
+    def test_aplicar_indicador_a_acciones(self):
+        ods = [ObjetivosDesarrolloSostenible.objects.create(nombre=f'ODS {i}') for i in (7, 13)]
+        self.indicador.objetivos_relacionados.set(ods)
+        con_indicador = crear_accion(self.usuario, 'Con indicador')
+        con_indicador.indicadores.add(crear_indicador('Emisiones'))
+        acciones = [crear_accion(self.usuario, f'Acción {i}') for i in range(2)]
+
+        copias = PlantillaIndicadorService.aplicar_a_acciones(self.indicador,
+                                                              [con_indicador.id] + [a.id for a in acciones])
+        # La acción que ya tiene un indicador con ese nombre se omite
+        self.assertEqual(len(copias), 2)
+        self.assertEqual(con_indicador.indicadores.count(), 1)
+        for accion in acciones:
+            copia = accion.indicadores.get()
+            self.assertNotEqual(copia.id, self.indicador.id)
+            self.assertEqual((copia.nombre, copia.formula, copia.plantilla_id), ('Emisiones', 'c*f', None))
+            self.assertEqual(set(copia.objetivos_relacionados.all()), set(ods))
+            self.assertEqual(set(copia.variable_indicador.all()), {self.cabezas, self.factor})
+            self.assertFalse(copia.resultados.exists())
+
+    def test_variables_del_formulario_del_indicador(self):
+        servicio = VariableIndicadorService()
+        servicio.set_model(VariableIndicador)
+        self.assertTrue(servicio.create_or_update_variables(self.items(Cabezas='c', Superficie='s'), self.indicador))
+        self.assertEqual(dict(self.indicador.variable_indicador.values_list('nombre', 'variable')),
+                         {'Cabezas': 'c', 'Superficie': 's'})
+        self.assertEqual(self.indicador.variable_indicador.get(nombre='Cabezas'), self.cabezas)
+        self.assertEqual(VariableIndicador.objects.count(), 3)
+
+    def test_plantilla_propaga_la_formula_y_recalcula(self):
+        plantilla, vinculados = PlantillaIndicadorService.crear_desde_indicador(self.indicador)
+        self.assertEqual(vinculados, [self.indicador.id])
+        acciones = [crear_accion(self.usuario, f'Acción {i}') for i in range(2)]
+        copias = PlantillaIndicadorService.aplicar_a_acciones(plantilla, [a.id for a in acciones])
+        self.assertEqual(len(copias), 2)
+        self.assertTrue(all(c.plantilla_id == plantilla.id for c in copias))
+        self.assertEqual(PlantillaIndicadorService.aplicar_a_acciones(plantilla, [a.id for a in acciones]), [])
+
+        completo = self.medir(copias[0], {self.cabezas: 2, self.factor: 3}, valor=6)
+        incompleto = self.medir(copias[1], {self.cabezas: 4}, valor=40)
+        plantilla.formula = 'c*f + 1'
+        recalculo = PlantillaIndicadorService.actualizar_plantilla(plantilla)
+        self.assertEqual(recalculo, {'indicadores': 3, 'resultados': 1, 'omitidos': 1})
+        completo.refresh_from_db()
+        incompleto.refresh_from_db()
+        self.assertEqual(completo.valor, 7)
+        # Sin la variable f no se puede recalcular: conserva el valor registrado
+        self.assertEqual(incompleto.valor, 40)
+        self.assertEqual(set(Indicador.objects.filter(plantilla=plantilla).values_list('formula', flat=True)),
+                         {'c*f + 1'})
+        self.assertEqual(set(Indicador.objects.filter(plantilla=plantilla).values_list('version_plantilla', flat=True)),
+                         {plantilla.version})
+
+    def test_recalculo_no_guarda_valores_no_finitos(self):
+        self.indicador.formula = 'c/f'
+        self.indicador.save()
+        cero = self.medir(self.indicador, {self.cabezas: 2, self.factor: 0}, valor=1)
+        dos = self.medir(self.indicador, {self.cabezas: 2, self.factor: 1}, fecha=datetime.date(2024, 2, 1), valor=1)
+        self.assertEqual(PlantillaIndicadorService.recalcular_resultados([self.indicador.id]),
+                         {'resultados': 1, 'omitidos': 1})
+        cero.refresh_from_db()
+        dos.refresh_from_db()
+        self.assertEqual((cero.valor, dos.valor), (1, 2))
+
+    def test_cambiar_variables_de_la_plantilla(self):
+        plantilla, _ = PlantillaIndicadorService.crear_desde_indicador(self.indicador)
+        otro = crear_indicador('Otro', formula='c')
+        otro.variable_indicador.set([self.cabezas])
+        resultado = self.medir(self.indicador, {self.cabezas: 2, self.factor: 3}, valor=6)
+        plantilla.formula = 'n*f'
+        recalculo = PlantillaIndicadorService.actualizar_plantilla(plantilla, self.items(Cabezas='n', Factor='f'))
+        # Los valores pasan a la copia con el símbolo n: el resultado se recalcula igual
+        self.assertEqual(recalculo, {'indicadores': 1, 'resultados': 0, 'omitidos': 0})
+        self.assertEqual(set(self.indicador.variable_indicador.values_list('variable', flat=True)), {'n', 'f'})
+        # El otro indicador sigue resolviendo su fórmula con la variable original
+        self.assertEqual(list(otro.variable_indicador.values_list('variable', flat=True)), ['c'])
+        resultado.refresh_from_db()
+        self.assertEqual(resultado.valor, 6)
+
+
+@override_settings(DOCUMENTOS_EXTRACCION_AUTOMATICA=False)
+class BusquedaTests(TestCase):
+    def setUp(self):
+        # captureOnCommitCallbacks simula confirmaciones que TestCase luego revierte, índice incluido
+        busqueda._preparadas.discard(connection.alias)
+        self.addCleanup(busqueda._preparadas.discard, connection.alias)
+        self.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.accion = crear_accion(self.usuario, 'Reforestación de manglares',
+                                       descripcion='Siembra de mangle rojo en la costa sur')
+            self.otra = crear_accion(self.usuario, 'Biogás en vaquerías',
+                                     descripcion='Digestores para reducir emisiones; protege los manglares cercanos')
+            self.indicador = crear_indicador('Emisiones evitadas', descripcion='Toneladas de CO2 equivalente')
+            self.otra.indicadores.add(self.indicador)
+
+    def titulos(self, consulta, **opciones):
+        return [r['titulo'] for r in busqueda.buscar(consulta, **opciones)['resultados']]
+
+    def test_terminos(self):
+        self.assertEqual(busqueda.normalizar('Acción ÁRBOL'), 'accion arbol')
+        self.assertEqual(busqueda.terminos('la reforestación de los manglares'), ['reforestacion', 'manglares'])
+        self.assertEqual(busqueda.terminos('de la'), ['de', 'la'])
+
+    def test_sin_tildes_y_por_prefijo(self):
+        self.assertEqual(self.titulos('reforestacion'), ['Reforestación de manglares'])
+        self.assertEqual(self.titulos('BIOGAS vaquer'), ['Biogás en vaquerías'])
+        self.assertEqual(self.titulos('mangle rojo'), ['Reforestación de manglares'])
+        self.assertEqual(self.titulos('mangle tiburón'), [])
+
+    def test_el_titulo_pesa_mas(self):
+        self.assertEqual(self.titulos('manglares'), ['Reforestación de manglares', 'Biogás en vaquerías'])
+
+    def test_tipos_url_y_fragmento(self):
+        resultados = busqueda.buscar('emisiones', tipos=['indicador'])['resultados']
+        self.assertEqual([r['id'] for r in resultados], [self.indicador.id])
+        self.assertEqual(resultados[0]['url'], reverse('registro:lista_resultado_indicador',
+                                                       args=[self.otra.id, self.indicador.id]))
+        self.assertEqual(busqueda.buscar('emisiones')['total'], 2)
+        fragmento = busqueda.buscar('digestores', tipos=['accion'])['resultados'][0]['fragmento']
+        self.assertIn('Digestores', fragmento)
+
+    def test_sigue_los_cambios(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.accion.nombre = 'Restauración de humedales'
+            self.accion.save()
+            self.otra.delete()
+        self.assertEqual(self.titulos('humedales'), ['Restauración de humedales'])
+        self.assertEqual(self.titulos('manglares'), [])
+        self.assertEqual(self.titulos('biogas'), [])
+
+    def test_texto_extraido_de_documentos(self):
+        archivo = ArchivoDocumento.objects.create(sha256='0' * 64, archivo='contenido/informe.txt', tamano=40,
+                                                  estado_extraccion='extraido')
+        FragmentoDocumento.objects.create(archivo=archivo, orden=0, texto='Inventario de carbono azul')
+        with self.captureOnCommitCallbacks(execute=True):
+            documento = Documento.objects.create(nombre='Informe anual', archivo=archivo)
+            self.accion.documentos.add(documento)
+        resultado = busqueda.buscar('carbono azul')['resultados']
+        self.assertEqual([(r['tipo'], r['id'], r['titulo']) for r in resultado],
+                         [('documento', documento.id, 'Informe anual')])
+
+    def test_reconstruir(self):
+        busqueda.eliminar('accion', [self.accion.id])
+        self.assertEqual(self.titulos('reforestacion'), [])
+        self.assertEqual(busqueda.reconstruir(), {'accion': 2, 'indicador': 1, 'resultado_accion': 0, 'documento': 0})
+        self.assertEqual(self.titulos('reforestacion'), ['Reforestación de manglares'])
+
+    def test_indice_preparado_al_confirmar(self):
+        busqueda._preparadas.discard(connection.alias)
+        with self.captureOnCommitCallbacks() as confirmar:
+            busqueda.asegurar_indice()
+        # Hasta confirmar, una reversión puede deshacer la tabla FTS
+        self.assertNotIn(connection.alias, busqueda._preparadas)
+        for funcion in confirmar:
+            funcion()
+        self.assertIn(connection.alias, busqueda._preparadas)
+
+    def test_vista(self):
+        self.client.force_login(self.usuario)
+        respuesta = self.client.get(reverse('registro:buscar_texto'), {'q': 'manglares', 'por_pagina': 1})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual((respuesta.json()['total'], respuesta.json()['paginas']), (2, 2))
+        self.assertEqual(self.client.get(reverse('registro:buscar_texto'), {'q': 'x', 'tipo': 'otro'}).status_code,
+                         400)
+
+
+class DatosGraficoTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        self.client.force_login(self.usuario)
+        self.accion = crear_accion(self.usuario, publicado=True)
+        self.indicador = crear_indicador()
+        self.accion.indicadores.add(self.indicador)
+        self.resultados = crear_resultados(self.indicador, [float(i % 17) for i in range(3000)])
+        self.moneda = TipoMoneda.objects.create(nombre='CUP', estado=True)
+        self.presupuesto = PresupuestoPlanificado.objects.create(
+            tipo_presupuesto=TipoPresupuesto.objects.create(nombre='Inversión', orden=1), tipo_moneda=self.moneda,
+            monto=100, fuente_financiamiento='Estado',
+            estado_presupuesto=EstadoPresupuesto.objects.create(nombre='Aprobado', orden=1))
+        self.accion.presupuestos_planificados.add(self.presupuesto)
+        self.urls = {
+            'serie': reverse('registro:serie_resultado_indicador', args=[self.accion.id, self.indicador.id]),
+            'distribucion': reverse('registro:distribucion_resultado_indicador',
+                                    args=[self.accion.id, self.indicador.id]),
+            'presupuesto': reverse('registro:graficos_presupuesto_planificado', args=[self.accion.id]),
+            'panel': reverse('registro:graficos_panel'),
+        }
+
+    def etags(self):
+        return {nombre: self.client.get(url)['ETag'] for nombre, url in self.urls.items()}
+
+    def cambiados(self, antes):
+        return {nombre for nombre, etag in self.etags().items() if etag != antes[nombre]}
+
+    def test_comportamiento_con_proyeccion(self):
+        respuesta = self.client.get(reverse('registro:lista_resultado_indicador',
+                                            args=[self.accion.id, self.indicador.id]))
+        self.assertEqual(respuesta.status_code, 200)
+        puntos = respuesta.context['projection']['puntos']
+        self.assertEqual(len(puntos), PronosticoService.HORIZONTE)
+        # Los puntos con sus intervalos llegan al gráfico como JSON (json_script)
+        self.assertContains(respuesta, '<script id="proyeccion-puntos" type="application/json">')
+        self.assertContains(respuesta, '"intervalo_95": [')
+        self.assertTrue(all(p['intervalo_95'][0] <= p['intervalo_80'][0] <= p['valor'] <= p['intervalo_80'][1]
+                            <= p['intervalo_95'][1] for p in puntos))
+
+    def test_validacion_condicional(self):
+        for url in self.urls.values():
+            respuesta = self.client.get(url)
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertEqual(respuesta['Cache-Control'], 'private, no-cache')
+            self.assertEqual(self.client.get(url, headers={'If-None-Match': respuesta['ETag']}).status_code, 304)
+            self.assertEqual(self.client.post(url).status_code, 405)
+
+    def test_serie_reducida(self):
+        serie = self.client.get(self.urls['serie'], {'puntos': 200}).json()
+        self.assertEqual((serie['total'], serie['puntos'], serie['reducida']), (3000, 200, True))
+        tramo = self.client.get(self.urls['serie'], {'desde': '2020-02-01', 'hasta': '2020-02-29'}).json()
+        self.assertEqual(tramo['total'], 31)
+        self.assertEqual(self.client.get(self.urls['serie'], {'puntos': 'x'}).status_code, 400)
+
+    def test_etag_cambia_con_los_resultados(self):
+        antes = self.etags()
+        self.resultados[100].valor = 99
+        self.resultados[100].save()
+        self.assertEqual(self.cambiados(antes), {'serie', 'distribucion'})
+        antes = self.etags()
+        self.resultados[0].delete()
+        self.assertEqual(self.cambiados(antes), {'serie', 'distribucion'})
+
+    def test_etag_cambia_con_el_presupuesto(self):
+        antes = self.etags()
+        self.presupuesto.monto = 500
+        self.presupuesto.save()
+        self.assertEqual(self.cambiados(antes), {'presupuesto', 'panel'})
+        antes = self.etags()
+        self.accion.publicado = False
+        self.accion.save()
+        self.assertEqual(self.cambiados(antes), {'panel'})
+
+    def test_etag_no_depende_de_la_cache(self):
+        antes = self.etags()
+        for espacio in ('vistas', 'nomencladores'):
+            cache_versionada.espacio(espacio).invalidar()
+        self.assertEqual(self.cambiados(antes), set())
+
+    def test_panel_por_usuario(self):
+        otro = User.objects.create_user('otro')
+        self.client.force_login(otro)
+        panel = self.client.get(self.urls['panel']).json()
+        self.assertEqual(panel['presupuestos'][0]['total_planificado'], 0)
+        self.assertEqual(self.client.get(self.urls['serie']).status_code, 403)
+
+
+class EspacioCacheTests(SimpleTestCase):
+    def test_version_e_invalidacion(self):
+        espacio = cache_versionada.EspacioCache('pruebas')
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                                   'LOCATION': 'pruebas'}}):
+            version = espacio.version()
+            self.assertEqual(espacio.version(), version)
+            espacio.set('clave', 1)
+            self.assertEqual(espacio.get('clave'), 1)
+            espacio.invalidar()
+            self.assertNotEqual(espacio.version(), version)
+            self.assertIsNone(espacio.get('clave'))
+
+    def test_dummy_version_constante(self):
+        espacio = cache_versionada.EspacioCache('pruebas')
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            self.assertEqual({espacio.version() for _ in range(3)}, {0})
+            espacio.invalidar()
+            self.assertEqual(espacio.version(), 0)
+            self.assertEqual(espacio.estadisticas()['invalidaciones'], 1)
+
+
+class CabecerasHttpTests(SimpleTestCase):
+    def test_codificaciones_aceptadas(self):
+        self.assertEqual(estaticos.codificaciones_aceptadas('gzip, deflate, br'), ['br', 'gzip'])
+        self.assertEqual(estaticos.codificaciones_aceptadas('br;q=0, gzip'), ['gzip'])
+        self.assertEqual(estaticos.codificaciones_aceptadas('gzip;q=0.5, br;q=0.8'), ['br', 'gzip'])
+        self.assertEqual(estaticos.codificaciones_aceptadas('*;q=0.1, br;q=0'), ['gzip'])
+        self.assertEqual(estaticos.codificaciones_aceptadas('identity'), [])
+
+    def test_coincide_etag(self):
+        self.assertTrue(estaticos.coincide_etag('"a"', '"a"'))
+        self.assertTrue(estaticos.coincide_etag('"x", W/"a"', '"a"'))
+        self.assertTrue(estaticos.coincide_etag('*', '"a"'))
+        self.assertFalse(estaticos.coincide_etag('"a-br"', '"a"'))
+        self.assertFalse(estaticos.coincide_etag('"xa"', 'a'))
+        self.assertFalse(estaticos.coincide_etag('', '"a"'))
+
+
+class GeometriaMapaTests(SimpleTestCase):
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        ajustes = override_settings(GEOMETRIAS_DIR=directorio)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        # El manifiesto se guarda en memoria por fecha de modificación, no por directorio
+        geometria._manifiesto['mtime'] = None
+
+        self.datos = b'{"type":"Topology","objects":{}}'
+        entrada = {'hash': geometria.hash_contenido(self.datos), 'archivo': 'provincias.z0.topo.json'}
+        for codificacion, contenido in geometria.comprimir(self.datos).items():
+            with open(os.path.join(directorio, entrada['archivo'] + {'': '', 'gzip': '.gz', 'br': '.br'}[codificacion]),
+                      'wb') as f:
+                f.write(contenido)
+            entrada[codificacion or 'bytes'] = len(contenido)
+        with open(os.path.join(directorio, 'manifest.json'), 'w') as f:
+            json.dump({'version': 'v1', 'capas': {'provincias': {'0': entrada}}}, f)
+        self.entrada = entrada
+        self.url = reverse('registro:geometria_mapa', args=['provincias'])
+
+    def pedir(self, **cabeceras):
+        return self.client.get(self.url, headers=cabeceras)
+
+    def test_codificacion_aceptada(self):
+        self.assertEqual(self.pedir(**{'Accept-Encoding': 'gzip'})['Content-Encoding'], 'gzip')
+        self.assertEqual(self.pedir(**{'Accept-Encoding': 'gzip;q=0'}).has_header('Content-Encoding'), False)
+        respuesta = self.pedir(**{'Accept-Encoding': 'br;q=0, gzip'})
+        self.assertEqual(respuesta['Content-Encoding'], 'gzip')
+        self.assertEqual(respuesta['ETag'], f'"{self.entrada["hash"]}-gzip"')
+        respuesta = self.pedir()
+        self.assertEqual(b''.join(respuesta.streaming_content), self.datos)
+
+    def test_etag_exacta(self):
+        etag = self.pedir()['ETag']
+        self.assertEqual(self.pedir(**{'If-None-Match': etag}).status_code, 304)
+        self.assertEqual(self.pedir(**{'If-None-Match': f'"otra", {etag}'}).status_code, 304)
+        self.assertEqual(self.pedir(**{'If-None-Match': etag[:-1] + '-gzip"'}).status_code, 200)
+        self.assertEqual(self.pedir(**{'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code, 200)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class MapaAccionesTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('usuario')
+        self.provincia = Provincia.objects.create(nombre='Pinar del Río', hc_keys='cu-pr')
+        self.municipio = Municipio.objects.create(nombre='Viñales', provincia=self.provincia)
+        self.accion = crear_accion(self.usuario)
+        self.accion.municipios.add(self.municipio)
+        self.url = reverse('registro:mapa_acciones_geojson')
+
+    def test_etag_estable_entre_llamadas(self):
+        self.assertEqual(MapaAccionesService.etag((), 0), MapaAccionesService.etag((), 0))
+        respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['features'][0]['properties']['acciones_count'], 1)
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': respuesta['ETag']}).status_code, 304)
+
+    def test_etag_cambia_con_los_datos(self):
+        antes = self.client.get(self.url)['ETag']
+        otra = crear_accion(self.usuario, 'Otra')
+        otra.provincias.add(self.provincia)
+        respuesta = self.client.get(self.url, headers={'If-None-Match': antes})
+        self.assertEqual(respuesta.status_code, 200)
+        antes = respuesta['ETag']
+        self.accion.municipios.remove(self.municipio)
+        self.assertNotEqual(self.client.get(self.url)['ETag'], antes)
+
+    def test_etag_por_filtros(self):
+        sin_filtros = self.client.get(self.url)['ETag']
+        self.assertNotEqual(self.client.get(self.url, {'sector': self.accion.sector_id})['ETag'], sin_filtros)
+
+
+class ResumenPresupuestoTests(TestCase):
+    def setUp(self):
+        usuario = User.objects.create_user('usuario')
+        self.sector = Sector.objects.create(nombre='Agricultura')
+        self.otro_sector = Sector.objects.create(nombre='Industria')
+        self.provincia = Provincia.objects.create(nombre='Pinar del Río', hc_keys='cu-pr')
+        self.otra_provincia = Provincia.objects.create(nombre='Matanzas', hc_keys='cu-ma')
+        self.municipio = Municipio.objects.create(nombre='Viñales', provincia=self.provincia)
+        self.otro_municipio = Municipio.objects.create(nombre='Cárdenas', provincia=self.otra_provincia)
+        self.cup = TipoMoneda.objects.create(nombre='CUP', estado=True)
+        self.usd = TipoMoneda.objects.create(nombre='USD', estado=True)
+        self.tipo = TipoPresupuesto.objects.create(nombre='Inversión', orden=1)
+        self.estado = EstadoPresupuesto.objects.create(nombre='Aprobado', orden=1)
+
+        self.accion = crear_accion(usuario, sector=self.sector)
+        self.accion.provincias.add(self.provincia)
+        self.accion.municipios.add(self.municipio)
+        self.otra = crear_accion(usuario, 'Otra', sector=self.otro_sector)
+        self.otra.provincias.add(self.otra_provincia)
+        self.planificado = self.crear_planificado(1000)
+        self.accion.presupuestos_planificados.add(self.planificado)
+        self.planificado_usd = self.crear_planificado(500, self.usd)
+        self.otra.presupuestos_planificados.add(self.planificado_usd)
+
+    def crear_planificado(self, monto, moneda=None):
+        return PresupuestoPlanificado.objects.create(tipo_presupuesto=self.tipo, tipo_moneda=moneda or self.cup,
+                                                     monto=monto, fuente_financiamiento='Estado',
+                                                     estado_presupuesto=self.estado)
+
+    def resumenes(self):
+        campos = ('tipo_moneda_id', 'monto_planificado', 'monto_ejecutado', 'monto_restante')
+        return {
+            'accion': set(ResumenPresupuestoAccion.objects.values_list('accion_id', *campos)),
+            'sector': set(ResumenPresupuestoSector.objects.values_list('sector_id', *campos)),
+            'territorio': set(ResumenPresupuestoTerritorio.objects.values_list('provincia_id', 'municipio_id',
+                                                                               *campos)),
+        }
+
+    def comprobar(self, accion=(), sector=(), territorio=()):
+        """Compara las filas mantenidas por las señales con las esperadas y con las de reconstruir()"""
+        actuales = self.resumenes()
+        self.assertEqual(actuales, {'accion': set(accion), 'sector': set(sector), 'territorio': set(territorio)})
+        ResumenPresupuestoService.reconstruir()
+        self.assertEqual(self.resumenes(), actuales)
+
+    def comprobar_cup(self, planificado, ejecutado):
+        """Filas de self.accion en CUP, con las de self.otra en USD sin cambios"""
+        cup = (self.cup.id, planificado, ejecutado, planificado - ejecutado)
+        usd = (self.usd.id, 500, 0, 500)
+        self.comprobar(
+            accion=[(self.accion.id, *cup), (self.otra.id, *usd)] if planificado else [(self.otra.id, *usd)],
+            sector=[(self.sector.id, *cup), (self.otro_sector.id, *usd)] if planificado else [(self.otro_sector.id,
+                                                                                                *usd)],
+            territorio=([(self.provincia.id, self.municipio.id, *cup)] if planificado else [])
+            + [(self.otra_provincia.id, None, *usd)],
+        )
+
+    def test_estado_inicial(self):
+        self.comprobar_cup(1000, 0)
+
+    def test_presupuesto_ejecutado(self):
+        ejecutado = PresupuestoEjecutado.objects.create(monto=300)
+        self.planificado.presupuestos_ejecutados.add(ejecutado)
+        self.comprobar_cup(1000, 300)
+        ejecutado.monto = 400
+        ejecutado.save()
+        self.comprobar_cup(1000, 400)
+
+        # Sentido inverso: desde el presupuesto ejecutado
+        otro = PresupuestoEjecutado.objects.create(monto=50)
+        otro.presupuestos_ejecutados.add(self.planificado)
+        self.comprobar_cup(1000, 450)
+        otro.presupuestos_ejecutados.remove(self.planificado)
+        self.comprobar_cup(1000, 400)
+        otro.presupuestos_ejecutados.add(self.planificado)
+        otro.presupuestos_ejecutados.clear()
+        self.comprobar_cup(1000, 400)
+
+        self.planificado.presupuestos_ejecutados.remove(ejecutado)
+        self.comprobar_cup(1000, 0)
+        self.planificado.presupuestos_ejecutados.add(ejecutado, otro)
+        self.planificado.presupuestos_ejecutados.clear()
+        self.comprobar_cup(1000, 0)
+        self.planificado.presupuestos_ejecutados.add(ejecutado)
+        ejecutado.delete()
+        self.comprobar_cup(1000, 0)
+        self.planificado.refresh_from_db()
+        self.assertEqual(self.planificado.monto_ejecutado, 0)
+
+    def test_presupuesto_planificado(self):
+        self.planificado.monto = 1200
+        self.planificado.save()
+        self.comprobar_cup(1200, 0)
+
+        otro = self.crear_planificado(300)
+        self.accion.presupuestos_planificados.add(otro)
+        self.comprobar_cup(1500, 0)
+        self.accion.presupuestos_planificados.remove(otro)
+        self.comprobar_cup(1200, 0)
+        otro.presupuestos_planificados.add(self.accion)
+        self.comprobar_cup(1500, 0)
+        otro.presupuestos_planificados.clear()
+        self.comprobar_cup(1200, 0)
+        otro.presupuestos_planificados.add(self.accion)
+        otro.delete()
+        self.comprobar_cup(1200, 0)
+
+        self.accion.presupuestos_planificados.clear()
+        self.comprobar_cup(0, 0)
+
+    def test_guardar_instancia_leida_antes_de_ejecutar(self):
+        self.planificado.presupuestos_ejecutados.add(PresupuestoEjecutado.objects.create(monto=300))
+        leido = PresupuestoPlanificado.objects.get(pk=self.planificado.pk)
+        self.planificado.presupuestos_ejecutados.add(PresupuestoEjecutado.objects.create(monto=50))
+
+        leido.fuente_financiamiento = 'Donación'
+        leido.save()
+        self.planificado.refresh_from_db()
+        self.assertEqual((self.planificado.fuente_financiamiento, self.planificado.monto_ejecutado),
+                         ('Donación', 350))
+        self.comprobar_cup(1000, 350)
+
+    def test_territorios(self):
+        cup = (self.cup.id, 1000, 0, 1000)
+        usd = (self.usd.id, 500, 0, 500)
+        acciones = [(self.accion.id, *cup), (self.otra.id, *usd)]
+        sectores = [(self.sector.id, *cup), (self.otro_sector.id, *usd)]
+
+        # Con municipios la acción deja de contar a nivel de provincia
+        self.otra.municipios.add(self.otro_municipio)
+        self.comprobar(acciones, sectores, [(self.provincia.id, self.municipio.id, *cup),
+                                            (self.otra_provincia.id, self.otro_municipio.id, *usd)])
+        self.otro_municipio.accion_set.clear()
+        self.comprobar(acciones, sectores, [(self.provincia.id, self.municipio.id, *cup),
+                                            (self.otra_provincia.id, None, *usd)])
+
+        self.accion.municipios.remove(self.municipio)
+        self.comprobar(acciones, sectores, [(self.provincia.id, None, *cup), (self.otra_provincia.id, None, *usd)])
+        self.provincia.accion_set.add(self.otra)
+        self.comprobar(acciones, sectores, [(self.provincia.id, None, self.cup.id, 1000, 0, 1000),
+                                            (self.provincia.id, None, *usd), (self.otra_provincia.id, None, *usd)])
+        self.otra.provincias.clear()
+        self.comprobar(acciones, sectores, [(self.provincia.id, None, *cup)])
+        self.municipio.accion_set.add(self.accion)
+        self.comprobar(acciones, sectores, [(self.provincia.id, self.municipio.id, *cup)])
+
+    def test_cambio_de_sector(self):
+        self.accion.sector = self.otro_sector
+        self.accion.save()
+        self.comprobar(
+            accion=[(self.accion.id, self.cup.id, 1000, 0, 1000), (self.otra.id, self.usd.id, 500, 0, 500)],
+            sector=[(self.otro_sector.id, self.cup.id, 1000, 0, 1000), (self.otro_sector.id, self.usd.id, 500, 0, 500)],
+            territorio=[(self.provincia.id, self.municipio.id, self.cup.id, 1000, 0, 1000),
+                        (self.otra_provincia.id, None, self.usd.id, 500, 0, 500)],
+        )
+
+    def test_eliminar_accion(self):
+        self.accion.delete()
+        self.comprobar_cup(0, 0)
+
+
+class ResultadoIndicadorServiceTests(TestCase):
+    def setUp(self):
+        # El índice de búsqueda se prepara aquí para no contar sus consultas en las mediciones
+        busqueda._preparadas.discard(connection.alias)
+        self.addCleanup(busqueda._preparadas.discard, connection.alias)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.indicador = crear_indicador(formula='a + b + d')
+        self.variables = {nombre: VariableIndicador.objects.create(nombre=nombre.upper(), variable=nombre)
+                          for nombre in 'abcd'}
+
+    def crear_resultado(self, fecha, valores):
+        resultado = ResultadoIndicador.objects.create(indicador=self.indicador, fecha=fecha, valor=0)
+        ResultadoVariable.objects.bulk_create([
+            ResultadoVariable(resultado=resultado, variable_indicador=self.variables[nombre], valor=valor)
+            for nombre, valor in valores.items()
+        ])
+        return resultado
+
+    def guardar(self, resultado, valores):
+        formset = [SimpleNamespace(cleaned_data={'variable_indicador_id': self.variables[nombre].id, 'valor': valor})
+                   for nombre, valor in valores.items()]
+        formulario = SimpleNamespace(cleaned_data={'fecha': resultado.fecha})
+        ResultadoIndicadorService().save_resultado_with_calculation(formulario, formset, self.indicador, resultado)
+
+    def test_actualiza_solo_las_diferencias(self):
+        resultado = self.crear_resultado(datetime.date(2024, 1, 1), {'a': 1, 'b': 2, 'c': 3})
+        sin_cambios = resultado.resultadovariable_set.get(variable_indicador=self.variables['a'])
+        cambiada = resultado.resultadovariable_set.get(variable_indicador=self.variables['b'])
+        eliminada = resultado.resultadovariable_set.get(variable_indicador=self.variables['c'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.guardar(resultado, {'a': 1, 'b': 5, 'd': 4})
+
+        self.assertEqual(dict(resultado.resultadovariable_set.values_list('variable_indicador__variable', 'valor')),
+                         {'a': 1, 'b': 5, 'd': 4})
+        self.assertEqual(resultado.resultadovariable_set.get(variable_indicador=self.variables['a']).id,
+                         sin_cambios.id)
+        self.assertEqual(resultado.resultadovariable_set.get(variable_indicador=self.variables['b']).id, cambiada.id)
+        resultado.refresh_from_db()
+        self.indicador.refresh_from_db()
+        self.assertEqual(resultado.valor, 10)
+        self.assertEqual(self.indicador.ultima_medicion, datetime.datetime(2024, 1, 1))
+
+        nueva = resultado.resultadovariable_set.get(variable_indicador=self.variables['d'])
+        entradas = LogEntry.objects.get_for_model(ResultadoVariable)
+        self.assertEqual({(e.object_id, e.action) for e in entradas}, {
+            (nueva.id, LogEntry.Action.CREATE), (cambiada.id, LogEntry.Action.UPDATE),
+            (eliminada.id, LogEntry.Action.DELETE),
+        })
+        self.assertEqual(json.loads(entradas.get(action=LogEntry.Action.CREATE).changes), {'valor': ['None', '4']})
+        self.assertEqual(json.loads(entradas.get(action=LogEntry.Action.UPDATE).changes), {'valor': ['2.0', '5']})
+
+    def test_consultas_no_dependen_de_la_historia(self):
+        for historia in (0, 40):
+            with self.subTest(historia=historia):
+                for i in range(historia):
+                    self.crear_resultado(datetime.date(2020, 1, 1) + datetime.timedelta(days=i),
+                                         {'a': i, 'b': i, 'c': i, 'd': i})
+                resultado = self.crear_resultado(datetime.date(2025, 1, 1) + datetime.timedelta(days=historia),
+                                                 {'a': 1, 'b': 2, 'c': 3})
+                ContentType.objects.clear_cache()  # misma caché de tipos en ambas mediciones
+                with self.assertNumQueries(31), self.captureOnCommitCallbacks(execute=True):
+                    self.guardar(resultado, {'a': 1, 'b': 5, 'd': 4})
@@ -2,11 +2,14 @@ from django.urls import path
 
 from registro.views import HomeView, ActionListView, ActionCreateView, ActionUpdateView, DetailtsActionUpdateView, \
     PresupuestoPlanificadoListView, PresupuestoPlanificadoCreateView, PresupuestoPlanificadoUpdateView, \
-    eliminar_presupuesto_planificado, \
+    eliminar_presupuesto_planificado, serie_ejecucion_presupuesto, \
     PresupuestoEjecutadoView, PresupuestoEjecutadoUpdateView, eliminar_presupuesto_ejecutado, IndicadoresListView, \
     eliminar_accion, IndicadorCreateView, IndicadorUpdateView, eliminar_indicador, ResultadosIndicadorListView, \
     ResultadoIndicadorCreateView, ResultadoIndicadorUpdateView, \
-    eliminar_resultado_indicador, mapa_cuba_leaflet, municipios_por_tipo_accion
+    eliminar_resultado_indicador, mapa_cuba_leaflet, municipios_por_tipo_accion, geometria_mapa, \
+    mapa_acciones_geojson, metricas_cache, buscar_texto, crear_subida_documento, subida_documento, \
+    fragmento_subida_documento, completar_subida_documento, serie_resultado_indicador, \
+    distribucion_resultado_indicador, graficos_presupuesto_planificado, graficos_panel
 
 app_name = 'registro'
 
@@ -25,6 +28,8 @@ urlpatterns = [
     path('accion/<int:id_accion>/presupuesto/crear/', PresupuestoPlanificadoCreateView.as_view(), name='registrar_presupuesto_planificado'),
     path('accion/<int:id_accion>/presupuesto/editar/<int:id_presupuesto>/', PresupuestoPlanificadoUpdateView.as_view(), name='editar_presupuesto_planificado'),
     path('accion/<int:id_accion>/presupuesto/eliminar/<int:id_presupuesto>/', eliminar_presupuesto_planificado ,name='eliminar_presupuesto_planificado'),
+    path('accion/<int:id_accion>/presupuesto/serie/', serie_ejecucion_presupuesto, name='serie_ejecucion_presupuesto'),
+    path('accion/<int:id_accion>/presupuesto/graficos/', graficos_presupuesto_planificado, name='graficos_presupuesto_planificado'),
 
     # Presupuesto Ejecutado
     path("accion/<int:id_accion>/presupuesto_planificado/<int:id_presupuesto>/ejecutado/crear/", PresupuestoEjecutadoView.as_view(), name="registrar_presupuesto_ejecutado"),
@@ -40,9 +45,20 @@ urlpatterns = [
     path("accion/<int:id_accion>/indicadores/<int:id_indicador>/resultado/comportamiento/", ResultadosIndicadorListView.as_view(), name="lista_resultado_indicador"),
     path("accion/<int:id_accion>/indicadores/<int:id_indicador>/resultado/editar/<int:id_resultado>/", ResultadoIndicadorUpdateView.as_view(), name="editar_resultado_indicador"),
     path("accion/<int:id_accion>/indicadores/<int:id_indicador>/resultado/eliminar/<int:id_resultado>/", eliminar_resultado_indicador, name="eliminar_resultado_indicador"),
+    path("accion/<int:id_accion>/indicadores/<int:id_indicador>/resultado/serie/", serie_resultado_indicador, name="serie_resultado_indicador"),
+    path("accion/<int:id_accion>/indicadores/<int:id_indicador>/resultado/distribucion/", distribucion_resultado_indicador, name="distribucion_resultado_indicador"),
 
 
     path("accion/mapa/", mapa_cuba_leaflet, name="mapa"),
     path('api/municipios-por-tipo-accion/', municipios_por_tipo_accion, name='municipios_por_tipo_accion'),
+    path('api/geometrias/<str:capa>/', geometria_mapa, name='geometria_mapa'),
+    path('api/mapa-acciones.geojson', mapa_acciones_geojson, name='mapa_acciones_geojson'),
+    path('api/cache/metricas/', metricas_cache, name='metricas_cache'),
+    path('api/busqueda/', buscar_texto, name='buscar_texto'),
+    path('api/panel/graficos/', graficos_panel, name='graficos_panel'),
+    path('api/accion/<int:id_accion>/subidas/', crear_subida_documento, name='crear_subida_documento'),
+    path('api/subidas/<uuid:id_subida>/', subida_documento, name='subida_documento'),
+    path('api/subidas/<uuid:id_subida>/<int:indice>/', fragmento_subida_documento, name='fragmento_subida_documento'),
+    path('api/subidas/<uuid:id_subida>/completar/', completar_subida_documento, name='completar_subida_documento'),
 
 ]
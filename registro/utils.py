@@ -1,90 +1,51 @@
+import copy
+
+# Partes fijas del gráfico de línea; data_chart_line solo construye lo que depende del indicador.
+# Se copian en cada llamada para que modificar un gráfico no cambie los siguientes
+_LINEA_TITULO_ESTILO = {
+    'fontSize': '20px',
+    'fontWeight': 'bold',
+    'fontFamily': 'Inter, Helvetica, sans-serif',
+}
+_LINEA_BASE = {
+    'chart': {
+        'height': 350,
+        'type': 'area',
+
+    },
+    'colors':['#1B84FF'],
+    'dataLabels': {
+        'enabled': 'false',
+        'style': {
+            'colors': ['#1B84FF']
+        }
+    },
+    'fill': {
+        'colors': ['#1B84FF']
+    },
+    'legend': {
+        'position': 'top',
+        'horizontalAlign': 'right',
+        'offsetX': -10
+    },
+}
+
+
 # Grafico de linea para el comportamiento de los resultados del indicador
 def data_chart_line(data_line, indicador):
     chart_data_line = {
         'series': [data_line['valores']],
-        'chart': {
-            'height': 350,
-            'type': 'area',
-
-        },
         'title': {
             'text': 'Comportamiento de los resultados de ' + indicador.nombre,
-            'style': {
-                'fontSize': '20px',
-                'fontWeight': 'bold',
-                'fontFamily': 'Inter, Helvetica, sans-serif',
-            }
-        },
-        'colors':['#1B84FF'],
-        'dataLabels': {
-            'enabled': 'false',
-            'style': {
-                'colors': ['#1B84FF']
-            }
-        },
-        'fill': {
-            'colors': ['#1B84FF']
+            'style': copy.deepcopy(_LINEA_TITULO_ESTILO),
         },
         'xaxis': {
             'categories': data_line['labels'],
         },
-        'legend': {
-            'position': 'top',
-            'horizontalAlign': 'right',
-            'offsetX': -10
-        },
     }
+    chart_data_line.update(copy.deepcopy(_LINEA_BASE))
     return chart_data_line
 
-def data_chart_donut():
-    chart_donut_data = {
-            'series': [],
-            'labels': ['Restante', 'Ejecutado'],
-            'locales': [
-                {
-                    "name": "en",
-                    "options": {
-                        "months": ["January", "February", "March", "April", "May", "June", "July", "August",
-                                   "September",
-                                   "October", "November", "December"],
-                        "shortMonths": ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov",
-                                        "Dec"],
-                        "days": ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"],
-                        "shortDays": ["Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat"],
-                        "toolbar": {
-                            "exportToSVG": "Download SVG",
-                            "exportToPNG": "Download PNG",
-                            "menu": "Menu",
-                            "selection": "Selection",
-                            "selectionZoom": "Selection Zoom",
-                            "zoomIn": "Zoom In",
-                            "zoomOut": "Zoom Out",
-                            "pan": "Panning",
-                            "reset": "Reset Zoom"
-                        }
-                    }
-                }
-            ],
-            'chart': {
-                'type': 'donut',
-            },
-            'plotOptions': {
-                'pie': {
-                    'donut': {
-                        'labels': {
-                            'show': 'true',
-                            'total': {
-                                'showAlways': 'true',
-                                'show': 'true'
-                            }
-                        }
-                    }
-                }
-            },
-
-        }
-    return chart_donut_data
-
 
 class ChartConfigurationService:
     """Servicio para configurar diferentes tipos de gráficos"""
@@ -261,4 +222,13 @@ def data_chart_enhanced(data_line, indicador, projection=None, meta=None):
 #     return ChartConfigurationService.get_donut_chart_config(
 #         series_data or default_series,
 #         labels or default_labels
-#     )
\ No newline at end of file
+#     )
+
+def data_chart_ejecucion_presupuesto(serie, monedas):
+    """Gráfico de área con el monto ejecutado por periodo de cada moneda"""
+    series = [
+        {'name': monedas.get(moneda_id, str(moneda_id)), 'data': datos['montos']}
+        for moneda_id, datos in serie['monedas'].items()
+    ]
+    return ChartConfigurationService.get_area_chart_config(
+        'Ejecución del presupuesto por periodo', series, serie['periodos'])
@@ -1,36 +1,40 @@
 import datetime
 import json
+import os
 import re
 from abc import ABC, abstractmethod
 from typing import List, Dict, Any
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.core.exceptions import PermissionDenied
 from django.db import IntegrityError, models, transaction
-from django.db.models import Q, Sum
+from django.db.models import Sum
 from django.forms import modelformset_factory, formset_factory
-from django.http import HttpResponseRedirect, JsonResponse
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, FileResponse, HttpResponseNotModified
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse_lazy
 from django.urls import reverse
 from django.utils import timezone
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_GET
+from django.views.decorators.http import condition, require_GET, require_POST, require_http_methods
 from django.views.generic import TemplateView, ListView, CreateView, UpdateView, DetailView, DeleteView, FormView
-from sympy import sympify, Symbol
 
 from nomencladores.models import EstadoAccion, TipoAccion, TipoMoneda, TipoPresupuesto, EstadoPresupuesto, \
     TipoIndicador, Escenario, Sector
 from registro.Services import FormulaCalculatorService, ResultadoIndicadorService, VariationCalculatorService, \
     ChartDataService, BreadcrumbBuilder, StatisticsCalculatorService, \
-    InsightGeneratorService, RankingCalculatorService, MetaProgressService
+    InsightGeneratorService, RankingCalculatorService, MetaProgressService, SerieEjecucionPresupuestoService, \
+    MapaAccionesService, PronosticoService, AnomaliaService, PlantillaIndicadorService
+from registro import busqueda, cache_versionada, documentos as documentos_adjuntos, estaticos, geometria, subidas
 from registro.forms import DocumentoForm, AccionForm, PresupuestoPlanificadoForm, PresupuestoEjecutadoForm, \
     IndicadorForm, VariableIndicadorForm, ResultadoVariableForm, ResultadoIndicadorForm
-from registro.models import Accion, Documento, PresupuestoPlanificado, PresupuestoEjecutado, VariableIndicador, \
-    Indicador, ResultadoIndicador, ResultadoVariable
-from registro.utils import data_chart_donut, data_chart_line
+from registro.models import Accion, PresupuestoPlanificado, PresupuestoEjecutado, VariableIndicador, \
+    Indicador, ResultadoIndicador, ResultadoVariable, ResumenPresupuestoAccion, SubidaDocumento
+from registro.utils import data_chart_line, data_chart_ejecucion_presupuesto
 
 
 # Create your views here.
@@ -59,10 +63,7 @@ class HomeView(LoginRequiredMixin, TemplateView):
         user = self.request.user
 
         # Filtrar acciones del usuario (o todas si es superuser)
-        if user.is_superuser:
-            acciones = Accion.objects.filter(publicado=True)
-        else:
-            acciones = Accion.objects.filter(user=user, publicado=True)
+        acciones = ChartDataService.acciones_panel(user)
 
         # ============ RESUMEN GENERAL ============
         # Obtener todos los indicadores de las acciones
@@ -85,52 +86,8 @@ class HomeView(LoginRequiredMixin, TemplateView):
             'indicadores_con_metas': indicadores_con_metas,
         }
 
-        # ============ PRESUPUESTOS POR MONEDA ============
-        presupuestos_por_moneda = []
-        for moneda in TipoMoneda.objects.filter(estado=True):
-            # Planificado total - iterar sobre acciones
-            total_planificado = 0
-            total_ejecutado = 0
-
-            for accion in acciones:
-                # Sumar presupuestos planificados de esta acción con esta moneda
-                presupuestos_accion = accion.presupuestos_planificados.filter(
-                    tipo_moneda=moneda
-                )
-                for pp in presupuestos_accion:
-                    total_planificado += pp.monto
-
-                    # Sumar ejecutados de este presupuesto planificado
-                    ejecutado_pp = pp.presupuestos_ejecutados.aggregate(
-                        total=Sum('monto')
-                    )['total'] or 0
-                    total_ejecutado += ejecutado_pp
-
-            # Cálculos
-            restante = total_planificado - total_ejecutado
-            porcentaje_ejecutado = (
-                (total_ejecutado / total_planificado * 100)
-                if total_planificado > 0 else 0
-            )
-
-            # Estado del semáforo
-            if porcentaje_ejecutado < 50:
-                estado = 'danger'
-            elif porcentaje_ejecutado < 80:
-                estado = 'warning'
-            else:
-                estado = 'success'
-
-            presupuestos_por_moneda.append({
-                'moneda': moneda.nombre,
-                'total_planificado': round(total_planificado, 2),
-                'total_ejecutado': round(total_ejecutado, 2),
-                'restante': round(restante, 2),
-                'porcentaje_ejecutado': round(porcentaje_ejecutado, 2),
-                'estado': estado
-            })
-
-        context['presupuestos_por_moneda'] = presupuestos_por_moneda
+        # Los presupuestos por moneda y las acciones por estado se cargan después de pintar la
+        # página desde graficos_panel
 
         # ============ INDICADORES CRÍTICOS (Alertas) ============
         indicadores_criticos = []
@@ -215,21 +172,6 @@ class HomeView(LoginRequiredMixin, TemplateView):
 
         context['indicadores_criticos'] = indicadores_criticos[:10]
 
-        # ============ ACCIONES POR ESTADO ============
-        acciones_por_estado = []
-        for estado in EstadoAccion.objects.all().order_by('orden'):
-            count = acciones.filter(estado_accion=estado).count()
-            acciones_por_estado.append({
-                'estado': estado.nombre,
-                'count': count,
-                'porcentaje': (
-                    count / acciones.count() * 100
-                    if acciones.count() > 0 else 0
-                )
-            })
-
-        context['acciones_por_estado'] = acciones_por_estado
-
         # ============ TOP 5 ACCIONES CON MEJOR DESEMPEÑO ============
         acciones_con_score = []
 
@@ -296,6 +238,12 @@ class HomeView(LoginRequiredMixin, TemplateView):
         context['top_acciones'] = acciones_con_score[:5]
 
         # ============ ANÁLISIS POR SECTOR ============
+        presupuesto_por_sector = dict(
+            ResumenPresupuestoAccion.objects.filter(accion__in=acciones)
+            .values('accion__sector_id')
+            .annotate(total=Sum('monto_planificado'))
+            .values_list('accion__sector_id', 'total')
+        )
         sectores_data = []
         for sector in Sector.objects.all():
             acciones_sector = acciones.filter(sector=sector)
@@ -308,11 +256,7 @@ class HomeView(LoginRequiredMixin, TemplateView):
             for accion in acciones_sector:
                 total_indicadores += accion.indicadores.count()
 
-            # ✅ CORRECTO: Presupuesto iterando sobre acciones
-            presupuesto_sector = 0
-            for accion in acciones_sector:
-                for pp in accion.presupuestos_planificados.all():
-                    presupuesto_sector += pp.monto
+            presupuesto_sector = presupuesto_por_sector.get(sector.id, 0)
 
             sectores_data.append({
                 'sector': sector.nombre,
@@ -432,13 +376,10 @@ class ActionCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
             self.object.user = self.request.user
             self.object.save()
 
-            # Procesar documentos adjuntos
+            # Procesar documentos adjuntos (un contenido ya subido no se guarda otra vez)
             documentos = self.request.FILES.getlist('documentos')
             for documento in documentos:
-                doc = Documento.objects.create(
-                    documento=documento,
-                    nombre=documento.name
-                )
+                doc = documentos_adjuntos.guardar_subida(documento)
                 self.object.documentos.add(doc)
 
             messages.success(self.request, 'La acción se ha registrado correctamente')
@@ -471,6 +412,8 @@ class ActionUpdateView(LoginRequiredMixin, PermissionRequiredMixin, UpdateView):
             'title_head': f'Editar acción [{self.object.id}]',
             'url_cancel': reverse('registro:lista_accion'),
             'form_docs': DocumentoForm(),
+            # Los documentos mayores que un fragmento se suben por fragmentos (subida_fragmentada.js)
+            'umbral_subida_fragmentada': settings.SUBIDAS_TAMANO_FRAGMENTO,
             'tipo_acciones': TipoAccion.objects.all().order_by('orden'),
             'selected_tipo_acciones': self.object.tipo_accion,
             'show_menu_left': True,
@@ -487,10 +430,7 @@ class ActionUpdateView(LoginRequiredMixin, PermissionRequiredMixin, UpdateView):
             documentos = self.request.FILES.getlist('documentos')
             if documentos:
                 for f in documentos:
-                    doc = Documento.objects.create(
-                        documento=f,
-                        nombre=f.name
-                    )
+                    doc = documentos_adjuntos.guardar_subida(f)
                     self.object.documentos.add(doc)
 
         messages.success(self.request, 'La acción se ha modificado correctamente')
@@ -578,21 +518,24 @@ class PresupuestoPlanificadoListView(LoginRequiredMixin, PermissionRequiredMixin
         totales_presupuestos = []
         desglose_total = []
 
+        # Totales precalculados por moneda (ResumenPresupuestoAccion)
+        resumenes = {r.tipo_moneda_id: r for r in self.accion.resumenes_presupuesto.all()}
+        presupuestos_por_moneda = {}
+        for pp in self.object_list:
+            presupuestos_por_moneda.setdefault(pp.tipo_moneda_id, []).append(pp)
+
         for tm in tipos_monedas:
-            presupuestos = self.accion.presupuestos_planificados.filter(
-                tipo_moneda=tm).order_by('tipo_presupuesto__orden')
-            total = presupuestos.aggregate(total=models.Sum('monto'))['total']
+            presupuestos = presupuestos_por_moneda.get(tm.id, [])
+            resumen = resumenes.get(tm.id)
+            total = resumen.monto_planificado if resumen else None
             monto_ejecutado_total = 0
             desglose_planificado = []
             subtotales = []
 
-            chart_donut_data = data_chart_donut()
-
             for pp in presupuestos:
                 subtotales.append(pp.monto)
                 monto_planificado = pp.monto
-                presupuestos_ejecutados = pp.presupuestos_ejecutados.all()
-                monto_ejecutado = sum(p.monto for p in presupuestos_ejecutados)
+                monto_ejecutado = pp.monto_ejecutado
 
                 if monto_planificado > 0:
                     porcentaje_ejecucion = (monto_ejecutado / monto_planificado) * 100
@@ -623,8 +566,6 @@ class PresupuestoPlanificadoListView(LoginRequiredMixin, PermissionRequiredMixin
                 restante_total = 0
                 porcentaje_restante_total = 0
 
-            chart_donut_data['series'] = [total - monto_ejecutado_total, monto_ejecutado_total] if total else [0, 0]
-
             desglose_total.append({
                 'moneda': tm.nombre,
                 'desglose_planificado': desglose_planificado,
@@ -632,7 +573,6 @@ class PresupuestoPlanificadoListView(LoginRequiredMixin, PermissionRequiredMixin
                 'monto_ejecutado_total': monto_ejecutado_total,
                 'monto_planificado_total': total,
                 'restante_total': restante_total,
-                'chart_donut_data': chart_donut_data,
                 'porcentaje_restante_total': porcentaje_restante_total
             })
 
@@ -931,6 +871,39 @@ class PresupuestoEjecutadoUpdateView(LoginRequiredMixin, PermissionRequiredMixin
                                 args=[self.kwargs['id_accion']]))
 
 
+@login_required
+@permission_required('registro.view_presupuestoplanificado', raise_exception=True)
+@require_GET
+def serie_ejecucion_presupuesto(request, id_accion):
+    """Serie de ejecución por mes o trimestre y proyección de agotamiento de cada presupuesto"""
+    accion = get_object_or_404(Accion, id=id_accion)
+    periodo = request.GET.get('periodo', 'mes')
+    if periodo not in SerieEjecucionPresupuestoService.PERIODOS:
+        return JsonResponse({'error': 'Periodo inválido. Use mes o trimestre'}, status=400)
+
+    serie = SerieEjecucionPresupuestoService.serie_accion(accion.id, periodo)
+    monedas = dict(TipoMoneda.objects.values_list('id', 'nombre'))
+    presupuestos = accion.presupuestos_planificados.select_related('tipo_presupuesto', 'tipo_moneda')
+    proyecciones = SerieEjecucionPresupuestoService.proyecciones(presupuestos)
+
+    return JsonResponse({
+        'chart': data_chart_ejecucion_presupuesto(serie, monedas),
+        'proyecciones': [
+            {
+                'presupuesto_id': p.id,
+                'tipo_presupuesto': p.tipo_presupuesto.nombre,
+                'moneda': p.tipo_moneda.nombre,
+                'ritmo_diario': proyecciones[p.id]['ritmo_diario'],
+                'monto_restante': proyecciones[p.id]['monto_restante'],
+                'dias_restantes': proyecciones[p.id]['dias_restantes'],
+                'fecha_agotamiento': (proyecciones[p.id]['fecha_agotamiento'].strftime('%d/%m/%Y')
+                                      if proyecciones[p.id]['fecha_agotamiento'] else None),
+            }
+            for p in presupuestos
+        ],
+    })
+
+
 @login_required
 @permission_required('registro.delete_presupuestoejecutado', raise_exception=True)
 def eliminar_presupuesto_ejecutado(request, id_accion, id_presupuesto, id_ejecutado):
@@ -1225,20 +1198,11 @@ class VariableIndicadorService:
         self.variable_model = model_class
 
     def create_or_update_variables(self, json_data: List[Dict[str, Any]], indicador) -> bool:
-        """Crea o actualiza variables de indicador"""
+        """Crea o actualiza variables de indicador y deja asociadas al indicador solo las del JSON"""
         try:
-            for item in json_data:
-                if item.get('nombre'):
-                    variable, created = self.variable_model.objects.get_or_create(
-                        nombre=item['nombre'],
-                        defaults={'variable': item['variable']}
-                    )
-
-                    if not created and variable.variable != item['variable']:
-                        variable.variable = item['variable']
-                        variable.save()
-
-                    indicador.variable_indicador.add(variable)
+            variables = PlantillaIndicadorService.resolver_variables(json_data, self.variable_model,
+                                                                     indicador_ids=[indicador.id])
+            PlantillaIndicadorService.sincronizar_variables([indicador.id], [v.id for v in variables.values()])
             return True
         except Exception:
             return False
@@ -1286,12 +1250,19 @@ class IndicadorService:
 
                 # Actualizar indicador
                 indicador = form.save()
-                indicador.variable_indicador.clear()
+                variables_previas = set(indicador.variable_indicador.values_list('id', 'variable'))
 
                 # Actualizar variables asociadas
                 if not self.variable_service.create_or_update_variables(json_data, indicador):
                     raise Exception("Error al actualizar variables")
 
+                # Copia al escribir: cambiar la definición desvincula el indicador de su plantilla
+                if indicador.plantilla_id and (
+                        set(form.changed_data) & set(PlantillaIndicadorService.CAMPOS_COMPARTIDOS)
+                        or variables_previas != set(indicador.variable_indicador.values_list('id', 'variable'))):
+                    messages.info(request, f'El indicador ya no sigue la plantilla "{indicador.plantilla.nombre}".')
+                    PlantillaIndicadorService.desvincular(indicador)
+
                 return True
         except Exception as e:
             messages.error(request, f'{str(e)} Ha ocurrido un error contacte con su administrador.')
@@ -1508,7 +1479,6 @@ def eliminar_indicador(request, id_accion, id_indicador):
     if request.method == 'POST':
         indicador = Indicador.objects.filter(id=id_indicador).first()
         indicador.variable_indicador.clear()
-        indicador.resultados.all().delete()
         indicador.delete()
         messages.success(request, 'El indicador se ha eliminado correctamente')
         return HttpResponseRedirect(
@@ -1572,10 +1542,9 @@ class ResultadosIndicadorListView(LoginRequiredMixin, PermissionRequiredMixin,
         BaseResultadoIndicadorView.__init__(self)
         # Inyección de dependencias
         self.variation_calculator = VariationCalculatorService()
-        self.chart_data_service = ChartDataService()
 
         self.statistics_calculator = StatisticsCalculatorService()
-        # self.projection_service = ProjectionService()
+        self.projection_service = PronosticoService()
         self.insight_generator = InsightGeneratorService()
 
     def handle_no_permission(self):
@@ -1597,15 +1566,16 @@ class ResultadosIndicadorListView(LoginRequiredMixin, PermissionRequiredMixin,
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         object_list = self.get_queryset()
+        # Resultados para estadísticas: sin los atípicos si así se configura
+        datos = AnomaliaService.para_estadisticas(object_list)
 
         # Usar servicios para calcular datos
-        variations = self.variation_calculator.calculate_variations(object_list, self.indicador)
-        chart_data = self.chart_data_service.prepare_chart_data(object_list, self.indicador)
+        variations = self.variation_calculator.calculate_variations(datos, self.indicador)
         # Nuevos cálculos estadísticos
-        advanced_stats = self.statistics_calculator.calculate_advanced_statistics(object_list, self.indicador)
-        # projection = self.projection_service.calculate_projection(object_list)
+        advanced_stats = self.statistics_calculator.calculate_advanced_statistics(datos, self.indicador)
+        projection = self.projection_service.proyeccion(self.indicador)
         # insights = self.insight_generator.generate_insights(object_list, advanced_stats, variations, self.indicador)
-        insights = self.insight_generator.generate_insights(object_list, advanced_stats, variations, self.indicador)
+        insights = self.insight_generator.generate_insights(datos, advanced_stats, variations, self.indicador)
 
         # Cálculo de progreso hacia meta (si existe)
         meta_progress = self.indicador.calcular_progreso_meta()
@@ -1624,10 +1594,10 @@ class ResultadosIndicadorListView(LoginRequiredMixin, PermissionRequiredMixin,
 
         # Resumen ejecutivo y score de impacto climático
         executive_summary = self.insight_generator.generate_executive_summary(
-            object_list, advanced_stats, variations, self.indicador
+            datos, advanced_stats, variations, self.indicador
         )
         climate_impact_score = self.insight_generator.generate_climate_impact_score(
-            object_list, advanced_stats, variations, self.indicador
+            datos, advanced_stats, variations, self.indicador
         )
 
         context.update({
@@ -1639,7 +1609,6 @@ class ResultadosIndicadorListView(LoginRequiredMixin, PermissionRequiredMixin,
             'crear_url': self.get_create_url(),
             'url_cancel': self.get_cancel_url(),
             'primer_resultado': object_list.first(),
-            'chart_data_line': chart_data,
             'dict_object_list': self.get_queryset(),
             'show_menu_left': True,
             'next_url': '#',
@@ -1651,7 +1620,7 @@ class ResultadosIndicadorListView(LoginRequiredMixin, PermissionRequiredMixin,
             'climate_impact_score': climate_impact_score,
             'advanced_statistics': advanced_stats,
 
-            # 'projection': projection,
+            'projection': projection,
             'meta_progress': meta_progress,
             'detailed_meta_progress': detailed_meta_progress,
             'next_measurement': next_measurement,
@@ -1757,6 +1726,11 @@ class ResultadoIndicadorCreateView(LoginRequiredMixin, PermissionRequiredMixin,
     def get_success_url(self):
         return self.get_list_url()
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['instance'] = ResultadoIndicador(indicador=self.indicador)
+        return kwargs
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
@@ -1941,132 +1915,292 @@ def eliminar_resultado_indicador(request, id_accion, id_indicador, id_resultado)
             reverse('resgistro:lista_resultado_indicador', args=[id_accion, id_indicador]))
 
 
+def _fecha_serie(valor):
+    """Fecha de un parámetro de serie: AAAA-MM-DD o milisegundos desde 1970 (zoom de ApexCharts)"""
+    if not valor:
+        return None
+    if valor.lstrip('-').isdigit():
+        return datetime.datetime.fromtimestamp(int(valor) / 1000, tz=datetime.timezone.utc).date()
+    return datetime.date.fromisoformat(valor)
+
+
+# Datos de gráficos: solo las series, que la página pide después de pintarse (assets/js/graficos.js
+# tiene la configuración fija). El ETag es la huella de las filas que lee cada vista
+# (ChartDataService.huella_*), así que una visita repetida recibe 304 sin calcular la respuesta.
+# No hay Last-Modified: los resultados no guardan fecha de modificación
+
+def _etag_resultados(request, id_accion, id_indicador):
+    return ChartDataService.huella_resultados(id_indicador)
+
+
+def _etag_presupuesto(request, id_accion):
+    return ChartDataService.huella_resumenes([id_accion])
+
+
+def _etag_panel(request):
+    return ChartDataService.huella_panel(ChartDataService.acciones_panel(request.user))
+
+
+def datos_grafico(etag):
+    """Vista GET de datos de gráfico, validada con etag(request, ...) y sin caché compartida"""
+    def decorador(vista):
+        vista = condition(etag_func=etag)(vista)
+        return require_GET(cache_control(private=True, no_cache=True)(vista))
+    return decorador
+
+
+@login_required
+@permission_required('registro.view_resultadoindicador', raise_exception=True)
+@datos_grafico(_etag_resultados)
+def serie_resultado_indicador(request, id_accion, id_indicador):
+    """
+    Resultados del indicador en formato columnar ({x, y, min, max, ...}), reducidos con LTTB a
+    ?puntos= (1000 por defecto) y opcionalmente acotados a ?desde=&hasta= al hacer zoom
+    """
+    indicador = get_object_or_404(Indicador.objects.select_related('unidad_medida'), id=id_indicador)
+    try:
+        puntos = int(request.GET.get('puntos', ChartDataService.PUNTOS))
+        desde = _fecha_serie(request.GET.get('desde'))
+        hasta = _fecha_serie(request.GET.get('hasta'))
+    except (ValueError, OverflowError, OSError):
+        return JsonResponse({'error': 'Parámetros inválidos: puntos entero, desde/hasta AAAA-MM-DD o milisegundos'},
+                            status=400)
+    return JsonResponse(ChartDataService.serie(indicador, puntos, desde, hasta))
+
+
+@login_required
+@permission_required('registro.view_resultadoindicador', raise_exception=True)
+@datos_grafico(_etag_resultados)
+def distribucion_resultado_indicador(request, id_accion, id_indicador):
+    """Histograma de los valores del indicador"""
+    indicador = get_object_or_404(Indicador, id=id_indicador)
+    return JsonResponse(ChartDataService.distribucion(indicador))
+
+
+@login_required
+@permission_required('registro.view_presupuestoplanificado', raise_exception=True)
+@datos_grafico(_etag_presupuesto)
+def graficos_presupuesto_planificado(request, id_accion):
+    """Series [restante, ejecutado] de las donas por moneda del presupuesto de la acción"""
+    accion = get_object_or_404(Accion, id=id_accion)
+    return JsonResponse({'donas': ChartDataService.donas_presupuesto(accion)})
+
+
+@login_required
+@datos_grafico(_etag_panel)
+def graficos_panel(request):
+    """Presupuestos por moneda y acciones por estado del panel de inicio"""
+    acciones = ChartDataService.acciones_panel(request.user)
+    return JsonResponse({
+        'presupuestos': ChartDataService.presupuestos_panel(acciones),
+        'estados': ChartDataService.estados_panel(acciones),
+    })
+
+
 def mapa_cuba_leaflet(request):
+    filtros = cache_versionada.espacio('nomencladores').get_or_set('mapa_filtros', lambda: {
+        'tipo_acciones': list(TipoAccion.objects.all().order_by('orden')),
+        'sectores': list(Sector.objects.all().order_by('nombre')),
+        'estados': list(EstadoAccion.objects.all().order_by('orden')),
+        'escenarios': list(Escenario.objects.all().order_by('nombre')),
+    })
     data = {
         'title_html': 'Mapa de acciones',
-        'tipo_acciones': TipoAccion.objects.all().order_by('orden'),
-        'sectores': Sector.objects.all().order_by('nombre'),
-        'estados': EstadoAccion.objects.all().order_by('orden'),
-        'escenarios': Escenario.objects.all().order_by('nombre'),
+        **filtros,
+        'geometrias_version': (geometria.manifiesto() or {}).get('version', ''),
     }
     return render(request, 'action/mapa.html', data)
 
 
+@require_GET
+def geometria_mapa(request, capa):
+    """
+    Sirve el TopoJSON de una capa del mapa con el nivel de detalle del zoom pedido y en la variante
+    comprimida que acepte el navegador. Con ?v=<versión del manifiesto> la respuesta se cachea sin
+    revalidar; sin ella se revalida con ETag.
+    """
+    try:
+        zoom = int(request.GET.get('zoom', 0))
+    except ValueError:
+        return JsonResponse({'error': 'Zoom inválido'}, status=400)
+
+    entrada = geometria.nivel_para_zoom(capa, zoom)
+    if entrada is None:
+        return JsonResponse({'error': 'Geometría no disponible'}, status=404)
+
+    aceptadas = estaticos.codificaciones_aceptadas(request.headers.get('Accept-Encoding', ''))
+    codificacion = next((c for c in aceptadas if c in entrada), '')
+    etag = f'"{entrada["hash"]}-{codificacion}"' if codificacion else f'"{entrada["hash"]}"'
+
+    if estaticos.coincide_etag(request.headers.get('If-None-Match', ''), etag):
+        respuesta = HttpResponseNotModified()
+    else:
+        extension = {'': '', 'gzip': '.gz', 'br': '.br'}[codificacion]
+        ruta = os.path.join(geometria.directorio_salida(), entrada['archivo'] + extension)
+        respuesta = FileResponse(open(ruta, 'rb'), content_type='application/json')
+        if codificacion:
+            respuesta['Content-Encoding'] = codificacion
+
+    versionada = request.GET.get('v') == geometria.manifiesto()['version']
+    respuesta['ETag'] = etag
+    respuesta['Vary'] = 'Accept-Encoding'
+    respuesta['Cache-Control'] = 'public, max-age=31536000, immutable' if versionada else 'public, max-age=86400'
+    return respuesta
+
+
 @require_GET
 def municipios_por_tipo_accion(request):
-    tipo_id = request.GET.get('tipo')
-    estado_id = request.GET.get('estado')
-    sector_id = request.GET.get('sector')
-    escenario_id = request.GET.get('escenario')
-    fecha = request.GET.get('fecha')
-    q = Q()
-    # acciones = Accion.objects.filter(tipo_accion_id=tipo_id)
-    # filtra con q estado, tipo, sector, escenario y fecha la fecha viene en formato 09/09/2025 to 18/09/2025
-    if tipo_id:
-        q &= Q(tipo_accion_id=tipo_id)
-    if estado_id:
-        q &= Q(estado_id=estado_id)
-    if sector_id:
-        q &= Q(sector_id=sector_id)
-    if escenario_id:
-        q &= Q(escenario_id=escenario_id)
-    if fecha:
-        try:
-            fecha_inicio_str, fecha_fin_str = fecha.split(' to ')
-            fecha_inicio = datetime.strptime(fecha_inicio_str, '%d/%m/%Y').date()
-            fecha_fin = datetime.strptime(fecha_fin_str, '%d/%m/%Y').date()
-            q &= Q(fecha_inicio__gte=fecha_inicio) & Q(fecha_fin__lte=fecha_fin)
-        except ValueError:
-            return JsonResponse({'error': 'Formato de fecha inválido. Use DD/MM/YYYY to DD/MM/YYYY'}, status=400)
-
-    acciones = Accion.objects.filter(q)
-    municipios = {}
-    provincias = {}
-    tiene_municipios = False
-    tiene_provincias = False
-
-    for accion in acciones:
-        # Si la acción tiene municipios
-        if accion.municipios.exists():
-            tiene_municipios = True
-            for municipio in accion.municipios.all():
-                prov = municipio.provincia
-                if municipio.id not in municipios:
-                    municipios[municipio.id] = {
-                        'municipio_id': municipio.id,
-                        'municipio_nombre': municipio.nombre,
-                        'provincia_id': prov.id,
-                        'provincia_nombre': prov.nombre,
-                        'provincia_hc_keys': prov.hc_keys.lower(),
-                        'acciones_count': 0,
-                        'presupuesto_total': {},  # Cambiar a dict para sumar por moneda
-                    }
-                municipios[municipio.id]['acciones_count'] += 1
-                for pp in accion.presupuestos_planificados.all():
-                    moneda = pp.tipo_moneda.nombre
-                    if moneda not in municipios[municipio.id]['presupuesto_total']:
-                        municipios[municipio.id]['presupuesto_total'][moneda] = 0
-                    municipios[municipio.id]['presupuesto_total'][moneda] += pp.monto
-        # Si la acción tiene provincias
-        elif accion.provincias.exists():
-            tiene_provincias = True
-            for provincia in accion.provincias.all():
-                if provincia.id not in provincias:
-                    provincias[provincia.id] = {
-                        'provincia_id': provincia.id,
-                        'provincia_nombre': provincia.nombre,
-                        'provincia_hc_keys': provincia.hc_keys.lower(),
-                        'acciones_count': 0,
-                        'presupuesto_total': {},
-                    }
-                provincias[provincia.id]['acciones_count'] += 1
-                for pp in accion.presupuestos_planificados.all():
-                    moneda = pp.tipo_moneda.nombre
-                    if moneda not in provincias[provincia.id]['presupuesto_total']:
-                        provincias[provincia.id]['presupuesto_total'][moneda] = 0
-                    provincias[provincia.id]['presupuesto_total'][moneda] += pp.monto
-
-    # Convertir los dicts de presupuesto_total a listas de objetos {moneda, monto_total}
-    for m in municipios.values():
-        m['presupuesto_total'] = [{'moneda': k, 'monto_total': v} for k, v in m['presupuesto_total'].items() if v > 0]
-    for p in provincias.values():
-        p['presupuesto_total'] = [{'moneda': k, 'monto_total': v} for k, v in p['presupuesto_total'].items() if v > 0]
-
-    # Calcular resumen ejecutivo
-    total_acciones = acciones.count()
-    total_activas = total_acciones  # Si tienes un campo para activas, cámbialo aquí
-    resumen_presupuesto = {}
-    for accion in acciones:
-        for p in accion.presupuesto_total:
-            moneda = p['moneda']
-            monto = p['monto_total']
-            if moneda not in resumen_presupuesto:
-                resumen_presupuesto[moneda] = 0
-            resumen_presupuesto[moneda] += monto
-    resumen_presupuesto_list = [{'moneda': k, 'monto_total': v} for k, v in resumen_presupuesto.items() if v > 0]
-
-    if municipios:
-        print(resumen_presupuesto_list)
-        return JsonResponse({
-            'tipo': 'municipio',
-            'municipios': list(municipios.values()),
-            'resumen': {
-                'total_acciones': total_acciones,
-                'total_activas': total_activas,
-                'presupuesto_total': resumen_presupuesto_list
-            }
-        }, safe=False)
-    elif provincias:
-        print(resumen_presupuesto_list)
-        return JsonResponse({
-            'tipo': 'provincia',
-            'provincias': list(provincias.values()),
-            'resumen': {
-                'total_acciones': total_acciones,
-                'total_activas': total_activas,
-                'presupuesto_total': resumen_presupuesto_list
-            }
-        }, safe=False)
+    # Filtros: tipo, estado, sector, escenario y periodo (la fecha viene en formato 09/09/2025 to 18/09/2025)
+    try:
+        filtros = MapaAccionesService.filtros(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(MapaAccionesService.agregados(filtros), safe=False)
+
+
+@require_GET
+def mapa_acciones_geojson(request):
+    """
+    FeatureCollection con las geometrías de los territorios filtrados y, en sus propiedades, el
+    número de acciones y el presupuesto por moneda; sustituye la descarga de un GeoJSON por
+    provincia en el cliente. Se revalida con un ETag calculado a partir de los datos.
+    """
+    try:
+        filtros = MapaAccionesService.filtros(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    try:
+        zoom = int(request.GET.get('zoom', 0))
+    except ValueError:
+        return JsonResponse({'error': 'Zoom inválido'}, status=400)
+
+    etag = MapaAccionesService.etag(filtros, zoom)
+    if estaticos.coincide_etag(request.headers.get('If-None-Match', ''), etag):
+        respuesta = HttpResponseNotModified()
     else:
-        return JsonResponse({'tipo': 'vacio', 'data': [],
-                             'resumen': {'total_acciones': 0, 'total_activas': 0, 'presupuesto_total': []}}, safe=False)
+        respuesta = HttpResponse(MapaAccionesService.geojson(filtros, zoom), content_type='application/json')
+    respuesta['ETag'] = etag
+    respuesta['Cache-Control'] = 'private, no-cache'
+    return respuesta
+
+
+@login_required
+@require_GET
+def metricas_cache(request):
+    """Aciertos, fallos, desalojos e invalidaciones de cada espacio de caché en este proceso"""
+    if not request.user.is_superuser:
+        return JsonResponse({'error': 'No tiene permisos para ver las métricas de caché'}, status=403)
+    return JsonResponse({'backend': settings.CACHE_BACKEND, 'espacios': cache_versionada.metricas()})
+
+
+@login_required
+@require_GET
+def buscar_texto(request):
+    """
+    Búsqueda de texto completo en acciones, indicadores, resultados de acciones y documentos.
+    Parámetros: q, tipo (repetible; accion, indicador, resultado_accion, documento), pagina y
+    por_pagina (máximo 50). Los resultados vienen ordenados por relevancia.
+    """
+    if not request.user.has_perm('registro.view_accion'):
+        return JsonResponse({'error': 'No tiene permisos para buscar'}, status=403)
+    consulta = request.GET.get('q', '').strip()
+    tipos = request.GET.getlist('tipo')
+    if set(tipos) - set(busqueda.FUENTES):
+        return JsonResponse({'error': f'Tipo inválido; use {", ".join(busqueda.FUENTES)}'}, status=400)
+    try:
+        pagina = max(1, int(request.GET.get('pagina', 1)))
+        por_pagina = min(50, max(1, int(request.GET.get('por_pagina', 20))))
+    except ValueError:
+        return JsonResponse({'error': 'Página inválida'}, status=400)
+
+    resultado = busqueda.buscar(consulta, tipos, pagina, por_pagina)
+    return JsonResponse({
+        'consulta': consulta,
+        'pagina': pagina,
+        'paginas': -(-resultado['total'] // por_pagina),
+        **resultado,
+    })
+
+
+# ============================================================================
+# Subida por fragmentos de documentos grandes (registro.subidas)
+# ============================================================================
+
+def _error_subida(error):
+    return JsonResponse({'error': str(error), **error.datos}, status=error.status)
+
+
+def _subida_del_usuario(request, id_subida):
+    if not request.user.has_perm('registro.change_accion'):
+        raise PermissionDenied
+    return get_object_or_404(SubidaDocumento, pk=id_subida, usuario=request.user)
+
+
+@login_required
+@require_POST
+def crear_subida_documento(request, id_accion):
+    """
+    Abre una subida por fragmentos a la acción. Cuerpo JSON: nombre, tamano y, opcional, sha256
+    del fichero. Devuelve el estado de la subida con el tamaño de fragmento que hay que usar.
+    """
+    if not request.user.has_perm('registro.change_accion'):
+        return JsonResponse({'error': 'Usted no tiene los privilegios necesarios para esta operación.'}, status=403)
+    accion = get_object_or_404(Accion, pk=id_accion)
+    try:
+        datos = json.loads(request.body or b'{}')
+        subida = subidas.crear(accion, request.user, datos.get('nombre'), datos.get('tamano'), datos.get('sha256'))
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': 'Se espera un objeto JSON con nombre y tamano'}, status=400)
+    except subidas.ErrorSubida as e:
+        return _error_subida(e)
+    return JsonResponse(subidas.estado(subida), status=201)
+
+
+@login_required
+@require_http_methods(['GET', 'DELETE'])
+def subida_documento(request, id_subida):
+    """Estado de la subida con los fragmentos pendientes, para reanudarla; DELETE la cancela"""
+    subida = _subida_del_usuario(request, id_subida)
+    if request.method == 'DELETE':
+        try:
+            subidas.cancelar(subida)
+        except subidas.ErrorSubida as e:
+            return _error_subida(e)
+        return HttpResponse(status=204)
+    return JsonResponse(subidas.estado(subida))
+
+
+@login_required
+@require_http_methods(['PUT'])
+def fragmento_subida_documento(request, id_subida, indice):
+    """
+    Recibe el fragmento `indice` en el cuerpo de la petición (application/octet-stream), con su
+    SHA-256 opcional en la cabecera X-Checksum-Sha256. Se copia al fichero por bloques, sin leer
+    el cuerpo entero en memoria.
+    """
+    subida = _subida_del_usuario(request, id_subida)
+    try:
+        longitud = int(request.META.get('CONTENT_LENGTH') or 0)
+        subida = subidas.escribir_fragmento(subida, indice, request, longitud,
+                                            request.headers.get('X-Checksum-Sha256', ''))
+    except subidas.ErrorSubida as e:
+        return _error_subida(e)
+    except ValueError:
+        return JsonResponse({'error': 'Content-Length inválido'}, status=400)
+    return JsonResponse(subidas.estado(subida))
+
+
+@login_required
+@require_POST
+def completar_subida_documento(request, id_subida):
+    """Verifica el SHA-256 del fichero completo y lo adjunta a la acción como documento"""
+    subida = _subida_del_usuario(request, id_subida)
+    try:
+        datos = json.loads(request.body or b'{}')
+        subida = subidas.completar(subida, datos.get('sha256', ''))
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': 'Se espera un objeto JSON'}, status=400)
+    except subidas.ErrorSubida as e:
+        return _error_subida(e)
+    return JsonResponse(subidas.estado(subida))
+
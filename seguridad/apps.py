@@ -6,4 +6,7 @@ class SeguridadConfig(AppConfig):
     name = 'seguridad'
 
     def ready(self):
-        import seguridad.signals
\ No newline at end of file
+        import seguridad.signals
+        from seguridad import auditoria
+
+        auditoria.instalar()
\ No newline at end of file
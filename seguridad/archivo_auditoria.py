@@ -0,0 +1,241 @@
+"""
+Archivo histórico del registro de auditoría.
+
+archivar() mueve por lotes los LogEntry anteriores a la ventana de retención a un fichero JSONL
+comprimido por mes (auditoria-AAAA-MM.jsonl.gz en settings.AUDITORIA_ARCHIVO_DIR) y los elimina
+de la tabla. Cada lote se añade como un miembro gzip nuevo, de modo que los ficheros solo crecen.
+indice.json resume cada mes (entradas, actores, modelos y rango de fechas) para que buscar() abra
+únicamente los ficheros que pueden contener lo pedido.
+
+buscar() consulta primero la tabla viva y completa con los archivos, del mes más reciente al más
+antiguo. Las entradas se devuelven como diccionarios con el mismo formato en ambos casos.
+ContadorAuditoriaUsuario cuenta las entradas vivas y archivadas, así que archivar no lo modifica.
+"""
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+from auditlog.models import LogEntry
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+ARCHIVO = 'auditoria-{mes}.jsonl.gz'
+INDICE = 'indice.json'
+
+
+def _directorio():
+    return settings.AUDITORIA_ARCHIVO_DIR
+
+
+def leer_indice():
+    try:
+        with open(os.path.join(_directorio(), INDICE), encoding='utf-8') as archivo:
+            return json.load(archivo)
+    except FileNotFoundError:
+        return {'meses': {}, 'pendientes': [], 'en_curso': {}}
+
+
+def _guardar_indice(indice):
+    ruta = os.path.join(_directorio(), INDICE)
+    temporal = f'{ruta}.tmp'
+    with open(temporal, 'w', encoding='utf-8') as archivo:
+        json.dump(indice, archivo, indent=1, sort_keys=True)
+        archivo.flush()
+        os.fsync(archivo.fileno())
+    os.replace(temporal, ruta)
+
+
+def serializar(entrada):
+    """Diccionario JSON de un LogEntry; el modelo se guarda como 'app_label.model'"""
+    return {
+        'id': entrada.id,
+        'modelo': f'{entrada.content_type.app_label}.{entrada.content_type.model}',
+        'object_pk': entrada.object_pk,
+        'object_id': entrada.object_id,
+        'object_repr': entrada.object_repr,
+        'action': entrada.action,
+        'changes': entrada.changes,
+        'serialized_data': entrada.serialized_data,
+        'additional_data': entrada.additional_data,
+        'actor_id': entrada.actor_id,
+        'remote_addr': entrada.remote_addr,
+        'timestamp': entrada.timestamp.isoformat(),
+    }
+
+
+def _ruta_mes(mes):
+    return os.path.join(_directorio(), ARCHIVO.format(mes=mes))
+
+
+def _escribir(mes, registros):
+    ruta = _ruta_mes(mes)
+    with open(ruta, 'ab') as crudo:
+        with gzip.GzipFile(fileobj=crudo, mode='ab') as comprimido:
+            for registro in registros:
+                comprimido.write(json.dumps(registro, ensure_ascii=False).encode('utf-8') + b'\n')
+        crudo.flush()
+        os.fsync(crudo.fileno())
+
+
+def _actualizar_mes(resumen, registros):
+    resumen['entradas'] = resumen.get('entradas', 0) + len(registros)
+    actores = resumen.setdefault('actores', {})
+    modelos = resumen.setdefault('modelos', {})
+    for registro in registros:
+        if registro['actor_id'] is not None:
+            actores[str(registro['actor_id'])] = actores.get(str(registro['actor_id']), 0) + 1
+        modelos[registro['modelo']] = modelos.get(registro['modelo'], 0) + 1
+    marcas = [r['timestamp'] for r in registros]
+    resumen['desde'] = min(marcas + [resumen.get('desde', marcas[0])])
+    resumen['hasta'] = max(marcas + [resumen.get('hasta', marcas[0])])
+
+
+def archivar(dias=None, lote=5000, simular=False):
+    """
+    Mueve al archivo los LogEntry con más de `dias` días (settings.AUDITORIA_RETENCION_DIAS por
+    defecto). Devuelve {mes: entradas archivadas}.
+
+    Antes de escribir un lote se guarda en el índice el tamaño de los ficheros que va a ampliar
+    (indice['en_curso']); el resumen del lote y sus ids (indice['pendientes']) se guardan después,
+    en la misma escritura atómica del índice que limpia en_curso, y solo entonces se borran de la
+    tabla. Si el proceso se interrumpe al escribir, la siguiente ejecución recorta los ficheros al
+    tamaño anotado y vuelve a archivar el lote; si se interrumpe al borrar, borra esas entradas
+    sin volver a escribirlas.
+    """
+    limite = datetime.now() - timedelta(days=settings.AUDITORIA_RETENCION_DIAS if dias is None else dias)
+    antiguas = LogEntry.objects.filter(timestamp__lt=limite)
+    if simular:
+        return {
+            f'{fila["timestamp__year"]:04d}-{fila["timestamp__month"]:02d}': fila['n']
+            for fila in antiguas.values('timestamp__year', 'timestamp__month')
+            .annotate(n=Count('id')).order_by()
+        }
+
+    os.makedirs(_directorio(), exist_ok=True)
+    indice = leer_indice()
+    if indice.get('en_curso'):
+        _deshacer(indice)
+    if indice.get('pendientes'):
+        _borrar(indice, indice['pendientes'])
+
+    archivadas = {}
+    while True:
+        entradas = list(antiguas.select_related('content_type').order_by('id')[:lote])
+        if not entradas:
+            break
+        por_mes = {}
+        for entrada in entradas:
+            por_mes.setdefault(entrada.timestamp.strftime('%Y-%m'), []).append(serializar(entrada))
+        indice['en_curso'] = {
+            mes: os.path.getsize(_ruta_mes(mes)) if os.path.exists(_ruta_mes(mes)) else 0 for mes in por_mes
+        }
+        _guardar_indice(indice)
+        for mes, registros in por_mes.items():
+            _escribir(mes, registros)
+            _actualizar_mes(indice['meses'].setdefault(mes, {}), registros)
+            archivadas[mes] = archivadas.get(mes, 0) + len(registros)
+        indice['en_curso'] = {}
+        indice['pendientes'] = [e.id for e in entradas]
+        _guardar_indice(indice)
+        _borrar(indice, indice['pendientes'])
+    return archivadas
+
+
+def _deshacer(indice):
+    """Recorta los ficheros de un lote que no llegó a anotarse en el índice a su tamaño anterior"""
+    for mes, tamano in indice['en_curso'].items():
+        if os.path.exists(_ruta_mes(mes)):
+            with open(_ruta_mes(mes), 'r+b') as archivo:
+                archivo.truncate(tamano)
+                os.fsync(archivo.fileno())
+    indice['en_curso'] = {}
+    _guardar_indice(indice)
+
+
+def _borrar(indice, ids):
+    with transaction.atomic():
+        LogEntry.objects.filter(id__in=ids).delete()
+    indice['pendientes'] = []
+    _guardar_indice(indice)
+
+
+def _leer_mes(mes):
+    ruta = _ruta_mes(mes)
+    if not os.path.exists(ruta):
+        return
+    with gzip.open(ruta, 'rt', encoding='utf-8') as archivo:
+        for linea in archivo:
+            if linea.strip():
+                yield json.loads(linea)
+
+
+def _coincide(registro, actor_id, modelo, object_pk, desde, hasta):
+    if actor_id is not None and registro['actor_id'] != actor_id:
+        return False
+    if modelo is not None and registro['modelo'] != modelo:
+        return False
+    if object_pk is not None and registro['object_pk'] != str(object_pk):
+        return False
+    if desde is not None and registro['timestamp'] < desde:
+        return False
+    if hasta is not None and registro['timestamp'] >= hasta:
+        return False
+    return True
+
+
+def buscar(actor_id=None, modelo=None, object_pk=None, desde=None, hasta=None, limite=50):
+    """
+    Entradas de auditoría vivas y archivadas, de la más reciente a la más antigua.
+    modelo es 'app_label.model' (p. ej. 'registro.accion'); desde y hasta son datetime y hasta es
+    exclusivo. Cada entrada lleva 'archivada' para distinguir su origen.
+    """
+    filtros = Q()
+    if actor_id is not None:
+        filtros &= Q(actor_id=actor_id)
+    if modelo is not None:
+        app_label, _, nombre = modelo.partition('.')
+        filtros &= Q(content_type__app_label=app_label, content_type__model=nombre)
+    if object_pk is not None:
+        filtros &= Q(object_pk=str(object_pk))
+    if desde is not None:
+        filtros &= Q(timestamp__gte=desde)
+    if hasta is not None:
+        filtros &= Q(timestamp__lt=hasta)
+
+    resultado = []
+    for entrada in (LogEntry.objects.filter(filtros).select_related('content_type')
+                    .order_by('-timestamp', '-id')[:limite]):
+        resultado.append({**serializar(entrada), 'archivada': False})
+    if len(resultado) >= limite:
+        return resultado
+
+    desde_iso = desde.isoformat() if desde is not None else None
+    hasta_iso = hasta.isoformat() if hasta is not None else None
+    vistos = {r['id'] for r in resultado}
+    for mes, resumen in sorted(leer_indice()['meses'].items(), reverse=True):
+        if actor_id is not None and str(actor_id) not in resumen.get('actores', {}):
+            continue
+        if modelo is not None and modelo not in resumen.get('modelos', {}):
+            continue
+        if (desde_iso and resumen['hasta'] < desde_iso) or (hasta_iso and resumen['desde'] >= hasta_iso):
+            continue
+        del_mes = [r for r in _leer_mes(mes)
+                   if r['id'] not in vistos and _coincide(r, actor_id, modelo, object_pk, desde_iso, hasta_iso)]
+        del_mes.sort(key=lambda r: (r['timestamp'], r['id']), reverse=True)
+        for registro in del_mes:
+            vistos.add(registro['id'])
+            resultado.append({**registro, 'archivada': True})
+            if len(resultado) >= limite:
+                return resultado
+    return resultado
+
+
+def entradas_archivadas_por_actor():
+    """{actor_id: entradas archivadas} según el índice"""
+    totales = {}
+    for resumen in leer_indice()['meses'].values():
+        for actor_id, n in resumen.get('actores', {}).items():
+            totales[int(actor_id)] = totales.get(int(actor_id), 0) + n
+    return totales
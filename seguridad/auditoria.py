@@ -0,0 +1,204 @@
+"""
+Escritura agrupada del registro de auditoría (django-auditlog).
+
+auditlog inserta un LogEntry por cada save/delete de un modelo registrado. Dentro de
+agrupar_auditoria() (el middleware la abre para cada petición) las entradas se acumulan y se
+insertan con un solo bulk_create al salir, o al confirmarse la transacción si se está dentro de
+una; las entradas de una transacción revertida se descartan. Al volcar se asigna el usuario de la
+petición y se actualiza el contador de entradas por usuario (ContadorAuditoriaUsuario).
+
+resumen_auditoria() es para procesos masivos (importaciones, recálculos): desactiva las entradas
+por fila y registra al final una sola entrada con el número de altas, cambios y bajas por modelo.
+"""
+import contextlib
+import json
+import threading
+from collections import Counter
+
+from auditlog.context import disable_auditlog, threadlocal
+from auditlog.models import LogEntry, LogEntryManager
+from auditlog.registry import auditlog
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.db.models.signals import post_save, post_delete
+
+_local = threading.local()
+
+
+class _Buffer:
+    def __init__(self, actor=None, remote_addr=None):
+        self.entradas = []
+        self.actor = actor
+        self.remote_addr = remote_addr
+
+
+def _buffer_activo():
+    pila = getattr(_local, 'buffers', None)
+    return pila[-1] if pila else None
+
+
+def _volcar(buffer):
+    entradas, buffer.entradas = buffer.entradas, []
+    if not entradas:
+        return
+    for entrada in entradas:
+        if entrada.actor_id is None and buffer.actor is not None:
+            entrada.actor = buffer.actor
+        if entrada.remote_addr is None:
+            entrada.remote_addr = buffer.remote_addr
+
+    from seguridad.models import ContadorAuditoriaUsuario
+
+    with transaction.atomic():
+        LogEntry.objects.bulk_create(entradas, batch_size=500)
+        ContadorAuditoriaUsuario.incrementar(Counter(e.actor_id for e in entradas if e.actor_id))
+
+
+@contextlib.contextmanager
+def agrupar_auditoria(actor=None, remote_addr=None):
+    """Acumula los LogEntry creados dentro del bloque y los inserta juntos al terminar"""
+    exterior = _buffer_activo()
+    if exterior is not None:
+        # Un bloque anidado comparte el buffer del exterior
+        yield exterior
+        return
+
+    buffer = _Buffer(actor, remote_addr)
+    _local.buffers = [buffer]
+    try:
+        yield buffer
+    finally:
+        _local.buffers = []
+        if connection.in_atomic_block:
+            # Las entradas pendientes llegan al buffer con on_commit, antes que este volcado
+            transaction.on_commit(lambda: _volcar(buffer))
+        else:
+            _volcar(buffer)
+
+
+def _crear_entrada(create):
+    def wrapper(self, **kwargs):
+        buffer = _buffer_activo()
+        if buffer is None or self.model is not LogEntry:
+            return create(self, **kwargs)
+        entrada = self.model(**kwargs)
+        if connection.in_atomic_block:
+            transaction.on_commit(lambda: buffer.entradas.append(entrada))
+        else:
+            buffer.entradas.append(entrada)
+        return entrada
+    return wrapper
+
+
+def instalar():
+    """Hace que LogEntry.objects.log_create pase por el buffer activo (SeguridadConfig.ready)"""
+    if not getattr(LogEntryManager.create, '_agrupado', False):
+        LogEntryManager.create = _crear_entrada(LogEntryManager.create)
+        LogEntryManager.create._agrupado = True
+    post_save.connect(_contar_entrada, sender=LogEntry, dispatch_uid='auditoria_contador')
+    post_save.connect(_contar_resumen, dispatch_uid='auditoria_resumen_save')
+    post_delete.connect(_contar_resumen, dispatch_uid='auditoria_resumen_delete')
+
+
+def _contar_entrada(sender, instance, created, **kwargs):
+    # Entradas escritas fuera de un buffer; las del buffer se cuentan al volcarlo
+    if created and instance.actor_id:
+        from seguridad.models import ContadorAuditoriaUsuario
+
+        ContadorAuditoriaUsuario.incrementar({instance.actor_id: 1})
+
+
+def registrar_cambios(cambios):
+    """
+    Entradas de auditoría para cambios hechos con bulk_create/bulk_update, que no emiten señales.
+    cambios es una lista de (instancia, acción de LogEntry.Action, {campo: [antes, después]}).
+    Pasan por el buffer activo y respetan disable_auditlog() y resumen_auditoria().
+    """
+    cambios = [c for c in cambios if auditlog.contains(type(c[0]))]
+    if not cambios:
+        return
+    conteo = getattr(_local, 'resumen', None)
+    if conteo is not None:
+        nombres = {LogEntry.Action.CREATE: 'create', LogEntry.Action.UPDATE: 'update', LogEntry.Action.DELETE: 'delete'}
+        for instancia, accion, _ in cambios:
+            conteo[(type(instancia), nombres[accion])] += 1
+        return
+    if getattr(threadlocal, 'auditlog_disabled', False):
+        return
+    # Sin buffer activo se abre uno para insertar todas las entradas juntas
+    with agrupar_auditoria():
+        for instancia, accion, campos in cambios:
+            LogEntry.objects.create(
+                content_type=ContentType.objects.get_for_model(instancia),
+                object_pk=str(instancia.pk),
+                object_id=instancia.pk if isinstance(instancia.pk, int) else None,
+                object_repr=str(instancia),
+                action=accion,
+                changes=json.dumps(campos),
+            )
+
+
+class AuditoriaAgrupadaMiddleware:
+    """
+    Agrupa las entradas de auditoría de cada petición y las asigna al usuario autenticado.
+    Sustituye a auditlog.middleware.AuditlogMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        actor = request.user if getattr(request, 'user', None) and request.user.is_authenticated else None
+        remote_addr = request.headers.get('X-Forwarded-For', request.META.get('REMOTE_ADDR', '')).split(',')[0]
+        with agrupar_auditoria(actor, remote_addr.strip() or None):
+            return self.get_response(request)
+
+
+# ============================================================================
+# Resumen único para procesos masivos
+# ============================================================================
+
+def _contar_resumen(sender, **kwargs):
+    conteo = getattr(_local, 'resumen', None)
+    if conteo is None or not auditlog.contains(sender):
+        return
+    if 'created' not in kwargs:
+        accion = 'delete'
+    else:
+        accion = 'create' if kwargs['created'] else 'update'
+    conteo[(sender, accion)] += 1
+
+
+@contextlib.contextmanager
+def resumen_auditoria(descripcion, actor=None):
+    """
+    Sustituye las entradas por fila del bloque por una sola entrada con el recuento por modelo y
+    acción. La entrada se asocia al modelo con más cambios.
+    """
+    anterior = getattr(_local, 'resumen', None)
+    _local.resumen = conteo = Counter()
+    try:
+        with disable_auditlog():
+            yield conteo
+    finally:
+        _local.resumen = anterior
+        if anterior is not None:
+            anterior.update(conteo)
+
+    if anterior is None and conteo:
+        modelos = {}
+        totales = Counter()
+        for (modelo, accion), total in conteo.items():
+            modelos.setdefault(modelo._meta.label_lower, {})[accion] = total
+            totales[modelo] += total
+        principal = totales.most_common(1)[0][0]
+        cambios = {'resumen': descripcion, 'modelos': modelos}
+        LogEntry.objects.create(
+            content_type=ContentType.objects.get_for_model(principal),
+            object_pk='',
+            object_repr=descripcion[:200],
+            action=LogEntry.Action.UPDATE,
+            changes=json.dumps(cambios),
+            additional_data=cambios,
+            actor=actor,
+        )
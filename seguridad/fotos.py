@@ -0,0 +1,125 @@
+"""
+Variantes reducidas de las fotos de perfil.
+
+Al subir una foto se encola generar() en un hilo aparte (señal de Perfil en seguridad.signals):
+la foto se recorta al cuadrado y se guarda en TAMANOS píxeles en WebP y JPEG. Los nombres llevan
+el SHA-256 de la original (perfil/derivados/<resumen>_<tamaño>.<formato>), así que una foto ya
+procesada no se vuelve a reducir y las variantes se pueden cachear en el navegador sin caducidad.
+Perfil.foto_derivados guarda los nombres generados y Perfil.get_foto(size=...) elige la variante;
+mientras no existen se sirve la original. El comando generar_fotos_perfil procesa las fotos que
+ya estaban subidas.
+"""
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+TAMANOS = (40, 80, 200)
+FORMATOS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True},
+}
+DIRECTORIO = 'perfil/derivados'
+
+_bloqueo = threading.Lock()
+_grupo = None
+
+
+def derivado(derivados, size, formato='webp'):
+    """Nombre de la variante más pequeña que mide al menos `size` píxeles, o None si no la hay"""
+    tamanos = (derivados or {}).get('tamanos', {})
+    for tamano in sorted(map(int, tamanos)):
+        if tamano >= size:
+            return tamanos[str(tamano)].get(formato)
+    return None
+
+
+def _resumen(fichero):
+    sha = hashlib.sha256()
+    fichero.seek(0)
+    for trozo in fichero.chunks():
+        sha.update(trozo)
+    fichero.seek(0)
+    return sha.hexdigest()[:32]
+
+
+def reducir(imagen, tamanos=TAMANOS):
+    """{tamaño: imagen cuadrada de ese lado}, de la mayor a la menor"""
+    imagen = ImageOps.exif_transpose(imagen)
+    imagen = imagen.convert('RGBA' if 'A' in imagen.getbands() or 'transparency' in imagen.info else 'RGB')
+    variantes = {}
+    base = imagen
+    for tamano in sorted(tamanos, reverse=True):
+        # Cada variante sale de la anterior, ya recortada y mucho más pequeña que la original
+        base = ImageOps.fit(base, (tamano, tamano), Image.Resampling.LANCZOS)
+        variantes[tamano] = base
+    return variantes
+
+
+def codificar(imagen, formato):
+    if formato == 'jpeg' and imagen.mode == 'RGBA':
+        fondo = Image.new('RGB', imagen.size, 'white')
+        fondo.paste(imagen, mask=imagen.getchannel('A'))
+        imagen = fondo
+    salida = io.BytesIO()
+    imagen.save(salida, **FORMATOS[formato])
+    return salida.getvalue()
+
+
+def generar_para(foto, storage=default_storage):
+    """
+    Genera (o reutiliza, si ya existen) las variantes de un fichero de foto y devuelve el valor
+    de Perfil.foto_derivados
+    """
+    resumen = _resumen(foto)
+    nombres = {str(t): {f: f'{DIRECTORIO}/{resumen}_{t}.{f}' for f in FORMATOS} for t in TAMANOS}
+    if not all(storage.exists(n) for formatos in nombres.values() for n in formatos.values()):
+        with Image.open(foto) as imagen:
+            # Los JPEG se decodifican ya reducidos (1/2 a 1/8) si sobra resolución
+            imagen.draft('RGB', (max(TAMANOS) * 2, max(TAMANOS) * 2))
+            variantes = reducir(imagen)
+        for tamano, imagen in variantes.items():
+            for formato, nombre in nombres[str(tamano)].items():
+                if not storage.exists(nombre):
+                    storage.save(nombre, ContentFile(codificar(imagen, formato)))
+    return {'origen': foto.name, 'tamanos': nombres}
+
+
+def generar(perfil_id):
+    """Genera las variantes de la foto de un perfil y las guarda en foto_derivados"""
+    from seguridad.models import Perfil
+
+    perfil = Perfil.objects.filter(pk=perfil_id).first()
+    if perfil is None or not perfil.foto:
+        return None
+    with perfil.foto.open('rb') as foto:
+        derivados = generar_para(foto)
+    # update() y no save(): no dispara la señal ni la auditoría, y no pisa una foto subida después
+    Perfil.objects.filter(pk=perfil_id, foto=perfil.foto.name).update(foto_derivados=derivados)
+    return derivados
+
+
+def _generar_en_segundo_plano(perfil_id):
+    try:
+        generar(perfil_id)
+    except Exception:
+        logger.exception('Error generando las variantes de la foto del perfil %s', perfil_id)
+    finally:
+        connection.close()
+
+
+def encolar(perfil_id):
+    """Genera en otro hilo las variantes de la foto de un perfil"""
+    global _grupo
+    with _bloqueo:
+        if _grupo is None:
+            _grupo = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fotos_perfil')
+    return _grupo.submit(_generar_en_segundo_plano, perfil_id)
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from seguridad import archivo_auditoria
+
+
+class Command(BaseCommand):
+    help = ('Mueve las entradas de auditoría más antiguas que la ventana de retención a archivos '
+            'JSONL comprimidos por mes en AUDITORIA_ARCHIVO_DIR y las elimina de la tabla')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=settings.AUDITORIA_RETENCION_DIAS,
+                            help='Días de auditoría que se conservan en la base de datos')
+        parser.add_argument('--lote', type=int, default=5000)
+        parser.add_argument('--simular', action='store_true', help='Solo cuenta las entradas a archivar')
+
+    def handle(self, *args, **options):
+        archivadas = archivo_auditoria.archivar(options['dias'], options['lote'], options['simular'])
+        for mes, total in sorted(archivadas.items()):
+            self.stdout.write(f'  {mes}: {total}')
+        verbo = 'se archivarían' if options['simular'] else 'archivadas'
+        self.stdout.write(self.style.SUCCESS(f'{sum(archivadas.values())} entradas {verbo}'))
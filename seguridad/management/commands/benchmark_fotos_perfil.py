@@ -0,0 +1,68 @@
+import io
+import tempfile
+import time
+
+import numpy as np
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from seguridad import fotos
+
+
+class Command(BaseCommand):
+    help = ('Mide la generación de las variantes de foto de perfil sobre fotos sintéticas del tamaño de '
+            'las de un móvil, y compara el peso y el tiempo de decodificación de la original con los de '
+            'cada variante (lo que cuesta mostrarla en la cabecera). Los ficheros van a un directorio '
+            'temporal')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fotos', type=int, default=10)
+        parser.add_argument('--ancho', type=int, default=4032)
+        parser.add_argument('--alto', type=int, default=3024)
+
+    def handle(self, *args, **options):
+        originales = [self._foto(i, options['ancho'], options['alto']) for i in range(options['fotos'])]
+        with tempfile.TemporaryDirectory() as directorio:
+            storage = FileSystemStorage(location=directorio)
+            inicio = time.perf_counter()
+            for i, datos in enumerate(originales):
+                fichero = ContentFile(datos, name=f'perfil/foto_{i}.jpg')
+                derivados = fotos.generar_para(fichero, storage)
+            duracion = time.perf_counter() - inicio
+            self.stdout.write(f'{len(originales)} fotos de {options["ancho"]}x{options["alto"]}: '
+                              f'{duracion / len(originales) * 1000:.0f} ms por foto')
+
+            original = originales[-1]
+            self.stdout.write(f'  original: {len(original) / 1024:,.0f} KB, '
+                              f'decodificación {self._decodificar(original):.1f} ms')
+            for tamano, formatos in derivados['tamanos'].items():
+                for formato, nombre in formatos.items():
+                    with storage.open(nombre, 'rb') as f:
+                        datos = f.read()
+                    self.stdout.write(f'  {tamano} px {formato}: {len(datos) / 1024:,.1f} KB, '
+                                      f'decodificación {self._decodificar(datos):.2f} ms')
+
+            inicio = time.perf_counter()
+            fotos.generar_para(ContentFile(original, name='perfil/repetida.jpg'), storage)
+            self.stdout.write(f'Foto ya procesada (nombres por contenido): {(time.perf_counter() - inicio) * 1000:.1f} ms')
+
+    @staticmethod
+    def _foto(semilla, ancho, alto):
+        """JPEG con degradados y ruido, que se comprime como una foto real y no como un color plano"""
+        rng = np.random.default_rng(semilla)
+        y, x = np.mgrid[0:alto, 0:ancho].astype(np.float32)
+        canales = [np.sin(x / rng.uniform(50, 400) + c) * np.cos(y / rng.uniform(50, 400)) * 90 + 128 for c in range(3)]
+        pixeles = np.stack(canales, axis=-1) + rng.normal(0, 12, (alto, ancho, 3))
+        salida = io.BytesIO()
+        Image.fromarray(np.clip(pixeles, 0, 255).astype(np.uint8)).save(salida, 'JPEG', quality=92)
+        return salida.getvalue()
+
+    @staticmethod
+    def _decodificar(datos, repeticiones=5):
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            with Image.open(io.BytesIO(datos)) as imagen:
+                imagen.load()
+        return (time.perf_counter() - inicio) / repeticiones * 1000
@@ -0,0 +1,44 @@
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from seguridad import fotos
+from seguridad.models import Perfil
+
+
+class Command(BaseCommand):
+    help = ('Genera las variantes reducidas de las fotos de perfil que aún no las tienen (con --todos, '
+            'de todas). Con --limpiar borra las variantes que ya no usa ningún perfil')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--todos', action='store_true')
+        parser.add_argument('--limpiar', action='store_true')
+
+    def handle(self, *args, **options):
+        perfiles = Perfil.objects.exclude(foto='').exclude(foto__isnull=True).only('id', 'foto', 'foto_derivados')
+        inicio = time.perf_counter()
+        generados = errores = 0
+        for perfil in perfiles.iterator():
+            if not options['todos'] and perfil.foto_derivados.get('origen') == perfil.foto.name:
+                continue
+            try:
+                fotos.generar(perfil.id)
+                generados += 1
+            except Exception as e:
+                errores += 1
+                self.stderr.write(f'Perfil {perfil.id}: {e}')
+        self.stdout.write(f'{generados} fotos procesadas en {time.perf_counter() - inicio:.2f} s, {errores} errores')
+
+        if options['limpiar']:
+            usados = {nombre for derivados in Perfil.objects.values_list('foto_derivados', flat=True)
+                      for formatos in (derivados or {}).get('tamanos', {}).values() for nombre in formatos.values()}
+            borrados = 0
+            if default_storage.exists(fotos.DIRECTORIO):
+                for nombre in default_storage.listdir(fotos.DIRECTORIO)[1]:
+                    ruta = f'{fotos.DIRECTORIO}/{nombre}'
+                    if ruta not in usados:
+                        default_storage.delete(ruta)
+                        borrados += 1
+            self.stdout.write(f'{borrados} variantes sin uso borradas')
+        self.stdout.write(self.style.SUCCESS('Listo'))
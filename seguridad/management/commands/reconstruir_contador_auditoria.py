@@ -0,0 +1,29 @@
+from auditlog.models import LogEntry
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from seguridad.archivo_auditoria import entradas_archivadas_por_actor
+from seguridad.models import ContadorAuditoriaUsuario
+
+
+class Command(BaseCommand):
+    help = ('Recalcula ContadorAuditoriaUsuario a partir de los LogEntry existentes y de los '
+            'archivados. Necesario tras crear la tabla y si se borran entradas de auditoría fuera '
+            'de la aplicación')
+
+    def handle(self, *args, **options):
+        totales = entradas_archivadas_por_actor()
+        for user_id, total in (LogEntry.objects.filter(actor__isnull=False)
+                               .values_list('actor_id').annotate(total=Count('id')).order_by()):
+            totales[user_id] = totales.get(user_id, 0) + total
+        # Las entradas archivadas pueden ser de usuarios ya eliminados
+        existentes = set(User.objects.filter(id__in=list(totales)).values_list('id', flat=True))
+        totales = {user_id: total for user_id, total in totales.items() if user_id in existentes}
+        with transaction.atomic():
+            ContadorAuditoriaUsuario.objects.all().delete()
+            ContadorAuditoriaUsuario.objects.bulk_create([
+                ContadorAuditoriaUsuario(user_id=user_id, total=total) for user_id, total in totales.items()
+            ], batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(f'{len(totales)} contadores reconstruidos'))
@@ -1,7 +1,8 @@
 from auditlog.models import AuditlogHistoryField
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator, MinValueValidator, MaxValueValidator, FileExtensionValidator
-from django.db import models
+from django.db import models, IntegrityError, transaction
+from django.db.models import F
 from django.utils import timezone
 
 from config.settings import MEDIA_URL, STATIC_URL
@@ -75,12 +76,25 @@ class Perfil(models.Model):
 
     ],
     help_text='Formatos soportados: JPG, JPEG, PNG')
+    foto_derivados = models.JSONField(default=dict, blank=True, editable=False,
+                                      help_text='Variantes reducidas de la foto (seguridad.fotos)')
 
     def __str__(self):
         return f"{self.nombre} {self.apellidos}".strip()
 
-    def get_foto(self):
+    def get_foto(self, size=None, formato='webp'):
+        """
+        URL de la foto. Con size, la de la variante reducida más pequeña que mida al menos size
+        píxeles; la original si aún no se han generado o si ninguna es tan grande
+        """
         if self.foto:
+            if size is not None and self.foto_derivados.get('origen') == self.foto.name:
+                # seguridad.fotos carga Pillow: solo se importa al usarlo
+                from seguridad import fotos
+
+                nombre = fotos.derivado(self.foto_derivados, size, formato)
+                if nombre:
+                    return '{}{}'.format(MEDIA_URL, nombre)
             return '{}{}'.format(MEDIA_URL, self.foto)
 
         else:
@@ -93,4 +107,23 @@ class Perfil(models.Model):
     @property
     def acciones(self):
         acciones = Accion.objects.filter(user=self.user)
-        return acciones
\ No newline at end of file
+        return acciones
+
+
+class ContadorAuditoriaUsuario(models.Model):
+    """Número de entradas de auditoría de cada usuario (seguridad.auditoria lo mantiene al día)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True,
+                                related_name='contador_auditoria')
+    total = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def incrementar(cls, conteos):
+        """Suma {user_id: n} a los contadores, creándolos si no existen"""
+        for user_id, n in conteos.items():
+            if cls.objects.filter(user_id=user_id).update(total=F('total') + n):
+                continue
+            try:
+                with transaction.atomic():
+                    cls.objects.create(user_id=user_id, total=n)
+            except IntegrityError:
+                cls.objects.filter(user_id=user_id).update(total=F('total') + n)
@@ -1,4 +1,5 @@
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
@@ -8,4 +9,18 @@ from seguridad.models import Perfil
 @receiver(post_save, sender=User)
 def post_save_create_profile(sender, instance, created, **kwargs):
     if created:
-        Perfil.objects.create(user=instance)
\ No newline at end of file
+        Perfil.objects.create(user=instance)
+
+
+@receiver(post_save, sender=Perfil)
+def generar_fotos_perfil(sender, instance, **kwargs):
+    # Variantes reducidas de una foto nueva, fuera de la petición
+    if not instance.foto:
+        if instance.foto_derivados:
+            Perfil.objects.filter(pk=instance.pk).update(foto_derivados={})
+        return
+    if instance.foto_derivados.get('origen') != instance.foto.name:
+        from seguridad import fotos
+
+        perfil_id = instance.pk
+        transaction.on_commit(lambda: fotos.encolar(perfil_id))
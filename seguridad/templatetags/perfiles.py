@@ -0,0 +1,12 @@
+from django import template
+from django.templatetags.static import static
+
+register = template.Library()
+
+
+@register.filter
+def foto(perfil, size):
+    """{{ user.perfil|foto:80 }}: URL de la variante de la foto de perfil de al menos 80 píxeles"""
+    if not hasattr(perfil, 'get_foto'):
+        return static('assets/media/user_empty.png')
+    return perfil.get_foto(size=int(size))
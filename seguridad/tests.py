@@ -1,3 +1,219 @@
-from django.test import TestCase
+import datetime
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from auditlog.context import set_actor
+from auditlog.models import LogEntry, LogEntryManager
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TestCase, override_settings
+
+from nomencladores.models import Sector
+from seguridad import archivo_auditoria, auditoria
+from seguridad.models import ContadorAuditoriaUsuario
+
+
+class AuditoriaAgrupadaTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('usuario')
+
+    def contador(self):
+        return ContadorAuditoriaUsuario.objects.filter(user=self.usuario).values_list('total', flat=True).first()
+
+    def test_instalado_una_sola_vez(self):
+        create = LogEntryManager.create
+        self.assertTrue(create._agrupado)
+        auditoria.instalar()
+        self.assertIs(LogEntryManager.create, create)
+
+    def test_un_solo_bulk_create_al_confirmar(self):
+        with mock.patch.object(LogEntry.objects, 'bulk_create', wraps=LogEntry.objects.bulk_create) as bulk_create:
+            with self.captureOnCommitCallbacks(execute=True):
+                with auditoria.agrupar_auditoria(self.usuario, '10.0.0.1'):
+                    for nombre in ('Agricultura', 'Industria', 'Turismo'):
+                        Sector.objects.create(nombre=nombre)
+                self.assertFalse(LogEntry.objects.exists())
+        bulk_create.assert_called_once()
+        entradas = LogEntry.objects.all()
+        self.assertEqual(len(entradas), 3)
+        self.assertEqual({(e.actor_id, e.remote_addr, e.action) for e in entradas},
+                         {(self.usuario.id, '10.0.0.1', LogEntry.Action.CREATE)})
+
+    def test_bloque_anidado_comparte_buffer(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with auditoria.agrupar_auditoria(self.usuario) as exterior:
+                with auditoria.agrupar_auditoria() as interior:
+                    Sector.objects.create(nombre='Agricultura')
+                self.assertIs(interior, exterior)
+                self.assertFalse(LogEntry.objects.exists())
+        self.assertEqual(LogEntry.objects.get().actor, self.usuario)
+
+    def test_savepoint_revertido_descarta_sus_entradas(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with auditoria.agrupar_auditoria(self.usuario):
+                Sector.objects.create(nombre='Agricultura')
+                try:
+                    with transaction.atomic():
+                        Sector.objects.create(nombre='Industria')
+                        raise ValueError
+                except ValueError:
+                    pass
+        self.assertEqual(list(LogEntry.objects.values_list('object_repr', flat=True)), ['Agricultura'])
+        self.assertEqual(self.contador(), 1)
+
+    def test_contador_dentro_y_fuera_del_buffer(self):
+        with set_actor(self.usuario):
+            Sector.objects.create(nombre='Agricultura')
+        self.assertEqual(self.contador(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with auditoria.agrupar_auditoria(self.usuario):
+                Sector.objects.create(nombre='Industria')
+                Sector.objects.create(nombre='Turismo')
+        # Las entradas del buffer no emiten post_save: solo se cuentan al volcarlo
+        self.assertEqual(self.contador(), 3)
+        self.assertEqual(LogEntry.objects.filter(actor=self.usuario).count(), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with auditoria.agrupar_auditoria():
+                Sector.objects.create(nombre='Pesca')
+        self.assertEqual(self.contador(), 3)
+
+    def test_registrar_cambios(self):
+        sector = Sector.objects.create(nombre='Agricultura')
+        LogEntry.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            auditoria.registrar_cambios([(sector, LogEntry.Action.UPDATE, {'nombre': ['Agro', 'Agricultura']}),
+                                         (self.usuario, LogEntry.Action.UPDATE, {})])
+        entrada = LogEntry.objects.get()
+        self.assertEqual((entrada.object_id, entrada.action), (sector.id, LogEntry.Action.UPDATE))
+        self.assertEqual(json.loads(entrada.changes), {'nombre': ['Agro', 'Agricultura']})
+
+    def test_resumen_una_sola_entrada(self):
+        with auditoria.resumen_auditoria('Importación de sectores', actor=self.usuario):
+            sectores = [Sector.objects.create(nombre=f'Sector {i}') for i in range(3)]
+            sectores[0].nombre = 'Cambiado'
+            sectores[0].save()
+            sectores[1].delete()
+            auditoria.registrar_cambios([(sectores[2], LogEntry.Action.UPDATE, {})])
+        entrada = LogEntry.objects.get()
+        self.assertEqual((entrada.object_repr, entrada.object_pk, entrada.actor),
+                         ('Importación de sectores', '', self.usuario))
+        self.assertEqual(entrada.additional_data, {
+            'resumen': 'Importación de sectores',
+            'modelos': {'nomencladores.sector': {'create': 3, 'update': 2, 'delete': 1}},
+        })
+        self.assertEqual(self.contador(), 1)
+
+    def test_resumen_anidado_suma_al_exterior(self):
+        with auditoria.resumen_auditoria('Exterior') as conteo:
+            Sector.objects.create(nombre='Agricultura')
+            with auditoria.resumen_auditoria('Interior'):
+                Sector.objects.create(nombre='Industria')
+        self.assertEqual(conteo[(Sector, 'create')], 2)
+        self.assertEqual(list(LogEntry.objects.values_list('object_repr', flat=True)), ['Exterior'])
+
+
+class ArchivoAuditoriaTests(TestCase):
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        ajustes = override_settings(AUDITORIA_ARCHIVO_DIR=directorio)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.usuario = User.objects.create_user('usuario')
+        self.otro = User.objects.create_user('otro')
+        fechas = {'Enero': datetime.datetime(2020, 1, 10), 'Enero 2': datetime.datetime(2020, 1, 20),
+                  'Febrero': datetime.datetime(2020, 2, 5), 'Reciente': datetime.datetime.now()}
+        self.ids = {}
+        for nombre, fecha in fechas.items():
+            with set_actor(self.otro if nombre == 'Febrero' else self.usuario):
+                sector = Sector.objects.create(nombre=nombre)
+            entrada = LogEntry.objects.get_for_object(sector).get()
+            LogEntry.objects.filter(pk=entrada.pk).update(timestamp=fecha)
+            self.ids[nombre] = entrada.pk
+
+    def archivados(self, mes):
+        with gzip.open(os.path.join(archivo_auditoria._directorio(), f'auditoria-{mes}.jsonl.gz'), 'rt') as archivo:
+            return [json.loads(linea)['id'] for linea in archivo]
+
+    def test_archivar(self):
+        self.assertEqual(archivo_auditoria.archivar(dias=30, simular=True), {'2020-01': 2, '2020-02': 1})
+        self.assertEqual(LogEntry.objects.count(), 4)
+
+        self.assertEqual(archivo_auditoria.archivar(dias=30, lote=2), {'2020-01': 2, '2020-02': 1})
+        self.assertEqual(list(LogEntry.objects.values_list('id', flat=True)), [self.ids['Reciente']])
+        self.assertEqual(self.archivados('2020-01'), [self.ids['Enero'], self.ids['Enero 2']])
+        self.assertEqual(self.archivados('2020-02'), [self.ids['Febrero']])
+
+        indice = archivo_auditoria.leer_indice()
+        self.assertEqual((indice['en_curso'], indice['pendientes']), ({}, []))
+        self.assertEqual(indice['meses']['2020-01'], {
+            'entradas': 2, 'actores': {str(self.usuario.id): 2}, 'modelos': {'nomencladores.sector': 2},
+            'desde': '2020-01-10T00:00:00', 'hasta': '2020-01-20T00:00:00',
+        })
+        self.assertEqual(indice['meses']['2020-02']['actores'], {str(self.otro.id): 1})
+        self.assertEqual(archivo_auditoria.entradas_archivadas_por_actor(), {self.usuario.id: 2, self.otro.id: 1})
+
+        self.assertEqual(archivo_auditoria.archivar(dias=30), {})
+
+    def test_buscar_une_vivas_y_archivadas(self):
+        archivo_auditoria.archivar(dias=30)
+        resultado = archivo_auditoria.buscar()
+        self.assertEqual([(r['id'], r['archivada']) for r in resultado], [
+            (self.ids['Reciente'], False), (self.ids['Febrero'], True),
+            (self.ids['Enero 2'], True), (self.ids['Enero'], True),
+        ])
+        self.assertEqual(resultado[1]['modelo'], 'nomencladores.sector')
+
+        self.assertEqual([r['id'] for r in archivo_auditoria.buscar(limite=2)],
+                         [self.ids['Reciente'], self.ids['Febrero']])
+        self.assertEqual([r['id'] for r in archivo_auditoria.buscar(actor_id=self.usuario.id)],
+                         [self.ids['Reciente'], self.ids['Enero 2'], self.ids['Enero']])
+        self.assertEqual([r['id'] for r in archivo_auditoria.buscar(desde=datetime.datetime(2020, 1, 15),
+                                                                    hasta=datetime.datetime(2020, 2, 5))],
+                         [self.ids['Enero 2']])
+        self.assertEqual(archivo_auditoria.buscar(modelo='registro.accion'), [])
+
+    def test_reanuda_escritura_interrumpida(self):
+        escribir = archivo_auditoria._escribir
+
+        def interrumpir(mes, registros):
+            escribir(mes, registros)
+            if mes == '2020-02':
+                raise KeyboardInterrupt
+
+        with mock.patch.object(archivo_auditoria, '_escribir', side_effect=interrumpir):
+            with self.assertRaises(KeyboardInterrupt):
+                archivo_auditoria.archivar(dias=30)
+        indice = archivo_auditoria.leer_indice()
+        self.assertEqual(set(indice['en_curso']), {'2020-01', '2020-02'})
+        self.assertEqual(indice['meses'], {})
+        self.assertEqual(LogEntry.objects.count(), 4)
+
+        # El lote a medias se recorta (_deshacer) y se vuelve a archivar sin duplicados
+        self.assertEqual(archivo_auditoria.archivar(dias=30), {'2020-01': 2, '2020-02': 1})
+        self.assertEqual(self.archivados('2020-01'), [self.ids['Enero'], self.ids['Enero 2']])
+        self.assertEqual(self.archivados('2020-02'), [self.ids['Febrero']])
+        self.assertEqual(archivo_auditoria.leer_indice()['meses']['2020-01']['entradas'], 2)
+
+    def test_reanuda_borrado_interrumpido(self):
+        with mock.patch.object(archivo_auditoria, '_borrar', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                archivo_auditoria.archivar(dias=30)
+        indice = archivo_auditoria.leer_indice()
+        self.assertEqual(sorted(indice['pendientes']), sorted([self.ids['Enero'], self.ids['Enero 2'],
+                                                              self.ids['Febrero']]))
+        self.assertEqual(LogEntry.objects.count(), 4)
+
+        # Las pendientes se borran sin volver a escribirlas
+        self.assertEqual(archivo_auditoria.archivar(dias=30), {})
+        self.assertEqual(LogEntry.objects.count(), 1)
+        self.assertEqual(self.archivados('2020-01'), [self.ids['Enero'], self.ids['Enero 2']])
+        self.assertEqual(archivo_auditoria.leer_indice()['pendientes'], [])
+        self.assertEqual(archivo_auditoria.leer_indice()['meses']['2020-01']['entradas'], 2)
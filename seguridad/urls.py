@@ -1,9 +1,10 @@
 from django.urls import path
 
-from seguridad.views import PerfilAdaptacionView
+from seguridad.views import PerfilAdaptacionView, historial_auditoria
 
 app_name = 'seguridad'
 
 urlpatterns = [
     path("perfil/", PerfilAdaptacionView.as_view(), name="perfil"),
+    path("auditoria/", historial_auditoria, name="historial_auditoria"),
 ]
\ No newline at end of file
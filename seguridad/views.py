@@ -1,13 +1,18 @@
+from datetime import datetime, timedelta
+
 from auditlog.models import LogEntry
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import JsonResponse
 from django.shortcuts import render, redirect
 from django.urls import reverse_lazy
+from django.views.decorators.http import require_GET
 from django.views.generic import UpdateView
 
+from seguridad import archivo_auditoria
 from seguridad.forms import PerfilForm
-from seguridad.models import Notificacion, Perfil
+from seguridad.models import Notificacion, Perfil, ContadorAuditoriaUsuario
 
 
 class PerfilAdaptacionView(LoginRequiredMixin, UpdateView):
@@ -39,9 +44,9 @@ class PerfilAdaptacionView(LoginRequiredMixin, UpdateView):
 
     def get_user_stats(self):
         return {
-            'logins_count': LogEntry.objects.filter(
-                actor_id=self.request.user.id,
-            ).count(),
+            'logins_count': ContadorAuditoriaUsuario.objects.filter(
+                user_id=self.request.user.id,
+            ).values_list('total', flat=True).first() or 0,
         }
 
     def form_valid(self, form):
@@ -52,3 +57,35 @@ class PerfilAdaptacionView(LoginRequiredMixin, UpdateView):
         messages.error(self.request, 'Por favor corrija los errores en el formulario')
         return super().form_invalid(form)
 
+
+@login_required
+@require_GET
+def historial_auditoria(request):
+    """
+    Entradas de auditoría vivas y archivadas en JSON. Filtros: actor, modelo ('app.modelo'),
+    object_pk, desde y hasta (AAAA-MM-DD, hasta incluido) y limite. Solo un superusuario puede
+    consultar otros actores.
+    """
+    actor_id = request.GET.get('actor')
+    if not request.user.is_superuser:
+        actor_id = request.user.id
+    try:
+        desde = hasta = None
+        if request.GET.get('desde'):
+            desde = datetime.strptime(request.GET['desde'], '%Y-%m-%d')
+        if request.GET.get('hasta'):
+            hasta = datetime.strptime(request.GET['hasta'], '%Y-%m-%d') + timedelta(days=1)
+        limite = max(1, min(int(request.GET.get('limite', 50)), 500))
+        actor_id = int(actor_id) if actor_id else None
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
+
+    entradas = archivo_auditoria.buscar(
+        actor_id=actor_id,
+        modelo=request.GET.get('modelo') or None,
+        object_pk=request.GET.get('object_pk') or None,
+        desde=desde,
+        hasta=hasta,
+        limite=limite,
+    )
+    return JsonResponse({'entradas': entradas})
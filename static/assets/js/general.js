@@ -13,6 +13,24 @@ var KTGeneral = function () {
                 submit.setAttribute("data-kt-indicator", "on");
                 submit.disabled = true;
 
+                // Los documentos grandes se suben antes por fragmentos (subida_fragmentada.js)
+                if (form.dataset.subidaUrl && window.KTSubidaFragmentada) {
+                    KTSubidaFragmentada.subirDesdeFormulario(form).then(function () {
+                        form.submit()
+                    }).catch(function (error) {
+                        submit.removeAttribute("data-kt-indicator");
+                        submit.disabled = false;
+                        Swal.fire({
+                            text: "No se pudo subir el documento: " + error.message,
+                            icon: "error",
+                            buttonsStyling: false,
+                            confirmButtonText: "Ok",
+                            customClass: {confirmButton: "btn fw-bold btn-primary"}
+                        });
+                    });
+                    return;
+                }
+
                 // Enviar el formulario
                 form.submit()
             }));
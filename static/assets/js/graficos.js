@@ -0,0 +1,169 @@
+"use strict";
+// Configuración común de los gráficos ApexCharts y carga diferida de sus datos. Las vistas de
+// datos de gráfico (registro.views, datos_grafico) devuelven solo las series; los idiomas,
+// colores y opciones de eje viven aquí. Los datos se piden cuando el contenedor se hace visible
+// y después del primer pintado; cada URL se pide una vez por página y el navegador la revalida
+// con ETag (304 si los datos no cambiaron).
+var KTGraficos = function () {
+    var LOCALES = [{
+        name: 'es',
+        options: {
+            months: ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio', 'Agosto', 'Septiembre',
+                'Octubre', 'Noviembre', 'Diciembre'],
+            shortMonths: ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic'],
+            days: ['Domingo', 'Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado'],
+            shortDays: ['Dom', 'Lun', 'Mar', 'Mié', 'Jue', 'Vie', 'Sáb'],
+            toolbar: {
+                exportToSVG: 'Descargar SVG', exportToPNG: 'Descargar PNG', exportToCSV: 'Descargar CSV',
+                menu: 'Menú', selection: 'Selección', selectionZoom: 'Ampliar selección', zoomIn: 'Ampliar',
+                zoomOut: 'Reducir', pan: 'Desplazar', reset: 'Restablecer'
+            }
+        }
+    }, {
+        name: 'en',
+        options: {
+            months: ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September',
+                'October', 'November', 'December'],
+            shortMonths: ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'],
+            days: ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday'],
+            shortDays: ['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat'],
+            toolbar: {
+                exportToSVG: 'Download SVG', exportToPNG: 'Download PNG', exportToCSV: 'Download CSV',
+                menu: 'Menu', selection: 'Selection', selectionZoom: 'Selection Zoom', zoomIn: 'Zoom In',
+                zoomOut: 'Zoom Out', pan: 'Panning', reset: 'Reset Zoom'
+            }
+        }
+    }];
+
+    var PRESETS = {
+        // Antes registro.utils.data_chart_line
+        linea: {
+            chart: {height: 350, type: 'area'},
+            colors: ['#1B84FF'],
+            dataLabels: {enabled: false},
+            fill: {colors: ['#1B84FF']},
+            legend: {position: 'top', horizontalAlign: 'right', offsetX: -10},
+            title: {style: {fontSize: '20px', fontWeight: 'bold', fontFamily: 'Inter, Helvetica, sans-serif'}}
+        },
+        // Antes registro.utils.data_chart_donut
+        dona: {
+            chart: {type: 'donut'},
+            labels: ['Restante', 'Ejecutado'],
+            plotOptions: {pie: {donut: {labels: {show: true, total: {showAlways: true, show: true}}}}}
+        },
+        barras: {
+            chart: {type: 'bar', toolbar: {show: false}},
+            colors: ['#1B84FF'],
+            dataLabels: {enabled: false},
+            plotOptions: {bar: {borderRadius: 4, columnWidth: '70%'}}
+        }
+    };
+
+    var pedidas = {};
+
+    function idioma() {
+        var cookie = document.cookie.split(';').map(function (c) { return c.trim(); })
+            .find(function (c) { return c.indexOf('django_language=') === 0; });
+        var codigo = cookie ? cookie.split('=')[1] : 'es';
+        return LOCALES.some(function (l) { return l.name === codigo; }) ? codigo : 'es';
+    }
+
+    function esObjeto(valor) {
+        return valor && typeof valor === 'object' && !Array.isArray(valor);
+    }
+
+    // Copia profunda de los objetos (no de los arreglos) de `base` con `extra` encima
+    function combinar(base, extra) {
+        var resultado = Object.assign({}, base);
+        Object.keys(extra || {}).forEach(function (clave) {
+            resultado[clave] = esObjeto(base[clave]) && esObjeto(extra[clave])
+                ? combinar(base[clave], extra[clave]) : extra[clave];
+        });
+        return resultado;
+    }
+
+    function despuesDePintar(callback) {
+        var lanzar = function () {
+            requestAnimationFrame(function () { setTimeout(callback, 0); });
+        };
+        if (document.readyState === 'loading') {
+            document.addEventListener('DOMContentLoaded', lanzar);
+        } else {
+            lanzar();
+        }
+    }
+
+    return {
+        PRESETS: PRESETS,
+        combinar: combinar,
+
+        // Opciones de ApexCharts: el preset, los idiomas y `extra` encima
+        opciones: function (preset, extra) {
+            var base = combinar(PRESETS[preset] || {}, {chart: {locales: LOCALES, defaultLocale: idioma()}});
+            return combinar(base, extra);
+        },
+
+        // Promesa con el JSON de `url`; revalida con el servidor (no-cache) en vez de reutilizar
+        // la copia sin preguntar, y la comparte entre los gráficos que usan la misma URL
+        datos: function (url) {
+            if (!pedidas[url]) {
+                pedidas[url] = fetch(url, {
+                    credentials: 'same-origin',
+                    cache: 'no-cache',
+                    headers: {'X-Requested-With': 'XMLHttpRequest'}
+                }).then(function (respuesta) {
+                    if (!respuesta.ok) {
+                        delete pedidas[url];
+                        throw new Error(respuesta.statusText);
+                    }
+                    return respuesta.json();
+                });
+            }
+            return pedidas[url];
+        },
+
+        // Llama a callback(elemento) la primera vez que el elemento se ve (p. ej. al abrir el modal
+        // que lo contiene), nunca antes del primer pintado de la página
+        alMostrarse: function (elemento, callback) {
+            despuesDePintar(function () {
+                if (!('IntersectionObserver' in window)) {
+                    callback(elemento);
+                    return;
+                }
+                var observador = new IntersectionObserver(function (entradas) {
+                    if (entradas.some(function (e) { return e.isIntersecting; })) {
+                        observador.disconnect();
+                        callback(elemento);
+                    }
+                });
+                observador.observe(elemento);
+            });
+        },
+
+        // Pares [x, y] de una serie columnar (registro.muestreo.reducir)
+        puntos: function (serie, columna) {
+            var valores = serie[columna || 'y'];
+            return serie.x.map(function (x, i) { return [x, valores[i]]; });
+        },
+
+        // Pares {x, y: [min, max]} de la envolvente de una serie reducida, para rangeArea
+        rango: function (serie) {
+            return serie.x.map(function (x, i) { return {x: x, y: [serie.min[i], serie.max[i]]}; });
+        },
+
+        // Carga y pinta en `elemento` un gráfico: opcionesDe(datos) devuelve las opciones extra
+        // sobre el preset. Devuelve una promesa con el gráfico
+        cargar: function (elemento, url, preset, opcionesDe) {
+            var self = this;
+            return new Promise(function (resolver, rechazar) {
+                self.alMostrarse(elemento, function () {
+                    self.datos(url).then(function (datos) {
+                        var grafico = new ApexCharts(elemento, self.opciones(preset, opcionesDe(datos)));
+                        grafico.render();
+                        resolver(grafico);
+                    }).catch(rechazar);
+                });
+            });
+        }
+    };
+}();
@@ -0,0 +1,281 @@
+"use strict";
+// Subida por fragmentos y reanudable de documentos grandes (registro.subidas). El id de cada
+// subida se guarda en localStorage: si se interrumpe, al volver a subir el mismo fichero se
+// consultan los fragmentos pendientes y solo se envían esos. Al completar se envía la suma SHA-256
+// del fichero entero para que el servidor la compare con la de los fragmentos recibidos.
+var KTSubidaFragmentada = function () {
+    var PARALELOS = 3, REINTENTOS = 3;
+    // Las URL de una subida llegan del formulario generadas con este id (y el fragmento 0)
+    var ID_PLANTILLA = '00000000-0000-0000-0000-000000000000';
+    var K = new Uint32Array([
+        0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+        0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+        0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+        0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+        0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+        0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+        0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+        0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+    ]);
+
+    function ruta(plantilla, id, indice) {
+        var url = plantilla.replace(ID_PLANTILLA, id);
+        return indice === undefined ? url : url.replace(/\/0\/$/, '/' + indice + '/');
+    }
+
+    function cookie(nombre) {
+        var valor = document.cookie.split(';').map(function (c) { return c.trim(); })
+            .find(function (c) { return c.indexOf(nombre + '=') === 0; });
+        return valor ? decodeURIComponent(valor.substring(nombre.length + 1)) : null;
+    }
+
+    function peticion(url, opciones) {
+        opciones.headers = Object.assign({'X-CSRFToken': cookie('csrftoken'), 'X-Requested-With': 'XMLHttpRequest'},
+            opciones.headers || {});
+        return fetch(url, opciones).then(function (respuesta) {
+            return respuesta.json().catch(function () { return {}; }).then(function (datos) {
+                if (!respuesta.ok) {
+                    var error = new Error(datos.error || respuesta.statusText);
+                    error.status = respuesta.status;
+                    throw error;
+                }
+                return datos;
+            });
+        });
+    }
+
+    // SHA-256 incremental: crypto.subtle solo calcula la suma de un bloque entero en memoria, y el
+    // fichero puede ocupar varios GB
+    function Sha256() {
+        this.h = new Uint32Array([0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a,
+            0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19]);
+        this.w = new Uint32Array(64);
+        this.resto = new Uint8Array(64);
+        this.usados = 0;
+        this.longitud = 0;
+    }
+
+    Sha256.prototype.bloque = function (datos, inicio) {
+        var w = this.w, h = this.h, i, x, y;
+        for (i = 0; i < 16; i++, inicio += 4) {
+            w[i] = (datos[inicio] << 24) | (datos[inicio + 1] << 16) | (datos[inicio + 2] << 8) | datos[inicio + 3];
+        }
+        for (i = 16; i < 64; i++) {
+            x = w[i - 15];
+            y = w[i - 2];
+            w[i] = w[i - 16] + w[i - 7]
+                + (((x >>> 7) | (x << 25)) ^ ((x >>> 18) | (x << 14)) ^ (x >>> 3))
+                + (((y >>> 17) | (y << 15)) ^ ((y >>> 19) | (y << 13)) ^ (y >>> 10));
+        }
+        var a = h[0], b = h[1], c = h[2], d = h[3], e = h[4], f = h[5], g = h[6], k = h[7];
+        for (i = 0; i < 64; i++) {
+            x = (k + (((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7)))
+                + ((e & f) ^ (~e & g)) + K[i] + w[i]) | 0;
+            y = ((((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10)))
+                + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+            k = g;
+            g = f;
+            f = e;
+            e = (d + x) | 0;
+            d = c;
+            c = b;
+            b = a;
+            a = (x + y) | 0;
+        }
+        h[0] += a;
+        h[1] += b;
+        h[2] += c;
+        h[3] += d;
+        h[4] += e;
+        h[5] += f;
+        h[6] += g;
+        h[7] += k;
+    };
+
+    Sha256.prototype.actualizar = function (datos) {
+        var i = 0;
+        this.longitud += datos.length;
+        if (this.usados) {
+            i = Math.min(64 - this.usados, datos.length);
+            this.resto.set(datos.subarray(0, i), this.usados);
+            this.usados += i;
+            if (this.usados < 64) {
+                return this;
+            }
+            this.bloque(this.resto, 0);
+        }
+        for (; i + 64 <= datos.length; i += 64) {
+            this.bloque(datos, i);
+        }
+        this.resto.set(datos.subarray(i));
+        this.usados = datos.length - i;
+        return this;
+    };
+
+    Sha256.prototype.hex = function () {
+        var bits = this.longitud * 8;
+        var relleno = new Uint8Array((this.usados < 56 ? 64 : 128) - this.usados);
+        var vista = new DataView(relleno.buffer);
+        relleno[0] = 0x80;
+        vista.setUint32(relleno.length - 8, Math.floor(bits / 0x100000000));
+        vista.setUint32(relleno.length - 4, bits >>> 0);
+        this.actualizar(relleno);
+        return Array.from(this.h).map(function (x) {
+            return x.toString(16).padStart(8, '0');
+        }).join('');
+    };
+
+    // Lee el fichero por fragmentos, en orden, sin cargarlo entero en memoria
+    function sumaFichero(fichero, tamano) {
+        var suma = new Sha256();
+        var leer = function (inicio) {
+            if (inicio >= fichero.size) {
+                return Promise.resolve(suma.hex());
+            }
+            return fichero.slice(inicio, inicio + tamano).arrayBuffer().then(function (datos) {
+                suma.actualizar(new Uint8Array(datos));
+                return leer(inicio + tamano);
+            });
+        };
+        return leer(0);
+    }
+
+    function sha256(blob) {
+        if (!window.crypto || !crypto.subtle) {
+            return Promise.resolve('');
+        }
+        return blob.arrayBuffer().then(function (datos) {
+            return crypto.subtle.digest('SHA-256', datos);
+        }).then(function (resumen) {
+            return Array.from(new Uint8Array(resumen)).map(function (b) {
+                return b.toString(16).padStart(2, '0');
+            }).join('');
+        });
+    }
+
+    function abrir(urls, fichero) {
+        var clave = ['subida', urls.crear, fichero.name, fichero.size, fichero.lastModified].join(':');
+        var nueva = function () {
+            return peticion(urls.crear, {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({nombre: fichero.name, tamano: fichero.size})
+            }).then(function (subida) {
+                localStorage.setItem(clave, subida.id);
+                return subida;
+            });
+        };
+        var id = localStorage.getItem(clave);
+        if (!id) {
+            return nueva().then(function (subida) { return [clave, subida]; });
+        }
+        return peticion(ruta(urls.estado, id), {method: 'GET'}).catch(function (error) {
+            if (error.status === 404) {
+                return nueva();
+            }
+            throw error;
+        }).then(function (subida) { return [clave, subida]; });
+    }
+
+    function enviar(urls, subida, fichero, indice, intento) {
+        var inicio = indice * subida.tamano_fragmento;
+        var fragmento = fichero.slice(inicio, Math.min(inicio + subida.tamano_fragmento, fichero.size));
+        return sha256(fragmento).then(function (resumen) {
+            return peticion(ruta(urls.fragmento, subida.id, indice), {
+                method: 'PUT',
+                headers: {'Content-Type': 'application/octet-stream', 'X-Checksum-Sha256': resumen},
+                body: fragmento
+            });
+        }).catch(function (error) {
+            if (intento >= REINTENTOS || (error.status && error.status < 500 && error.status !== 422)) {
+                throw error;
+            }
+            return new Promise(function (resolver) {
+                setTimeout(resolver, 1000 * Math.pow(2, intento));
+            }).then(function () { return enviar(urls, subida, fichero, indice, intento + 1); });
+        });
+    }
+
+    return {
+        // Sube `fichero` con las URL de `urls` (crear, estado, fragmento y completar; las tres últimas
+        // generadas con ID_PLANTILLA); progreso(0..1)
+        subir: function (urls, fichero, progreso) {
+            var clave;
+            return abrir(urls, fichero).then(function (resultado) {
+                clave = resultado[0];
+                var subida = resultado[1];
+                if (subida.estado === 'completada') {
+                    return subida;
+                }
+                var pendientes = subida.pendientes.slice();
+                var total = subida.fragmentos, hechos = total - pendientes.length;
+                var trabajador = function () {
+                    if (!pendientes.length) {
+                        return Promise.resolve();
+                    }
+                    return enviar(urls, subida, fichero, pendientes.shift(), 0).then(function () {
+                        hechos++;
+                        if (progreso) {
+                            progreso(hechos / total);
+                        }
+                        return trabajador();
+                    });
+                };
+                var trabajadores = [];
+                for (var i = 0; i < PARALELOS; i++) {
+                    trabajadores.push(trabajador());
+                }
+                return Promise.all([sumaFichero(fichero, subida.tamano_fragmento), Promise.all(trabajadores)])
+                    .then(function (hecho) {
+                        return peticion(ruta(urls.completar, subida.id), {
+                            method: 'POST',
+                            headers: {'Content-Type': 'application/json'},
+                            body: JSON.stringify({sha256: hecho[0]})
+                        });
+                    });
+            }).then(function (subida) {
+                localStorage.removeItem(clave);
+                return subida;
+            });
+        },
+
+        // Sube por fragmentos los ficheros del campo documentos mayores que data-subida-umbral y
+        // los quita del campo, para que el formulario envíe solo los pequeños. Las URL se toman de
+        // data-subida-url y data-subida-{estado,fragmento,completar}-url
+        subirDesdeFormulario: function (form) {
+            var campo = form.querySelector('input[type=file][name=documentos]');
+            var umbral = parseInt(form.dataset.subidaUmbral || '0', 10);
+            var aviso = form.querySelector('[data-subida-progreso]');
+            if (!campo || !campo.files.length) {
+                return Promise.resolve();
+            }
+            var urls = {
+                crear: form.dataset.subidaUrl,
+                estado: form.dataset.subidaEstadoUrl,
+                fragmento: form.dataset.subidaFragmentoUrl,
+                completar: form.dataset.subidaCompletarUrl
+            };
+            var restantes = new DataTransfer(), grandes = [];
+            Array.from(campo.files).forEach(function (fichero) {
+                if (fichero.size > umbral) {
+                    grandes.push(fichero);
+                } else {
+                    restantes.items.add(fichero);
+                }
+            });
+            var cadena = Promise.resolve();
+            grandes.forEach(function (fichero) {
+                cadena = cadena.then(function () {
+                    return KTSubidaFragmentada.subir(urls, fichero, function (fraccion) {
+                        if (aviso) {
+                            aviso.textContent = fichero.name + ': ' + Math.round(fraccion * 100) + '%';
+                        }
+                    });
+                });
+            });
+            return cadena.then(function () {
+                campo.files = restantes.files;
+            });
+        }
+    };
+}();
@@ -0,0 +1,41 @@
+// Convierte en GeoJSON (FeatureCollection) el primer objeto de una topología TopoJSON
+// cuantizada, como las que genera el comando construir_geometrias.
+function topojsonFeature(topologia) {
+    const transform = topologia.transform;
+    const arcos = topologia.arcs.map(function (arco) {
+        let x = 0, y = 0;
+        return arco.map(function (punto) {
+            x += punto[0];
+            y += punto[1];
+            return [x * transform.scale[0] + transform.translate[0], y * transform.scale[1] + transform.translate[1]];
+        });
+    });
+
+    function anillo(indices) {
+        const puntos = [];
+        indices.forEach(function (i, k) {
+            const arco = i < 0 ? arcos[~i].slice().reverse() : arcos[i];
+            Array.prototype.push.apply(puntos, k ? arco.slice(1) : arco);
+        });
+        return puntos;
+    }
+
+    function poligono(anillos) {
+        return anillos.map(anillo);
+    }
+
+    const objeto = topologia.objects[Object.keys(topologia.objects)[0]];
+    return {
+        type: 'FeatureCollection',
+        features: objeto.geometries.map(function (geometria) {
+            return {
+                type: 'Feature',
+                properties: geometria.properties || {},
+                geometry: {
+                    type: geometria.type,
+                    coordinates: geometria.type === 'Polygon' ? poligono(geometria.arcs) : geometria.arcs.map(poligono)
+                }
+            };
+        })
+    };
+}